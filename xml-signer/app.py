@@ -3,32 +3,69 @@ Microserviço Fiscal Completo — Assinatura XMLDSig + SOAP/mTLS com SEFAZ
 
 Endpoints:
   POST /sign          — Assinar XML (mantido para compatibilidade)
+  POST /sign-batch    — Assinar vários XML em paralelo (mesmo certificado)
+  POST /verify        — Verificar assinatura + cadeia ICP-Brasil de CT-e/MDF-e
+  POST /verify-batch  — Verificar vários documentos em paralelo
   POST /cte/emit      — Assinar + enviar CT-e para SEFAZ
+  POST /cte/emit-batch — Assinar + enviar vários CT-e em lotes enviCTe
+  POST /cte/receipt   — Acompanhar recibo de lote (retConsReciCTe)
   POST /cte/consult   — Consultar CT-e na SEFAZ
+  POST /cte/consult-batch — Consultar milhares de CT-e (NDJSON em streaming)
   POST /cte/cancel    — Cancelar CT-e
   POST /cte/cce       — Carta de Correção CT-e
   POST /mdfe/emit     — Assinar + enviar MDF-e para SEFAZ
   POST /mdfe/consult  — Consultar MDF-e na SEFAZ
+  POST /mdfe/consult-batch — Consultar milhares de MDF-e (NDJSON em streaming)
   POST /mdfe/cancel   — Cancelar MDF-e
   POST /mdfe/close    — Encerrar MDF-e
+  POST /certs         — Registrar certificado no keystore (depois: cert_id/cnpj no lugar do PFX)
+  GET  /certs         — Certificados do keystore (sem segredos)
+  DELETE /certs/<id>  — Remover certificado do keystore
+  POST /jobs          — Enfileirar operação e devolver job_id (assíncrono)
+  GET  /jobs/<id>     — Status/resultado do job
+  GET  /sefaz/status  — Status dos autorizadores (sonda CTeStatusServico)
   GET  /health        — Health check
+  GET  /metrics       — Métricas Prometheus (latência por etapa, round trip SEFAZ, cStat)
 """
 
+import atexit
 import base64
+import contextvars
 import glob
+import gzip
+import hashlib
 import io
+import json
 import os
 import logging
+import queue
+import re
+import ssl
 import tempfile
+import threading
 import time
+import weakref
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-
-from flask import Flask, request, jsonify
+from typing import Callable, Iterator, NamedTuple
+from urllib.parse import urlsplit
+
+from flask import Flask, Response, request, jsonify
+from consult_cache import ConsultCache
+import http_compression
+from idempotency import IdempotencyConflict, IdempotencyStore
+from job_queue import JobQueue, PRIORITY_HIGH, PRIORITY_LOW
+from keystore import Keystore, KeystoreError, certificate_cnpj
+import metrics
+from sefaz_health import CircuitBreaker, SefazStatusTable
+from sefaz_limits import EndpointBusy, EndpointLimiter, RateLimiter, parse_rate_limits
+from signer import SigningKey, SigningPool, parse_xml, sign_xml
+from verify import trust_store, verify_chunk, verify_document
 from cryptography.hazmat.primitives.serialization import pkcs12, Encoding, PrivateFormat, NoEncryption
-from cryptography.x509 import load_pem_x509_certificate
 from lxml import etree
-from signxml import XMLSigner, methods
 import requests as http_requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
@@ -36,6 +73,88 @@ from urllib3.util.retry import Retry
 app = Flask(__name__)
 API_KEY = os.environ.get("API_KEY", "")
 DEFAULT_TIMEOUT = int(os.environ.get("SEFAZ_TIMEOUT", "30"))
+CA_BUNDLE = os.environ.get("REQUESTS_CA_BUNDLE", "/etc/ssl/certs/ca-certificates.crt")
+CERT_CACHE_SIZE = int(os.environ.get("CERT_CACHE_SIZE", "32"))
+CERT_CACHE_TTL = int(os.environ.get("CERT_CACHE_TTL", "3600"))
+# Keystore de certificados no servidor (desligado sem diretório e chave Fernet)
+KEYSTORE_DIR = os.environ.get("KEYSTORE_DIR", "")
+KEYSTORE_KEY = os.environ.get("KEYSTORE_KEY", "")
+KEYSTORE_RELOAD_INTERVAL = float(os.environ.get("KEYSTORE_RELOAD_INTERVAL", "30"))
+KEYSTORE_EXPIRY_WARN_DAYS = float(os.environ.get("KEYSTORE_EXPIRY_WARN_DAYS", "30"))
+SIGN_WORKERS = int(os.environ.get("SIGN_WORKERS", "0")) or (os.cpu_count() or 1)
+SIGN_POOL_MIN_BATCH = int(os.environ.get("SIGN_POOL_MIN_BATCH", "4"))
+SIGN_POOL_START_METHOD = os.environ.get("SIGN_POOL_START_METHOD", "forkserver")
+VERIFY_BATCH_MAX_DOCS = int(os.environ.get("VERIFY_BATCH_MAX_DOCS", "5000"))
+JOBS_DB_PATH = os.environ.get("JOBS_DB_PATH", "/app/data/jobs.sqlite3")
+JOBS_WORKERS = int(os.environ.get("JOBS_WORKERS", "4"))
+JOBS_RESERVED_HIGH = int(os.environ.get("JOBS_RESERVED_HIGH", "1"))
+# Lease de um job em execução (renovado a cada terço enquanto ele roda)
+JOBS_LEASE = float(os.environ.get("JOBS_LEASE", "300"))
+# Obrigatória para /jobs: os payloads (com PFX e senha) ficam cifrados no SQLite
+JOBS_ENCRYPTION_KEY = os.environ.get("JOBS_ENCRYPTION_KEY", "")
+# Hosts aceitos em callback_url ("*.dominio" vale para os subdomínios); vazio: sem callbacks
+JOBS_CALLBACK_HOSTS = frozenset(
+    h.strip().lower() for h in os.environ.get("JOBS_CALLBACK_HOSTS", "").split(",") if h.strip()
+)
+RECEIPT_INITIAL_DELAY = float(os.environ.get("RECEIPT_INITIAL_DELAY", "2"))
+RECEIPT_MAX_DELAY = float(os.environ.get("RECEIPT_MAX_DELAY", "15"))
+RECEIPT_MAX_WAIT = float(os.environ.get("RECEIPT_MAX_WAIT", "60"))
+# Base (https://host:porta) que substitui o host de todos os endpoints SEFAZ,
+# ex.: o mock de bench/mock_sefaz.py em testes de carga
+SEFAZ_URL_OVERRIDE = os.environ.get("SEFAZ_URL_OVERRIDE", "").rstrip("/")
+# Serviços enviados compactados (<cteDadosMsg>/<mdfeDadosMsg> com gzip + base64),
+# só os de recepção síncrona, que recebem o documento sozinho (cteRecepcaoSinc,
+# mdfeAutorizacao). Com cteRecepcaoSinc, /cte/emit usa a recepção síncrona em
+# vez do lote enviCTe. Vazio (padrão): tudo em XML puro
+SEFAZ_GZIP_SERVICES = {
+    s.strip() for s in os.environ.get("SEFAZ_GZIP_SERVICES", "").split(",") if s.strip()
+}
+SEFAZ_GZIP_LEVEL = int(os.environ.get("SEFAZ_GZIP_LEVEL", "6"))
+SEFAZ_POOL_MAX_SESSIONS = int(os.environ.get("SEFAZ_POOL_MAX_SESSIONS", "64"))
+SEFAZ_POOL_MAXSIZE = int(os.environ.get("SEFAZ_POOL_MAXSIZE", "4"))
+SEFAZ_POOL_IDLE_TIMEOUT = int(os.environ.get("SEFAZ_POOL_IDLE_TIMEOUT", "90"))
+# Chamadas simultâneas por webservice (por processo); além disso, até
+# SEFAZ_ENDPOINT_QUEUE requisições aguardam até SEFAZ_QUEUE_TIMEOUT segundos — depois, HTTP 429
+SEFAZ_ENDPOINT_CONCURRENCY = int(os.environ.get("SEFAZ_ENDPOINT_CONCURRENCY", "8"))
+SEFAZ_ENDPOINT_QUEUE = int(os.environ.get("SEFAZ_ENDPOINT_QUEUE", "4"))
+SEFAZ_QUEUE_TIMEOUT = float(os.environ.get("SEFAZ_QUEUE_TIMEOUT", "10"))
+# Token bucket por (CNPJ, UF, ambiente, serviço): "serviço=chamadas/s[:balde]", "*" = demais.
+# Ex.: "cteConsulta=2:10,cteAutorizacao=5:20,*=5". Vazio: sem limite (só a pausa após um 656)
+SEFAZ_RATE_LIMITS = os.environ.get("SEFAZ_RATE_LIMITS", "")
+SEFAZ_RATE_PENALTY = float(os.environ.get("SEFAZ_RATE_PENALTY", "60"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_OPEN_SECONDS = float(os.environ.get("CIRCUIT_OPEN_SECONDS", "30"))
+# Serviços desviados para a SVC (SVC-RS/SVC-SP) com o circuito do autorizador aberto;
+# os demais falham na hora. Ex.: "cteConsulta,cteRetAutorizacao,cteStatus"
+SEFAZ_SVC_SERVICES = {s.strip() for s in os.environ.get("SEFAZ_SVC_SERVICES", "").split(",") if s.strip()}
+# Sonda de status (CTeStatusServico) em segundo plano — desligada sem UFs/certificado
+SEFAZ_STATUS_UFS = [u.strip().upper() for u in os.environ.get("SEFAZ_STATUS_UFS", "").split(",") if u.strip()]
+SEFAZ_STATUS_AMBIENTES = [
+    a.strip() for a in os.environ.get("SEFAZ_STATUS_AMBIENTES", "producao").split(",") if a.strip()
+]
+SEFAZ_STATUS_INTERVAL = float(os.environ.get("SEFAZ_STATUS_INTERVAL", "180"))
+SEFAZ_STATUS_TIMEOUT = int(os.environ.get("SEFAZ_STATUS_TIMEOUT", "10"))
+SEFAZ_STATUS_PFX_PATH = os.environ.get("SEFAZ_STATUS_PFX_PATH", "")
+SEFAZ_STATUS_PFX_PASSWORD = os.environ.get("SEFAZ_STATUS_PFX_PASSWORD", "")
+SEFAZ_STATUS_FILE = os.environ.get("SEFAZ_STATUS_FILE", "/app/data/sefaz_status.json")
+CONSULT_CACHE_SIZE = int(os.environ.get("CONSULT_CACHE_SIZE", "10000"))
+CONSULT_CACHE_TTL = float(os.environ.get("CONSULT_CACHE_TTL", "60"))
+# SQLite das situações finais (vazio = só memória, por worker)
+CONSULT_CACHE_DB_PATH = os.environ.get("CONSULT_CACHE_DB_PATH", "")
+# Replay de emissões/eventos repetidos (0 desliga a idempotência)
+IDEMPOTENCY_TTL = float(os.environ.get("IDEMPOTENCY_TTL", "300"))
+IDEMPOTENCY_LEASE = float(os.environ.get("IDEMPOTENCY_LEASE", "180"))
+# SQLite compartilhado para coalescer entre workers/réplicas (vazio = por processo)
+IDEMPOTENCY_DB_PATH = os.environ.get("IDEMPOTENCY_DB_PATH", "")
+# Limite do corpo das requisições, já descompactado (Content-Encoding gzip/zstd)
+REQUEST_MAX_BYTES = int(os.environ.get("REQUEST_MAX_BYTES", str(32 * 1024 * 1024)))
+# Respostas menores que isso vão sem compressão, mesmo com Accept-Encoding
+HTTP_COMPRESS_MIN_BYTES = int(os.environ.get("HTTP_COMPRESS_MIN_BYTES", "1024"))
+HTTP_GZIP_LEVEL = int(os.environ.get("HTTP_GZIP_LEVEL", "5"))
+HTTP_ZSTD_LEVEL = int(os.environ.get("HTTP_ZSTD_LEVEL", "3"))
+CONSULT_BATCH_MAX_KEYS = int(os.environ.get("CONSULT_BATCH_MAX_KEYS", "5000"))
+# Consultas simultâneas por endpoint SEFAZ em /cte/consult-batch e /mdfe/consult-batch
+CONSULT_BATCH_CONCURRENCY = int(os.environ.get("CONSULT_BATCH_CONCURRENCY", "4"))
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
@@ -53,6 +172,8 @@ SEFAZ_ENDPOINTS = {
     "homologacao": {
         "SVRS": {
             "cteAutorizacao": "https://cte-homologacao.svrs.rs.gov.br/ws/cterecepcao/CTeRecepcao.asmx",
+            "cteRecepcaoSinc": "https://cte-homologacao.svrs.rs.gov.br/ws/CTeRecepcaoSinc/CTeRecepcaoSinc.asmx",
+            "cteRetAutorizacao": "https://cte-homologacao.svrs.rs.gov.br/ws/cteretrecepcao/CTeRetRecepcao.asmx",
             "cteConsulta": "https://cte-homologacao.svrs.rs.gov.br/ws/cteconsulta/CTeConsulta.asmx",
             "cteEvento": "https://cte-homologacao.svrs.rs.gov.br/ws/cterecepcaoevento/CTeRecepcaoEvento.asmx",
             "cteStatus": "https://cte-homologacao.svrs.rs.gov.br/ws/ctestatusservico/CTeStatusServico.asmx",
@@ -62,38 +183,67 @@ SEFAZ_ENDPOINTS = {
         },
         "SP": {
             "cteAutorizacao": "https://homologacao.nfe.fazenda.sp.gov.br/cteWEB/services/CTeRecepcao.asmx",
+            "cteRecepcaoSinc": "https://homologacao.nfe.fazenda.sp.gov.br/cteWEB/services/CTeRecepcaoSinc.asmx",
+            "cteRetAutorizacao": "https://homologacao.nfe.fazenda.sp.gov.br/cteWEB/services/CTeRetRecepcao.asmx",
             "cteConsulta": "https://homologacao.nfe.fazenda.sp.gov.br/cteWEB/services/CTeConsulta.asmx",
             "cteEvento": "https://homologacao.nfe.fazenda.sp.gov.br/cteWEB/services/CTeRecepcaoEvento.asmx",
             "cteStatus": "https://homologacao.nfe.fazenda.sp.gov.br/cteWEB/services/CTeStatusServico.asmx",
         },
         "MG": {
             "cteAutorizacao": "https://hcte.fazenda.mg.gov.br/cte/services/CTeRecepcao.asmx",
+            "cteRecepcaoSinc": "https://hcte.fazenda.mg.gov.br/cte/services/CTeRecepcaoSinc.asmx",
+            "cteRetAutorizacao": "https://hcte.fazenda.mg.gov.br/cte/services/CTeRetRecepcao.asmx",
             "cteConsulta": "https://hcte.fazenda.mg.gov.br/cte/services/CTeConsulta.asmx",
             "cteEvento": "https://hcte.fazenda.mg.gov.br/cte/services/CTeRecepcaoEvento.asmx",
             "cteStatus": "https://hcte.fazenda.mg.gov.br/cte/services/CTeStatusServico.asmx",
         },
         "MT": {
             "cteAutorizacao": "https://homologacao.sefaz.mt.gov.br/ctews/services/CTeRecepcao.asmx",
+            "cteRecepcaoSinc": "https://homologacao.sefaz.mt.gov.br/ctews/services/CTeRecepcaoSinc.asmx",
+            "cteRetAutorizacao": "https://homologacao.sefaz.mt.gov.br/ctews/services/CTeRetRecepcao.asmx",
             "cteConsulta": "https://homologacao.sefaz.mt.gov.br/ctews/services/CTeConsulta.asmx",
             "cteEvento": "https://homologacao.sefaz.mt.gov.br/ctews/services/CTeRecepcaoEvento.asmx",
             "cteStatus": "https://homologacao.sefaz.mt.gov.br/ctews/services/CTeStatusServico.asmx",
         },
         "MS": {
             "cteAutorizacao": "https://homologacao.cte.ms.gov.br/services/CTeRecepcao.asmx",
+            "cteRecepcaoSinc": "https://homologacao.cte.ms.gov.br/services/CTeRecepcaoSinc.asmx",
+            "cteRetAutorizacao": "https://homologacao.cte.ms.gov.br/services/CTeRetRecepcao.asmx",
             "cteConsulta": "https://homologacao.cte.ms.gov.br/services/CTeConsulta.asmx",
             "cteEvento": "https://homologacao.cte.ms.gov.br/services/CTeRecepcaoEvento.asmx",
             "cteStatus": "https://homologacao.cte.ms.gov.br/services/CTeStatusServico.asmx",
         },
         "PR": {
             "cteAutorizacao": "https://homologacao.cte.fazenda.pr.gov.br/cte/CTeRecepcao.asmx",
+            "cteRecepcaoSinc": "https://homologacao.cte.fazenda.pr.gov.br/cte/CTeRecepcaoSinc.asmx",
+            "cteRetAutorizacao": "https://homologacao.cte.fazenda.pr.gov.br/cte/CTeRetRecepcao.asmx",
             "cteConsulta": "https://homologacao.cte.fazenda.pr.gov.br/cte/CTeConsulta.asmx",
             "cteEvento": "https://homologacao.cte.fazenda.pr.gov.br/cte/CTeRecepcaoEvento.asmx",
             "cteStatus": "https://homologacao.cte.fazenda.pr.gov.br/cte/CTeStatusServico.asmx",
         },
+        # Sefaz Virtual de Contingência — só CT-e (MDF-e não tem SVC)
+        "SVC-RS": {
+            "cteAutorizacao": "https://cte-homologacao.svrs.rs.gov.br/ws/cterecepcao/CTeRecepcao.asmx",
+            "cteRecepcaoSinc": "https://cte-homologacao.svrs.rs.gov.br/ws/CTeRecepcaoSinc/CTeRecepcaoSinc.asmx",
+            "cteRetAutorizacao": "https://cte-homologacao.svrs.rs.gov.br/ws/cteretrecepcao/CTeRetRecepcao.asmx",
+            "cteConsulta": "https://cte-homologacao.svrs.rs.gov.br/ws/cteconsulta/CTeConsulta.asmx",
+            "cteEvento": "https://cte-homologacao.svrs.rs.gov.br/ws/cterecepcaoevento/CTeRecepcaoEvento.asmx",
+            "cteStatus": "https://cte-homologacao.svrs.rs.gov.br/ws/ctestatusservico/CTeStatusServico.asmx",
+        },
+        "SVC-SP": {
+            "cteAutorizacao": "https://homologacao.nfe.fazenda.sp.gov.br/cteWEB/services/CTeRecepcao.asmx",
+            "cteRecepcaoSinc": "https://homologacao.nfe.fazenda.sp.gov.br/cteWEB/services/CTeRecepcaoSinc.asmx",
+            "cteRetAutorizacao": "https://homologacao.nfe.fazenda.sp.gov.br/cteWEB/services/CTeRetRecepcao.asmx",
+            "cteConsulta": "https://homologacao.nfe.fazenda.sp.gov.br/cteWEB/services/CTeConsulta.asmx",
+            "cteEvento": "https://homologacao.nfe.fazenda.sp.gov.br/cteWEB/services/CTeRecepcaoEvento.asmx",
+            "cteStatus": "https://homologacao.nfe.fazenda.sp.gov.br/cteWEB/services/CTeStatusServico.asmx",
+        },
     },
     "producao": {
         "SVRS": {
             "cteAutorizacao": "https://cte.svrs.rs.gov.br/ws/cterecepcao/CTeRecepcao.asmx",
+            "cteRecepcaoSinc": "https://cte.svrs.rs.gov.br/ws/CTeRecepcaoSinc/CTeRecepcaoSinc.asmx",
+            "cteRetAutorizacao": "https://cte.svrs.rs.gov.br/ws/cteretrecepcao/CTeRetRecepcao.asmx",
             "cteConsulta": "https://cte.svrs.rs.gov.br/ws/cteconsulta/CTeConsulta.asmx",
             "cteEvento": "https://cte.svrs.rs.gov.br/ws/cterecepcaoevento/CTeRecepcaoEvento.asmx",
             "cteStatus": "https://cte.svrs.rs.gov.br/ws/ctestatusservico/CTeStatusServico.asmx",
@@ -103,40 +253,71 @@ SEFAZ_ENDPOINTS = {
         },
         "SP": {
             "cteAutorizacao": "https://nfe.fazenda.sp.gov.br/cteWEB/services/CTeRecepcao.asmx",
+            "cteRecepcaoSinc": "https://nfe.fazenda.sp.gov.br/cteWEB/services/CTeRecepcaoSinc.asmx",
+            "cteRetAutorizacao": "https://nfe.fazenda.sp.gov.br/cteWEB/services/CTeRetRecepcao.asmx",
             "cteConsulta": "https://nfe.fazenda.sp.gov.br/cteWEB/services/CTeConsulta.asmx",
             "cteEvento": "https://nfe.fazenda.sp.gov.br/cteWEB/services/CTeRecepcaoEvento.asmx",
             "cteStatus": "https://nfe.fazenda.sp.gov.br/cteWEB/services/CTeStatusServico.asmx",
         },
         "MG": {
             "cteAutorizacao": "https://cte.fazenda.mg.gov.br/cte/services/CTeRecepcao.asmx",
+            "cteRecepcaoSinc": "https://cte.fazenda.mg.gov.br/cte/services/CTeRecepcaoSinc.asmx",
+            "cteRetAutorizacao": "https://cte.fazenda.mg.gov.br/cte/services/CTeRetRecepcao.asmx",
             "cteConsulta": "https://cte.fazenda.mg.gov.br/cte/services/CTeConsulta.asmx",
             "cteEvento": "https://cte.fazenda.mg.gov.br/cte/services/CTeRecepcaoEvento.asmx",
             "cteStatus": "https://cte.fazenda.mg.gov.br/cte/services/CTeStatusServico.asmx",
         },
         "MT": {
             "cteAutorizacao": "https://cte.sefaz.mt.gov.br/ctews/services/CTeRecepcao.asmx",
+            "cteRecepcaoSinc": "https://cte.sefaz.mt.gov.br/ctews/services/CTeRecepcaoSinc.asmx",
+            "cteRetAutorizacao": "https://cte.sefaz.mt.gov.br/ctews/services/CTeRetRecepcao.asmx",
             "cteConsulta": "https://cte.sefaz.mt.gov.br/ctews/services/CTeConsulta.asmx",
             "cteEvento": "https://cte.sefaz.mt.gov.br/ctews/services/CTeRecepcaoEvento.asmx",
             "cteStatus": "https://cte.sefaz.mt.gov.br/ctews/services/CTeStatusServico.asmx",
         },
         "MS": {
             "cteAutorizacao": "https://producao.cte.ms.gov.br/services/CTeRecepcao.asmx",
+            "cteRecepcaoSinc": "https://producao.cte.ms.gov.br/services/CTeRecepcaoSinc.asmx",
+            "cteRetAutorizacao": "https://producao.cte.ms.gov.br/services/CTeRetRecepcao.asmx",
             "cteConsulta": "https://producao.cte.ms.gov.br/services/CTeConsulta.asmx",
             "cteEvento": "https://producao.cte.ms.gov.br/services/CTeRecepcaoEvento.asmx",
             "cteStatus": "https://producao.cte.ms.gov.br/services/CTeStatusServico.asmx",
         },
         "PR": {
             "cteAutorizacao": "https://cte.fazenda.pr.gov.br/cte/CTeRecepcao.asmx",
+            "cteRecepcaoSinc": "https://cte.fazenda.pr.gov.br/cte/CTeRecepcaoSinc.asmx",
+            "cteRetAutorizacao": "https://cte.fazenda.pr.gov.br/cte/CTeRetRecepcao.asmx",
             "cteConsulta": "https://cte.fazenda.pr.gov.br/cte/CTeConsulta.asmx",
             "cteEvento": "https://cte.fazenda.pr.gov.br/cte/CTeRecepcaoEvento.asmx",
             "cteStatus": "https://cte.fazenda.pr.gov.br/cte/CTeStatusServico.asmx",
         },
+        "SVC-RS": {
+            "cteAutorizacao": "https://cte.svrs.rs.gov.br/ws/cterecepcao/CTeRecepcao.asmx",
+            "cteRecepcaoSinc": "https://cte.svrs.rs.gov.br/ws/CTeRecepcaoSinc/CTeRecepcaoSinc.asmx",
+            "cteRetAutorizacao": "https://cte.svrs.rs.gov.br/ws/cteretrecepcao/CTeRetRecepcao.asmx",
+            "cteConsulta": "https://cte.svrs.rs.gov.br/ws/cteconsulta/CTeConsulta.asmx",
+            "cteEvento": "https://cte.svrs.rs.gov.br/ws/cterecepcaoevento/CTeRecepcaoEvento.asmx",
+            "cteStatus": "https://cte.svrs.rs.gov.br/ws/ctestatusservico/CTeStatusServico.asmx",
+        },
+        "SVC-SP": {
+            "cteAutorizacao": "https://nfe.fazenda.sp.gov.br/cteWEB/services/CTeRecepcao.asmx",
+            "cteRecepcaoSinc": "https://nfe.fazenda.sp.gov.br/cteWEB/services/CTeRecepcaoSinc.asmx",
+            "cteRetAutorizacao": "https://nfe.fazenda.sp.gov.br/cteWEB/services/CTeRetRecepcao.asmx",
+            "cteConsulta": "https://nfe.fazenda.sp.gov.br/cteWEB/services/CTeConsulta.asmx",
+            "cteEvento": "https://nfe.fazenda.sp.gov.br/cteWEB/services/CTeRecepcaoEvento.asmx",
+            "cteStatus": "https://nfe.fazenda.sp.gov.br/cteWEB/services/CTeStatusServico.asmx",
+        },
     },
 }
 
 # UFs que têm endpoints próprios; demais usam SVRS
 UFS_COM_ENDPOINT_PROPRIO = {"SP", "MG", "MT", "MS", "PR"}
 
+# Autorizadores próprios cuja contingência é a SVC-RS; os demais usam SVC-SP.
+# AP, PE e RR também teriam SVC-RS, mas autorizam na SVRS, que responde nas
+# mesmas URLs da SVC-RS: com a SVRS fora, o desvio útil é para a SVC-SP
+UFS_SVC_RS = {"MS", "MT", "SP"}
+
 UF_CODIGO_IBGE = {
     "AC": "12", "AL": "27", "AM": "13", "AP": "16", "BA": "29", "CE": "23",
     "DF": "53", "ES": "32", "GO": "52", "MA": "21", "MG": "31", "MS": "50",
@@ -144,127 +325,295 @@ UF_CODIGO_IBGE = {
     "RJ": "33", "RN": "24", "RO": "11", "RR": "14", "RS": "43", "SC": "42",
     "SE": "28", "SP": "35", "TO": "17",
 }
+UF_POR_CODIGO = {codigo: uf for uf, codigo in UF_CODIGO_IBGE.items()}
 
 
-def get_sefaz_url(uf: str, ambiente: str, service_key: str) -> str:
-    """Resolve URL do webservice SEFAZ para UF/ambiente/serviço."""
+def _endpoint_url(amb: str, region: str, service_key: str) -> str | None:
+    url = SEFAZ_ENDPOINTS.get(amb, {}).get(region, {}).get(service_key)
+    if url and SEFAZ_URL_OVERRIDE:
+        # Mantém host e caminho originais no path, para o destino distinguir os endpoints
+        parts = urlsplit(url)
+        url = f"{SEFAZ_URL_OVERRIDE}/{parts.netloc}{parts.path}"
+    return url
+
+
+def resolve_sefaz_endpoint(uf: str, ambiente: str, service_key: str) -> tuple[str, str, str]:
+    """(ambiente, região, URL) do autorizador da UF — sem circuito/status/SVC."""
     uf = uf.upper()
     amb = ambiente if ambiente in ("homologacao", "producao") else "homologacao"
     region = uf if uf in UFS_COM_ENDPOINT_PROPRIO else "SVRS"
-    endpoints = SEFAZ_ENDPOINTS.get(amb, {}).get(region, {})
-    url = endpoints.get(service_key)
+    url = _endpoint_url(amb, region, service_key)
     if not url:
         # Fallback: SVRS
-        url = SEFAZ_ENDPOINTS.get(amb, {}).get("SVRS", {}).get(service_key)
+        region = "SVRS"
+        url = _endpoint_url(amb, region, service_key)
     if not url:
         raise ValueError(f"Endpoint não encontrado: {service_key} para UF={uf} ambiente={amb}")
-    return url
+    return amb, region, url
+
+
+def get_sefaz_url(uf: str, ambiente: str, service_key: str) -> str:
+    """
+    Resolve URL do webservice SEFAZ para UF/ambiente/serviço.
+
+    Com o circuito do autorizador aberto (ver CircuitBreaker) — ou, na
+    emissão, com a UF fora do ar na tabela de status (SefazStatusTable) —,
+    desvia para a SVC da UF se o serviço estiver em SEFAZ_SVC_SERVICES; senão
+    falha na hora com 503 em vez de esperar o timeout da SEFAZ.
+    """
+    uf = uf.upper()
+    amb, region, url = resolve_sefaz_endpoint(uf, ambiente, service_key)
+
+    down = sefaz_status.is_down(uf, amb) if service_key in STATUS_GATED_SERVICES else None
+    if down is None and sefaz_circuits.available(url):
+        return url
+
+    # Pela região resolvida: UF atendida pela SVRS nunca vai para a SVC-RS
+    svc = "SVC-RS" if region in UFS_SVC_RS else "SVC-SP"
+    svc_url = _endpoint_url(amb, svc, service_key) if service_key in SEFAZ_SVC_SERVICES else None
+    if svc_url and svc_url != url and sefaz_circuits.available(svc_url):
+        logger.warning(f"[CIRCUIT] {region}/{service_key} ({amb}) indisponível — desviando UF={uf} para {svc}")
+        return svc_url
+
+    reason = f"fora do ar na sonda de status ({down['cStat'] or 'sem resposta'})" if down else "circuito aberto"
+    raise RequestError({
+        "success": False,
+        "error": f"SEFAZ {region} indisponível para {service_key} ({amb}): {reason}, tente novamente em instantes",
+        "status_detail": "servico_indisponivel",
+        "sefaz_url": url,
+    }, 503)
+
+
+# ── Circuit breaker por endpoint SEFAZ (sefaz_health.py) ─────────
+
+sefaz_circuits = CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_OPEN_SECONDS)
+
+# cStat de serviço paralisado/erro interno: contam como falha do endpoint
+CIRCUIT_FAILURE_CSTATS = ("108", "109", "999")
+
+
+def circuit_open_error(url: str, endpoint: tuple[str, str, str]) -> Exception:
+    """503 de uma chamada barrada pelo circuito já na hora do POST (abriu enquanto ela aguardava)."""
+    return RequestError({
+        "success": False,
+        "error": (
+            f"SEFAZ indisponível para {endpoint[2] or url} ({endpoint[1] or '-'}): "
+            "circuito aberto, tente novamente em instantes"
+        ),
+        "status_detail": "servico_indisponivel",
+        "sefaz_url": url,
+    }, 503)
+
+
+# ── Concorrência e consumo por webservice SEFAZ ──────────────────
+
+sefaz_limiter = EndpointLimiter(SEFAZ_ENDPOINT_CONCURRENCY, SEFAZ_ENDPOINT_QUEUE, SEFAZ_QUEUE_TIMEOUT)
+sefaz_rate_limiter = RateLimiter(parse_rate_limits(SEFAZ_RATE_LIMITS), SEFAZ_RATE_PENALTY)
+
+# True nas requisições da API: fila limitada, 429 quando cheia. Jobs, recibos,
+# sondas de status e consultas em lote marcam False e aguardam a vez.
+sefaz_admission: contextvars.ContextVar[bool] = contextvars.ContextVar("sefaz_admission", default=True)
+
+# Consumo indevido: a SEFAZ bloqueia o CNPJ temporariamente
+CONSUMO_INDEVIDO_CSTAT = "656"
 
 
 # ── Certificado: extrair PEM em memória ──────────────────────────
 
-class InMemoryCert:
-    """Extrai cert.pem e key.pem do PFX em memória para uso com requests/mTLS."""
+def _load_cert_chain_from_memory(context: ssl.SSLContext, pem: bytes):
+    """
+    Carrega certificado + chave (PEM) num SSLContext sem gravar em disco.
+
+    O módulo ssl só aceita caminhos em load_cert_chain; no Linux usamos um
+    memfd anônimo (sem entrada em nenhum filesystem), fechado logo após a
+    carga. Fora do Linux, cai para um arquivo temporário removido na hora.
+    """
+    if hasattr(os, "memfd_create"):
+        fd = os.memfd_create("client-cert", os.MFD_CLOEXEC)
+        try:
+            os.write(fd, pem)
+            context.load_cert_chain(f"/proc/self/fd/{fd}")
+        finally:
+            os.close(fd)
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=".pem") as tmp:
+        tmp.write(pem)
+        tmp.flush()
+        context.load_cert_chain(tmp.name)
+
+
+class InMemoryCert(SigningKey):
+    """Carrega o PFX em memória e monta o SSLContext de cliente para mTLS."""
 
     def __init__(self, pfx_bytes: bytes, password: bytes):
-        self.private_key, self.certificate, self.additional_certs = (
-            pkcs12.load_key_and_certificates(pfx_bytes, password)
-        )
-        if not self.private_key or not self.certificate:
+        private_key, certificate, self.additional_certs = pkcs12.load_key_and_certificates(pfx_bytes, password)
+        if not private_key or not certificate:
             raise ValueError("Certificado inválido ou senha incorreta")
+        super().__init__(private_key, certificate)
 
-        # Gerar PEM em memória
-        self._key_pem = self.private_key.private_bytes(
+        self.not_valid_after = self.certificate.not_valid_after_utc.timestamp()
+        # Contribuinte do certificado: chave dos limites de consumo e do rodízio entre filas
+        self.cnpj = certificate_cnpj(self.certificate) or self.fingerprint[:16]
+
+        # Cadeia em PEM: certificado do titular + intermediárias do PFX
+        chain_pem = self._cert_pem + b"".join(
+            c.public_bytes(Encoding.PEM) for c in (self.additional_certs or [])
+        )
+        key_pem = self.private_key.private_bytes(
             Encoding.PEM, PrivateFormat.TraditionalOpenSSL, NoEncryption()
         )
-        self._cert_pem = self.certificate.public_bytes(Encoding.PEM)
-
-        # Criar arquivos temporários (em memória via tmpfs quando disponível)
-        self._cert_file = tempfile.NamedTemporaryFile(suffix=".pem", delete=False)
-        self._key_file = tempfile.NamedTemporaryFile(suffix=".pem", delete=False)
-        self._cert_file.write(self._cert_pem)
-        self._cert_file.flush()
-        self._key_file.write(self._key_pem)
-        self._key_file.flush()
-
-    @property
-    def cert_tuple(self):
-        """Retorna (cert_path, key_path) para requests.post(cert=...)"""
-        return (self._cert_file.name, self._key_file.name)
-
-    def cleanup(self):
-        """Remove arquivos temporários da memória."""
-        try:
-            os.unlink(self._cert_file.name)
-        except OSError:
-            pass
+
+        # SSLContext imutável após a criação — pode ser usado por várias threads
+        self.ssl_context = ssl.create_default_context(cafile=CA_BUNDLE)
+        _load_cert_chain_from_memory(self.ssl_context, key_pem + chain_pem)
+
+
+class CertCache:
+    """
+    Cache LRU/TTL de certificados já carregados, compartilhado pelo processo.
+
+    Chave = SHA-256 de (PFX, senha): requisições repetidas com o mesmo
+    certificado não refazem a decriptação PKCS#12 nem a geração de PEM.
+    Cada entrada expira no menor entre o TTL e o vencimento do certificado.
+    Threads que pedem ao mesmo tempo um certificado ainda não carregado
+    aguardam uma única carga (modo gthread, pool de CPU do modo async).
+    """
+
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[InMemoryCert, float]] = OrderedDict()
+        # chave -> carga em andamento, para as demais threads aguardarem
+        self._loading: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(pfx_bytes: bytes, password: bytes) -> str:
+        digest = hashlib.sha256()
+        digest.update(len(pfx_bytes).to_bytes(8, "big"))
+        digest.update(pfx_bytes)
+        digest.update(password)
+        return digest.hexdigest()
+
+    def get(self, pfx_bytes: bytes, password: bytes) -> InMemoryCert:
+        """Retorna o certificado do cache ou carrega (e cacheia) a partir do PFX."""
+        key = self.make_key(pfx_bytes, password)
+        now = time.time()
+        leader = False
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                cert, expires_at = entry
+                if now < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return cert
+                del self._entries[key]
+                self.evictions += 1
+            loading = self._loading.get(key)
+            if loading is not None:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+                loading = self._loading[key] = Future()
+                leader = True
+        if not leader:
+            return loading.result()
+
+        # Carregar fora do lock: PKCS#12 é lento e não deve serializar o processo
         try:
-            os.unlink(self._key_file.name)
-        except OSError:
-            pass
+            with metrics.stage("pfx_load"):
+                cert = InMemoryCert(pfx_bytes, password)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            loading.set_exception(e)
+            raise
+        expires_at = min(now + self.ttl, cert.not_valid_after)
 
-    def __del__(self):
-        self.cleanup()
+        with self._lock:
+            del self._loading[key]
+            if self.max_size > 0 and expires_at > now:
+                self._entries[key] = (cert, expires_at)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        loading.set_result(cert)
+        return cert
 
+    def clear(self):
+        """Esvazia o cache e zera os contadores expostos em stats()."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = self.coalesced = 0
 
-# ── Assinatura XMLDSig ───────────────────────────────────────────
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "coalesced": self.coalesced,
+            }
 
-def sign_xml(xml_str: str, cert: InMemoryCert, doc_type: str, doc_id: str) -> dict:
-    """Assina XML usando XMLDSig (enveloped signature)."""
-    root = etree.fromstring(xml_str.encode("utf-8"))
 
-    if doc_type == "cte":
-        sign_node = root.find(".//cte:infCte", NAMESPACES)
-    elif doc_type == "mdfe":
-        sign_node = root.find(".//mdfe:infMDFe", NAMESPACES)
-    else:
-        raise ValueError(f"document_type inválido: {doc_type}")
+cert_cache = CertCache(CERT_CACHE_SIZE, CERT_CACHE_TTL)
 
-    if sign_node is None:
-        raise ValueError(f"Nó {'infCte' if doc_type == 'cte' else 'infMDFe'} não encontrado no XML")
 
-    node_id = sign_node.attrib.get("Id", "")
-    if not node_id:
-        raise ValueError("Atributo Id não encontrado no nó a ser assinado")
+def load_cert(pfx_bytes: bytes, password: bytes) -> InMemoryCert:
+    with metrics.stage("pfx_load"):
+        return InMemoryCert(pfx_bytes, password)
 
-    signer = XMLSigner(
-        method=methods.enveloped,
-        signature_algorithm="rsa-sha256",
-        digest_algorithm="sha256",
-        c14n_algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315",
-    )
 
-    signed_root = signer.sign(
-        root,
-        key=cert.private_key,
-        cert=[cert.certificate],
-        reference_uri=f"#{node_id}",
-    )
+# Certificados registrados no servidor: requisições usam cert_id/cnpj em vez do PFX
+keystore = Keystore(
+    KEYSTORE_DIR, KEYSTORE_KEY, load_cert,
+    reload_interval=KEYSTORE_RELOAD_INTERVAL, warn_days=KEYSTORE_EXPIRY_WARN_DAYS,
+)
 
-    signed_xml_body = etree.tostring(signed_root, encoding="unicode")
-    signed_xml = '<?xml version="1.0" encoding="UTF-8"?>\n' + signed_xml_body
 
-    digest_el = signed_root.find(".//ds:DigestValue", NAMESPACES)
-    sig_val_el = signed_root.find(".//ds:SignatureValue", NAMESPACES)
+# ── Assinatura XMLDSig (signer.py) ───────────────────────────────
 
-    return {
-        "signed_xml": signed_xml,
-        "signed_root": signed_root,
-        "digest_value": digest_el.text if digest_el is not None else "",
-        "signature_value": sig_val_el.text if sig_val_el is not None else "",
-    }
+signing_pool = SigningPool(SIGN_WORKERS, SIGN_POOL_MIN_BATCH, SIGN_POOL_START_METHOD)
+atexit.register(signing_pool.shutdown)
+
+
+# ── Verificação de assinatura (verify.py) ────────────────────────
+
+def verify_many(xmls: list[str]) -> list[dict]:
+    """Verifica vários documentos em paralelo no pool de processos; resultados na mesma ordem."""
+    return signing_pool.map_chunks(verify_chunk, xmls)
 
 
 # ── Validação XSD CT-e 4.00 ──────────────────────────────────────
 
 XSD_DIR = Path(os.environ.get("XSD_DIR", "/app/xsd"))
-_xsd_cache: dict[str, etree.XMLSchema] = {}
+# XSD já parseados, compartilhados pelo processo. O XMLSchema compilado é por
+# thread: validate() grava o error_log no próprio objeto, e threads validando
+# com o mesmo schema (modo gthread, pool de CPU do modo async) misturariam os
+# erros umas das outras.
+_xsd_cache: dict[str, etree._ElementTree] = {}
+_xsd_lock = threading.Lock()
+_xsd_local = threading.local()
 
 
 def _load_xsd(schema_name: str) -> etree.XMLSchema | None:
     """Carrega e cacheia schema XSD do diretório de schemas."""
-    if schema_name in _xsd_cache:
-        return _xsd_cache[schema_name]
+    schemas = getattr(_xsd_local, "schemas", None)
+    if schemas is None:
+        schemas = _xsd_local.schemas = {}
+    if schema_name in schemas:
+        return schemas[schema_name]
 
     xsd_path = XSD_DIR / schema_name
     if not xsd_path.exists():
@@ -272,18 +621,22 @@ def _load_xsd(schema_name: str) -> etree.XMLSchema | None:
         return None
 
     try:
-        with open(xsd_path, "rb") as f:
-            xsd_doc = etree.parse(f)
-        schema = etree.XMLSchema(xsd_doc)
-        _xsd_cache[schema_name] = schema
-        logger.info(f"[XSD] Schema carregado: {schema_name}")
+        # Sob o lock: o XSD é lido uma vez por processo e compilado uma vez por thread
+        with _xsd_lock:
+            xsd_doc = _xsd_cache.get(schema_name)
+            if xsd_doc is None:
+                with open(xsd_path, "rb") as f:
+                    xsd_doc = _xsd_cache[schema_name] = etree.parse(f)
+                logger.info(f"[XSD] Schema carregado: {schema_name}")
+            schema = etree.XMLSchema(xsd_doc)
+        schemas[schema_name] = schema
         return schema
     except Exception as e:
         logger.error(f"[XSD] Erro ao carregar {schema_name}: {e}")
         return None
 
 
-def validate_cte_xsd(xml_str: str) -> list[str]:
+def validate_cte_xsd(xml: str | etree._Element) -> list[str]:
     """
     Valida XML do CT-e contra o schema XSD oficial 4.00.
     Retorna lista de erros (vazia = válido).
@@ -299,8 +652,10 @@ def validate_cte_xsd(xml_str: str) -> list[str]:
         return []
 
     try:
-        doc = etree.fromstring(xml_str.encode("utf-8"))
-        if schema.validate(doc):
+        doc = parse_xml(xml)
+        with metrics.stage("xsd_validation"):
+            valid = schema.validate(doc)
+        if valid:
             return []
 
         errors = []
@@ -315,15 +670,17 @@ def validate_cte_xsd(xml_str: str) -> list[str]:
         return [f"XML malformado: {str(e)}"]
 
 
-def validate_mdfe_xsd(xml_str: str) -> list[str]:
+def validate_mdfe_xsd(xml: str | etree._Element) -> list[str]:
     """Valida XML do MDF-e contra schema XSD 3.00."""
     schema = _load_xsd("mdfe_v3.00.xsd")
     if schema is None:
         return []
 
     try:
-        doc = etree.fromstring(xml_str.encode("utf-8"))
-        if schema.validate(doc):
+        doc = parse_xml(xml)
+        with metrics.stage("xsd_validation"):
+            valid = schema.validate(doc)
+        if valid:
             return []
         return [err.message for err in schema.error_log][:10]
     except etree.XMLSyntaxError as e:
@@ -332,27 +689,132 @@ def validate_mdfe_xsd(xml_str: str) -> list[str]:
 
 
 
-def build_soap_envelope(xml_content: str, soap_action: str) -> str:
-    """Monta envelope SOAP 1.2 para envio à SEFAZ."""
-    return f"""<?xml version="1.0" encoding="UTF-8"?>
+_SOAP_ENVELOPE_HEAD = b"""<?xml version="1.0" encoding="UTF-8"?>
 <soap12:Envelope xmlns:soap12="http://www.w3.org/2003/05/soap-envelope"
                  xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
                  xmlns:xsd="http://www.w3.org/2001/XMLSchema">
   <soap12:Header/>
   <soap12:Body>
-    {xml_content}
+    """
+_SOAP_ENVELOPE_TAIL = b"""
   </soap12:Body>
 </soap12:Envelope>"""
 
 
-def build_cte_lote_xml(signed_xml: str, id_lote: str, versao: str = "4.00") -> str:
-    """Monta o XML de lote para envio CT-e (enviCTe)."""
+def build_soap_envelope(xml_content: str | bytes, soap_action: str, compress: bool = False) -> bytes:
+    """
+    Monta envelope SOAP 1.2 para envio à SEFAZ, já em bytes UTF-8.
+
+    Com `compress`, o XML vai compactado (gzip + base64) dentro de
+    <cteDadosMsg>/<mdfeDadosMsg>, no namespace do WSDL tirado do SOAPAction.
+    """
+    with metrics.stage("envelope_build"):
+        if isinstance(xml_content, str):
+            xml_content = xml_content.encode("utf-8")
+        if compress:
+            wsdl_ns = soap_action.rpartition("/")[0]
+            tag = "mdfeDadosMsg" if "/mdfe/" in wsdl_ns else "cteDadosMsg"
+            # mtime=0: o mesmo documento gera sempre o mesmo envelope
+            payload = base64.b64encode(gzip.compress(xml_content, compresslevel=SEFAZ_GZIP_LEVEL, mtime=0))
+            xml_content = b"".join((f'<{tag} xmlns="{wsdl_ns}">'.encode("utf-8"), payload, f"</{tag}>".encode("utf-8")))
+        return b"".join((_SOAP_ENVELOPE_HEAD, xml_content, _SOAP_ENVELOPE_TAIL))
+
+
+# Nós que o leiaute define como portadores de conteúdo gzip + base64: o
+# retorno compactado da recepção síncrona e o docZip da distribuição DF-e
+_COMPRESSED_CARRIERS = ("{*}retCTe", "{*}docZip")
+
+
+def inflate_compressed_nodes(body: etree._Element) -> etree._Element:
+    """
+    Troca o conteúdo gzip + base64 de retCTe/docZip da resposta pelo XML
+    descompactado, no lugar. Os demais nós não são tocados; conteúdo que não
+    descompacta como XML fica como está.
+    """
+    compressed = [
+        elem for elem in body.iter(*_COMPRESSED_CARRIERS)
+        if len(elem) == 0 and (elem.text or "").strip()
+    ]
+    for elem in compressed:
+        try:
+            inner = etree.fromstring(gzip.decompress(base64.b64decode(elem.text)))
+        except (ValueError, OSError, EOFError, etree.XMLSyntaxError):
+            continue
+        elem.text = None
+        elem.append(inner)
+    return body
+
+
+def sends_compressed(endpoint: tuple[str, str, str]) -> bool:
+    """Se o serviço recebe o XML compactado (`endpoint` = (UF, ambiente, serviço))."""
+    return endpoint[2] in SEFAZ_GZIP_SERVICES
+
+
+# Recepção assíncrona (CTeRecepcao) do lote enviCTe: responde com recibo,
+# acompanhado em CTeRetRecepcao
+CTE_RECEPCAO_ACTION = "http://www.portalfiscal.inf.br/cte/wsdl/CTeRecepcao/cteRecepcaoLote"
+
+# Limites do lote enviCTe (MOC CT-e): até 50 CT-e e 500 KB por mensagem
+CTE_LOTE_MAX_DOCS = 50
+CTE_LOTE_MAX_BYTES = 500 * 1024
+CTE_BATCH_MAX_DOCS = int(os.environ.get("CTE_BATCH_MAX_DOCS", "1000"))
+
+
+def strip_xml_declaration(xml_str: str) -> str:
+    """Remove a declaração <?xml ...?> para embutir o documento em outro XML."""
+    xml_str = xml_str.lstrip()
+    if xml_str.startswith("<?xml"):
+        xml_str = xml_str[xml_str.index("?>") + 2:].lstrip()
+    return xml_str
+
+
+def new_id_lote() -> str:
+    """Gera idLote numérico de até 15 dígitos, único por processo na prática."""
+    return str(time.time_ns() // 1000)[-15:]
+
+
+def build_cte_lote_xml(signed_xml: str | list[str], id_lote: str, versao: str = "4.00") -> str:
+    """Monta o XML de lote para envio CT-e (enviCTe) com um ou mais CT-e assinados."""
+    docs = [signed_xml] if isinstance(signed_xml, str) else signed_xml
+    body = "\n  ".join(strip_xml_declaration(doc) for doc in docs)
     return f"""<enviCTe xmlns="http://www.portalfiscal.inf.br/cte" versao="{versao}">
   <idLote>{id_lote}</idLote>
-  {signed_xml}
+  {body}
 </enviCTe>"""
 
 
+def build_cte_lote_bytes(signed_bytes: bytes, id_lote: str, versao: str = "4.00") -> bytes:
+    """
+    Versão em bytes de build_cte_lote_xml para um CT-e já serializado
+    (sign_xml()["signed_bytes"]): embrulha sem decodificar/reformatar o documento.
+    """
+    head = f"""<enviCTe xmlns="http://www.portalfiscal.inf.br/cte" versao="{versao}">
+  <idLote>{id_lote}</idLote>
+  """.encode("utf-8")
+    return b"".join((head, signed_bytes, b"\n</enviCTe>"))
+
+
+def pack_cte_lotes(signed_xmls: list[str]) -> list[list[int]]:
+    """
+    Agrupa CT-e assinados em lotes respeitando os limites de quantidade e tamanho.
+    Retorna listas de índices (na ordem de entrada) para cada lote.
+    """
+    overhead = len(build_cte_lote_xml([], "0" * 15).encode("utf-8"))
+    lotes: list[list[int]] = []
+    current: list[int] = []
+    current_size = overhead
+    for i, doc in enumerate(signed_xmls):
+        size = len(strip_xml_declaration(doc).encode("utf-8")) + 3
+        if current and (len(current) >= CTE_LOTE_MAX_DOCS or current_size + size > CTE_LOTE_MAX_BYTES):
+            lotes.append(current)
+            current, current_size = [], overhead
+        current.append(i)
+        current_size += size
+    if current:
+        lotes.append(current)
+    return lotes
+
+
 def build_consulta_xml(chave_acesso: str, tp_amb: str, doc_type: str = "cte") -> str:
     """Monta XML de consulta de situação."""
     if doc_type == "cte":
@@ -369,6 +831,23 @@ def build_consulta_xml(chave_acesso: str, tp_amb: str, doc_type: str = "cte") ->
 </consSitMDFe>"""
 
 
+def build_cons_reci_xml(n_rec: str, tp_amb: str) -> str:
+    """Monta XML de consulta do recibo de lote (retConsReciCTe)."""
+    return f"""<consReciCTe xmlns="http://www.portalfiscal.inf.br/cte" versao="4.00">
+  <tpAmb>{tp_amb}</tpAmb>
+  <nRec>{n_rec}</nRec>
+</consReciCTe>"""
+
+
+def build_cons_stat_serv_xml(tp_amb: str, cuf: str) -> str:
+    """Monta XML de consulta de status do serviço (CTeStatusServico)."""
+    return f"""<consStatServCTe xmlns="http://www.portalfiscal.inf.br/cte" versao="4.00">
+  <tpAmb>{tp_amb}</tpAmb>
+  <cUF>{cuf}</cUF>
+  <xServ>STATUS</xServ>
+</consStatServCTe>"""
+
+
 def build_cancel_event_xml(
     chave_acesso: str, protocolo: str, justificativa: str,
     tp_amb: str, cnpj: str, doc_type: str = "cte", seq: int = 1
@@ -433,59 +912,381 @@ def build_cce_event_xml(
 
 # ── Comunicação mTLS com SEFAZ ───────────────────────────────────
 
-def create_session_with_retry(retries: int = 2) -> http_requests.Session:
-    """Cria sessão HTTP com retry automático em erros temporários."""
+class SSLContextAdapter(HTTPAdapter):
+    """
+    HTTPAdapter que usa um SSLContext pronto (certificado de cliente + CAs).
+
+    Evita que requests/urllib3 recarreguem cert/CA a partir de arquivos a
+    cada nova conexão: tudo já está no contexto, que é compartilhado.
+    """
+
+    def __init__(self, ssl_context: ssl.SSLContext, **kwargs):
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **pool_kwargs):
+        pool_kwargs["ssl_context"] = self.ssl_context
+        return super().init_poolmanager(*args, **pool_kwargs)
+
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+        pool_kwargs.pop("ca_certs", None)
+        pool_kwargs.pop("ca_cert_dir", None)
+        return host_params, pool_kwargs
+
+    def cert_verify(self, conn, url, verify, cert):
+        super().cert_verify(conn, url, verify, cert)
+        conn.ca_certs = None
+        conn.ca_cert_dir = None
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        # Cabeçalhos lidos e conexão ainda aberta (o corpo vem depois): o
+        # ticket TLS 1.3 já chegou, mesmo que a SEFAZ feche a conexão no fim
+        if isinstance(self.ssl_context, ResumableSSLContext):
+            self.ssl_context.save_session()
+        return response
+
+
+SEFAZ_RETRIES = 2
+SEFAZ_RETRY_STATUS = (502, 503, 504)
+# Serviços em que reenviar uma requisição já transmitida pode autorizar/registrar
+# em dobro (a SEFAZ processa e o 503/reset chega depois): só há retry de conexão
+NON_IDEMPOTENT_SERVICES = frozenset(("cteAutorizacao", "cteRecepcaoSinc", "mdfeAutorizacao", "cteEvento", "mdfeEvento"))
+
+
+def can_resend(endpoint: tuple[str, str, str]) -> bool:
+    """Se a chamada pode ser reenviada após erro de leitura/5xx (`endpoint` = (UF, ambiente, serviço))."""
+    return endpoint[2] not in NON_IDEMPOTENT_SERVICES
+
+
+def retry_backoff(attempt: int) -> float:
+    """Espera antes da tentativa `attempt` (1, 2, ...) de uma chamada SEFAZ: 1s, 2s, 4s..."""
+    return 2 ** (attempt - 1)
+
+
+def create_session_with_retry(
+    retries: int = SEFAZ_RETRIES, pool_maxsize: int = 1, ssl_context: ssl.SSLContext | None = None
+) -> http_requests.Session:
+    """
+    Cria sessão HTTP com retry automático de conexão.
+
+    Só falhas ao conectar (requisição não enviada) são repetidas aqui; 5xx e
+    erros de leitura ficam com send_to_sefaz, que só reenvia serviços
+    idempotentes (can_resend).
+    """
     session = http_requests.Session()
     retry_strategy = Retry(
         total=retries,
+        connect=retries,
+        read=0,
+        status=0,
+        other=0,
         backoff_factor=1,
-        status_forcelist=[502, 503, 504],
         allowed_methods=["POST"],
     )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
+    adapter_kwargs = dict(
+        max_retries=retry_strategy,
+        pool_connections=1,
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_maxsize > 1,
+    )
+    if ssl_context is not None:
+        adapter = SSLContextAdapter(ssl_context, **adapter_kwargs)
+    else:
+        adapter = HTTPAdapter(**adapter_kwargs)
     session.mount("https://", adapter)
     return session
 
 
-def send_to_sefaz(
-    url: str, soap_xml: str, cert: InMemoryCert,
-    soap_action: str, timeout: int = None
-) -> etree._Element:
-    """Envia envelope SOAP para SEFAZ com mTLS."""
-    timeout = timeout or DEFAULT_TIMEOUT
-    envelope = build_soap_envelope(soap_xml, soap_action)
+class ResumableSSLContext:
+    """
+    SSLContext do certificado para um host, retomando a última sessão TLS.
+
+    Encaminha tudo ao contexto do certificado (compartilhado entre hosts);
+    wrap_socket passa a sessão guardada, e a conexão nova faz o handshake
+    abreviado — sem troca de certificados nem assinatura com a chave do
+    cliente. No TLS 1.3 o ticket só chega com a primeira resposta, então a
+    sessão é lida das conexões vivas (save_session) a cada resposta recebida
+    pelo SSLContextAdapter.
+    """
+
+    __slots__ = ("context", "session", "handshakes", "resumed", "_sockets", "_lock")
+
+    def __init__(self, context: ssl.SSLContext):
+        self.context = context
+        self.session: ssl.SSLSession | None = None
+        self.handshakes = 0
+        self.resumed = 0
+        self._sockets: weakref.WeakSet = weakref.WeakSet()
+        self._lock = threading.Lock()
 
-    headers = {
+    def __getattr__(self, name):
+        return getattr(self.context, name)
+
+    def __setattr__(self, name, value):
+        # urllib3 ajusta verify_mode/check_hostname a cada conexão: vale para o contexto do certificado
+        if name in ResumableSSLContext.__slots__:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.context, name, value)
+
+    def wrap_socket(self, sock, *args, **kwargs) -> ssl.SSLSocket:
+        ssl_sock = self.context.wrap_socket(sock, *args, session=self.save_session(), **kwargs)
+        with self._lock:
+            self._sockets.add(ssl_sock)
+            self.handshakes += 1
+            self.resumed += ssl_sock.session_reused
+        return ssl_sock
+
+    def save_session(self) -> ssl.SSLSession | None:
+        """Guarda a sessão retomável mais recente das conexões vivas e a devolve."""
+        with self._lock:
+            for sock in list(self._sockets):
+                session = sock.session
+                # TLS 1.3 sem ticket ainda (nenhuma resposta lida) não é retomável
+                if session is not None and (session.has_ticket or sock.version() != "TLSv1.3"):
+                    self.session = session
+            return self.session
+
+
+class SefazSessionPool:
+    """
+    Pool de sessões mTLS reaproveitadas entre chamadas, por (certificado, host).
+
+    Chamadas seguidas do mesmo tenant para a mesma SEFAZ reutilizam conexões
+    keep-alive já autenticadas, sem refazer TCP + handshake TLS com cliente.
+    Conexões novas — vaga extra do pool, conexão fechada pela SEFAZ, sessão
+    recriada após ficar ociosa — retomam a última sessão TLS do (certificado,
+    host) (ResumableSSLContext, que sobrevive ao fechamento da sessão HTTP).
+    Cada sessão limita suas conexões a `pool_maxsize`; sessões ociosas por
+    mais de `idle_timeout` segundos são fechadas, e o total de sessões é
+    limitado a `max_sessions` (LRU, ignorando sessões em uso).
+    """
+
+    def __init__(self, max_sessions: int, pool_maxsize: int, idle_timeout: int):
+        self.max_sessions = max_sessions
+        self.pool_maxsize = pool_maxsize
+        self.idle_timeout = idle_timeout
+        # chave -> [session, cert, last_used, in_use]
+        self._sessions: OrderedDict[tuple[str, str], list] = OrderedDict()
+        # chave -> sessão TLS a retomar (também limitado a max_sessions, LRU)
+        self._tls: OrderedDict[tuple[str, str], ResumableSSLContext] = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    @contextmanager
+    def lease(self, cert: InMemoryCert, url: str):
+        """Empresta a sessão de (certificado, host), criando se necessário."""
+        key = (cert.fingerprint, urlsplit(url).netloc)
+        with self._lock:
+            self._evict_idle(time.monotonic())
+            entry = self._sessions.get(key)
+            if entry is None:
+                self._enforce_limit()
+                tls = self._tls_context(key, cert)
+                session = create_session_with_retry(pool_maxsize=self.pool_maxsize, ssl_context=tls)
+                entry = [session, cert, 0.0, 0]
+                self._sessions[key] = entry
+                self.created += 1
+            else:
+                self.reused += 1
+                if key in self._tls:
+                    self._tls.move_to_end(key)
+            self._sessions.move_to_end(key)
+            entry[3] += 1
+
+        try:
+            yield entry[0]
+        finally:
+            with self._lock:
+                entry[2] = time.monotonic()
+                entry[3] -= 1
+
+    def _tls_context(self, key: tuple[str, str], cert: InMemoryCert) -> ResumableSSLContext:
+        """Contexto que retoma a sessão TLS de `key` (chamar com lock)."""
+        tls = self._tls.get(key)
+        # Certificado recarregado (CertCache) tem outro SSLContext: a sessão antiga não serve
+        if tls is None or tls.context is not cert.ssl_context:
+            tls = self._tls[key] = ResumableSSLContext(cert.ssl_context)
+        self._tls.move_to_end(key)
+        while len(self._tls) > self.max_sessions:
+            self._tls.popitem(last=False)
+        return tls
+
+    def _evict_idle(self, now: float):
+        """Fecha sessões ociosas há mais de idle_timeout (chamar com lock)."""
+        for key, entry in list(self._sessions.items()):
+            if entry[3] == 0 and now - entry[2] > self.idle_timeout:
+                del self._sessions[key]
+                entry[0].close()
+
+    def _enforce_limit(self):
+        """Abre espaço para uma nova sessão fechando as menos usadas (chamar com lock)."""
+        for key, entry in list(self._sessions.items()):
+            if len(self._sessions) < self.max_sessions:
+                break
+            if entry[3] == 0:
+                del self._sessions[key]
+                entry[0].close()
+
+    def close_all(self):
+        with self._lock:
+            for entry in self._sessions.values():
+                entry[0].close()
+            self._sessions.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "in_use": sum(1 for e in self._sessions.values() if e[3]),
+                "max_sessions": self.max_sessions,
+                "pool_maxsize": self.pool_maxsize,
+                "created": self.created,
+                "reused": self.reused,
+                "tls_handshakes": sum(tls.handshakes for tls in self._tls.values()),
+                "tls_resumed": sum(tls.resumed for tls in self._tls.values()),
+            }
+
+
+sefaz_sessions = SefazSessionPool(SEFAZ_POOL_MAX_SESSIONS, SEFAZ_POOL_MAXSIZE, SEFAZ_POOL_IDLE_TIMEOUT)
+
+
+def soap_headers(soap_action: str) -> dict:
+    return {
         "Content-Type": "application/soap+xml; charset=utf-8",
         "SOAPAction": soap_action,
     }
 
-    session = create_session_with_retry()
-    try:
-        logger.info(f"[SEFAZ] POST {url} | SOAPAction: {soap_action}")
-        start = time.time()
-        response = session.post(
-            url,
-            data=envelope.encode("utf-8"),
-            headers=headers,
-            cert=cert.cert_tuple,
-            verify=os.environ.get("REQUESTS_CA_BUNDLE", "/etc/ssl/certs/ca-certificates.crt"),
-            timeout=timeout,
-        )
-        elapsed = int((time.time() - start) * 1000)
-        logger.info(f"[SEFAZ] Response {response.status_code} in {elapsed}ms")
 
-        if response.status_code != 200:
-            raise Exception(f"SEFAZ retornou HTTP {response.status_code}: {response.text[:500]}")
+def parse_soap_body(status_code: int, content: bytes) -> etree._Element:
+    """Valida o status HTTP e extrai o soap:Body da resposta da SEFAZ."""
+    if status_code != 200:
+        raise Exception(f"SEFAZ retornou HTTP {status_code}: {content[:500].decode('utf-8', 'replace')}")
 
-        # Parse SOAP response
-        resp_root = etree.fromstring(response.content)
+    with metrics.stage("response_parse"):
+        resp_root = etree.fromstring(content)
         body = resp_root.find(".//{http://www.w3.org/2003/05/soap-envelope}Body")
         if body is None:
             body = resp_root  # fallback
-        return body
+        # Retorno compactado vira XML aqui: métricas, circuito e extract_sefaz_response leem o conteúdo
+        return inflate_compressed_nodes(body)
+
+
+def parse_sefaz_response(
+    url: str, endpoint: tuple[str, str, str], seconds: float, status_code: int, content: bytes,
+) -> etree._Element:
+    """parse_soap_body + registro do round trip nas métricas e no circuit breaker."""
+    try:
+        body = parse_soap_body(status_code, content)
+    except Exception:
+        metrics.observe_sefaz(endpoint, seconds, f"http_{status_code}" if status_code != 200 else "resposta_invalida")
+        # 4xx é problema da requisição, não do autorizador
+        sefaz_circuits.record(url, success=status_code < 500 and status_code != 200)
+        raise
+    cstat = body.findtext(".//{*}cStat") or ""
+    metrics.observe_sefaz(endpoint, seconds, cstat)
+    sefaz_circuits.record(url, success=cstat not in CIRCUIT_FAILURE_CSTATS)
+    return body
+
+
+def throttle_delay(cert: InMemoryCert, endpoint: tuple[str, str, str]) -> float:
+    """
+    Reserva a chamada no token bucket de (CNPJ, UF, ambiente, serviço) e
+    devolve quanto aguardar antes dela. Requisições da API que teriam de
+    aguardar mais que SEFAZ_QUEUE_TIMEOUT recebem 429 (RateLimited).
+    """
+    max_wait = SEFAZ_QUEUE_TIMEOUT if sefaz_admission.get() else None
+    try:
+        delay = sefaz_rate_limiter.reserve((cert.cnpj, *endpoint), max_wait)
+    except EndpointBusy as e:
+        metrics.observe_rejected(endpoint, e.reason)
+        raise
+    if delay > 0:
+        metrics.observe_throttled(endpoint, delay)
+    return delay
+
+
+def check_consumption(cert: InMemoryCert, endpoint: tuple[str, str, str], body: etree._Element):
+    """cStat 656 na resposta: pausa as chamadas do CNPJ a esse serviço por SEFAZ_RATE_PENALTY segundos."""
+    # Em geral no cStat do retorno; em lotes pode vir no protocolo do documento
+    if any(node.text == CONSUMO_INDEVIDO_CSTAT for node in body.iter("{*}cStat")):
+        logger.warning(
+            f"[SEFAZ] Consumo indevido (656) para {cert.cnpj} em {'/'.join(endpoint)}: "
+            f"pausa de {SEFAZ_RATE_PENALTY:g}s"
+        )
+        sefaz_rate_limiter.penalize((cert.cnpj, *endpoint))
+
+
+def send_to_sefaz(
+    url: str, soap_xml: str | bytes, cert: InMemoryCert,
+    soap_action: str, timeout: int = None, endpoint: tuple[str, str, str] = ("", "", ""),
+) -> etree._Element:
+    """Envia envelope SOAP para SEFAZ com mTLS; `endpoint` = (UF, ambiente, serviço) para as métricas."""
+    timeout = timeout or DEFAULT_TIMEOUT
+    envelope = build_soap_envelope(soap_xml, soap_action, compress=sends_compressed(endpoint))
+
+    retries = SEFAZ_RETRIES if can_resend(endpoint) else 0
+
+    delay = throttle_delay(cert, endpoint)
+    if delay > 0:
+        time.sleep(delay)
+    probe = None
+    try:
+        with sefaz_limiter.acquire(url, sefaz_admission.get(), cert.cnpj) as waited, \
+                sefaz_sessions.lease(cert, url) as session:
+            metrics.observe_queue(endpoint, waited)
+            # Circuito consultado só agora, com a vaga em mãos: a chamada de
+            # teste do meio-aberto é de fato esta
+            probe = sefaz_circuits.begin(url)
+            if probe is None:
+                sefaz_rate_limiter.refund((cert.cnpj, *endpoint))
+                raise circuit_open_error(url, endpoint)
+            for attempt in range(retries + 1):
+                if attempt:
+                    time.sleep(retry_backoff(attempt))
+                logger.info(f"[SEFAZ] POST {url} | SOAPAction: {soap_action}")
+                start = time.time()
+                try:
+                    response = session.post(
+                        url,
+                        data=envelope,
+                        headers=soap_headers(soap_action),
+                        timeout=timeout,
+                    )
+                except Exception:
+                    if attempt < retries:
+                        continue
+                    metrics.observe_sefaz(endpoint, time.time() - start, "erro_conexao")
+                    sefaz_circuits.record(url, success=False)
+                    raise
+                if response.status_code in SEFAZ_RETRY_STATUS and attempt < retries:
+                    continue
+                break
+            seconds = time.time() - start
+            logger.info(f"[SEFAZ] Response {response.status_code} in {int(seconds * 1000)}ms")
+        body = parse_sefaz_response(url, endpoint, seconds, response.status_code, response.content)
+    except EndpointBusy as e:
+        # Fila do endpoint cheia: a chamada não foi feita, a ficha volta ao balde
+        sefaz_rate_limiter.refund((cert.cnpj, *endpoint))
+        metrics.observe_rejected(endpoint, e.reason)
+        raise
     finally:
-        session.close()
+        sefaz_circuits.end(url, probe)
+
+    check_consumption(cert, endpoint, body)
+    return body
+
+
+# Nós lidos da resposta SEFAZ, em qualquer namespace
+_RESPONSE_TAGS = tuple(
+    f"{{*}}{tag}" for tag in
+    ("cStat", "xMotivo", "chCTe", "chMDFe", "nProt", "nRec", "dhRecbto", "protCTe", "protMDFe")
+)
+_LOTE_PARENTS = frozenset(("retEnviCTe", "retConsReciCTe", "retEnviMDFe", "retCTe", "retMDFe"))
+_PROT_PARENTS = frozenset(("infProt", "protCTe", "protMDFe", "infEvento", "retEvento"))
 
 
 def extract_sefaz_response(body: etree._Element, doc_type: str = "cte") -> dict:
@@ -517,52 +1318,58 @@ def extract_sefaz_response(body: etree._Element, doc_type: str = "cte") -> dict:
         "status_detail": "",
     }
 
-    # Primeiro pass: extrair cStat do retorno do lote (retEnviCTe / retConsReciCTe)
+    # Visita só os nós relevantes (o filtro de tag roda dentro do lxml, sem
+    # criar objetos Python para o resto da árvore). Quando um campo aparece
+    # mais de uma vez vale a última ocorrência, como no percurso completo.
     lote_cstat = ""
     lote_xmotivo = ""
     prot_cstat = ""
     prot_xmotivo = ""
+    last_prot = None
 
-    for elem in body.iter():
-        tag = etree.QName(elem).localname if isinstance(elem.tag, str) else ""
-        text = (elem.text or "").strip()
+    for elem in body.iter(*_RESPONSE_TAGS):
+        tag = elem.tag.rpartition("}")[2]
+
+        if tag in ("protCTe", "protMDFe"):
+            last_prot = elem
+            continue
 
-        # cStat pode aparecer no nível do lote E no nível do protocolo
-        if tag == "cStat" and text:
-            parent_tag = ""
-            if elem.getparent() is not None:
-                parent_tag = etree.QName(elem.getparent()).localname if isinstance(elem.getparent().tag, str) else ""
-
-            if parent_tag in ("retEnviCTe", "retConsReciCTe", "retEnviMDFe", "retCTe", "retMDFe"):
-                lote_cstat = text
-            elif parent_tag in ("infProt", "protCTe", "protMDFe", "infEvento", "retEvento"):
-                prot_cstat = text
-            elif not lote_cstat:
-                # Fallback: primeiro cStat encontrado
-                lote_cstat = text
-
-        elif tag == "xMotivo" and text:
-            parent_tag = ""
-            if elem.getparent() is not None:
-                parent_tag = etree.QName(elem.getparent()).localname if isinstance(elem.getparent().tag, str) else ""
-
-            if parent_tag in ("retEnviCTe", "retConsReciCTe", "retEnviMDFe", "retCTe", "retMDFe"):
-                lote_xmotivo = text
-            elif parent_tag in ("infProt", "protCTe", "protMDFe", "infEvento", "retEvento"):
-                prot_xmotivo = text
-            elif not lote_xmotivo:
-                lote_xmotivo = text
-
-        elif tag in ("chCTe", "chMDFe") and text:
+        text = (elem.text or "").strip()
+        if not text:
+            continue
+
+        # cStat/xMotivo podem aparecer no nível do lote E no nível do protocolo
+        if tag in ("cStat", "xMotivo"):
+            parent = elem.getparent()
+            parent_tag = parent.tag.rpartition("}")[2] if parent is not None else ""
+
+            if tag == "cStat":
+                if parent_tag in _LOTE_PARENTS:
+                    lote_cstat = text
+                elif parent_tag in _PROT_PARENTS:
+                    prot_cstat = text
+                elif not lote_cstat:
+                    # Fallback: primeiro cStat encontrado
+                    lote_cstat = text
+            else:
+                if parent_tag in _LOTE_PARENTS:
+                    lote_xmotivo = text
+                elif parent_tag in _PROT_PARENTS:
+                    prot_xmotivo = text
+                elif not lote_xmotivo:
+                    lote_xmotivo = text
+
+        elif tag in ("chCTe", "chMDFe"):
             result["chave_acesso"] = text
-        elif tag == "nProt" and text:
+        elif tag == "nProt":
             result["protocolo"] = text
-        elif tag == "nRec" and text:
+        elif tag == "nRec":
             result["nRec"] = text
-        elif tag == "dhRecbto" and text:
+        elif tag == "dhRecbto":
             result["data_autorizacao"] = text
-        elif tag in ("protCTe", "protMDFe"):
-            result["xml_autorizado"] = etree.tostring(elem, encoding="unicode")
+
+    if last_prot is not None:
+        result["xml_autorizado"] = etree.tostring(last_prot, encoding="unicode")
 
     # Usar cStat do protocolo se disponível, senão do lote
     final_cstat = prot_cstat or lote_cstat
@@ -647,435 +1454,977 @@ def extract_sefaz_response(body: etree._Element, doc_type: str = "cte") -> dict:
     return result
 
 
-# ── Autenticação ─────────────────────────────────────────────────
+def extract_sefaz_protocols(body: etree._Element, doc_type: str = "cte") -> tuple[dict, dict[str, dict]]:
+    """
+    Extrai a resposta de um lote com vários protocolos.
 
-def check_auth():
-    if API_KEY and request.headers.get("X-API-Key") != API_KEY:
-        return jsonify({"error": "Unauthorized"}), 401
-    return None
+    Retorna (resultado do lote, {chave_acesso: resultado do protocolo}), onde
+    cada protocolo passa pelo mesmo tratamento de cStat de extract_sefaz_response.
+    """
+    lote_result = extract_sefaz_response(body, doc_type)
+    prot_tag = "protCTe" if doc_type == "cte" else "protMDFe"
+    ns = NAMESPACES[doc_type]
 
+    protocols = {}
+    for prot in body.iter(f"{{{ns}}}{prot_tag}"):
+        prot_result = extract_sefaz_response(prot, doc_type)
+        if prot_result["chave_acesso"]:
+            protocols[prot_result["chave_acesso"]] = prot_result
+    return lote_result, protocols
 
-def parse_cert_from_request(data: dict) -> InMemoryCert:
-    """Extrai e valida certificado do request body."""
-    for field in ("pfx_base64", "password"):
-        if not data.get(field):
-            raise ValueError(f"Campo obrigatório ausente: {field}")
-    pfx_bytes = base64.b64decode(data["pfx_base64"])
-    password = data["password"].encode()
-    return InMemoryCert(pfx_bytes, password)
 
+# ── Consulta de recibo (retConsReciCTe) ─────────────────────────
 
-def get_tp_amb(ambiente: str) -> str:
-    return "1" if ambiente == "producao" else "2"
+CTE_RET_RECEPCAO_ACTION = "http://www.portalfiscal.inf.br/cte/wsdl/CTeRetRecepcao/cteRetRecepcao"
 
+# status_detail que indicam lote ainda não processado
+RECEIPT_PENDING_STATUS = ("lote_recebido", "em_processamento")
 
-# ── Endpoints ────────────────────────────────────────────────────
 
-@app.route("/health", methods=["GET"])
-def health():
-    # Verificar XSDs disponíveis
-    xsd_files = list(XSD_DIR.glob("*.xsd")) if XSD_DIR.exists() else []
-    xsd_names = [f.name for f in xsd_files]
-    return jsonify({
-        "status": "ok",
-        "version": "2.1.0",
-        "xsd_available": len(xsd_files) > 0,
-        "xsd_schemas": xsd_names,
-        "capabilities": [
-            "sign", "cte/emit", "cte/consult", "cte/cancel", "cte/cce",
-            "mdfe/emit", "mdfe/consult", "mdfe/cancel", "mdfe/close",
-        ],
-    }), 200
+class _PendingReceipt:
+    def __init__(
+        self, cert: InMemoryCert, tp_amb: str, delay: float, max_wait: float, endpoint: tuple[str, str, str],
+    ):
+        now = time.monotonic()
+        self.future: Future = Future()
+        self.cert = cert
+        self.tp_amb = tp_amb
+        self.endpoint = endpoint
+        self.delay = delay
+        self.submitted_at = now
+        self.next_poll = now + delay
+        self.deadline = now + max_wait
 
 
-@app.route("/sign", methods=["POST"])
-def sign_endpoint():
-    """Apenas assinar XML (compatibilidade retroativa)."""
-    auth_err = check_auth()
-    if auth_err:
-        return auth_err
+class _EndpointReceipts:
+    def __init__(self, estimate: float):
+        self.pending: dict[str, _PendingReceipt] = {}
+        self.estimate = estimate  # tempo médio até o lote ser processado (EWMA)
+        self.thread: threading.Thread | None = None
 
-    try:
-        data = request.json
-        if not data:
-            return jsonify({"error": "Request body is required"}), 400
 
-        for field in ("xml", "pfx_base64", "password", "document_type", "document_id"):
-            if not data.get(field):
-                return jsonify({"error": f"Campo obrigatório ausente: {field}"}), 400
+class ReceiptPoller:
+    """
+    Acompanha recibos de lote (cStat 103/105) até o protocolo final.
+
+    Um único poller por endpoint SEFAZ atende todos os recibos pendentes
+    daquele endpoint, em sequência, pela sessão mTLS já aberta. Pedidos para
+    o mesmo nRec são coalescidos num só Future. A primeira consulta espera o
+    tempo médio de processamento observado no endpoint (EWMA por UF/ambiente);
+    as seguintes crescem 1,5x até RECEIPT_MAX_DELAY.
+    """
 
-        cert = parse_cert_from_request(data)
+    def __init__(self, initial_delay: float, max_delay: float):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self._endpoints: dict[str, _EndpointReceipts] = {}
+        self._cond = threading.Condition()
+        self.polls = 0
+        self.coalesced = 0
+
+    def submit(
+        self, cert: InMemoryCert, url: str, n_rec: str, tp_amb: str, max_wait: float,
+        metric_endpoint: tuple[str, str, str] = ("", "", ""),
+    ) -> Future:
+        """Registra o recibo (ou reaproveita o pedido em andamento) e devolve o Future do resultado."""
+        with self._cond:
+            endpoint = self._endpoints.get(url)
+            if endpoint is None:
+                endpoint = self._endpoints[url] = _EndpointReceipts(self.initial_delay)
+
+            pending = endpoint.pending.get(n_rec)
+            if pending is not None:
+                self.coalesced += 1
+                return pending.future
+
+            pending = _PendingReceipt(cert, tp_amb, endpoint.estimate, max_wait, metric_endpoint)
+            endpoint.pending[n_rec] = pending
+            if endpoint.thread is None:
+                endpoint.thread = threading.Thread(
+                    target=self._run_endpoint, args=(url, endpoint), name="receipt-poller", daemon=True,
+                )
+                endpoint.thread.start()
+            self._cond.notify_all()
+            return pending.future
+
+    def _run_endpoint(self, url: str, endpoint: _EndpointReceipts):
+        sefaz_admission.set(False)
+        while True:
+            with self._cond:
+                if not endpoint.pending:
+                    # Sem recibos pendentes: encerra; o próximo submit cria outra thread
+                    endpoint.thread = None
+                    return
+                now = time.monotonic()
+                due = [(n_rec, p) for n_rec, p in endpoint.pending.items() if p.next_poll <= now]
+                if not due:
+                    wait = min(p.next_poll for p in endpoint.pending.values()) - now
+                    self._cond.wait(timeout=wait)
+                    continue
+
+            for n_rec, pending in due:
+                self._poll(url, endpoint, n_rec, pending)
+
+    def _poll(self, url: str, endpoint: _EndpointReceipts, n_rec: str, pending: _PendingReceipt):
         try:
-            result = sign_xml(data["xml"], cert, data["document_type"], data["document_id"])
-            logger.info(f"Signed {data['document_type']} document: {data['document_id']}")
-            return jsonify({
-                "signed_xml": result["signed_xml"],
-                "digest_value": result["digest_value"],
-                "signature_value": result["signature_value"],
-            }), 200
-        finally:
-            cert.cleanup()
+            body = send_to_sefaz(
+                url, build_cons_reci_xml(n_rec, pending.tp_amb), pending.cert,
+                soap_action=CTE_RET_RECEPCAO_ACTION, endpoint=pending.endpoint,
+            )
+            result, protocols = extract_sefaz_protocols(body, "cte")
+            result["protocolos"] = list(protocols.values())
+            error = None
+        except Exception as e:
+            result, error = None, e
+
+        now = time.monotonic()
+        with self._cond:
+            self.polls += 1
+            finished = result is not None and result["status_detail"] not in RECEIPT_PENDING_STATUS
+            if not finished and now + pending.delay < pending.deadline:
+                pending.delay = min(pending.delay * 1.5, self.max_delay)
+                pending.next_poll = now + pending.delay
+                return
+
+            del endpoint.pending[n_rec]
+            if finished:
+                elapsed = now - pending.submitted_at
+                endpoint.estimate = 0.7 * endpoint.estimate + 0.3 * min(elapsed, self.max_delay)
+
+        if result is not None:
+            result["nRec"] = result["nRec"] or n_rec
+            pending.future.set_result(result)
+        else:
+            pending.future.set_exception(error)
 
-    except Exception as e:
-        logger.error(f"Signing error: {str(e)}")
-        return jsonify({"error": f"Erro ao assinar: {str(e)}"}), 500
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "polls": self.polls,
+                "coalesced": self.coalesced,
+                "endpoints": {
+                    url: {"pending": len(ep.pending), "estimate_s": round(ep.estimate, 2)}
+                    for url, ep in self._endpoints.items()
+                },
+            }
 
 
-@app.route("/cte/emit", methods=["POST"])
-def cte_emit():
-    """Assinar CT-e + enviar para SEFAZ via SOAP/mTLS."""
-    auth_err = check_auth()
-    if auth_err:
-        return auth_err
+receipt_poller = ReceiptPoller(RECEIPT_INITIAL_DELAY, RECEIPT_MAX_DELAY)
+
+
+# ── Status dos autorizadores (sefaz_health.py) ──────────────────
+
+CTE_STATUS_ACTION = "http://www.portalfiscal.inf.br/cte/wsdl/CTeStatusServico/cteStatusServicoCT"
 
-    cert = None
+# Serviços recusados de antemão quando a UF está fora do ar na tabela de status
+STATUS_GATED_SERVICES = ("cteAutorizacao", "cteRecepcaoSinc")
+
+
+def probe_sefaz_status(cert: InMemoryCert, uf: str, ambiente: str) -> dict:
+    """Entrada da tabela de status para a UF/ambiente, pelo CTeStatusServico."""
+    # Sonda aguarda a vez na fila do endpoint, sem 429
+    sefaz_admission.set(False)
+    region = uf if uf in UFS_COM_ENDPOINT_PROPRIO else "SVRS"
+    url = _endpoint_url(ambiente, region, "cteStatus")
+    entry = {
+        "uf": uf, "ambiente": ambiente, "status": "down", "cStat": "", "xMotivo": "", "tMed": None,
+        "latencia_ms": None, "verificado_em": datetime.now().isoformat(timespec="seconds"),
+    }
+    start = time.time()
     try:
-        data = request.json
-        if not data:
-            return jsonify({"error": "Request body is required"}), 400
+        body = send_to_sefaz(
+            url, build_cons_stat_serv_xml(get_tp_amb(ambiente), UF_CODIGO_IBGE[uf]), cert,
+            soap_action=CTE_STATUS_ACTION, timeout=SEFAZ_STATUS_TIMEOUT, endpoint=(uf, ambiente, "cteStatus"),
+        )
+    except Exception as e:
+        entry["erro"] = str(e)[:200]
+        return entry
 
-        for field in ("xml", "pfx_base64", "password", "uf", "ambiente"):
-            if not data.get(field):
-                return jsonify({"error": f"Campo obrigatório ausente: {field}"}), 400
+    entry["latencia_ms"] = int((time.time() - start) * 1000)
+    entry["cStat"] = body.findtext(".//{*}cStat") or ""
+    entry["xMotivo"] = body.findtext(".//{*}xMotivo") or ""
+    t_med = body.findtext(".//{*}tMed")
+    entry["tMed"] = int(t_med) if t_med and t_med.isdigit() else None
+    if entry["cStat"] == "107":
+        entry["status"] = "ok"
+    elif entry["cStat"] not in ("108", "109"):
+        # Rejeição da própria consulta (certificado, consumo indevido...): não diz nada do serviço
+        entry["status"] = "desconhecido"
+    return entry
 
-        cert = parse_cert_from_request(data)
-        doc_id = data.get("document_id", "CTe_unknown")
 
-        # 0. Validar XML contra XSD (se disponível)
-        skip_xsd = data.get("skip_xsd_validation", False)
-        if not skip_xsd:
-            xsd_errors = validate_cte_xsd(data["xml"])
-            if xsd_errors:
-                logger.warning(f"[CTE EMIT] XSD validation failed: {xsd_errors}")
-                return jsonify({
-                    "success": False,
-                    "error": "Validação XSD falhou",
-                    "xsd_errors": xsd_errors,
-                    "status_detail": "xsd_invalido",
-                }), 400
+sefaz_status = SefazStatusTable(
+    SEFAZ_STATUS_FILE, SEFAZ_STATUS_UFS, SEFAZ_STATUS_AMBIENTES, SEFAZ_STATUS_INTERVAL,
+    SEFAZ_STATUS_PFX_PATH, SEFAZ_STATUS_PFX_PASSWORD, cert_cache.get, probe_sefaz_status,
+)
 
-        # 1. Assinar XML
-        logger.info(f"[CTE EMIT] Assinando CT-e {doc_id}")
-        sign_result = sign_xml(data["xml"], cert, "cte", doc_id)
 
-        # 2. Montar lote
-        id_lote = str(int(time.time()))[-15:]
-        lote_xml = build_cte_lote_xml(sign_result["signed_xml"], id_lote)
+# ── Cache de consultas ───────────────────────────────────────────
+#
+# /cte/consult e /mdfe/consult respondem do cache quando a chave já tem
+# situação conhecida; emissões autorizadas, cancelamentos e encerramentos
+# homologados por este serviço já deixam a situação final guardada.
 
-        # 3. Resolver endpoint SEFAZ
-        url = get_sefaz_url(data["uf"], data["ambiente"], "cteAutorizacao")
-        tp_amb = get_tp_amb(data["ambiente"])
+consult_cache = ConsultCache(CONSULT_CACHE_SIZE, CONSULT_CACHE_TTL, CONSULT_CACHE_DB_PATH)
 
-        # 4. Enviar via mTLS
-        logger.info(f"[CTE EMIT] Enviando lote {id_lote} para {url}")
-        soap_body = send_to_sefaz(
-            url, lote_xml, cert,
-            soap_action="http://www.portalfiscal.inf.br/cte/wsdl/CTeRecepcaoSinc/cteRecepcaoLote",
-            timeout=data.get("timeout", DEFAULT_TIMEOUT),
-        )
+EVENT_REGISTERED_CSTATS = ("135", "155")
 
-        # 5. Extrair resposta
-        result = extract_sefaz_response(soap_body, "cte")
-        result["signed_xml"] = sign_result["signed_xml"]
-        result["digest_value"] = sign_result["digest_value"]
-        result["signature_value"] = sign_result["signature_value"]
-        result["sefaz_url"] = url
-        result["ambiente"] = data["ambiente"]
-        result["tpAmb"] = tp_amb
-        result["id_lote"] = id_lote
 
-        logger.info(f"[CTE EMIT] Resultado: cStat={result['cStat']} | {result['xMotivo']}")
-        return jsonify(result), 200
+def cache_emit_results(data: dict, result: dict):
+    """Guarda os documentos autorizados de uma emissão (simples ou lote)."""
+    for item in result.get("results") or [result]:
+        consult_cache.put_final(data["ambiente"], item.get("chave_acesso", ""), item)
 
-    except Exception as e:
-        logger.error(f"[CTE EMIT] Error: {str(e)}")
-        return jsonify({"error": str(e), "success": False}), 500
-    finally:
-        if cert:
-            cert.cleanup()
 
+def cache_cancel_result(data: dict, result: dict):
+    """Cancelamento homologado: a consulta da chave passa a devolver 101."""
+    if result.get("cStat") not in EVENT_REGISTERED_CSTATS:
+        return
+    consult_cache.put_final(data["ambiente"], data["chave_acesso"], {
+        "success": True,
+        "cStat": "101",
+        "xMotivo": "Cancelamento homologado",
+        "chave_acesso": data["chave_acesso"],
+        "protocolo": result.get("protocolo", ""),
+        "data_autorizacao": result.get("data_autorizacao", ""),
+        "status_detail": "cancelamento_homologado",
+    })
 
-@app.route("/cte/consult", methods=["POST"])
-def cte_consult():
-    """Consultar situação de CT-e na SEFAZ."""
-    auth_err = check_auth()
-    if auth_err:
-        return auth_err
 
-    cert = None
-    try:
-        data = request.json
-        for field in ("chave_acesso", "pfx_base64", "password", "uf", "ambiente"):
-            if not data.get(field):
-                return jsonify({"error": f"Campo obrigatório ausente: {field}"}), 400
-
-        cert = parse_cert_from_request(data)
-        tp_amb = get_tp_amb(data["ambiente"])
-        consulta_xml = build_consulta_xml(data["chave_acesso"], tp_amb, "cte")
-        url = get_sefaz_url(data["uf"], data["ambiente"], "cteConsulta")
-
-        soap_body = send_to_sefaz(
-            url, consulta_xml, cert,
-            soap_action="http://www.portalfiscal.inf.br/cte/wsdl/CTeConsultaSinc/cteConsultaCT",
-            timeout=data.get("timeout", DEFAULT_TIMEOUT),
-        )
+def discard_cached_consult(data: dict, result: dict):
+    """Evento que muda a situação sem ser cancelamento (encerramento): próxima consulta vai à SEFAZ."""
+    if result.get("cStat") in EVENT_REGISTERED_CSTATS:
+        consult_cache.discard(data["ambiente"], data["chave_acesso"])
 
-        result = extract_sefaz_response(soap_body, "cte")
-        result["sefaz_url"] = url
-        return jsonify(result), 200
 
-    except Exception as e:
-        logger.error(f"[CTE CONSULT] Error: {str(e)}")
-        return jsonify({"error": str(e), "success": False}), 500
-    finally:
-        if cert:
-            cert.cleanup()
+# ── Autenticação ─────────────────────────────────────────────────
 
+def check_auth():
+    if API_KEY and request.headers.get("X-API-Key") != API_KEY:
+        return jsonify({"error": "Unauthorized"}), 401
+    return None
 
-@app.route("/cte/cancel", methods=["POST"])
-def cte_cancel():
-    """Cancelar CT-e na SEFAZ."""
-    auth_err = check_auth()
-    if auth_err:
-        return auth_err
 
-    cert = None
-    try:
-        data = request.json
-        for field in ("chave_acesso", "protocolo", "justificativa", "cnpj",
-                       "pfx_base64", "password", "uf", "ambiente"):
-            if not data.get(field):
-                return jsonify({"error": f"Campo obrigatório ausente: {field}"}), 400
-
-        if len(data["justificativa"]) < 15:
-            return jsonify({"error": "Justificativa deve ter no mínimo 15 caracteres"}), 400
-
-        cert = parse_cert_from_request(data)
-        tp_amb = get_tp_amb(data["ambiente"])
-        seq = data.get("seq", 1)
-
-        event_xml = build_cancel_event_xml(
-            data["chave_acesso"], data["protocolo"], data["justificativa"],
-            tp_amb, data["cnpj"], "cte", seq,
-        )
+# Campos que identificam o certificado no body; lotes os trocam pelo
+# InMemoryCert já carregado (campo interno, nunca vem do JSON)
+CERT_FIELDS = ("pfx_base64", "password", "cert_id", "cnpj")
+RESOLVED_CERT_FIELD = "_cert"
 
-        # Assinar o evento
-        sign_result = sign_xml(event_xml, cert, "cte", f"ID110111{data['chave_acesso']}{seq:02d}")
 
-        url = get_sefaz_url(data["uf"], data["ambiente"], "cteEvento")
-        soap_body = send_to_sefaz(
-            url, sign_result["signed_xml"], cert,
-            soap_action="http://www.portalfiscal.inf.br/cte/wsdl/CTeRecepcaoEvento/cteRecepcaoEvento",
-            timeout=data.get("timeout", DEFAULT_TIMEOUT),
-        )
+def parse_cert_from_request(data: dict) -> InMemoryCert:
+    """
+    Extrai e valida certificado do request body: o PFX enviado (pfx_base64 +
+    password) ou, sem ele, o do keystore por cert_id ou cnpj. Itens de um lote
+    trazem o certificado já resolvido em RESOLVED_CERT_FIELD.
+    """
+    cert = data.get(RESOLVED_CERT_FIELD)
+    if isinstance(cert, InMemoryCert):
+        return cert
+    if not data.get("pfx_base64") and (data.get("cert_id") or data.get("cnpj")) and keystore.enabled:
+        try:
+            return keystore.get(str(data.get("cert_id") or ""), str(data.get("cnpj") or ""))
+        except KeystoreError as e:
+            raise RequestError({"success": False, "error": str(e), "status_detail": "certificado_indisponivel"})
+    for field in ("pfx_base64", "password"):
+        if not data.get(field):
+            raise RequestError(f"Campo obrigatório ausente: {field} (ou cert_id/cnpj de um certificado do keystore)")
+    pfx_bytes = base64.b64decode(data["pfx_base64"])
+    password = data["password"].encode()
+    return cert_cache.get(pfx_bytes, password)
 
-        result = extract_sefaz_response(soap_body, "cte")
-        result["sefaz_url"] = url
-        return jsonify(result), 200
 
-    except Exception as e:
-        logger.error(f"[CTE CANCEL] Error: {str(e)}")
-        return jsonify({"error": str(e), "success": False}), 500
-    finally:
-        if cert:
-            cert.cleanup()
+def get_tp_amb(ambiente: str) -> str:
+    return "1" if ambiente == "producao" else "2"
 
 
-@app.route("/cte/cce", methods=["POST"])
-def cte_cce():
-    """Carta de Correção Eletrônica (CC-e) para CT-e."""
-    auth_err = check_auth()
-    if auth_err:
-        return auth_err
+# ── Operações ────────────────────────────────────────────────────
+#
+# Cada rota é uma operação em três fases: preparar (validar, assinar, montar
+# XML — CPU), chamar a SEFAZ (I/O) e finalizar (extrair a resposta — CPU).
+# O servidor síncrono (Flask, abaixo) e o assíncrono (async_app.py) executam
+# as mesmas funções de preparo/finalização e só diferem no transporte.
 
-    cert = None
-    try:
-        data = request.json
-        for field in ("chave_acesso", "correcoes", "cnpj",
-                       "pfx_base64", "password", "uf", "ambiente"):
-            if not data.get(field):
-                return jsonify({"error": f"Campo obrigatório ausente: {field}"}), 400
-
-        cert = parse_cert_from_request(data)
-        tp_amb = get_tp_amb(data["ambiente"])
-        seq = data.get("seq", 1)
-
-        # correcoes: string XML com tags <infCorrecao>
-        event_xml = build_cce_event_xml(
-            data["chave_acesso"], data["correcoes"], tp_amb, data["cnpj"], seq,
-        )
+class RequestError(Exception):
+    """Erro de validação do request — vira resposta HTTP com o payload dado."""
 
-        # Assinar o evento
-        sign_result = sign_xml(event_xml, cert, "cte", f"ID110110{data['chave_acesso']}{seq:02d}")
+    def __init__(self, payload: dict | str, status: int = 400):
+        if isinstance(payload, str):
+            payload = {"error": payload}
+        super().__init__(payload.get("error", ""))
+        self.payload = payload
+        self.status = status
 
-        url = get_sefaz_url(data["uf"], data["ambiente"], "cteEvento")
-        soap_body = send_to_sefaz(
-            url, sign_result["signed_xml"], cert,
-            soap_action="http://www.portalfiscal.inf.br/cte/wsdl/CTeRecepcaoEvento/cteRecepcaoEvento",
-            timeout=data.get("timeout", DEFAULT_TIMEOUT),
-        )
 
-        result = extract_sefaz_response(soap_body, "cte")
-        result["sefaz_url"] = url
-        return jsonify(result), 200
+def require_fields(data: dict, fields: tuple[str, ...]):
+    for field in fields:
+        if not data.get(field):
+            raise RequestError(f"Campo obrigatório ausente: {field}")
 
-    except Exception as e:
-        logger.error(f"[CTE CCe] Error: {str(e)}")
-        return jsonify({"error": str(e), "success": False}), 500
-    finally:
-        if cert:
-            cert.cleanup()
 
+class SefazCall(NamedTuple):
+    url: str
+    soap_xml: str | bytes
+    soap_action: str
+    timeout: int
+    endpoint: tuple[str, str, str] = ("", "", "")  # (UF, ambiente, serviço) — labels das métricas
 
-@app.route("/mdfe/emit", methods=["POST"])
-def mdfe_emit():
-    """Assinar MDF-e + enviar para SEFAZ via SOAP/mTLS."""
-    auth_err = check_auth()
-    if auth_err:
-        return auth_err
 
-    cert = None
-    try:
-        data = request.json
-        for field in ("xml", "pfx_base64", "password", "uf", "ambiente"):
-            if not data.get(field):
-                return jsonify({"error": f"Campo obrigatório ausente: {field}"}), 400
+def sefaz_endpoint(data: dict, service_key: str) -> tuple[str, str, str]:
+    return (data["uf"].upper(), data["ambiente"], service_key)
 
-        cert = parse_cert_from_request(data)
-        doc_id = data.get("document_id", "MDFe_unknown")
 
-        # 1. Assinar
-        sign_result = sign_xml(data["xml"], cert, "mdfe", doc_id)
+class SefazPlan:
+    """
+    Operação preparada: chamadas SOAP a fazer + função que monta o resultado.
 
-        # 2. Resolver endpoint (MDF-e usa recepção síncrona)
-        url = get_sefaz_url(data["uf"], data["ambiente"], "mdfeAutorizacao")
+    `finish` recebe o soap:Body de cada chamada, na ordem de `calls`. Com
+    `partial_failures`, uma chamada que falha entra como a exceção em vez de
+    abortar a operação (usado pelos lotes). `receipt`, se presente, recebe o
+    resultado e pode devolver um Future do ReceiptPoller; o resultado final
+    do recibo é então sobreposto ao retorno do envio.
+    """
 
-        # 3. Enviar via mTLS
-        soap_body = send_to_sefaz(
-            url, sign_result["signed_xml"], cert,
-            soap_action="http://www.portalfiscal.inf.br/mdfe/wsdl/MDFeRecepcaoSinc/mdfeRecepcao",
-            timeout=data.get("timeout", DEFAULT_TIMEOUT),
+    def __init__(
+        self, cert: InMemoryCert | None, calls: list[SefazCall],
+        finish: Callable[[list], dict], partial_failures: bool = False,
+        receipt: Callable[[dict], Future | None] | None = None,
+    ):
+        self.cert = cert
+        self.calls = calls
+        self.finish = finish
+        self.partial_failures = partial_failures
+        self.receipt = receipt
+
+
+class Operation(NamedTuple):
+    prepare: Callable[[dict], SefazPlan]
+    log_tag: str
+    error_prefix: str = ""
+    # Id do documento/evento (infCte/infEvento) — chave de idempotência padrão
+    idempotency_id: Callable[[dict], str] | None = None
+
+
+def run_plan(plan: SefazPlan) -> dict:
+    """Executa as chamadas do plano de forma síncrona e devolve o resultado."""
+    responses = []
+    for call in plan.calls:
+        try:
+            responses.append(send_to_sefaz(
+                call.url, call.soap_xml, plan.cert, call.soap_action, call.timeout, call.endpoint,
+            ))
+        except Exception as e:
+            if not plan.partial_failures:
+                raise
+            responses.append(e)
+    result = plan.finish(responses)
+
+    future = plan.receipt(result) if plan.receipt else None
+    if future is not None:
+        result = {**result, **future.result()}
+    return result
+
+
+def operation_error_response(operation: Operation, e: Exception) -> tuple[dict, int]:
+    """Converte uma exceção da operação no payload/status HTTP do contrato."""
+    if isinstance(e, RequestError):
+        metrics.observe_results(operation.log_tag, {
+            "status_detail": e.payload.get("status_detail") or "requisicao_invalida",
+        })
+        return e.payload, e.status
+    if isinstance(e, EndpointBusy):
+        logger.warning(f"[{operation.log_tag}] {e}")
+        metrics.observe_results(operation.log_tag, {"status_detail": e.status_detail})
+        return {
+            "success": False, "error": str(e), "status_detail": e.status_detail, "retry_after": e.retry_after,
+        }, 429
+    logger.error(f"[{operation.log_tag}] Error: {str(e)}")
+    metrics.observe_results(operation.log_tag, {"status_detail": "erro"})
+    if operation.error_prefix:
+        return {"error": f"{operation.error_prefix}{str(e)}"}, 500
+    return {"error": str(e), "success": False}, 500
+
+
+def error_headers(payload: dict) -> dict:
+    """Retry-After das respostas 429 (limite de concorrência ou de consumo da SEFAZ)."""
+    return {"Retry-After": str(payload["retry_after"])} if "retry_after" in payload else {}
+
+
+def prepare_sign(data: dict) -> SefazPlan:
+    """Apenas assinar XML (compatibilidade retroativa)."""
+    require_fields(data, ("xml", "document_type", "document_id"))
+
+    cert = parse_cert_from_request(data)
+    result = sign_xml(data["xml"], cert, data["document_type"], data["document_id"])
+    logger.info(f"Signed {data['document_type']} document: {data['document_id']}")
+    return SefazPlan(cert, [], lambda responses: {
+        "signed_xml": result["signed_xml"],
+        "digest_value": result["digest_value"],
+        "signature_value": result["signature_value"],
+    })
+
+
+def prepare_sign_batch(data: dict) -> SefazPlan:
+    """Assinar vários XML com o mesmo certificado, em paralelo (re-assinatura em massa)."""
+    require_fields(data, ("jobs",))
+
+    jobs = []
+    for i, job in enumerate(data["jobs"]):
+        if not job.get("xml") or not job.get("document_type"):
+            raise RequestError(f"jobs[{i}]: campos obrigatórios xml e document_type")
+        jobs.append((job["xml"], job["document_type"], job.get("document_id", str(i))))
+
+    cert = parse_cert_from_request(data)
+    results = signing_pool.sign_many(cert, jobs)
+    for result in results:
+        result.pop("node_id", None)
+    signed_count = sum(1 for r in results if "error" not in r)
+    logger.info(f"Signed batch: {signed_count}/{len(jobs)} documents")
+    return SefazPlan(cert, [], lambda responses: {"results": results})
+
+
+def prepare_verify(data: dict) -> SefazPlan:
+    """Verificar assinatura XMLDSig e cadeia ICP-Brasil de um CT-e/MDF-e."""
+    require_fields(data, ("xml",))
+
+    result = verify_document(data["xml"])
+    logger.info(f"[VERIFY] {result.get('chave_acesso', '?')}: {result['status_detail']}")
+    return SefazPlan(None, [], lambda responses: result)
+
+
+def prepare_verify_batch(data: dict) -> SefazPlan:
+    """
+    Verificar vários documentos (importação em massa) em paralelo no pool de processos.
+
+    Body: {"xmls": [{"xml": "...", "document_id": "..."}, ...]}; "results"
+    mantém a ordem de "xmls".
+    """
+    require_fields(data, ("xmls",))
+
+    items = [item if isinstance(item, dict) else {"xml": item} for item in data["xmls"]]
+    if len(items) > VERIFY_BATCH_MAX_DOCS:
+        raise RequestError(f"Máximo de {VERIFY_BATCH_MAX_DOCS} documentos por requisição")
+
+    results = verify_many([item.get("xml") or "" for item in items])
+    for i, (item, result) in enumerate(zip(items, results)):
+        result["document_id"] = item.get("document_id", str(i))
+    valid = sum(1 for r in results if r["valid"])
+    logger.info(f"[VERIFY BATCH] {valid}/{len(results)} assinaturas válidas")
+    return SefazPlan(None, [], lambda responses: {
+        "success": valid == len(results),
+        "valid": valid,
+        "invalid": len(results) - valid,
+        "results": results,
+    })
+
+
+def prepare_cert_register(data: dict) -> SefazPlan:
+    """Registrar certificado A1 no keystore; as próximas requisições usam cert_id/cnpj."""
+    require_fields(data, ("pfx_base64", "password"))
+    if not keystore.enabled:
+        raise RequestError("Keystore de certificados não configurado (KEYSTORE_DIR/KEYSTORE_KEY)")
+
+    try:
+        info = keystore.register(
+            base64.b64decode(data["pfx_base64"]), data["password"].encode(), str(data.get("label") or ""),
         )
+    except ValueError as e:
+        raise RequestError({"success": False, "error": str(e), "status_detail": "certificado_invalido"})
+    return SefazPlan(None, [], lambda responses: {"success": True, **info})
+
+
+def prepare_cte_emit(data: dict) -> SefazPlan:
+    """
+    Assinar CT-e + enviar para SEFAZ via SOAP/mTLS.
 
-        result = extract_sefaz_response(soap_body, "mdfe")
+    Por padrão vai em lote enviCTe (cteAutorizacao); com cteRecepcaoSinc em
+    SEFAZ_GZIP_SERVICES, vai sozinho e compactado para a recepção síncrona.
+    """
+    require_fields(data, ("xml", "uf", "ambiente"))
+
+    service = "cteRecepcaoSinc" if "cteRecepcaoSinc" in SEFAZ_GZIP_SERVICES else "cteAutorizacao"
+
+    # Endpoint primeiro: autorizador fora do ar recusa antes de assinar
+    url = get_sefaz_url(data["uf"], data["ambiente"], service)
+    tp_amb = get_tp_amb(data["ambiente"])
+
+    cert = parse_cert_from_request(data)
+    doc_id = data.get("document_id", "CTe_unknown")
+
+    # 0. Parse único + validação XSD (se disponível): a mesma árvore é
+    # assinada e serializada uma só vez (signed_bytes) para o lote/envelope
+    skip_xsd = data.get("skip_xsd_validation", False)
+    try:
+        root = parse_xml(data["xml"])
+        xsd_errors = [] if skip_xsd else validate_cte_xsd(root)
+    except etree.XMLSyntaxError as e:
+        if skip_xsd:
+            raise
+        xsd_errors = [f"XML malformado: {str(e)}"]
+    if xsd_errors:
+        logger.warning(f"[CTE EMIT] XSD validation failed: {xsd_errors}")
+        raise RequestError({
+            "success": False,
+            "error": "Validação XSD falhou",
+            "xsd_errors": xsd_errors,
+            "status_detail": "xsd_invalido",
+        })
+
+    # 1. Assinar XML
+    logger.info(f"[CTE EMIT] Assinando CT-e {doc_id}")
+    sign_result = sign_xml(root, cert, "cte", doc_id)
+
+    # 2. Montar lote (a recepção síncrona recebe o CT-e sozinho, sem lote)
+    if service == "cteRecepcaoSinc":
+        id_lote = ""
+        soap_xml = sign_result.pop("signed_bytes")
+        soap_action = "http://www.portalfiscal.inf.br/cte/wsdl/CTeRecepcaoSinc/cteRecepcao"
+        logger.info(f"[CTE EMIT] Enviando CT-e {doc_id} para {url}")
+    else:
+        id_lote = new_id_lote()
+        soap_xml = build_cte_lote_bytes(sign_result.pop("signed_bytes"), id_lote)
+        soap_action = CTE_RECEPCAO_ACTION
+        logger.info(f"[CTE EMIT] Enviando lote {id_lote} para {url}")
+
+    # 3. Enviar via mTLS
+    call = SefazCall(
+        url, soap_xml,
+        soap_action=soap_action,
+        timeout=data.get("timeout", DEFAULT_TIMEOUT),
+        endpoint=sefaz_endpoint(data, service),
+    )
+
+    def finish(responses: list) -> dict:
+        # 4. Extrair resposta
+        result = extract_sefaz_response(responses[0], "cte")
         result["signed_xml"] = sign_result["signed_xml"]
         result["digest_value"] = sign_result["digest_value"]
         result["signature_value"] = sign_result["signature_value"]
         result["sefaz_url"] = url
         result["ambiente"] = data["ambiente"]
+        result["tpAmb"] = tp_amb
+        result["id_lote"] = id_lote
 
-        return jsonify(result), 200
+        logger.info(f"[CTE EMIT] Resultado: cStat={result['cStat']} | {result['xMotivo']}")
+        cache_emit_results(data, result)
+        return result
 
-    except Exception as e:
-        logger.error(f"[MDFE EMIT] Error: {str(e)}")
-        return jsonify({"error": str(e), "success": False}), 500
-    finally:
-        if cert:
-            cert.cleanup()
+    receipt = None
+    if data.get("aguardar_recibo"):
+        try:
+            receipt = _receipt_follow_up(cert, data)
+        except RequestError as e:
+            # Consulta de recibo indisponível (circuito aberto): envia assim mesmo; o
+            # cliente acompanha depois por /cte/receipt com o nRec devolvido
+            logger.warning(f"[CTE EMIT] Sem acompanhamento de recibo: {e}")
+    return SefazPlan(cert, [call], finish, receipt=receipt)
+
+
+def _receipt_follow_up(cert: InMemoryCert, data: dict) -> Callable[[dict], Future | None]:
+    """Hook de SefazPlan: se o lote ficou pendente (103/105), acompanha o recibo."""
+    url = get_sefaz_url(data["uf"], data["ambiente"], "cteRetAutorizacao")
+    tp_amb = get_tp_amb(data["ambiente"])
+    max_wait = float(data.get("max_wait", RECEIPT_MAX_WAIT))
+
+    def follow_up(result: dict) -> Future | None:
+        if result.get("status_detail") not in RECEIPT_PENDING_STATUS or not result.get("nRec"):
+            return None
+        logger.info(f"[CTE RECIBO] Aguardando recibo {result['nRec']} em {url}")
+        future = receipt_poller.submit(
+            cert, url, result["nRec"], tp_amb, max_wait, sefaz_endpoint(data, "cteRetAutorizacao"),
+        )
+        future.add_done_callback(_cache_receipt_result)
+        return future
 
+    def _cache_receipt_result(future: Future):
+        if future.exception() is None:
+            cache_emit_results(data, future.result())
 
-@app.route("/mdfe/consult", methods=["POST"])
-def mdfe_consult():
-    """Consultar MDF-e na SEFAZ."""
-    auth_err = check_auth()
-    if auth_err:
-        return auth_err
+    return follow_up
 
-    cert = None
-    try:
-        data = request.json
-        for field in ("chave_acesso", "pfx_base64", "password", "uf", "ambiente"):
-            if not data.get(field):
-                return jsonify({"error": f"Campo obrigatório ausente: {field}"}), 400
-
-        cert = parse_cert_from_request(data)
-        tp_amb = get_tp_amb(data["ambiente"])
-        consulta_xml = build_consulta_xml(data["chave_acesso"], tp_amb, "mdfe")
-        url = get_sefaz_url(data["uf"], data["ambiente"], "mdfeConsulta")
-
-        soap_body = send_to_sefaz(
-            url, consulta_xml, cert,
-            soap_action="http://www.portalfiscal.inf.br/mdfe/wsdl/MDFeConsulta/mdfeConsultaMDF",
+
+def prepare_cte_emit_batch(data: dict) -> SefazPlan:
+    """
+    Assinar N CT-e do mesmo emitente/UF e enviar em lotes enviCTe.
+
+    Body: {"xmls": [{"xml": "...", "document_id": "..."}, ...], "pfx_base64",
+    "password", "uf", "ambiente"}. Os documentos são empacotados em lotes de até
+    CTE_LOTE_MAX_DOCS / CTE_LOTE_MAX_BYTES e enviados à recepção assíncrona
+    (CTeRecepcao); os recibos (103/105) são acompanhados em CTeRetRecepcao, a
+    menos que "aguardar_recibo" seja false. Cada protCTe é associado ao
+    documento de origem pela chave de acesso. "results" mantém a ordem de "xmls".
+    """
+    require_fields(data, ("xmls", "uf", "ambiente"))
+
+    items = [
+        item if isinstance(item, dict) else {"xml": item}
+        for item in data["xmls"]
+    ]
+    if len(items) > CTE_BATCH_MAX_DOCS:
+        raise RequestError(f"Máximo de {CTE_BATCH_MAX_DOCS} CT-e por requisição")
+
+    cert = parse_cert_from_request(data)
+    skip_xsd = data.get("skip_xsd_validation", False)
+    url = get_sefaz_url(data["uf"], data["ambiente"], "cteAutorizacao")
+    tp_amb = get_tp_amb(data["ambiente"])
+
+    # 1. Validar cada documento; falhas não impedem os demais
+    results: list[dict] = []
+    to_sign: list[int] = []
+    roots: dict[int, etree._Element] = {}
+    for i, item in enumerate(items):
+        doc_id = item.get("document_id", f"CTe_{i}")
+        result = {"document_id": doc_id, "success": False}
+        results.append(result)
+        if not item.get("xml"):
+            result.update({"error": "Campo obrigatório ausente: xml", "status_detail": "erro"})
+            continue
+
+        if not skip_xsd:
+            try:
+                roots[i] = parse_xml(item["xml"])
+                xsd_errors = validate_cte_xsd(roots[i])
+            except etree.XMLSyntaxError as e:
+                xsd_errors = [f"XML malformado: {str(e)}"]
+            if xsd_errors:
+                result.update({
+                    "error": "Validação XSD falhou",
+                    "xsd_errors": xsd_errors,
+                    "status_detail": "xsd_invalido",
+                })
+                continue
+        to_sign.append(i)
+
+    # 2. Assinar em paralelo no pool de processos; lote pequeno assina aqui
+    # mesmo a árvore da validação XSD, sem parsear de novo
+    signed: list[tuple[int, dict]] = []
+    reuse_roots = signing_pool.in_process(len(to_sign))
+    sign_results = signing_pool.sign_many(cert, [
+        (roots[i] if reuse_roots and i in roots else items[i]["xml"], "cte", results[i]["document_id"])
+        for i in to_sign
+    ])
+    for i, sign_result in zip(to_sign, sign_results):
+        if "error" in sign_result:
+            results[i].update({"error": sign_result["error"], "status_detail": "erro"})
+            continue
+        results[i]["chave_acesso"] = sign_result["node_id"][3:]
+        results[i]["signed_xml"] = sign_result["signed_xml"]
+        results[i]["digest_value"] = sign_result["digest_value"]
+        results[i]["signature_value"] = sign_result["signature_value"]
+        signed.append((i, sign_result))
+
+    # A mesma chave duas vezes seria rejeitada (duplicidade) e os protocolos,
+    # associados por chave, se misturariam: recusa antes de enviar
+    seen: dict[str, int] = {}
+    duplicates = sorted({
+        results[i]["chave_acesso"] for i, _ in signed
+        if seen.setdefault(results[i]["chave_acesso"], i) != i
+    })
+    if duplicates:
+        raise RequestError({
+            "success": False,
+            "error": f"Chave de acesso repetida no lote: {', '.join(duplicates)}",
+            "status_detail": "chave_duplicada",
+            "chaves_duplicadas": duplicates,
+        })
+
+    # 3. Empacotar em lotes
+    lotes = []
+    lote_members: list[list[int]] = []
+    calls = []
+    for lote_indexes in pack_cte_lotes([sr["signed_xml"] for _, sr in signed]):
+        id_lote = new_id_lote()
+        members = [signed[j][0] for j in lote_indexes]
+        lote_xml = build_cte_lote_xml([results[i]["signed_xml"] for i in members], id_lote)
+        lotes.append({"id_lote": id_lote, "quantidade": len(members)})
+        lote_members.append(members)
+        logger.info(f"[CTE EMIT BATCH] Enviando lote {id_lote} ({len(members)} CT-e) para {url}")
+        calls.append(SefazCall(
+            url, lote_xml,
+            soap_action=CTE_RECEPCAO_ACTION,
             timeout=data.get("timeout", DEFAULT_TIMEOUT),
-        )
+            endpoint=sefaz_endpoint(data, "cteAutorizacao"),
+        ))
+
+    def finish(responses: list) -> dict:
+        for lote_info, members, soap_body in zip(lotes, lote_members, responses):
+            id_lote = lote_info["id_lote"]
+            if isinstance(soap_body, Exception):
+                logger.error(f"[CTE EMIT BATCH] Lote {id_lote} falhou: {str(soap_body)}")
+                lote_info["error"] = str(soap_body)
+                for i in members:
+                    results[i].update({"id_lote": id_lote, "error": str(soap_body), "status_detail": "erro_envio"})
+                continue
+
+            # 4. Associar cada protCTe ao documento de origem
+            lote_result, protocols = extract_sefaz_protocols(soap_body, "cte")
+            lote_info.update({
+                "cStat": lote_result["cStat_lote"],
+                "xMotivo": lote_result["xMotivo_lote"],
+                "nRec": lote_result["nRec"],
+            })
+            apply_lote_protocols(results, members, lote_result, protocols, id_lote)
+
+        autorizados = sum(1 for r in results if r.get("status_detail") == "autorizado")
+        logger.info(f"[CTE EMIT BATCH] {autorizados}/{len(results)} autorizados em {len(lotes)} lote(s)")
+        cache_emit_results(data, {"results": results})
+        return {
+            "success": all(r["success"] for r in results),
+            "results": results,
+            "lotes": lotes,
+            "sefaz_url": url,
+            "ambiente": data["ambiente"],
+            "tpAmb": tp_amb,
+        }
+
+    receipt = None
+    if data.get("aguardar_recibo", True):
+        try:
+            receipt = _batch_receipt_follow_up(cert, data, results, lote_members)
+        except RequestError as e:
+            logger.warning(f"[CTE EMIT BATCH] Sem acompanhamento de recibo: {e}")
+    return SefazPlan(cert, calls, finish, partial_failures=True, receipt=receipt)
+
+
+def apply_lote_protocols(
+    results: list[dict], members: list[int], lote_result: dict, protocols: dict[str, dict], id_lote: str,
+):
+    """Copia para cada documento do lote o seu protCTe — ou, sem protocolo individual (103/105), o retorno do lote."""
+    for i in members:
+        doc_result = protocols.get(results[i]["chave_acesso"])
+        if doc_result is None:
+            doc_result = dict(lote_result, chave_acesso=results[i]["chave_acesso"], xml_autorizado="")
+            doc_result.pop("protocolos", None)
+        results[i].update(doc_result)
+        results[i]["id_lote"] = id_lote
+
+
+def _batch_receipt_follow_up(
+    cert: InMemoryCert, data: dict, results: list[dict], lote_members: list[list[int]],
+) -> Callable[[dict], Future | None]:
+    """Hook de SefazPlan do lote: acompanha no ReceiptPoller o recibo de cada lote pendente (103/105)."""
+    url = get_sefaz_url(data["uf"], data["ambiente"], "cteRetAutorizacao")
+    tp_amb = get_tp_amb(data["ambiente"])
+    max_wait = float(data.get("max_wait", RECEIPT_MAX_WAIT))
+
+    def follow_up(result: dict) -> Future | None:
+        pending = [
+            (lote_info, members) for lote_info, members in zip(result["lotes"], lote_members)
+            if lote_info.get("nRec") and results[members[0]].get("status_detail") in RECEIPT_PENDING_STATUS
+        ]
+        if not pending:
+            return None
+
+        combined: Future = Future()
+        remaining = [len(pending)]
+        lock = threading.Lock()
+
+        def lote_done(lote_info: dict, members: list[int], future: Future):
+            if future.exception() is None:
+                receipt = future.result()
+                protocols = {p["chave_acesso"]: p for p in receipt.get("protocolos", [])}
+                lote_info.update({"cStat": receipt["cStat_lote"], "xMotivo": receipt["xMotivo_lote"]})
+                apply_lote_protocols(results, members, receipt, protocols, lote_info["id_lote"])
+            else:
+                # Recibo não consultado: os documentos ficam como "lote_recebido", com o nRec
+                logger.error(f"[CTE RECIBO] Lote {lote_info['id_lote']}: {future.exception()}")
+                lote_info["error"] = str(future.exception())
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            cache_emit_results(data, {"results": results})
+            combined.set_result({"success": all(r["success"] for r in results), "results": results})
+
+        for lote_info, members in pending:
+            logger.info(f"[CTE RECIBO] Aguardando recibo {lote_info['nRec']} do lote {lote_info['id_lote']} em {url}")
+            future = receipt_poller.submit(
+                cert, url, lote_info["nRec"], tp_amb, max_wait, sefaz_endpoint(data, "cteRetAutorizacao"),
+            )
+            future.add_done_callback(
+                lambda f, lote_info=lote_info, members=members: lote_done(lote_info, members, f)
+            )
+        return combined
+
+    return follow_up
+
+
+def prepare_cte_receipt(data: dict) -> SefazPlan:
+    """Acompanhar recibo de lote (retConsReciCTe) até o protocolo final."""
+    require_fields(data, ("nRec", "uf", "ambiente"))
+
+    cert = parse_cert_from_request(data)
+    url = get_sefaz_url(data["uf"], data["ambiente"], "cteRetAutorizacao")
+    pending = {"nRec": data["nRec"], "status_detail": "lote_recebido", "sefaz_url": url}
+    return SefazPlan(cert, [], lambda responses: dict(pending), receipt=_receipt_follow_up(cert, data))
+
+
+def prepare_cte_consult(data: dict) -> SefazPlan:
+    """Consultar situação de CT-e na SEFAZ."""
+    require_fields(data, ("chave_acesso", "uf", "ambiente"))
+
+    cached = _cached_consult_plan(data)
+    if cached:
+        return cached
+
+    cert = parse_cert_from_request(data)
+    tp_amb = get_tp_amb(data["ambiente"])
+    consulta_xml = build_consulta_xml(data["chave_acesso"], tp_amb, "cte")
+    url = get_sefaz_url(data["uf"], data["ambiente"], "cteConsulta")
+
+    call = SefazCall(
+        url, consulta_xml,
+        soap_action="http://www.portalfiscal.inf.br/cte/wsdl/CTeConsultaSinc/cteConsultaCT",
+        timeout=data.get("timeout", DEFAULT_TIMEOUT),
+        endpoint=sefaz_endpoint(data, "cteConsulta"),
+    )
+    return SefazPlan(cert, [call], lambda responses: _finish_consult(responses, "cte", url, data))
 
-        result = extract_sefaz_response(soap_body, "mdfe")
-        result["sefaz_url"] = url
-        return jsonify(result), 200
 
-    except Exception as e:
-        logger.error(f"[MDFE CONSULT] Error: {str(e)}")
-        return jsonify({"error": str(e), "success": False}), 500
-    finally:
-        if cert:
-            cert.cleanup()
+def prepare_cte_cancel(data: dict) -> SefazPlan:
+    """Cancelar CT-e na SEFAZ."""
+    require_fields(data, ("chave_acesso", "protocolo", "justificativa", "cnpj", "uf", "ambiente"))
 
+    if len(data["justificativa"]) < 15:
+        raise RequestError("Justificativa deve ter no mínimo 15 caracteres")
 
-@app.route("/mdfe/cancel", methods=["POST"])
-def mdfe_cancel():
-    """Cancelar MDF-e na SEFAZ."""
-    auth_err = check_auth()
-    if auth_err:
-        return auth_err
+    cert = parse_cert_from_request(data)
+    tp_amb = get_tp_amb(data["ambiente"])
+    seq = data.get("seq", 1)
 
-    cert = None
-    try:
-        data = request.json
-        for field in ("chave_acesso", "protocolo", "justificativa", "cnpj",
-                       "pfx_base64", "password", "uf", "ambiente"):
-            if not data.get(field):
-                return jsonify({"error": f"Campo obrigatório ausente: {field}"}), 400
-
-        cert = parse_cert_from_request(data)
-        tp_amb = get_tp_amb(data["ambiente"])
-
-        event_xml = build_cancel_event_xml(
-            data["chave_acesso"], data["protocolo"], data["justificativa"],
-            tp_amb, data["cnpj"], "mdfe",
-        )
+    event_xml = build_cancel_event_xml(
+        data["chave_acesso"], data["protocolo"], data["justificativa"],
+        tp_amb, data["cnpj"], "cte", seq,
+    )
 
-        sign_result = sign_xml(event_xml, cert, "mdfe", f"ID110111{data['chave_acesso']}01")
+    # Assinar o evento
+    sign_result = sign_xml(event_xml, cert, "cte", f"ID110111{data['chave_acesso']}{seq:02d}")
 
-        url = get_sefaz_url(data["uf"], data["ambiente"], "mdfeEvento")
-        soap_body = send_to_sefaz(
-            url, sign_result["signed_xml"], cert,
-            soap_action="http://www.portalfiscal.inf.br/mdfe/wsdl/MDFeRecepcaoEvento/mdfeRecepcaoEvento",
-            timeout=data.get("timeout", DEFAULT_TIMEOUT),
-        )
+    url = get_sefaz_url(data["uf"], data["ambiente"], "cteEvento")
+    call = SefazCall(
+        url, sign_result["signed_xml"],
+        soap_action="http://www.portalfiscal.inf.br/cte/wsdl/CTeRecepcaoEvento/cteRecepcaoEvento",
+        timeout=data.get("timeout", DEFAULT_TIMEOUT),
+        endpoint=sefaz_endpoint(data, "cteEvento"),
+    )
+    return SefazPlan(cert, [call], lambda responses: _finish_event(responses, "cte", url, data, cache_cancel_result))
+
+
+def prepare_cte_cce(data: dict) -> SefazPlan:
+    """Carta de Correção Eletrônica (CC-e) para CT-e."""
+    require_fields(data, ("chave_acesso", "correcoes", "cnpj", "uf", "ambiente"))
+
+    cert = parse_cert_from_request(data)
+    tp_amb = get_tp_amb(data["ambiente"])
+    seq = data.get("seq", 1)
+
+    # correcoes: string XML com tags <infCorrecao>
+    event_xml = build_cce_event_xml(
+        data["chave_acesso"], data["correcoes"], tp_amb, data["cnpj"], seq,
+    )
+
+    # Assinar o evento
+    sign_result = sign_xml(event_xml, cert, "cte", f"ID110110{data['chave_acesso']}{seq:02d}")
 
-        result = extract_sefaz_response(soap_body, "mdfe")
+    url = get_sefaz_url(data["uf"], data["ambiente"], "cteEvento")
+    call = SefazCall(
+        url, sign_result["signed_xml"],
+        soap_action="http://www.portalfiscal.inf.br/cte/wsdl/CTeRecepcaoEvento/cteRecepcaoEvento",
+        timeout=data.get("timeout", DEFAULT_TIMEOUT),
+        endpoint=sefaz_endpoint(data, "cteEvento"),
+    )
+    return SefazPlan(cert, [call], lambda responses: _finish_simple(responses, "cte", url))
+
+
+def prepare_mdfe_emit(data: dict) -> SefazPlan:
+    """Assinar MDF-e + enviar para SEFAZ via SOAP/mTLS."""
+    require_fields(data, ("xml", "uf", "ambiente"))
+
+    cert = parse_cert_from_request(data)
+    doc_id = data.get("document_id", "MDFe_unknown")
+
+    # 1. Assinar
+    sign_result = sign_xml(data["xml"], cert, "mdfe", doc_id)
+
+    # 2. Resolver endpoint (MDF-e usa recepção síncrona)
+    url = get_sefaz_url(data["uf"], data["ambiente"], "mdfeAutorizacao")
+
+    # 3. Enviar via mTLS
+    call = SefazCall(
+        url, sign_result["signed_bytes"],
+        soap_action="http://www.portalfiscal.inf.br/mdfe/wsdl/MDFeRecepcaoSinc/mdfeRecepcao",
+        timeout=data.get("timeout", DEFAULT_TIMEOUT),
+        endpoint=sefaz_endpoint(data, "mdfeAutorizacao"),
+    )
+
+    def finish(responses: list) -> dict:
+        result = extract_sefaz_response(responses[0], "mdfe")
+        result["signed_xml"] = sign_result["signed_xml"]
+        result["digest_value"] = sign_result["digest_value"]
+        result["signature_value"] = sign_result["signature_value"]
         result["sefaz_url"] = url
-        return jsonify(result), 200
+        result["ambiente"] = data["ambiente"]
+        cache_emit_results(data, result)
+        return result
 
-    except Exception as e:
-        logger.error(f"[MDFE CANCEL] Error: {str(e)}")
-        return jsonify({"error": str(e), "success": False}), 500
-    finally:
-        if cert:
-            cert.cleanup()
+    return SefazPlan(cert, [call], finish)
 
 
-@app.route("/mdfe/close", methods=["POST"])
-def mdfe_close():
+def prepare_mdfe_consult(data: dict) -> SefazPlan:
+    """Consultar MDF-e na SEFAZ."""
+    require_fields(data, ("chave_acesso", "uf", "ambiente"))
+
+    cached = _cached_consult_plan(data)
+    if cached:
+        return cached
+
+    cert = parse_cert_from_request(data)
+    tp_amb = get_tp_amb(data["ambiente"])
+    consulta_xml = build_consulta_xml(data["chave_acesso"], tp_amb, "mdfe")
+    url = get_sefaz_url(data["uf"], data["ambiente"], "mdfeConsulta")
+
+    call = SefazCall(
+        url, consulta_xml,
+        soap_action="http://www.portalfiscal.inf.br/mdfe/wsdl/MDFeConsulta/mdfeConsultaMDF",
+        timeout=data.get("timeout", DEFAULT_TIMEOUT),
+        endpoint=sefaz_endpoint(data, "mdfeConsulta"),
+    )
+    return SefazPlan(cert, [call], lambda responses: _finish_consult(responses, "mdfe", url, data))
+
+
+def prepare_mdfe_cancel(data: dict) -> SefazPlan:
+    """Cancelar MDF-e na SEFAZ."""
+    require_fields(data, ("chave_acesso", "protocolo", "justificativa", "cnpj", "uf", "ambiente"))
+
+    cert = parse_cert_from_request(data)
+    tp_amb = get_tp_amb(data["ambiente"])
+
+    event_xml = build_cancel_event_xml(
+        data["chave_acesso"], data["protocolo"], data["justificativa"],
+        tp_amb, data["cnpj"], "mdfe",
+    )
+
+    sign_result = sign_xml(event_xml, cert, "mdfe", f"ID110111{data['chave_acesso']}01")
+
+    url = get_sefaz_url(data["uf"], data["ambiente"], "mdfeEvento")
+    call = SefazCall(
+        url, sign_result["signed_xml"],
+        soap_action="http://www.portalfiscal.inf.br/mdfe/wsdl/MDFeRecepcaoEvento/mdfeRecepcaoEvento",
+        timeout=data.get("timeout", DEFAULT_TIMEOUT),
+        endpoint=sefaz_endpoint(data, "mdfeEvento"),
+    )
+    return SefazPlan(cert, [call], lambda responses: _finish_event(responses, "mdfe", url, data, cache_cancel_result))
+
+
+def prepare_mdfe_close(data: dict) -> SefazPlan:
     """Encerrar MDF-e na SEFAZ."""
-    auth_err = check_auth()
-    if auth_err:
-        return auth_err
+    require_fields(data, ("chave_acesso", "protocolo", "cnpj", "codigo_municipio", "uf", "ambiente"))
 
-    cert = None
-    try:
-        data = request.json
-        for field in ("chave_acesso", "protocolo", "cnpj", "codigo_municipio",
-                       "pfx_base64", "password", "uf", "ambiente"):
-            if not data.get(field):
-                return jsonify({"error": f"Campo obrigatório ausente: {field}"}), 400
-
-        cert = parse_cert_from_request(data)
-        tp_amb = get_tp_amb(data["ambiente"])
-        dt = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S-03:00")
-        cuf = data["chave_acesso"][:2]
-
-        event_xml = f"""<eventoMDFe xmlns="http://www.portalfiscal.inf.br/mdfe" versao="3.00">
+    cert = parse_cert_from_request(data)
+    tp_amb = get_tp_amb(data["ambiente"])
+    dt = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S-03:00")
+    cuf = data["chave_acesso"][:2]
+
+    event_xml = f"""<eventoMDFe xmlns="http://www.portalfiscal.inf.br/mdfe" versao="3.00">
   <infEvento Id="ID110112{data['chave_acesso']}01">
     <cOrgao>{cuf}</cOrgao>
     <tpAmb>{tp_amb}</tpAmb>
@@ -1096,25 +2445,702 @@ def mdfe_close():
   </infEvento>
 </eventoMDFe>"""
 
-        sign_result = sign_xml(event_xml, cert, "mdfe", f"ID110112{data['chave_acesso']}01")
+    sign_result = sign_xml(event_xml, cert, "mdfe", f"ID110112{data['chave_acesso']}01")
 
-        url = get_sefaz_url(data["uf"], data["ambiente"], "mdfeEvento")
-        soap_body = send_to_sefaz(
-            url, sign_result["signed_xml"], cert,
-            soap_action="http://www.portalfiscal.inf.br/mdfe/wsdl/MDFeRecepcaoEvento/mdfeRecepcaoEvento",
-            timeout=data.get("timeout", DEFAULT_TIMEOUT),
-        )
+    url = get_sefaz_url(data["uf"], data["ambiente"], "mdfeEvento")
+    call = SefazCall(
+        url, sign_result["signed_xml"],
+        soap_action="http://www.portalfiscal.inf.br/mdfe/wsdl/MDFeRecepcaoEvento/mdfeRecepcaoEvento",
+        timeout=data.get("timeout", DEFAULT_TIMEOUT),
+        endpoint=sefaz_endpoint(data, "mdfeEvento"),
+    )
+    return SefazPlan(cert, [call], lambda responses: _finish_event(responses, "mdfe", url, data, discard_cached_consult))
 
-        result = extract_sefaz_response(soap_body, "mdfe")
-        result["sefaz_url"] = url
+
+def _finish_simple(responses: list, doc_type: str, url: str) -> dict:
+    """Finalização padrão de consultas/eventos: resposta extraída + URL usada."""
+    result = extract_sefaz_response(responses[0], doc_type)
+    result["sefaz_url"] = url
+    return result
+
+
+def _finish_consult(responses: list, doc_type: str, url: str, data: dict) -> dict:
+    result = _finish_simple(responses, doc_type, url)
+    consult_cache.put(data["ambiente"], data["chave_acesso"], result)
+    return result
+
+
+def _finish_event(
+    responses: list, doc_type: str, url: str, data: dict, update_cache: Callable[[dict, dict], None],
+) -> dict:
+    result = _finish_simple(responses, doc_type, url)
+    update_cache(data, result)
+    return result
+
+
+def _cached_consult_plan(data: dict) -> SefazPlan | None:
+    """Plano sem chamadas SEFAZ quando a chave está no cache (force_refresh ignora o cache)."""
+    if data.get("force_refresh"):
+        return None
+    cached = consult_cache.get(data["ambiente"], data["chave_acesso"])
+    if cached is None:
+        return None
+    return SefazPlan(None, [], lambda responses: cached)
+
+
+def xml_document_id(tag: str) -> Callable[[dict], str]:
+    """Id do elemento `tag` (ex.: infCte) no XML do request, sem parse completo."""
+    pattern = re.compile(rf'<(?:\w+:)?{tag}\b[^>]*?\sId="([^"]+)"')
+
+    def document_id(data: dict) -> str:
+        match = pattern.search(data.get("xml") or "")
+        return match.group(1) if match else ""
+
+    return document_id
+
+
+def event_id(tp_evento: str, fixed_seq: int | None = None) -> Callable[[dict], str]:
+    """Id do infEvento montado pelo serviço (MDF-e usa sequência fixa 01)."""
+    def document_id(data: dict) -> str:
+        seq = fixed_seq or int(data.get("seq", 1))
+        return f"ID{tp_evento}{data.get('chave_acesso', '')}{seq:02d}"
+
+    return document_id
+
+
+OPERATIONS: dict[str, Operation] = {
+    "/sign": Operation(prepare_sign, "SIGN", error_prefix="Erro ao assinar: "),
+    "/sign-batch": Operation(prepare_sign_batch, "SIGN BATCH", error_prefix="Erro ao assinar: "),
+    "/verify": Operation(prepare_verify, "VERIFY"),
+    "/verify-batch": Operation(prepare_verify_batch, "VERIFY BATCH"),
+    "/certs": Operation(prepare_cert_register, "CERTS"),
+    "/cte/emit": Operation(prepare_cte_emit, "CTE EMIT", idempotency_id=xml_document_id("infCte")),
+    "/cte/emit-batch": Operation(prepare_cte_emit_batch, "CTE EMIT BATCH"),
+    "/cte/receipt": Operation(prepare_cte_receipt, "CTE RECIBO"),
+    "/cte/consult": Operation(prepare_cte_consult, "CTE CONSULT"),
+    "/cte/cancel": Operation(prepare_cte_cancel, "CTE CANCEL", idempotency_id=event_id("110111")),
+    "/cte/cce": Operation(prepare_cte_cce, "CTE CCe", idempotency_id=event_id("110110")),
+    "/mdfe/emit": Operation(prepare_mdfe_emit, "MDFE EMIT", idempotency_id=xml_document_id("infMDFe")),
+    "/mdfe/consult": Operation(prepare_mdfe_consult, "MDFE CONSULT"),
+    "/mdfe/cancel": Operation(prepare_mdfe_cancel, "MDFE CANCEL", idempotency_id=event_id("110111", fixed_seq=1)),
+    "/mdfe/close": Operation(prepare_mdfe_close, "MDFE CLOSE", idempotency_id=event_id("110112", fixed_seq=1)),
+}
+
+
+# ── Idempotência ─────────────────────────────────────────────────
+#
+# Emissões e eventos idênticos em andamento compartilham uma só execução
+# (assinatura + SEFAZ); repetidos em até IDEMPOTENCY_TTL segundos recebem o
+# mesmo resultado com "idempotent_replay": true. A chave é "idempotency_key"
+# (body ou header Idempotency-Key) ou, por padrão, o Id do infCte/infMDFe/
+# infEvento + hash do request — um XML corrigido com a mesma chave de acesso
+# é outra requisição.
+
+idempotency_store = IdempotencyStore(IDEMPOTENCY_TTL, IDEMPOTENCY_LEASE, IDEMPOTENCY_DB_PATH)
+
+# Campos que não mudam o resultado na SEFAZ (fora do hash do request); compact só muda o formato
+IDEMPOTENCY_IGNORED_FIELDS = ("idempotency_key", "timeout", "compact", RESOLVED_CERT_FIELD)
+
+
+def idempotency_key(operation: Operation, data: dict) -> tuple[str, str]:
+    """(chave, hash do request); chave vazia = operação sem idempotência."""
+    explicit = str(data.get("idempotency_key") or "")
+    doc_id = operation.idempotency_id(data) if operation.idempotency_id and not explicit else ""
+    if not idempotency_store.enabled or not (explicit or doc_id):
+        return "", ""
+    fingerprint = hashlib.sha256(json.dumps(
+        {k: v for k, v in data.items() if k not in IDEMPOTENCY_IGNORED_FIELDS}, sort_keys=True, default=str,
+    ).encode()).hexdigest()
+    if explicit:
+        return f"{operation.log_tag}:{explicit}", fingerprint
+    return f"{operation.log_tag}:{data.get('ambiente', '')}:{doc_id}:{fingerprint[:16]}", fingerprint
+
+
+def begin_idempotent(key: str, fingerprint: str):
+    try:
+        return idempotency_store.begin(key, fingerprint)
+    except IdempotencyConflict as e:
+        raise RequestError({
+            "success": False, "error": str(e), "status_detail": "idempotencia_conflito",
+        }, 422)
+
+
+def finish_idempotent(key: str, fingerprint: str, result: dict | None):
+    # Falha de serviço é repassada a quem aguarda, mas não fica para replay
+    store = result is not None and result.get("status_detail") != "servico_indisponivel"
+    idempotency_store.finish(key, fingerprint, result, store=store)
+
+
+def idempotent_replay(result: dict) -> dict:
+    return {**result, "idempotent_replay": True}
+
+
+def execute_operation(operation: Operation, data: dict) -> dict:
+    """Prepara e executa a operação de forma síncrona, com idempotência/single-flight."""
+    key, fingerprint = idempotency_key(operation, data)
+    if not key:
+        return run_plan(operation.prepare(data))
+
+    for _ in range(2):
+        claim = begin_idempotent(key, fingerprint)
+        if claim.role == "leader":
+            break
+        result = claim.result if claim.role == "replay" else claim.future.result()
+        if result is not None:
+            return idempotent_replay(result)
+    else:
+        # Líderes falharam em sequência: executa sem coalescer
+        return run_plan(operation.prepare(data))
+
+    try:
+        result = run_plan(operation.prepare(data))
+    except BaseException:
+        finish_idempotent(key, fingerprint, None)
+        raise
+    finish_idempotent(key, fingerprint, result)
+    return result
+
+
+# ── Consulta em lote (NDJSON) ────────────────────────────────────
+#
+# /cte/consult-batch e /mdfe/consult-batch recebem milhares de chaves com um
+# só certificado. Cada chave vira uma consulta individual (mesmo preparo,
+# cache e circuito de /cte/consult), executada com no máximo
+# CONSULT_BATCH_CONCURRENCY chamadas simultâneas por endpoint SEFAZ; cada
+# resultado sai como uma linha NDJSON assim que fica pronto. A última linha
+# é o resumo: {"done": true, "total": N, "status_detail": {...}}.
+
+# rota do lote -> (rota da consulta individual, serviço SEFAZ)
+CONSULT_BATCH_OPERATIONS = {
+    "/cte/consult-batch": ("/cte/consult", "cteConsulta"),
+    "/mdfe/consult-batch": ("/mdfe/consult", "mdfeConsulta"),
+}
+
+
+class ConsultBatch(NamedTuple):
+    operation: Operation
+    groups: dict[str, list[dict]]  # URL do endpoint -> payloads de consulta individual
+    invalid: list[dict]  # linhas de erro de chaves inválidas
+    total: int
+
+
+def prepare_consult_batch(path: str, data: dict) -> ConsultBatch:
+    """
+    Valida o lote e agrupa as consultas por endpoint SEFAZ.
+
+    Body: {"chaves": ["35...", ...], "ambiente"}.
+    A UF de cada chave vem do cUF (dois primeiros dígitos); "uf" no body vale
+    para todas. Chaves repetidas são consultadas uma vez.
+    """
+    require_fields(data, ("chaves", "ambiente"))
+    if not isinstance(data["chaves"], list):
+        raise RequestError("Campo chaves deve ser uma lista de chaves de acesso")
+    chaves = list(dict.fromkeys(str(chave).strip() for chave in data["chaves"]))
+    if len(chaves) > CONSULT_BATCH_MAX_KEYS:
+        raise RequestError(f"Máximo de {CONSULT_BATCH_MAX_KEYS} chaves por requisição")
+
+    # Certificado resolvido uma vez (inválido falha com 400 antes de começar o
+    # stream); as consultas recebem o InMemoryCert, não o PFX a decodificar
+    cert = parse_cert_from_request(data)
+
+    consult_path, service_key = CONSULT_BATCH_OPERATIONS[path]
+    base = {key: value for key, value in data.items() if key != "chaves" and key not in CERT_FIELDS}
+    base[RESOLVED_CERT_FIELD] = cert
+    groups: dict[str, list[dict]] = {}
+    invalid = []
+    for chave in chaves:
+        uf = (data.get("uf") or UF_POR_CODIGO.get(chave[:2], "")).upper()
+        if len(chave) != 44 or not chave.isdigit() or not uf:
+            invalid.append(consult_batch_line(chave, {
+                "success": False, "error": "Chave de acesso inválida", "status_detail": "requisicao_invalida",
+            }, 400))
+            continue
+        _, _, url = resolve_sefaz_endpoint(uf, data["ambiente"], service_key)
+        item = {**base, "chave_acesso": chave, "uf": uf}
+        if data.get("idempotency_key"):
+            # A chave do cliente é do lote: cada consulta recebe a sua, senão
+            # a segunda chave de acesso já daria idempotencia_conflito
+            item["idempotency_key"] = f"{data['idempotency_key']}:{chave}"
+        groups.setdefault(url, []).append(item)
+    return ConsultBatch(OPERATIONS[consult_path], groups, invalid, len(chaves))
+
+
+def consult_batch_line(chave: str, payload: dict, status: int) -> dict:
+    return {**payload, "chave_acesso": chave, "http_status": status}
+
+
+def consult_batch_summary(batch: ConsultBatch, counts: Counter) -> dict:
+    return {"done": True, "total": batch.total, "status_detail": dict(counts.most_common())}
+
+
+def ndjson_line(payload: dict) -> bytes:
+    return (json.dumps(payload, sort_keys=True, separators=(",", ":")) + "\n").encode()
+
+
+def run_consult_batch_item(operation: Operation, item: dict) -> dict:
+    """Executa uma consulta do lote no modo síncrono; erros viram a linha da chave."""
+    try:
+        result = execute_operation(operation, item)
+        metrics.observe_results(operation.log_tag, result)
+        return consult_batch_line(item["chave_acesso"], result, 200)
+    except Exception as e:
+        payload, status = operation_error_response(operation, e)
+        return consult_batch_line(item["chave_acesso"], payload, status)
+
+
+def stream_consult_batch(batch: ConsultBatch) -> Iterator[dict]:
+    """
+    Gera as linhas do lote na ordem em que as consultas terminam.
+
+    Cada endpoint tem até CONSULT_BATCH_CONCURRENCY threads consumindo sua fila
+    de chaves. Se o cliente desconectar (gerador fechado), as threads param de
+    pegar chaves novas.
+    """
+    results: queue.Queue = queue.Queue()
+    stop = threading.Event()
+
+    def drain(pending: deque):
+        sefaz_admission.set(False)
+        while not stop.is_set():
+            try:
+                item = pending.popleft()
+            except IndexError:
+                return
+            results.put(run_consult_batch_item(batch.operation, item))
+
+    for url, items in batch.groups.items():
+        pending = deque(items)
+        for _ in range(min(CONSULT_BATCH_CONCURRENCY, len(items))):
+            threading.Thread(target=drain, args=(pending,), daemon=True, name="consult-batch").start()
+
+    counts: Counter = Counter()
+    try:
+        for line in batch.invalid:
+            counts[line["status_detail"]] += 1
+            yield line
+        for _ in range(sum(len(items) for items in batch.groups.values())):
+            line = results.get()
+            counts[line.get("status_detail") or "erro"] += 1
+            yield line
+        yield consult_batch_summary(batch, counts)
+    finally:
+        stop.set()
+
+
+# ── Jobs assíncronos ─────────────────────────────────────────────
+
+# Consultas vão para a faixa de baixa prioridade; emissões e eventos na frente
+JOB_PRIORITIES = {
+    "/cte/emit": PRIORITY_HIGH,
+    "/cte/emit-batch": PRIORITY_HIGH,
+    "/cte/cancel": PRIORITY_HIGH,
+    "/cte/cce": PRIORITY_HIGH,
+    "/mdfe/emit": PRIORITY_HIGH,
+    "/mdfe/cancel": PRIORITY_HIGH,
+    "/mdfe/close": PRIORITY_HIGH,
+    "/cte/consult": PRIORITY_LOW,
+    "/cte/receipt": PRIORITY_LOW,
+    "/mdfe/consult": PRIORITY_LOW,
+}
+
+# Jobs que podem ser repetidos se o worker morrer no meio (lease vencido);
+# emissões e eventos podem já ter chegado à SEFAZ e não são reenviados
+JOB_RESUMABLE = frozenset(path for path, priority in JOB_PRIORITIES.items() if priority == PRIORITY_LOW)
+
+
+def run_job(path: str, payload: dict) -> tuple[dict, int]:
+    """Executa um job da fila como a rota síncrona executaria."""
+    operation = OPERATIONS[path]
+    sefaz_admission.set(False)  # thread do worker de jobs: aguarda a vez em vez de 429
+    try:
+        result = execute_operation(operation, payload)
+        metrics.observe_results(operation.log_tag, result)
+        return (compact_result(result) if payload.get("compact") else result), 200
+    except Exception as e:
+        return operation_error_response(operation, e)
+
+
+job_queue = JobQueue(
+    JOBS_DB_PATH, run_job,
+    workers=JOBS_WORKERS,
+    reserved_high=JOBS_RESERVED_HIGH,
+    lease_seconds=JOBS_LEASE,
+    encryption_key=JOBS_ENCRYPTION_KEY,
+    resumable=JOB_RESUMABLE,
+    callback_hosts=JOBS_CALLBACK_HOSTS,
+)
+
+
+def submit_job(data: dict) -> dict:
+    """Valida e enfileira um job: {"operation": "cte/emit", "payload": {...}, "callback_url"}."""
+    path = "/" + (data.get("operation") or "").strip("/")
+    if path not in JOB_PRIORITIES:
+        raise RequestError(f"Operação inválida para job: {data.get('operation')}")
+    if not isinstance(data.get("payload"), dict) or not data["payload"]:
+        raise RequestError("Campo obrigatório ausente: payload")
+    if not job_queue.enabled:
+        raise RequestError({
+            "success": False,
+            "error": "Fila de jobs desativada: JOBS_ENCRYPTION_KEY não configurado",
+            "status_detail": "servico_indisponivel",
+        }, 503)
+    if data.get("callback_url") and not job_queue.callback_allowed(data["callback_url"]):
+        raise RequestError("callback_url não permitido (host fora de JOBS_CALLBACK_HOSTS)")
+
+    job_id = job_queue.submit(path, data["payload"], JOB_PRIORITIES[path], data.get("callback_url", ""))
+    logger.info(f"[JOBS] {job_id} enfileirado: {path}")
+    return {"job_id": job_id, "status": "queued", "operation": path}
+
+
+def start_background_workers():
+    """Inicia as threads de fundo do processo (idempotente)."""
+    if JOBS_WORKERS > 0:
+        job_queue.start()
+    sefaz_status.start()
+    keystore.start()
+
+
+def health_info() -> dict:
+    # Verificar XSDs disponíveis
+    xsd_files = list(XSD_DIR.glob("*.xsd")) if XSD_DIR.exists() else []
+    xsd_names = [f.name for f in xsd_files]
+    return {
+        "status": "ok",
+        "version": "2.1.0",
+        "xsd_available": len(xsd_files) > 0,
+        "xsd_schemas": xsd_names,
+        "cert_cache": cert_cache.stats(),
+        "sefaz_sessions": sefaz_sessions.stats(),
+        "receipts": receipt_poller.stats(),
+        "sefaz_circuits": sefaz_circuits.stats(),
+        "sefaz_limits": sefaz_limiter.stats(),
+        "sefaz_rate_limits": sefaz_rate_limiter.stats(),
+        "consult_cache": consult_cache.stats(),
+        "idempotency": idempotency_store.stats(),
+        "trust_store": trust_store.stats(),
+        "keystore": keystore.stats(),
+        "capabilities": [
+            "sign", "sign-batch", "verify", "verify-batch",
+            "cte/emit", "cte/emit-batch", "cte/receipt", "cte/consult", "cte/consult-batch",
+            "cte/cancel", "cte/cce",
+            "mdfe/emit", "mdfe/consult", "mdfe/consult-batch", "mdfe/cancel", "mdfe/close",
+            "jobs", "sefaz/status", "certs",
+        ],
+    }
+
+
+# ── Compressão HTTP e modo compacto ──────────────────────────────
+
+# Documento + protocolo (o XML que a SEFAZ distribui), pela raiz do documento assinado
+PROC_ROOTS = {"CTe": "cteProc", "CTeOS": "cteOSProc", "MDFe": "mdfeProc"}
+
+
+def build_proc_xml(signed_xml: str, prot_xml: str) -> str | None:
+    """Monta cteProc/cteOSProc/mdfeProc com o documento assinado e o protocolo (None se a raiz não for conhecida)."""
+    doc = strip_xml_declaration(signed_xml)
+    match = re.match(r"<(?:\w+:)?(\w+)", doc)
+    proc = PROC_ROOTS.get(match.group(1)) if match else None
+    if proc is None:
+        return None
+    versao = re.search(r'versao="([^"]+)"', doc)
+    ns = NAMESPACES["mdfe" if proc == "mdfeProc" else "cte"]
+    return f'<{proc} xmlns="{ns}" versao="{versao.group(1) if versao else ""}">{doc}{strip_xml_declaration(prot_xml)}</{proc}>'
+
+
+def compact_result(result: dict) -> dict:
+    """
+    Modo compacto ("compact": true no body): documento autorizado sai só em
+    xml_autorizado, já como *Proc (documento assinado + protocolo), sem o
+    signed_xml repetido. Demais resultados (e itens de lote) ficam como estão.
+    """
+    if isinstance(result.get("results"), list):
+        return {**result, "results": [compact_result(item) for item in result["results"]]}
+    if result.get("status_detail") != "autorizado" or not result.get("xml_autorizado") or not result.get("signed_xml"):
+        return result
+    proc_xml = build_proc_xml(result["signed_xml"], result["xml_autorizado"])
+    if proc_xml is None:
+        return result
+    compact = {key: value for key, value in result.items() if key != "signed_xml"}
+    compact["xml_autorizado"] = proc_xml
+    return compact
+
+
+def decode_json_body(body: bytes, content_encoding: str) -> dict | None:
+    """Corpo JSON da requisição, descompactando gzip/zstd até REQUEST_MAX_BYTES."""
+    try:
+        body = http_compression.decode_body(body, content_encoding, REQUEST_MAX_BYTES)
+    except http_compression.UnsupportedEncoding as e:
+        raise RequestError(str(e), 415)
+    except http_compression.BodyTooLarge as e:
+        raise RequestError(str(e), 413)
+    except ValueError as e:
+        raise RequestError(str(e))
+    if not body:
+        return None
+    try:
+        return json.loads(body)
+    except ValueError as e:
+        raise RequestError(f"JSON inválido: {str(e)}")
+
+
+def response_compressor(accept_encoding: str) -> http_compression.Compressor | None:
+    """Compressor para a resposta conforme o Accept-Encoding do cliente (None: sem compressão)."""
+    encoding = http_compression.negotiate(accept_encoding)
+    if encoding is None:
+        return None
+    return http_compression.Compressor(encoding, HTTP_ZSTD_LEVEL if encoding == "zstd" else HTTP_GZIP_LEVEL)
+
+
+# ── Endpoints ────────────────────────────────────────────────────
+
+def request_json() -> dict | None:
+    """request.json com suporte a Content-Encoding gzip/zstd."""
+    if not request.is_json:
+        raise RequestError("Content-Type deve ser application/json", 415)
+    return decode_json_body(request.get_data(cache=False), request.headers.get("Content-Encoding", ""))
+
+
+def _run_operation(path: str):
+    """Executa a operação da rota no modo síncrono (worker Flask/gunicorn)."""
+    auth_err = check_auth()
+    if auth_err:
+        return auth_err
+
+    operation = OPERATIONS[path]
+    try:
+        data = request_json()
+        if not data:
+            return jsonify({"error": "Request body is required"}), 400
+        if request.headers.get("Idempotency-Key"):
+            data.setdefault("idempotency_key", request.headers["Idempotency-Key"])
+        result = execute_operation(operation, data)
+        metrics.observe_results(operation.log_tag, result)
+        if data.get("compact"):
+            result = compact_result(result)
         return jsonify(result), 200
+    except Exception as e:
+        payload, status = operation_error_response(operation, e)
+        return jsonify(payload), status, error_headers(payload)
+
 
+def _run_consult_batch(path: str):
+    """Lote de consultas no modo síncrono: valida, depois transmite as linhas NDJSON."""
+    auth_err = check_auth()
+    if auth_err:
+        return auth_err
+
+    operation = OPERATIONS[CONSULT_BATCH_OPERATIONS[path][0]]
+    try:
+        data = request_json()
+        if not data:
+            return jsonify({"error": "Request body is required"}), 400
+        batch = prepare_consult_batch(path, data)
     except Exception as e:
-        logger.error(f"[MDFE CLOSE] Error: {str(e)}")
+        payload, status = operation_error_response(operation, e)
+        return jsonify(payload), status
+
+    logger.info(f"[{operation.log_tag} BATCH] {batch.total} chave(s) em {len(batch.groups)} endpoint(s)")
+    return Response(
+        (ndjson_line(line) for line in stream_consult_batch(batch)),
+        mimetype="application/x-ndjson",
+    )
+
+
+@app.before_request
+def _ensure_background_workers():
+    start_background_workers()
+
+
+@app.after_request
+def _compress_response(response: Response) -> Response:
+    """Compacta a resposta conforme Accept-Encoding, em blocos (streaming NDJSON: bloco a bloco)."""
+    if response.status_code < 200 or response.status_code in (204, 304) or "Content-Encoding" in response.headers:
+        return response
+    if not response.is_streamed and (response.content_length or 0) < HTTP_COMPRESS_MIN_BYTES:
+        return response
+    response.vary.add("Accept-Encoding")
+    compressor = response_compressor(request.headers.get("Accept-Encoding", ""))
+    if compressor is None:
+        return response
+    response.response = http_compression.iter_compressed(
+        response.iter_encoded(), compressor, flush_each=response.is_streamed,
+    )
+    response.headers["Content-Encoding"] = compressor.encoding
+    response.headers.pop("Content-Length", None)
+    return response
+
+
+@app.route("/health", methods=["GET"])
+def health():
+    return jsonify(health_info()), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+
+@app.route("/sefaz/status", methods=["GET"])
+def sefaz_status_endpoint():
+    auth_err = check_auth()
+    if auth_err:
+        return auth_err
+    return jsonify(sefaz_status.snapshot()), 200
+
+
+@app.route("/sign", methods=["POST"])
+def sign_endpoint():
+    """Apenas assinar XML (compatibilidade retroativa)."""
+    return _run_operation("/sign")
+
+
+@app.route("/sign-batch", methods=["POST"])
+def sign_batch_endpoint():
+    """Assinar vários XML com o mesmo certificado, em paralelo."""
+    return _run_operation("/sign-batch")
+
+
+@app.route("/verify", methods=["POST"])
+def verify_endpoint():
+    """Verificar assinatura e cadeia ICP-Brasil de um CT-e/MDF-e."""
+    return _run_operation("/verify")
+
+
+@app.route("/verify-batch", methods=["POST"])
+def verify_batch_endpoint():
+    """Verificar vários documentos importados, em paralelo."""
+    return _run_operation("/verify-batch")
+
+
+@app.route("/cte/emit", methods=["POST"])
+def cte_emit():
+    """Assinar CT-e + enviar para SEFAZ via SOAP/mTLS."""
+    return _run_operation("/cte/emit")
+
+
+@app.route("/cte/emit-batch", methods=["POST"])
+def cte_emit_batch():
+    """Assinar N CT-e do mesmo emitente/UF e enviar em lotes enviCTe."""
+    return _run_operation("/cte/emit-batch")
+
+
+@app.route("/cte/receipt", methods=["POST"])
+def cte_receipt():
+    """Acompanhar recibo de lote (103/105) até o protocolo final."""
+    return _run_operation("/cte/receipt")
+
+
+@app.route("/cte/consult", methods=["POST"])
+def cte_consult():
+    """Consultar situação de CT-e na SEFAZ."""
+    return _run_operation("/cte/consult")
+
+
+@app.route("/cte/cancel", methods=["POST"])
+def cte_cancel():
+    """Cancelar CT-e na SEFAZ."""
+    return _run_operation("/cte/cancel")
+
+
+@app.route("/cte/cce", methods=["POST"])
+def cte_cce():
+    """Carta de Correção Eletrônica (CC-e) para CT-e."""
+    return _run_operation("/cte/cce")
+
+
+@app.route("/mdfe/emit", methods=["POST"])
+def mdfe_emit():
+    """Assinar MDF-e + enviar para SEFAZ via SOAP/mTLS."""
+    return _run_operation("/mdfe/emit")
+
+
+@app.route("/mdfe/consult", methods=["POST"])
+def mdfe_consult():
+    """Consultar MDF-e na SEFAZ."""
+    return _run_operation("/mdfe/consult")
+
+
+@app.route("/mdfe/cancel", methods=["POST"])
+def mdfe_cancel():
+    """Cancelar MDF-e na SEFAZ."""
+    return _run_operation("/mdfe/cancel")
+
+
+@app.route("/mdfe/close", methods=["POST"])
+def mdfe_close():
+    """Encerrar MDF-e na SEFAZ."""
+    return _run_operation("/mdfe/close")
+
+
+@app.route("/cte/consult-batch", methods=["POST"])
+def cte_consult_batch():
+    """Consultar milhares de CT-e com um certificado (resposta NDJSON em streaming)."""
+    return _run_consult_batch("/cte/consult-batch")
+
+
+@app.route("/mdfe/consult-batch", methods=["POST"])
+def mdfe_consult_batch():
+    """Consultar milhares de MDF-e com um certificado (resposta NDJSON em streaming)."""
+    return _run_consult_batch("/mdfe/consult-batch")
+
+
+@app.route("/certs", methods=["POST"])
+def certs_register():
+    """Registrar certificado no keystore do servidor."""
+    return _run_operation("/certs")
+
+
+@app.route("/certs", methods=["GET"])
+def certs_list():
+    """Certificados do keystore (sem PFX/senha), com dias até o vencimento."""
+    auth_err = check_auth()
+    if auth_err:
+        return auth_err
+    return jsonify({"certificates": keystore.list()}), 200
+
+
+@app.route("/certs/<cert_id>", methods=["DELETE"])
+def certs_delete(cert_id: str):
+    """Remover certificado do keystore."""
+    auth_err = check_auth()
+    if auth_err:
+        return auth_err
+    if not keystore.remove(cert_id):
+        return jsonify({"error": "Certificado não encontrado"}), 404
+    return jsonify({"success": True, "cert_id": cert_id}), 200
+
+
+@app.route("/jobs", methods=["POST"])
+def jobs_submit():
+    """Enfileirar operação (emit/cancel/consult...) e devolver job_id imediatamente."""
+    auth_err = check_auth()
+    if auth_err:
+        return auth_err
+
+    try:
+        data = request_json()
+        if not data:
+            return jsonify({"error": "Request body is required"}), 400
+        return jsonify(submit_job(data)), 202
+    except RequestError as e:
+        return jsonify(e.payload), e.status
+    except Exception as e:
+        logger.error(f"[JOBS] Error: {str(e)}")
         return jsonify({"error": str(e), "success": False}), 500
-    finally:
-        if cert:
-            cert.cleanup()
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def jobs_get(job_id: str):
+    """Consultar status/resultado de um job."""
+    auth_err = check_auth()
+    if auth_err:
+        return auth_err
+
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job não encontrado"}), 404
+    return jsonify(job), 200
 
 
 if __name__ == "__main__":
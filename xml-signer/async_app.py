@@ -0,0 +1,464 @@
+"""
+Modo de serviço assíncrono (aiohttp) — mesmas rotas e contratos JSON do app.py.
+
+No modo síncrono cada worker gunicorn fica preso até SEFAZ_TIMEOUT esperando
+a SEFAZ. Aqui as chamadas mTLS são assíncronas: um processo mantém centenas
+de chamadas em andamento. O trabalho de CPU (certificado, XSD, assinatura,
+parse da resposta) roda num pool de threads fora do event loop, usando as
+mesmas funções de preparo/finalização das rotas Flask (app.OPERATIONS).
+
+Executar:
+  SERVE_MODE=async gunicorn -c gunicorn.conf.py
+  (equivale a: gunicorn async_app:app --worker-class aiohttp.GunicornWebWorker)
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from aiohttp import web
+
+from app import (
+    API_KEY, CONSULT_BATCH_CONCURRENCY, CONSULT_BATCH_OPERATIONS, HTTP_COMPRESS_MIN_BYTES, OPERATIONS,
+    REQUEST_MAX_BYTES, SEFAZ_POOL_IDLE_TIMEOUT, SEFAZ_RETRIES, SEFAZ_RETRY_STATUS,
+    ConsultBatch, EndpointBusy, InMemoryCert, Operation, RequestError, SefazCall, SefazPlan,
+    begin_idempotent, build_soap_envelope, can_resend, check_consumption, circuit_open_error,
+    compact_result, consult_batch_line, consult_batch_summary, decode_json_body, error_headers, finish_idempotent,
+    health_info, idempotency_key, idempotent_replay, job_queue, keystore, logger, ndjson_line, operation_error_response,
+    parse_sefaz_response, prepare_consult_batch, response_compressor, retry_backoff, sefaz_admission, sefaz_circuits,
+    sefaz_limiter, sefaz_rate_limiter, sefaz_status, sends_compressed, soap_headers, start_background_workers, submit_job,
+    throttle_delay,
+)
+import http_compression
+import metrics
+
+ASYNC_CPU_THREADS = int(os.environ.get("ASYNC_CPU_THREADS", "0")) or (os.cpu_count() or 1)
+ASYNC_MAX_PER_HOST = int(os.environ.get("ASYNC_MAX_PER_HOST", "32"))
+
+
+class AsyncSefazClient:
+    """
+    Sessões aiohttp por certificado, com keep-alive e limite de conexões por host.
+
+    Cada certificado tem seu TCPConnector com o SSLContext do InMemoryCert
+    (o mesmo usado no modo síncrono). Sessões ociosas por mais de
+    SEFAZ_POOL_IDLE_TIMEOUT, sem chamada em andamento, são fechadas por
+    close_idle().
+    """
+
+    def __init__(self, limit_per_host: int, idle_timeout: int):
+        self.limit_per_host = limit_per_host
+        self.idle_timeout = idle_timeout
+        # fingerprint -> [ClientSession, cert, last_used, chamadas em andamento]
+        self._sessions: dict[str, list] = {}
+
+    def _session_for(self, cert: InMemoryCert) -> list:
+        entry = self._sessions.get(cert.fingerprint)
+        if entry is None or entry[0].closed:
+            connector = aiohttp.TCPConnector(
+                ssl=cert.ssl_context,
+                limit=0,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.idle_timeout,
+            )
+            entry = [aiohttp.ClientSession(connector=connector), cert, 0.0, 0]
+            self._sessions[cert.fingerprint] = entry
+        entry[2] = time.monotonic()
+        return entry
+
+    async def post(self, cert: InMemoryCert, call: SefazCall, data: bytes) -> tuple[int, bytes]:
+        """
+        POST com retry (mesma política do modo síncrono): falha ao conectar é
+        sempre repetida; erro após o envio e HTTP 502/503/504, só em serviços
+        idempotentes (app.can_resend).
+        """
+        entry = self._session_for(cert)
+        # Em uso: close_idle não fecha a sessão no meio da chamada
+        entry[3] += 1
+        try:
+            return await self._post(entry[0], call, data)
+        finally:
+            entry[3] -= 1
+            entry[2] = time.monotonic()
+
+    @staticmethod
+    async def _post(session: aiohttp.ClientSession, call: SefazCall, data: bytes) -> tuple[int, bytes]:
+        timeout = aiohttp.ClientTimeout(total=call.timeout)
+        resend = SEFAZ_RETRIES if can_resend(call.endpoint) else 0
+        for attempt in range(SEFAZ_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(retry_backoff(attempt))
+            try:
+                async with session.post(
+                    call.url, data=data, headers=soap_headers(call.soap_action), timeout=timeout,
+                ) as response:
+                    content = await response.read()
+            except aiohttp.ClientConnectorError:
+                if attempt == SEFAZ_RETRIES:
+                    raise
+                continue
+            except aiohttp.ClientConnectionError:
+                if attempt >= resend:
+                    raise
+                continue
+            if response.status in SEFAZ_RETRY_STATUS and attempt < resend:
+                continue
+            return response.status, content
+
+    async def close_idle(self):
+        now = time.monotonic()
+        for fingerprint, entry in list(self._sessions.items()):
+            if entry[3] == 0 and now - entry[2] > self.idle_timeout:
+                del self._sessions[fingerprint]
+                await entry[0].close()
+
+    async def close(self):
+        for entry in self._sessions.values():
+            await entry[0].close()
+        self._sessions.clear()
+
+    def stats(self) -> dict:
+        return {"sessions": len(self._sessions), "limit_per_host": self.limit_per_host}
+
+
+cpu_executor = ThreadPoolExecutor(max_workers=ASYNC_CPU_THREADS, thread_name_prefix="cpu")
+sefaz_client = AsyncSefazClient(ASYNC_MAX_PER_HOST, SEFAZ_POOL_IDLE_TIMEOUT)
+
+
+async def run_cpu(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(cpu_executor, func, *args)
+
+
+async def send_to_sefaz_async(call: SefazCall, cert: InMemoryCert):
+    """
+    Versão assíncrona de app.send_to_sefaz. Montagem do envelope (e gzip),
+    parse da resposta e checagem de consumo rodam no cpu_executor, fora do
+    event loop.
+    """
+    envelope = await run_cpu(
+        build_soap_envelope, call.soap_xml, call.soap_action, sends_compressed(call.endpoint),
+    )
+    delay = throttle_delay(cert, call.endpoint)
+    if delay > 0:
+        await asyncio.sleep(delay)
+    probe = None
+    try:
+        async with sefaz_limiter.acquire_async(call.url, sefaz_admission.get(), cert.cnpj) as waited:
+            metrics.observe_queue(call.endpoint, waited)
+            probe = sefaz_circuits.begin(call.url)
+            if probe is None:
+                sefaz_rate_limiter.refund((cert.cnpj, *call.endpoint))
+                raise circuit_open_error(call.url, call.endpoint)
+            logger.info(f"[SEFAZ] POST {call.url} | SOAPAction: {call.soap_action}")
+            start = time.time()
+            try:
+                status, content = await sefaz_client.post(cert, call, envelope)
+            except Exception:
+                metrics.observe_sefaz(call.endpoint, time.time() - start, "erro_conexao")
+                sefaz_circuits.record(call.url, success=False)
+                raise
+            seconds = time.time() - start
+        logger.info(f"[SEFAZ] Response {status} in {int(seconds * 1000)}ms")
+        body = await run_cpu(parse_sefaz_response, call.url, call.endpoint, seconds, status, content)
+    except EndpointBusy as e:
+        sefaz_rate_limiter.refund((cert.cnpj, *call.endpoint))
+        metrics.observe_rejected(call.endpoint, e.reason)
+        raise
+    finally:
+        sefaz_circuits.end(call.url, probe)
+    await run_cpu(check_consumption, cert, call.endpoint, body)
+    return body
+
+
+async def run_plan_async(plan: SefazPlan) -> dict:
+    """Versão assíncrona de app.run_plan."""
+    responses = await asyncio.gather(
+        *(send_to_sefaz_async(call, plan.cert) for call in plan.calls),
+        return_exceptions=plan.partial_failures,
+    )
+    result = await run_cpu(plan.finish, list(responses))
+
+    future = plan.receipt(result) if plan.receipt else None
+    if future is not None:
+        result = {**result, **await asyncio.wrap_future(future)}
+    return result
+
+
+async def execute_operation_async(operation: Operation, data: dict) -> dict:
+    """Versão assíncrona de app.execute_operation."""
+    key, fingerprint = idempotency_key(operation, data)
+    if not key:
+        return await run_plan_async(await run_cpu(operation.prepare, data))
+
+    for _ in range(2):
+        claim = await run_cpu(begin_idempotent, key, fingerprint)
+        if claim.role == "leader":
+            break
+        result = claim.result if claim.role == "replay" else await asyncio.wrap_future(claim.future)
+        if result is not None:
+            return idempotent_replay(result)
+    else:
+        return await run_plan_async(await run_cpu(operation.prepare, data))
+
+    try:
+        result = await run_plan_async(await run_cpu(operation.prepare, data))
+    except BaseException:
+        await run_cpu(finish_idempotent, key, fingerprint, None)
+        raise
+    await run_cpu(finish_idempotent, key, fingerprint, result)
+    return result
+
+
+def json_response(payload: dict, status: int = 200, headers: dict | None = None) -> web.Response:
+    # Mesma serialização do jsonify do Flask (chaves ordenadas, ASCII)
+    return web.json_response(
+        payload, status=status, headers=headers,
+        dumps=lambda obj: json.dumps(obj, sort_keys=True, separators=(",", ":")),
+    )
+
+
+async def read_json(request: web.Request) -> dict | None:
+    """Versão assíncrona de app.request_json (o corpo chega sem descompactar: auto_decompress=False)."""
+    if request.content_type != "application/json" and not request.content_type.endswith("+json"):
+        raise RequestError("Content-Type deve ser application/json", 415)
+    return await run_cpu(decode_json_body, await request.read(), request.headers.get("Content-Encoding", ""))
+
+
+@web.middleware
+async def compression_middleware(request: web.Request, handler) -> web.StreamResponse:
+    """Versão assíncrona de app._compress_response para respostas com corpo pronto (JSON, /metrics)."""
+    response = await handler(request)
+    if (
+        not isinstance(response, web.Response) or response.prepared or response.body is None
+        or response.status < 200 or response.status in (204, 304) or "Content-Encoding" in response.headers
+        or len(response.body) < HTTP_COMPRESS_MIN_BYTES
+    ):
+        return response
+    compressor = response_compressor(request.headers.get("Accept-Encoding", ""))
+    if compressor is None:
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+    stream = web.StreamResponse(status=response.status, headers=response.headers)
+    stream.headers.pop("Content-Length", None)
+    stream.headers["Content-Encoding"] = compressor.encoding
+    stream.headers["Vary"] = "Accept-Encoding"
+    await stream.prepare(request)
+    chunks = http_compression.iter_compressed([response.body], compressor)
+    while (chunk := await run_cpu(next, chunks, None)) is not None:
+        await stream.write(chunk)
+    await stream.write_eof()
+    return stream
+
+
+def _unauthorized(request: web.Request) -> web.Response | None:
+    if API_KEY and request.headers.get("X-API-Key") != API_KEY:
+        return json_response({"error": "Unauthorized"}, 401)
+    return None
+
+
+def operation_handler(operation: Operation):
+    async def handler(request: web.Request) -> web.Response:
+        denied = _unauthorized(request)
+        if denied:
+            return denied
+
+        try:
+            data = await read_json(request)
+            if not data:
+                return json_response({"error": "Request body is required"}, 400)
+            if request.headers.get("Idempotency-Key"):
+                data.setdefault("idempotency_key", request.headers["Idempotency-Key"])
+
+            result = await execute_operation_async(operation, data)
+            metrics.observe_results(operation.log_tag, result)
+            if data.get("compact"):
+                result = compact_result(result)
+            return json_response(result)
+        except Exception as e:
+            payload, status = operation_error_response(operation, e)
+            return json_response(payload, status, error_headers(payload))
+
+    return handler
+
+
+async def _consult_batch_item(operation: Operation, item: dict) -> dict:
+    try:
+        result = await execute_operation_async(operation, item)
+        metrics.observe_results(operation.log_tag, result)
+        return consult_batch_line(item["chave_acesso"], result, 200)
+    except Exception as e:
+        payload, status = operation_error_response(operation, e)
+        return consult_batch_line(item["chave_acesso"], payload, status)
+
+
+def consult_batch_handler(path: str):
+    """Lote de consultas: até CONSULT_BATCH_CONCURRENCY tarefas por endpoint, linhas NDJSON na ordem de término."""
+    operation = OPERATIONS[CONSULT_BATCH_OPERATIONS[path][0]]
+
+    async def handler(request: web.Request) -> web.StreamResponse:
+        denied = _unauthorized(request)
+        if denied:
+            return denied
+
+        try:
+            data = await read_json(request)
+            if not data:
+                return json_response({"error": "Request body is required"}, 400)
+            batch: ConsultBatch = await run_cpu(prepare_consult_batch, path, data)
+        except Exception as e:
+            payload, status = operation_error_response(operation, e)
+            return json_response(payload, status)
+
+        logger.info(f"[{operation.log_tag} BATCH] {batch.total} chave(s) em {len(batch.groups)} endpoint(s)")
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson", "Vary": "Accept-Encoding"})
+        compressor = response_compressor(request.headers.get("Accept-Encoding", ""))
+        if compressor is not None:
+            response.headers["Content-Encoding"] = compressor.encoding
+        await response.prepare(request)
+
+        async def write(data: bytes):
+            # Cada linha sai na hora, mesmo compactada
+            await response.write(compressor.compress(data) + compressor.flush() if compressor else data)
+
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def drain(pending: deque):
+            sefaz_admission.set(False)  # contexto da própria tarefa
+            while pending:
+                await results.put(await _consult_batch_item(operation, pending.popleft()))
+
+        workers = [
+            asyncio.create_task(drain(pending))
+            for pending in (deque(items) for items in batch.groups.values())
+            for _ in range(min(CONSULT_BATCH_CONCURRENCY, len(pending)))
+        ]
+        counts: Counter = Counter()
+        try:
+            for line in batch.invalid:
+                counts[line["status_detail"]] += 1
+                await write(ndjson_line(line))
+            for _ in range(sum(len(items) for items in batch.groups.values())):
+                line = await results.get()
+                counts[line.get("status_detail") or "erro"] += 1
+                await write(ndjson_line(line))
+            await write(ndjson_line(consult_batch_summary(batch, counts)))
+            if compressor is not None:
+                await response.write(compressor.finish())
+        finally:
+            # Cliente desconectou (ou terminou): nenhuma consulta nova
+            for worker in workers:
+                worker.cancel()
+        await response.write_eof()
+        return response
+
+    return handler
+
+
+async def health(request: web.Request) -> web.Response:
+    info = health_info()
+    info["serve_mode"] = "async"
+    info["async_sessions"] = sefaz_client.stats()
+    return json_response(info)
+
+
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    body, content_type = await run_cpu(metrics.render)
+    return web.Response(body=body, headers={"Content-Type": content_type})
+
+
+async def sefaz_status_get(request: web.Request) -> web.Response:
+    denied = _unauthorized(request)
+    if denied:
+        return denied
+    return json_response(await run_cpu(sefaz_status.snapshot))
+
+
+async def certs_list(request: web.Request) -> web.Response:
+    denied = _unauthorized(request)
+    if denied:
+        return denied
+    return json_response({"certificates": await run_cpu(keystore.list)})
+
+
+async def certs_delete(request: web.Request) -> web.Response:
+    denied = _unauthorized(request)
+    if denied:
+        return denied
+    cert_id = request.match_info["cert_id"]
+    if not await run_cpu(keystore.remove, cert_id):
+        return json_response({"error": "Certificado não encontrado"}, 404)
+    return json_response({"success": True, "cert_id": cert_id})
+
+
+async def jobs_submit(request: web.Request) -> web.Response:
+    denied = _unauthorized(request)
+    if denied:
+        return denied
+    try:
+        data = await read_json(request)
+        if not data:
+            return json_response({"error": "Request body is required"}, 400)
+        return json_response(await run_cpu(submit_job, data), 202)
+    except RequestError as e:
+        return json_response(e.payload, e.status)
+    except Exception as e:
+        logger.error(f"[JOBS] Error: {str(e)}")
+        return json_response({"error": str(e), "success": False}, 500)
+
+
+async def jobs_get(request: web.Request) -> web.Response:
+    denied = _unauthorized(request)
+    if denied:
+        return denied
+    job = await run_cpu(job_queue.get, request.match_info["job_id"])
+    if job is None:
+        return json_response({"error": "Job não encontrado"}, 404)
+    return json_response(job)
+
+
+async def _background_tasks(app: web.Application):
+    async def loop():
+        while True:
+            await asyncio.sleep(30)
+            await sefaz_client.close_idle()
+
+    start_background_workers()
+    task = asyncio.create_task(loop())
+    yield
+    task.cancel()
+    await sefaz_client.close()
+    cpu_executor.shutdown(wait=False)
+
+
+def create_app() -> web.Application:
+    # Corpo chega como enviado: read_json descompacta (gzip/zstd) com o limite de REQUEST_MAX_BYTES
+    application = web.Application(
+        client_max_size=REQUEST_MAX_BYTES,
+        middlewares=[compression_middleware],
+        handler_args={"auto_decompress": False},
+    )
+    application.router.add_get("/health", health)
+    application.router.add_get("/metrics", metrics_endpoint)
+    application.router.add_get("/sefaz/status", sefaz_status_get)
+    for path, operation in OPERATIONS.items():
+        application.router.add_post(path, operation_handler(operation))
+    for path in CONSULT_BATCH_OPERATIONS:
+        application.router.add_post(path, consult_batch_handler(path))
+    application.router.add_get("/certs", certs_list)
+    application.router.add_delete("/certs/{cert_id}", certs_delete)
+    application.router.add_post("/jobs", jobs_submit)
+    application.router.add_get("/jobs/{job_id}", jobs_get)
+    application.cleanup_ctx.append(_background_tasks)
+    return application
+
+
+app = create_app()
+
+
+if __name__ == "__main__":
+    web.run_app(app, host="0.0.0.0", port=8080)
@@ -0,0 +1,303 @@
+"""
+Benchmark do extrator de respostas SEFAZ (app.extract_sefaz_response).
+
+Compara o extrator atual (iter filtrado por tag) com o percurso completo
+anterior (body.iter() + QName/getparent em todo nó), mantido aqui como
+referência. Gera respostas sintéticas — retorno de lote com N protCTe
+assinados e consulta de situação com N eventos — confere que os dois
+produzem o mesmo dict e mede o tempo por chamada.
+
+Executar (a partir de xml-signer/):
+  python bench/bench_extract.py
+  python bench/bench_extract.py --protocols 1 50 500 --repeat 200
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lxml import etree  # noqa: E402
+
+from app import extract_sefaz_protocols, extract_sefaz_response  # noqa: E402
+
+CTE_NS = "http://www.portalfiscal.inf.br/cte"
+
+# Assinatura típica de um protCTe (o extrator antigo visitava todos esses nós)
+_SIGNATURE = (
+    '<Signature xmlns="http://www.w3.org/2000/09/xmldsig#"><SignedInfo>'
+    '<CanonicalizationMethod Algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315"/>'
+    '<SignatureMethod Algorithm="http://www.w3.org/2000/09/xmldsig#rsa-sha1"/>'
+    '<Reference URI="#CTe{n}"><Transforms>'
+    '<Transform Algorithm="http://www.w3.org/2000/09/xmldsig#enveloped-signature"/>'
+    '<Transform Algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315"/></Transforms>'
+    '<DigestMethod Algorithm="http://www.w3.org/2000/09/xmldsig#sha1"/>'
+    '<DigestValue>{digest}</DigestValue></Reference></SignedInfo>'
+    '<SignatureValue>{sig}</SignatureValue>'
+    '<KeyInfo><X509Data><X509Certificate>{cert}</X509Certificate></X509Data></KeyInfo></Signature>'
+)
+
+
+def _chave(i: int) -> str:
+    return f"3526011234567800019957001{i:09d}1{i:08d}"[:44]
+
+
+def _prot_cte(i: int, cstat: str = "100") -> str:
+    signature = _SIGNATURE.format(n=_chave(i), digest="A" * 28, sig="B" * 344, cert="C" * 1800)
+    return (
+        f'<protCTe versao="4.00"><infProt Id="CTe{i:015d}"><tpAmb>2</tpAmb><verAplic>RS20240101</verAplic>'
+        f"<chCTe>{_chave(i)}</chCTe><dhRecbto>2026-01-01T10:00:00-03:00</dhRecbto>"
+        f"<nProt>1352600000{i:05d}</nProt><digVal>{'D' * 28}</digVal>"
+        f"<cStat>{cstat}</cStat><xMotivo>Autorizado o uso do CT-e</xMotivo></infProt>{signature}</protCTe>"
+    )
+
+
+def _soap(inner: str) -> bytes:
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope"><soap:Body>'
+        f'<cteResult xmlns="http://www.portalfiscal.inf.br/cte/wsdl/CTeRetRecepcao">{inner}</cteResult>'
+        "</soap:Body></soap:Envelope>"
+    ).encode("utf-8")
+
+
+def lote_response(protocols: int) -> bytes:
+    """retConsReciCTe com `protocols` protCTe (último rejeitado, para exercitar o cStat)."""
+    prots = "".join(_prot_cte(i, "100" if i < protocols - 1 else "539") for i in range(protocols))
+    return _soap(
+        f'<retConsReciCTe xmlns="{CTE_NS}" versao="4.00"><tpAmb>2</tpAmb><verAplic>RS20240101</verAplic>'
+        f"<nRec>351000000000001</nRec><cStat>104</cStat><xMotivo>Lote processado</xMotivo><cUF>35</cUF>"
+        f"{prots}</retConsReciCTe>"
+    )
+
+
+def consulta_response(events: int) -> bytes:
+    """retConsSitCTe com o protCTe e `events` procEventoCTe."""
+    eventos = "".join(
+        f'<procEventoCTe versao="4.00"><eventoCTe versao="4.00"><infEvento Id="ID110110{_chave(0)}{i:03d}">'
+        f"<cOrgao>35</cOrgao><tpAmb>2</tpAmb><CNPJ>12345678000199</CNPJ><chCTe>{_chave(0)}</chCTe>"
+        f"<dhEvento>2026-01-02T10:00:00-03:00</dhEvento><tpEvento>110110</tpEvento><nSeqEvento>{i + 1}</nSeqEvento>"
+        f"<detEvento versaoEvento=\"4.00\"><evCCeCTe><descEvento>Carta de Correcao</descEvento>"
+        f"<infCorrecao><grupoAlterado>ide</grupoAlterado><campoAlterado>natOp</campoAlterado>"
+        f"<valorAlterado>PRESTACAO</valorAlterado></infCorrecao></evCCeCTe></detEvento></infEvento>"
+        f"{_SIGNATURE.format(n=i, digest='A' * 28, sig='B' * 344, cert='C' * 1800)}</eventoCTe>"
+        f'<retEventoCTe versao="4.00"><infEvento><tpAmb>2</tpAmb><cOrgao>35</cOrgao>'
+        f"<cStat>135</cStat><xMotivo>Evento registrado e vinculado a CT-e</xMotivo>"
+        f"<chCTe>{_chave(0)}</chCTe><tpEvento>110110</tpEvento><nSeqEvento>{i + 1}</nSeqEvento>"
+        f"<dhRegEvento>2026-01-02T10:00:01-03:00</dhRegEvento><nProt>1352600001{i:05d}</nProt>"
+        f"</infEvento></retEventoCTe></procEventoCTe>"
+        for i in range(events)
+    )
+    return _soap(
+        f'<retConsSitCTe xmlns="{CTE_NS}" versao="4.00"><tpAmb>2</tpAmb><verAplic>RS20240101</verAplic>'
+        f"<cStat>100</cStat><xMotivo>Autorizado o uso do CT-e</xMotivo><cUF>35</cUF>"
+        f"{_prot_cte(0)}{eventos}</retConsSitCTe>"
+    )
+
+
+def legacy_extract_sefaz_response(body: etree._Element, doc_type: str = "cte") -> dict:
+    """Extrator anterior (percurso completo da árvore), mantido como referência."""
+    result = {
+        "success": False,
+        "cStat": "",
+        "cStat_lote": "",
+        "xMotivo": "",
+        "xMotivo_lote": "",
+        "chave_acesso": "",
+        "protocolo": "",
+        "nRec": "",
+        "data_autorizacao": "",
+        "xml_autorizado": "",
+        "status_detail": "",
+    }
+
+    # Primeiro pass: extrair cStat do retorno do lote (retEnviCTe / retConsReciCTe)
+    lote_cstat = ""
+    lote_xmotivo = ""
+    prot_cstat = ""
+    prot_xmotivo = ""
+
+    for elem in body.iter():
+        tag = etree.QName(elem).localname if isinstance(elem.tag, str) else ""
+        text = (elem.text or "").strip()
+
+        # cStat pode aparecer no nível do lote E no nível do protocolo
+        if tag == "cStat" and text:
+            parent_tag = ""
+            if elem.getparent() is not None:
+                parent_tag = etree.QName(elem.getparent()).localname if isinstance(elem.getparent().tag, str) else ""
+
+            if parent_tag in ("retEnviCTe", "retConsReciCTe", "retEnviMDFe", "retCTe", "retMDFe"):
+                lote_cstat = text
+            elif parent_tag in ("infProt", "protCTe", "protMDFe", "infEvento", "retEvento"):
+                prot_cstat = text
+            elif not lote_cstat:
+                # Fallback: primeiro cStat encontrado
+                lote_cstat = text
+
+        elif tag == "xMotivo" and text:
+            parent_tag = ""
+            if elem.getparent() is not None:
+                parent_tag = etree.QName(elem.getparent()).localname if isinstance(elem.getparent().tag, str) else ""
+
+            if parent_tag in ("retEnviCTe", "retConsReciCTe", "retEnviMDFe", "retCTe", "retMDFe"):
+                lote_xmotivo = text
+            elif parent_tag in ("infProt", "protCTe", "protMDFe", "infEvento", "retEvento"):
+                prot_xmotivo = text
+            elif not lote_xmotivo:
+                lote_xmotivo = text
+
+        elif tag in ("chCTe", "chMDFe") and text:
+            result["chave_acesso"] = text
+        elif tag == "nProt" and text:
+            result["protocolo"] = text
+        elif tag == "nRec" and text:
+            result["nRec"] = text
+        elif tag == "dhRecbto" and text:
+            result["data_autorizacao"] = text
+        elif tag in ("protCTe", "protMDFe"):
+            result["xml_autorizado"] = etree.tostring(elem, encoding="unicode")
+
+    # Usar cStat do protocolo se disponível, senão do lote
+    final_cstat = prot_cstat or lote_cstat
+    final_xmotivo = prot_xmotivo or lote_xmotivo
+
+    result["cStat"] = final_cstat
+    result["xMotivo"] = final_xmotivo
+    result["cStat_lote"] = lote_cstat
+    result["xMotivo_lote"] = lote_xmotivo
+
+    # ── Tratamento explícito por código ──────────────────────
+    cstat = final_cstat
+
+    # Códigos de sucesso definitivo
+    if cstat in ("100", "150"):
+        result["success"] = True
+        result["status_detail"] = "autorizado"
+
+    elif cstat == "101":
+        result["success"] = True
+        result["status_detail"] = "cancelamento_homologado"
+
+    elif cstat == "135":
+        result["success"] = True
+        result["status_detail"] = "evento_registrado"
+
+    # Lote recebido — processamento assíncrono
+    elif cstat == "103":
+        result["success"] = True
+        result["status_detail"] = "lote_recebido"
+        result["xMotivo"] = f"Lote recebido com sucesso. nRec={result['nRec']}. Consultar recibo."
+
+    # Lote processado — verificar protocolo individual
+    elif cstat == "104":
+        # Se temos protocolo individual, verificar seu cStat
+        if prot_cstat in ("100", "150"):
+            result["success"] = True
+            result["status_detail"] = "autorizado"
+        elif prot_cstat == "204":
+            result["success"] = True  # Duplicidade não é erro fatal
+            result["status_detail"] = "duplicidade"
+            result["xMotivo"] = f"Duplicidade de CT-e: {prot_xmotivo}"
+        elif prot_cstat:
+            result["success"] = False
+            result["status_detail"] = "rejeitado"
+            result["motivo_rejeicao"] = f"Rejeição {prot_cstat}: {prot_xmotivo}"
+        else:
+            # 104 sem protocolo individual — tratar como sucesso parcial
+            result["success"] = True
+            result["status_detail"] = "lote_processado"
+
+    # Lote em processamento — precisa aguardar
+    elif cstat == "105":
+        result["success"] = False
+        result["status_detail"] = "em_processamento"
+        result["xMotivo"] = f"Lote em processamento. nRec={result['nRec']}. Aguardar e consultar."
+
+    # Duplicidade direta (sem ser dentro de 104)
+    elif cstat == "204":
+        result["success"] = True
+        result["status_detail"] = "duplicidade"
+        result["xMotivo"] = f"Duplicidade: {final_xmotivo}"
+
+    # Erros de serviço (temporários — retry)
+    elif cstat in ("108", "109", "999"):
+        result["success"] = False
+        result["status_detail"] = "servico_indisponivel"
+        result["motivo_rejeicao"] = f"Serviço indisponível ({cstat}): {final_xmotivo}"
+
+    # Rejeições genéricas (200-999 exceto os tratados acima)
+    elif cstat and int(cstat) >= 200:
+        result["success"] = False
+        result["status_detail"] = "rejeitado"
+        result["motivo_rejeicao"] = f"Rejeição {cstat}: {final_xmotivo}"
+
+    # Código desconhecido
+    elif cstat:
+        result["success"] = False
+        result["status_detail"] = "desconhecido"
+        result["motivo_rejeicao"] = f"Código {cstat}: {final_xmotivo}"
+
+    return result
+
+
+def legacy_extract_sefaz_protocols(body: etree._Element, doc_type: str = "cte") -> tuple[dict, dict[str, dict]]:
+    lote_result = legacy_extract_sefaz_response(body, doc_type)
+    protocols = {}
+    for prot in body.iter(f"{{{CTE_NS}}}protCTe"):
+        prot_result = legacy_extract_sefaz_response(prot, doc_type)
+        if prot_result["chave_acesso"]:
+            protocols[prot_result["chave_acesso"]] = prot_result
+    return lote_result, protocols
+
+
+def _body(content: bytes) -> etree._Element:
+    return etree.fromstring(content).find("{http://www.w3.org/2003/05/soap-envelope}Body")
+
+
+def _time_per_call(func, body: etree._Element, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func(body, "cte")
+        best = min(best, (time.perf_counter() - start) / repeat)
+    return best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--protocols", type=int, nargs="+", default=[1, 50, 500])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    cases = [
+        (f"lote {n} protCTe", lote_response(n), extract_sefaz_protocols, legacy_extract_sefaz_protocols)
+        for n in args.protocols
+    ] + [
+        (f"consulta {n} eventos", consulta_response(n), extract_sefaz_response, legacy_extract_sefaz_response)
+        for n in args.protocols
+    ]
+
+    print(f"{'caso':<24} {'KB':>8} {'anterior ms':>12} {'atual ms':>10} {'ganho':>7}")
+    mismatches = 0
+    for name, content, current, legacy in cases:
+        body = _body(content)
+        if current(body, "cte") != legacy(body, "cte"):
+            print(f"{name}: resultado diferente do extrator anterior")
+            mismatches += 1
+            continue
+        repeat = max(1, args.repeat // max(1, len(content) // 100_000))
+        t_legacy = _time_per_call(legacy, body, repeat)
+        t_current = _time_per_call(current, body, repeat)
+        print(
+            f"{name:<24} {len(content) / 1024:>8.0f} {t_legacy * 1000:>12.3f} "
+            f"{t_current * 1000:>10.3f} {t_legacy / t_current:>6.1f}x"
+        )
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""
+Conferência do assinador nativo (signer.EnvelopedSigner) contra o signxml.
+
+Assina o mesmo documento com SIGNER_BACKEND=native e com o XMLSigner do
+signxml (sem a otimização InPlaceXMLSigner) e exige saída idêntica byte a byte
+em todos os casos: CT-e/MDF-e de vários tamanhos, texto com acentos e
+entidades, documento indentado/CRLF, namespaces extras na raiz, comentários,
+chaves RSA 2048/4096 e certificado emitido por AC. Sai com código 1 se algum
+caso divergir; no fim mede o tempo de assinatura dos dois caminhos.
+
+Os mesmos casos rodam no pytest (tests/test_signer.py). Executar (a partir
+de xml-signer/):
+  python bench/crosscheck_signer.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryptography.hazmat.primitives.serialization import pkcs12  # noqa: E402
+from lxml import etree  # noqa: E402
+from signxml import XMLSigner, methods  # noqa: E402
+
+import signer  # noqa: E402
+from bench.fixtures import PFX_PASSWORD, cte_xml, make_ca, make_pfx, mdfe_xml  # noqa: E402
+
+
+def signing_key(pfx: bytes) -> signer.SigningKey:
+    """SigningKey do PFX de teste (o que InMemoryCert herda, sem o SSLContext)."""
+    private_key, certificate, _ = pkcs12.load_key_and_certificates(pfx, PFX_PASSWORD)
+    return signer.SigningKey(private_key, certificate)
+
+
+def signxml_reference(xml: str, cert: signer.SigningKey, doc_type: str) -> str:
+    """Caminho original: XMLSigner padrão do signxml sobre o documento parseado."""
+    root = etree.fromstring(xml.encode("utf-8"))
+    ns = "cte:infCte" if doc_type == "cte" else "mdfe:infMDFe"
+    node_id = root.find(f".//{ns}", signer.NAMESPACES).attrib["Id"]
+    signed_root = XMLSigner(
+        method=methods.enveloped,
+        signature_algorithm="rsa-sha256",
+        digest_algorithm="sha256",
+        c14n_algorithm=signer.C14N_ALGORITHM,
+    ).sign(root, key=cert.private_key, cert=[cert.certificate], reference_uri=f"#{node_id}")
+    return signer.XML_DECLARATION + etree.tostring(signed_root, encoding="unicode")
+
+
+def sign_with(backend: str, xml: str, cert: signer.SigningKey, doc_type: str) -> str:
+    signer.SIGNER_BACKEND = backend
+    return signer.sign_xml(xml, cert, doc_type, "crosscheck")["signed_xml"]
+
+
+def cases() -> list[tuple[str, str, str]]:
+    cte = cte_xml(3)
+    result = [(f"CT-e {n} infNFe", "cte", cte_xml(n)) for n in (1, 50, 500)]
+    result += [(f"MDF-e {n} infNFe", "mdfe", mdfe_xml(n)) for n in (1, 50)]
+    result += [
+        ("acentos e entidades", "cte", cte.replace(
+            "<xNome>REMETENTE LTDA</xNome>",
+            "<xNome>AÇÚCAR &amp; CAFÉ \"SÃO JOÃO\" &lt;LTDA&gt; ☕ €</xNome>",
+        ).replace('versao="4.00">', 'versao="4.00" xml:lang="pt-BR">', 1)),
+        ("indentado com CRLF", "cte", etree.tostring(
+            etree.fromstring(cte.encode("utf-8")), pretty_print=True, encoding="unicode",
+        ).replace("\n", "\r\n")),
+        ("namespaces extras na raiz", "cte", cte.replace(
+            '<CTe xmlns="http://www.portalfiscal.inf.br/cte">',
+            '<CTe xmlns="http://www.portalfiscal.inf.br/cte" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:ext="urn:exemplo">',
+        )),
+        ("comentários", "cte", cte.replace("<ide>", "<!-- gerado pelo ERP --><ide>")),
+        ("prefixo explícito", "cte", cte.replace(
+            '<CTe xmlns="http://www.portalfiscal.inf.br/cte">', '<cte:CTe xmlns:cte="http://www.portalfiscal.inf.br/cte">',
+        ).replace("</CTe>", "</cte:CTe>").replace("<infCte ", "<cte:infCte ").replace("</infCte>", "</cte:infCte>")),
+    ]
+    return result
+
+
+def main() -> int:
+    ca = make_ca()
+    certs = {
+        "RSA 2048": signing_key(make_pfx()),
+        "RSA 4096": signing_key(make_pfx(key_size=4096)),
+        "emitido por AC": signing_key(make_pfx(ca=ca)),
+    }
+
+    failures = 0
+    for cert_name, cert in certs.items():
+        for name, doc_type, xml in cases():
+            reference = signxml_reference(xml, cert, doc_type)
+            outputs = {backend: sign_with(backend, xml, cert, doc_type) for backend in ("native", "signxml")}
+            for backend, output in outputs.items():
+                if output != reference:
+                    failures += 1
+                    print(f"DIVERGE  {cert_name:<15} {name:<28} backend={backend}")
+        print(f"ok       {cert_name}")
+
+    cert = certs["RSA 2048"]
+    xml = cte_xml(500)
+    print(f"\n{'backend':<10} {'ms/assinatura (CT-e 500 infNFe)':>32}")
+    for backend in ("signxml", "native"):
+        sign_with(backend, xml, cert, "cte")
+        start = time.perf_counter()
+        for _ in range(50):
+            sign_with(backend, xml, cert, "cte")
+        print(f"{backend:<10} {(time.perf_counter() - start) / 50 * 1000:>32.2f}")
+    start = time.perf_counter()
+    for _ in range(50):
+        signxml_reference(xml, cert, "cte")
+    print(f"{'signxml*':<10} {(time.perf_counter() - start) / 50 * 1000:>32.2f}  (*XMLSigner padrão)")
+
+    if failures:
+        print(f"\n{failures} divergência(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+Dados sintéticos para os benchmarks (tudo gerado localmente, sem rede).
+
+- make_ca / make_pfx: AC raiz e certificado A1 (PFX) no formato ICP-Brasil
+  ("RAZAO SOCIAL:CNPJ" no CN)
+- make_server_cert: certificado TLS de servidor emitido pela AC (mock SEFAZ)
+- cte_xml / mdfe_xml: documentos com N referências infNFe, no layout 4.00/3.00
+  (estrutura realista, não necessariamente válida contra o XSD)
+"""
+
+import datetime
+import ipaddress
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import pkcs12
+from cryptography.x509.oid import NameOID
+
+PFX_PASSWORD = b"1234"
+CNPJ = "12345678000199"
+
+
+def chave_acesso(modelo: str, numero: int, uf: str = "35") -> str:
+    """Chave de 44 dígitos (com DV módulo 11) para o número do documento."""
+    base = f"{uf}2601{CNPJ}{modelo}001{numero:09d}1{numero % 10**8:08d}"
+    weights = [2, 3, 4, 5, 6, 7, 8, 9]
+    total = sum(int(d) * weights[i % 8] for i, d in enumerate(reversed(base)))
+    dv = 11 - total % 11
+    return base + str(0 if dv >= 10 else dv)
+
+
+def make_ca(cn: str = "AC TESTE BENCH", key_size: int = 2048) -> tuple[rsa.RSAPrivateKey, x509.Certificate]:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=key_size)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, cn)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder().subject_name(name).issuer_name(name)
+        .public_key(key.public_key()).serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=3650))
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    return key, cert
+
+
+def make_pfx(
+    cn: str = f"EMPRESA TESTE LTDA:{CNPJ}", password: bytes = PFX_PASSWORD, days: int = 365,
+    key_size: int = 2048, ca: tuple | None = None,
+) -> bytes:
+    """PFX A1 autoassinado, ou emitido por `ca` (make_ca()) com a AC na cadeia."""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=key_size)
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, cn)])
+    issuer_key, issuer_cert = ca if ca else (key, None)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder().subject_name(subject)
+        .issuer_name(issuer_cert.subject if issuer_cert else subject)
+        .public_key(key.public_key()).serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=days))
+        .sign(issuer_key, hashes.SHA256())
+    )
+    chain = [issuer_cert] if issuer_cert else None
+    return pkcs12.serialize_key_and_certificates(
+        b"bench", key, cert, chain, serialization.BestAvailableEncryption(password),
+    )
+
+
+def make_server_cert(ca: tuple, hostnames: list[str]) -> tuple[rsa.RSAPrivateKey, x509.Certificate]:
+    """Certificado de servidor TLS (SAN com os nomes/IPs dados) emitido por `ca`."""
+    ca_key, ca_cert = ca
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    san = []
+    for host in hostnames:
+        try:
+            san.append(x509.IPAddress(ipaddress.ip_address(host)))
+        except ValueError:
+            san.append(x509.DNSName(host))
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, hostnames[0])]))
+        .issuer_name(ca_cert.subject)
+        .public_key(key.public_key()).serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=825))
+        .add_extension(x509.SubjectAlternativeName(san), critical=False)
+        .sign(ca_key, hashes.SHA256())
+    )
+    return key, cert
+
+
+def _nfe_refs(n_nfe: int) -> str:
+    return "".join(
+        f"<infNFe><chave>{chave_acesso('55', i + 1)}</chave></infNFe>" for i in range(n_nfe)
+    )
+
+
+def cte_xml(n_nfe: int = 1, numero: int = 1, uf: str = "35") -> str:
+    chave = chave_acesso("57", numero, uf)
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<CTe xmlns="http://www.portalfiscal.inf.br/cte"><infCte Id="CTe{chave}" versao="4.00"><ide><cUF>{uf}</cUF><cCT>{numero % 10**8:08d}</cCT><CFOP>5353</CFOP><natOp>PRESTACAO DE SERVICO DE TRANSPORTE</natOp><mod>57</mod><serie>1</serie><nCT>{numero}</nCT><dhEmi>2026-01-01T10:00:00-03:00</dhEmi><tpImp>1</tpImp><tpEmis>1</tpEmis><cDV>{chave[-1]}</cDV><tpAmb>2</tpAmb><tpCTe>0</tpCTe><procEmi>0</procEmi><verProc>bench</verProc><cMunEnv>3550308</cMunEnv><xMunEnv>SAO PAULO</xMunEnv><UFEnv>SP</UFEnv><modal>01</modal><tpServ>0</tpServ><cMunIni>3550308</cMunIni><xMunIni>SAO PAULO</xMunIni><UFIni>SP</UFIni><cMunFim>3304557</cMunFim><xMunFim>RIO DE JANEIRO</xMunFim><UFFim>RJ</UFFim><retira>1</retira><indIEToma>1</indIEToma><toma3><toma>0</toma></toma3></ide><emit><CNPJ>{CNPJ}</CNPJ><IE>111111111111</IE><xNome>EMPRESA TESTE LTDA</xNome><enderEmit><xLgr>RUA DAS FLORES</xLgr><nro>100</nro><xBairro>CENTRO</xBairro><cMun>3550308</cMun><xMun>SAO PAULO</xMun><CEP>01001000</CEP><UF>SP</UF></enderEmit><CRT>3</CRT></emit><rem><CNPJ>11222333000181</CNPJ><IE>222222222222</IE><xNome>REMETENTE LTDA</xNome><enderReme><xLgr>AV PAULISTA</xLgr><nro>1000</nro><xBairro>BELA VISTA</xBairro><cMun>3550308</cMun><xMun>SAO PAULO</xMun><UF>SP</UF></enderReme></rem><dest><CNPJ>44555666000172</CNPJ><IE>333333333333</IE><xNome>DESTINATARIO COMERCIO E SERVICOS</xNome><enderDest><xLgr>RUA DO OUVIDOR</xLgr><nro>50</nro><xBairro>CENTRO</xBairro><cMun>3304557</cMun><xMun>RIO DE JANEIRO</xMun><UF>RJ</UF></enderDest></dest><vPrest><vTPrest>1500.00</vTPrest><vRec>1500.00</vRec></vPrest><imp><ICMS><ICMS00><CST>00</CST><vBC>1500.00</vBC><pICMS>12.00</pICMS><vICMS>180.00</vICMS></ICMS00></ICMS></imp><infCTeNorm><infCarga><vCarga>25000.00</vCarga><proPred>MERCADORIAS DIVERSAS</proPred><infQ><cUnid>01</cUnid><tpMed>PESO BRUTO</tpMed><qCarga>1200.0000</qCarga></infQ></infCarga><infDoc>{_nfe_refs(n_nfe)}</infDoc><infModal versaoModal="4.00"><rodo><RNTRC>12345678</RNTRC></rodo></infModal></infCTeNorm></infCte><infCTeSupl><qrCodCTe>https://nfe.fazenda.sp.gov.br/CTeConsulta/qrCode?chCTe={chave}&amp;tpAmb=2</qrCodCTe></infCTeSupl></CTe>"""
+
+
+def mdfe_xml(n_nfe: int = 1, numero: int = 1, uf: str = "35") -> str:
+    chave = chave_acesso("58", numero, uf)
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<MDFe xmlns="http://www.portalfiscal.inf.br/mdfe"><infMDFe Id="MDFe{chave}" versao="3.00"><ide><cUF>{uf}</cUF><tpAmb>2</tpAmb><tpEmit>1</tpEmit><mod>58</mod><serie>1</serie><nMDF>{numero}</nMDF><cMDF>{numero % 10**8:08d}</cMDF><cDV>{chave[-1]}</cDV><modal>1</modal><dhEmi>2026-01-01T10:00:00-03:00</dhEmi><tpEmis>1</tpEmis><procEmi>0</procEmi><verProc>bench</verProc><UFIni>SP</UFIni><UFFim>RJ</UFFim><infMunCarrega><cMunCarrega>3550308</cMunCarrega><xMunCarrega>SAO PAULO</xMunCarrega></infMunCarrega></ide><emit><CNPJ>{CNPJ}</CNPJ><IE>111111111111</IE><xNome>EMPRESA TESTE LTDA</xNome><enderEmit><xLgr>RUA DAS FLORES</xLgr><nro>100</nro><xBairro>CENTRO</xBairro><cMun>3550308</cMun><xMun>SAO PAULO</xMun><UF>SP</UF></enderEmit></emit><infModal versaoModal="3.00"><rodo><infANTT><RNTRC>12345678</RNTRC></infANTT><veicTracao><placa>ABC1D23</placa><tara>8000</tara><condutor><xNome>MOTORISTA TESTE</xNome><CPF>12345678909</CPF></condutor><tpRod>02</tpRod><tpCar>02</tpCar><UF>SP</UF></veicTracao></rodo></infModal><infDoc><infMunDescarga><cMunDescarga>3304557</cMunDescarga><xMunDescarga>RIO DE JANEIRO</xMunDescarga>{_nfe_refs(n_nfe)}</infMunDescarga></infDoc><tot><qNFe>{n_nfe}</qNFe><vCarga>25000.00</vCarga><cUnid>01</cUnid><qCarga>1200.0000</qCarga></tot></infMDFe><infMDFeSupl><qrCodMDFe>https://dfe-portal.svrs.rs.gov.br/mdfe/qrCode?chMDFe={chave}&amp;tpAmb=2</qrCodMDFe></infMDFeSupl></MDFe>"""
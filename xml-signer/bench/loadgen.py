@@ -0,0 +1,222 @@
+"""
+Gerador de carga ponta a ponta: serviço (Flask/gunicorn ou aiohttp) → mock SEFAZ.
+
+Cada requisição usa um número de documento novo (chave de acesso única), para
+o mock não responder duplicidade. Mede docs/s, req/s e latência p50/p95/p99
+por requisição (após o aquecimento) e conta HTTP status e status_detail.
+
+Passo a passo (a partir de xml-signer/):
+  1. python bench/mock_sefaz.py --latency lognormal:120:0.4
+  2. SEFAZ_URL_OVERRIDE=https://localhost:8443 \\
+     REQUESTS_CA_BUNDLE=bench/mock-certs/ca.pem \\
+     XSD_DIR=... gunicorn -c gunicorn.conf.py
+  3. python bench/loadgen.py --operation cte-emit --concurrency 32 --duration 60
+
+Sem os XSD oficiais, use --skip-xsd (os documentos sintéticos não passam no
+schema oficial de qualquer forma).
+"""
+
+import argparse
+import base64
+import itertools
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench.fixtures import PFX_PASSWORD, chave_acesso, cte_xml, mdfe_xml  # noqa: E402
+
+OPERATIONS = ("cte-emit", "cte-emit-batch", "mdfe-emit", "cte-consult", "mix")
+MIX = ("cte-emit",) * 6 + ("cte-consult",) * 3 + ("mdfe-emit",)
+# Cópia de app.UF_CODIGO_IBGE (importar o app aqui inicializaria fila de jobs, pools etc.)
+UF_CODIGO_IBGE = {
+    "AC": "12", "AL": "27", "AM": "13", "AP": "16", "BA": "29", "CE": "23",
+    "DF": "53", "ES": "32", "GO": "52", "MA": "21", "MG": "31", "MS": "50",
+    "MT": "51", "PA": "15", "PB": "25", "PE": "26", "PI": "22", "PR": "41",
+    "RJ": "33", "RN": "24", "RO": "11", "RR": "14", "RS": "43", "SC": "42",
+    "SE": "28", "SP": "35", "TO": "17",
+}
+
+
+class LoadGenerator:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.cuf = UF_CODIGO_IBGE[args.uf]
+        self.base = {
+            "pfx_base64": base64.b64encode(Path(args.pfx).read_bytes()).decode(),
+            "password": args.password,
+            "uf": args.uf,
+            "ambiente": "homologacao",
+        }
+        if args.skip_xsd:
+            self.base["skip_xsd_validation"] = True
+        self.headers = {"X-API-Key": args.api_key} if args.api_key else {}
+        # Números altos por execução, para não colidir com chaves de execuções anteriores no mock
+        self.numbers = itertools.count(int(time.time()) % 10**6 * 1000)
+        self.emitted: list[str] = []
+        self.lock = threading.Lock()
+        self.latencies: list[float] = []
+        self.http_status: Counter = Counter()
+        self.status_detail: Counter = Counter()
+        self.documents = 0
+        self.requests = 0
+        self.errors = 0
+        self.measuring = False
+
+    def next_number(self) -> int:
+        with self.lock:
+            return next(self.numbers)
+
+    def build(self, operation: str) -> tuple[str, dict, int]:
+        """(rota, body, documentos) para uma requisição."""
+        args = self.args
+        if operation == "cte-emit":
+            numero = self.next_number()
+            body = {**self.base, "xml": cte_xml(args.nfe, numero, self.cuf), "document_id": f"CTe_{numero}"}
+            if args.aguardar_recibo:
+                body["aguardar_recibo"] = True
+            return "/cte/emit", body, 1
+        if operation == "cte-emit-batch":
+            xmls = []
+            for _ in range(args.batch_size):
+                numero = self.next_number()
+                xmls.append({"xml": cte_xml(args.nfe, numero, self.cuf), "document_id": f"CTe_{numero}"})
+            return "/cte/emit-batch", {**self.base, "xmls": xmls}, len(xmls)
+        if operation == "mdfe-emit":
+            numero = self.next_number()
+            return "/mdfe/emit", {**self.base, "xml": mdfe_xml(args.nfe, numero, self.cuf), "document_id": f"MDFe_{numero}"}, 1
+        if operation == "cte-consult":
+            with self.lock:
+                chave = self.emitted[self.requests % len(self.emitted)] if self.emitted else None
+            chave = chave or chave_acesso("57", self.next_number(), self.cuf)
+            return "/cte/consult", {**self.base, "chave_acesso": chave}, 1
+        raise ValueError(operation)
+
+    def record(self, elapsed_ms: float, status: int, payload: dict, documents: int):
+        results = payload.get("results") or [payload]
+        with self.lock:
+            for r in results:
+                if r.get("status_detail") == "autorizado" and r.get("chave_acesso"):
+                    self.emitted.append(r["chave_acesso"])
+            del self.emitted[:-10_000]
+            if not self.measuring:
+                return
+            self.requests += 1
+            self.documents += documents
+            self.latencies.append(elapsed_ms)
+            self.http_status[status] += 1
+            for r in results:
+                self.status_detail[r.get("status_detail") or r.get("error", "sem_status")[:60]] += 1
+
+    def worker(self, deadline: float, operations: itertools.cycle):
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            with self.lock:
+                operation = next(operations)
+            path, body, documents = self.build(operation)
+            start = time.perf_counter()
+            try:
+                response = session.post(
+                    self.args.service_url + path, json=body, headers=self.headers, timeout=self.args.timeout,
+                )
+                payload = response.json()
+                status = response.status_code
+            except (requests.RequestException, ValueError) as e:
+                with self.lock:
+                    if self.measuring:
+                        self.errors += 1
+                        self.status_detail[f"cliente: {type(e).__name__}"] += 1
+                continue
+            self.record((time.perf_counter() - start) * 1000, status, payload, documents)
+
+    def run(self) -> dict:
+        args = self.args
+        operations = itertools.cycle(MIX if args.operation == "mix" else (args.operation,))
+        deadline = time.monotonic() + args.warmup + args.duration
+        threads = [
+            threading.Thread(target=self.worker, args=(deadline, operations), daemon=True)
+            for _ in range(args.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.warmup)
+        with self.lock:
+            self.measuring = True
+        started = time.monotonic()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        latencies = sorted(self.latencies)
+
+        def pct(p: float) -> float:
+            return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))], 1) if latencies else 0.0
+
+        return {
+            "operation": args.operation,
+            "concurrency": args.concurrency,
+            "batch_size": args.batch_size if args.operation == "cte-emit-batch" else 1,
+            "nfe_por_documento": args.nfe,
+            "duration_s": round(elapsed, 1),
+            "requests": self.requests,
+            "documents": self.documents,
+            "errors": self.errors,
+            "req_per_s": round(self.requests / elapsed, 1),
+            "docs_per_s": round(self.documents / elapsed, 1),
+            "p50_ms": pct(50),
+            "p95_ms": pct(95),
+            "p99_ms": pct(99),
+            "http_status": {str(k): v for k, v in sorted(self.http_status.items())},
+            "status_detail": dict(self.status_detail.most_common()),
+        }
+
+
+def main() -> int:
+    default_pfx = Path(__file__).resolve().parent / "mock-certs" / "client.pfx"
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--service-url", default="http://localhost:8080")
+    parser.add_argument("--api-key", default="")
+    parser.add_argument("--pfx", default=str(default_pfx), help="PFX enviado ao serviço (padrão: cliente do mock)")
+    parser.add_argument("--password", default=PFX_PASSWORD.decode())
+    parser.add_argument("--uf", default="SP", choices=sorted(UF_CODIGO_IBGE))
+    parser.add_argument("--operation", choices=OPERATIONS, default="cte-emit")
+    parser.add_argument("--batch-size", type=int, default=50, help="CT-e por requisição em cte-emit-batch")
+    parser.add_argument("--nfe", type=int, default=1, help="referências infNFe por documento")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0, help="segundos medidos")
+    parser.add_argument("--warmup", type=float, default=5.0, help="segundos descartados no início")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--aguardar-recibo", action="store_true", help="cte-emit com aguardar_recibo")
+    parser.add_argument("--skip-xsd", action="store_true", help="envia skip_xsd_validation")
+    parser.add_argument("--mock-stats", default="http://127.0.0.1:8444/stats", help="'' para não consultar")
+    parser.add_argument("--output", help="grava o relatório em JSON")
+    args = parser.parse_args()
+
+    report = LoadGenerator(args).run()
+    if args.mock_stats:
+        try:
+            report["mock"] = requests.get(args.mock_stats, timeout=5).json()
+        except requests.RequestException:
+            pass
+
+    print(f"{report['operation']}: {report['requests']} req, {report['documents']} docs em {report['duration_s']}s "
+          f"(concorrência {report['concurrency']})")
+    print(f"  {report['req_per_s']} req/s | {report['docs_per_s']} docs/s")
+    print(f"  latência p50 {report['p50_ms']} ms | p95 {report['p95_ms']} ms | p99 {report['p99_ms']} ms")
+    print(f"  HTTP: {report['http_status']} | erros de cliente: {report['errors']}")
+    for detail, count in report["status_detail"].items():
+        print(f"  {count:>8}  {detail}")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,428 @@
+"""
+SEFAZ local para testes de carga (mTLS, SOAP 1.2) — não usar em produção.
+
+Atende as operações usadas pelo app.py, identificadas pelo elemento dentro do
+soap:Body (o caminho da URL é ignorado):
+
+  enviCTe          → retEnviCte (104 + protCTe por CT-e, ou 103 + nRec)
+  consReciCTe      → retConsReciCTe (105 até o lote "processar", depois 104)
+  consSitCTe       → retConsSitCTe (100/101 para chaves emitidas, senão 217)
+  eventoCTe        → retEventoCTe (135; cancelamento marca a chave como 101)
+  consStatServCTe  → retConsStatServCte (107)
+  MDFe             → retMDFe (protMDFe)
+  consSitMDFe      → retConsSitMDFe
+  eventoMDFe       → retEventoMDFe (135)
+  consStatServMDFe → retConsStatServMDFe (107)
+
+Mix de cStat (--emit-mix, ex. "100=90,103=4,204=2,108=1,999=1,539=2"):
+103 torna o lote assíncrono (responde 103 e o protocolo sai na consulta do
+recibo); 108/109/999 respondem no nível do lote, sem protocolo; os demais são
+sorteados por documento dentro do protCTe. Uma chave já autorizada sempre
+recebe 204 (duplicidade).
+
+Latência por serviço (--latency [serviço=]dist, repetível), com dist em ms:
+  fixed:50 | uniform:20:200 | lognormal:80:0.5 (mediana, sigma) | exp:100 (média)
+
+Falhas injetadas, em fração das requisições: --fail-503, --fail-timeout (não
+responde por --timeout-seconds), --fail-reset (fecha a conexão sem resposta),
+--fail-malformed (XML truncado).
+
+Na primeira execução gera em --certs-dir uma AC, o certificado do servidor e
+um PFX de cliente (client.pfx, senha 1234) emitido pela mesma AC. O app deve
+confiar na AC (REQUESTS_CA_BUNDLE=<certs-dir>/ca.pem) e apontar para o mock
+(SEFAZ_URL_OVERRIDE=https://localhost:8443). Estatísticas em JSON em
+http://<host>:<stats-port>/stats (HTTP simples, sem mTLS).
+
+Executar (a partir de xml-signer/):
+  python bench/mock_sefaz.py --latency lognormal:120:0.4 --emit-mix 100=95,103=3,999=2
+"""
+
+import argparse
+import asyncio
+import random
+import ssl
+import sys
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable
+
+from aiohttp import web
+from cryptography.hazmat.primitives import serialization
+from lxml import etree
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench.fixtures import PFX_PASSWORD, make_ca, make_pfx, make_server_cert  # noqa: E402
+
+SOAP_NS = "http://www.w3.org/2003/05/soap-envelope"
+CTE_NS = "http://www.portalfiscal.inf.br/cte"
+MDFE_NS = "http://www.portalfiscal.inf.br/mdfe"
+BRT = timezone(timedelta(hours=-3))
+
+XMOTIVO = {
+    "100": "Autorizado o uso do CT-e",
+    "101": "Cancelamento de CT-e homologado",
+    "103": "Lote recebido com sucesso",
+    "104": "Lote processado",
+    "105": "Lote em processamento",
+    "106": "Lote não localizado",
+    "107": "Serviço em Operação",
+    "108": "Serviço Paralisado Momentaneamente (curto prazo)",
+    "109": "Serviço Paralisado sem Previsão",
+    "135": "Evento registrado e vinculado a CT-e",
+    "204": "Rejeição: Duplicidade de CT-e",
+    "217": "Rejeição: CT-e não consta na base de dados da SEFAZ",
+    "539": "Rejeição: Duplicidade de CT-e, com diferença na Chave de Acesso",
+    "999": "Rejeição: Erro não catalogado",
+}
+LOTE_LEVEL = ("108", "109", "999")
+
+
+# ── Configuração ─────────────────────────────────────────────────
+
+def parse_distribution(spec: str) -> Callable[[], float]:
+    """Distribuição em ms → função que sorteia um valor em segundos."""
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(":")] if args else []
+    if kind in ("0", "none"):
+        return lambda: 0.0
+    if kind == "fixed":
+        return lambda: values[0] / 1000
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if kind == "lognormal":
+        import math
+        mu = math.log(values[0])
+        return lambda: random.lognormvariate(mu, values[1]) / 1000
+    if kind == "exp":
+        return lambda: random.expovariate(1 / values[0]) / 1000
+    raise ValueError(f"Distribuição inválida: {spec}")
+
+
+def parse_mix(spec: str) -> tuple[list[str], list[float]]:
+    codes, weights = [], []
+    for part in spec.split(","):
+        code, _, weight = part.partition("=")
+        codes.append(code.strip())
+        weights.append(float(weight or 1))
+    return codes, weights
+
+
+class MockSefaz:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.latency: dict[str, Callable[[], float]] = {}
+        for spec in args.latency:
+            service, _, dist = spec.rpartition("=")
+            self.latency[service or "default"] = parse_distribution(dist)
+        self.latency.setdefault("default", lambda: 0.0)
+        self.processing_delay = parse_distribution(args.processing_delay)
+        self.emit_mix = parse_mix(args.emit_mix)
+        self.mdfe_mix = parse_mix(args.mdfe_mix)
+        self.event_mix = parse_mix(args.event_mix)
+
+        self.documents: OrderedDict[str, tuple[str, str]] = OrderedDict()  # chave -> (cStat, nProt)
+        self.receipts: dict[str, tuple[float, list[tuple[str, str]]]] = {}  # nRec -> (pronto_em, [(chave, cStat)])
+        self.counter = 0
+        self.stats: Counter = Counter()
+        self.started = time.time()
+
+    # ── Utilitários ─────────────────────────────────────────────
+
+    def next_number(self) -> int:
+        self.counter += 1
+        return self.counter
+
+    @staticmethod
+    def draw(mix: tuple[list[str], list[float]], exclude: tuple[str, ...] = ()) -> str:
+        codes, weights = mix
+        pairs = [(c, w) for c, w in zip(codes, weights) if c not in exclude] or [("100", 1.0)]
+        return random.choices([c for c, _ in pairs], weights=[w for _, w in pairs])[0]
+
+    def remember(self, chave: str, cstat: str, n_prot: str):
+        self.documents[chave] = (cstat, n_prot)
+        while len(self.documents) > self.args.max_documents:
+            self.documents.popitem(last=False)
+
+    @staticmethod
+    def now() -> str:
+        return datetime.now(BRT).isoformat(timespec="seconds")
+
+    def prot(self, ns_tag: str, chave: str, cstat: str) -> str:
+        """protCTe/protMDFe; autorizações ganham nProt e entram na base."""
+        kind = "CTe" if ns_tag == "protCTe" else "MDFe"
+        n_prot = ""
+        if cstat in ("100", "150"):
+            n_prot = f"1{self.next_number():014d}"
+            self.remember(chave, "100", n_prot)
+        n_prot_xml = f"<nProt>{n_prot}</nProt>" if n_prot else ""
+        return (
+            f'<{ns_tag} versao="4.00"><infProt><tpAmb>2</tpAmb><verAplic>MOCK</verAplic>'
+            f"<ch{kind}>{chave}</ch{kind}><dhRecbto>{self.now()}</dhRecbto>{n_prot_xml}"
+            f"<cStat>{cstat}</cStat><xMotivo>{XMOTIVO.get(cstat, 'Rejeição: simulada')}</xMotivo>"
+            f"</infProt></{ns_tag}>"
+        )
+
+    def doc_cstat(self, chave: str, mix: tuple) -> str:
+        known = self.documents.get(chave)
+        if known and known[0] == "100":
+            return "204"
+        return self.draw(mix, exclude=("103", "105") + LOTE_LEVEL)
+
+    # ── Operações ───────────────────────────────────────────────
+
+    def envi_cte(self, request: etree._Element) -> str:
+        chaves = [el.get("Id", "")[3:] for el in request.iter(f"{{{CTE_NS}}}infCte")]
+        lote_cstat = self.draw(self.emit_mix, exclude=("105",))
+        head = f'<retEnviCte xmlns="{CTE_NS}" versao="4.00"><tpAmb>2</tpAmb><verAplic>MOCK</verAplic><cUF>35</cUF>'
+
+        if lote_cstat in LOTE_LEVEL:
+            return f"{head}<cStat>{lote_cstat}</cStat><xMotivo>{XMOTIVO[lote_cstat]}</xMotivo></retEnviCte>"
+
+        if lote_cstat == "103":
+            n_rec = f"35{self.next_number():013d}"
+            ready_at = time.monotonic() + self.processing_delay()
+            self.receipts[n_rec] = (ready_at, [(c, self.doc_cstat(c, self.emit_mix)) for c in chaves])
+            return (
+                f"{head}<cStat>103</cStat><xMotivo>{XMOTIVO['103']}</xMotivo>"
+                f"<infRec><nRec>{n_rec}</nRec><dhRecbto>{self.now()}</dhRecbto><tMed>1</tMed></infRec></retEnviCte>"
+            )
+
+        prots = "".join(self.prot("protCTe", c, self.doc_cstat(c, self.emit_mix)) for c in chaves)
+        return f"{head}<cStat>104</cStat><xMotivo>{XMOTIVO['104']}</xMotivo>{prots}</retEnviCte>"
+
+    def cons_reci_cte(self, request: etree._Element) -> str:
+        n_rec = request.findtext(f"{{{CTE_NS}}}nRec", "")
+        head = (
+            f'<retConsReciCTe xmlns="{CTE_NS}" versao="4.00"><tpAmb>2</tpAmb><verAplic>MOCK</verAplic>'
+            f"<nRec>{n_rec}</nRec>"
+        )
+        pending = self.receipts.get(n_rec)
+        if pending is None:
+            return f"{head}<cStat>106</cStat><xMotivo>{XMOTIVO['106']}</xMotivo><cUF>35</cUF></retConsReciCTe>"
+        ready_at, docs = pending
+        if time.monotonic() < ready_at:
+            return f"{head}<cStat>105</cStat><xMotivo>{XMOTIVO['105']}</xMotivo><cUF>35</cUF></retConsReciCTe>"
+        del self.receipts[n_rec]
+        prots = "".join(self.prot("protCTe", chave, cstat) for chave, cstat in docs)
+        return f"{head}<cStat>104</cStat><xMotivo>{XMOTIVO['104']}</xMotivo><cUF>35</cUF>{prots}</retConsReciCTe>"
+
+    def cons_sit(self, request: etree._Element, ns: str) -> str:
+        kind = "CTe" if ns == CTE_NS else "MDFe"
+        chave = request.findtext(f"{{{ns}}}ch{kind}", "")
+        known = self.documents.get(chave)
+        tag = f"retConsSit{kind}"
+        if known is None:
+            return (
+                f'<{tag} xmlns="{ns}" versao="4.00"><tpAmb>2</tpAmb><verAplic>MOCK</verAplic>'
+                f"<cStat>217</cStat><xMotivo>{XMOTIVO['217']}</xMotivo><cUF>35</cUF></{tag}>"
+            )
+        cstat, n_prot = known
+        prot = (
+            f'<prot{kind} versao="4.00"><infProt><tpAmb>2</tpAmb><verAplic>MOCK</verAplic>'
+            f"<ch{kind}>{chave}</ch{kind}><dhRecbto>{self.now()}</dhRecbto><nProt>{n_prot}</nProt>"
+            f"<cStat>100</cStat><xMotivo>{XMOTIVO['100']}</xMotivo></infProt></prot{kind}>"
+        )
+        return (
+            f'<{tag} xmlns="{ns}" versao="4.00"><tpAmb>2</tpAmb><verAplic>MOCK</verAplic>'
+            f"<cStat>{cstat}</cStat><xMotivo>{XMOTIVO.get(cstat, '')}</xMotivo><cUF>35</cUF>{prot}</{tag}>"
+        )
+
+    def evento(self, request: etree._Element, ns: str) -> str:
+        kind = "CTe" if ns == CTE_NS else "MDFe"
+        chave = request.findtext(f".//{{{ns}}}ch{kind}", "")
+        tp_evento = request.findtext(f".//{{{ns}}}tpEvento", "")
+        cstat = self.draw(self.event_mix)
+        n_prot = ""
+        if cstat == "135":
+            n_prot = f"1{self.next_number():014d}"
+            if tp_evento == "110111" and chave in self.documents:
+                self.documents[chave] = ("101", self.documents[chave][1])
+        n_prot_xml = f"<nProt>{n_prot}</nProt>" if n_prot else ""
+        return (
+            f'<retEvento{kind} xmlns="{ns}" versao="4.00"><infEvento><tpAmb>2</tpAmb><verAplic>MOCK</verAplic>'
+            f"<cOrgao>35</cOrgao><cStat>{cstat}</cStat><xMotivo>{XMOTIVO.get(cstat, 'Rejeição: simulada')}</xMotivo>"
+            f"<ch{kind}>{chave}</ch{kind}><tpEvento>{tp_evento}</tpEvento><nSeqEvento>1</nSeqEvento>"
+            f"<dhRegEvento>{self.now()}</dhRegEvento>{n_prot_xml}</infEvento></retEvento{kind}>"
+        )
+
+    def status(self, ns: str) -> str:
+        tag = "retConsStatServCte" if ns == CTE_NS else "retConsStatServMDFe"
+        return (
+            f'<{tag} xmlns="{ns}" versao="4.00"><tpAmb>2</tpAmb><verAplic>MOCK</verAplic>'
+            f"<cStat>107</cStat><xMotivo>{XMOTIVO['107']}</xMotivo><cUF>35</cUF>"
+            f"<dhRecbto>{self.now()}</dhRecbto><tMed>1</tMed></{tag}>"
+        )
+
+    def mdfe(self, request: etree._Element) -> str:
+        chaves = [el.get("Id", "")[4:] for el in request.iter(f"{{{MDFE_NS}}}infMDFe")]
+        cstat = self.draw(self.mdfe_mix, exclude=("103", "105"))
+        head = f'<retMDFe xmlns="{MDFE_NS}" versao="3.00"><tpAmb>2</tpAmb><cUF>35</cUF><verAplic>MOCK</verAplic>'
+        if cstat in LOTE_LEVEL:
+            return f"{head}<cStat>{cstat}</cStat><xMotivo>{XMOTIVO[cstat]}</xMotivo></retMDFe>"
+        chave = chaves[0] if chaves else ""
+        known = self.documents.get(chave)
+        if known and known[0] == "100":
+            cstat = "204"
+        return f"{head}<cStat>{cstat}</cStat><xMotivo>{XMOTIVO.get(cstat, '')}</xMotivo>{self.prot('protMDFe', chave, cstat)}</retMDFe>"
+
+    def dispatch(self, body: bytes) -> tuple[str, str]:
+        """Devolve (serviço, XML de retorno) para o conteúdo do soap:Body."""
+        envelope = etree.fromstring(body)
+        soap_body = envelope.find(f"{{{SOAP_NS}}}Body")
+        request = next(el for el in (soap_body if soap_body is not None else envelope) if isinstance(el.tag, str))
+        name = etree.QName(request).localname
+        handlers = {
+            "enviCTe": ("cteAutorizacao", lambda: self.envi_cte(request)),
+            "consReciCTe": ("cteRetAutorizacao", lambda: self.cons_reci_cte(request)),
+            "consSitCTe": ("cteConsulta", lambda: self.cons_sit(request, CTE_NS)),
+            "eventoCTe": ("cteEvento", lambda: self.evento(request, CTE_NS)),
+            "consStatServCTe": ("cteStatus", lambda: self.status(CTE_NS)),
+            "MDFe": ("mdfeAutorizacao", lambda: self.mdfe(request)),
+            "consSitMDFe": ("mdfeConsulta", lambda: self.cons_sit(request, MDFE_NS)),
+            "eventoMDFe": ("mdfeEvento", lambda: self.evento(request, MDFE_NS)),
+            "consStatServMDFe": ("mdfeStatus", lambda: self.status(MDFE_NS)),
+        }
+        if name not in handlers:
+            raise ValueError(f"Operação não suportada pelo mock: {name}")
+        service, handler = handlers[name]
+        return service, handler()
+
+    # ── HTTP ────────────────────────────────────────────────────
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        body = await request.read()
+        try:
+            service, result = self.dispatch(body)
+        except Exception as e:
+            self.stats["erro_requisicao"] += 1
+            return web.Response(status=400, text=str(e))
+        self.stats[f"{service}.requisicoes"] += 1
+
+        roll = random.random()
+        args = self.args
+        if roll < args.fail_reset:
+            self.stats[f"{service}.falha_reset"] += 1
+            request.transport.close()
+            return web.Response(status=500)
+        roll -= args.fail_reset
+        if roll < args.fail_503:
+            self.stats[f"{service}.falha_503"] += 1
+            return web.Response(status=503, text="Service Unavailable")
+        roll -= args.fail_503
+        if roll < args.fail_timeout:
+            self.stats[f"{service}.falha_timeout"] += 1
+            await asyncio.sleep(args.timeout_seconds)
+        roll -= args.fail_timeout
+
+        await asyncio.sleep(self.latency.get(service, self.latency["default"])())
+
+        envelope = (
+            f'<?xml version="1.0" encoding="utf-8"?><soap:Envelope xmlns:soap="{SOAP_NS}"><soap:Body>'
+            f"<{service}Result>{result}</{service}Result></soap:Body></soap:Envelope>"
+        )
+        if roll < args.fail_malformed:
+            self.stats[f"{service}.falha_malformado"] += 1
+            envelope = envelope[: len(envelope) // 2]
+        else:
+            cstat = etree.fromstring(result.encode("utf-8")).findtext(".//{*}cStat")
+            self.stats[f"{service}.cStat_{cstat}"] += 1
+        return web.Response(body=envelope.encode("utf-8"), content_type="application/soap+xml", charset="utf-8")
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "uptime_s": round(time.time() - self.started, 1),
+            "documentos": len(self.documents),
+            "recibos_pendentes": len(self.receipts),
+            "contadores": dict(sorted(self.stats.items())),
+        })
+
+
+# ── Certificados ─────────────────────────────────────────────────
+
+def ensure_certs(certs_dir: Path, hostnames: list[str]) -> Path:
+    """Gera AC, certificado do servidor e client.pfx na primeira execução."""
+    if (certs_dir / "server.pem").exists():
+        return certs_dir
+    certs_dir.mkdir(parents=True, exist_ok=True)
+    ca = make_ca("AC MOCK SEFAZ")
+    server_key, server_cert = make_server_cert(ca, hostnames)
+    pem = serialization.Encoding.PEM
+    key_format = (serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    (certs_dir / "ca.pem").write_bytes(ca[1].public_bytes(pem))
+    (certs_dir / "ca.key").write_bytes(ca[0].private_bytes(pem, *key_format))
+    (certs_dir / "server.pem").write_bytes(server_cert.public_bytes(pem))
+    (certs_dir / "server.key").write_bytes(server_key.private_bytes(pem, *key_format))
+    (certs_dir / "client.pfx").write_bytes(make_pfx(ca=ca))
+    return certs_dir
+
+
+def server_ssl_context(certs_dir: Path, client_auth: str, client_cas: list[str]) -> ssl.SSLContext:
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certs_dir / "server.pem", certs_dir / "server.key")
+    context.verify_mode = {
+        "required": ssl.CERT_REQUIRED, "optional": ssl.CERT_OPTIONAL, "none": ssl.CERT_NONE,
+    }[client_auth]
+    if client_auth != "none":
+        context.load_verify_locations(certs_dir / "ca.pem")
+        for path in client_cas:
+            context.load_verify_locations(path)
+    return context
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--stats-port", type=int, default=8444)
+    parser.add_argument("--certs-dir", default=str(Path(__file__).resolve().parent / "mock-certs"))
+    parser.add_argument("--hostnames", nargs="+", default=["localhost", "127.0.0.1"])
+    parser.add_argument("--client-auth", choices=("required", "optional", "none"), default="required")
+    parser.add_argument("--client-ca", action="append", default=[], help="AC adicional aceita para o certificado cliente")
+    parser.add_argument("--latency", action="append", default=[], help="[serviço=]distribuição em ms")
+    parser.add_argument("--processing-delay", default="uniform:500:3000", help="tempo até um lote 103 processar (ms)")
+    parser.add_argument("--emit-mix", default="100=100")
+    parser.add_argument("--mdfe-mix", default="100=100")
+    parser.add_argument("--event-mix", default="135=100")
+    parser.add_argument("--fail-503", type=float, default=0.0)
+    parser.add_argument("--fail-timeout", type=float, default=0.0)
+    parser.add_argument("--fail-reset", type=float, default=0.0)
+    parser.add_argument("--fail-malformed", type=float, default=0.0)
+    parser.add_argument("--timeout-seconds", type=float, default=120.0)
+    parser.add_argument("--max-documents", type=int, default=1_000_000, help="chaves lembradas para consulta/duplicidade")
+    args = parser.parse_args()
+
+    certs_dir = ensure_certs(Path(args.certs_dir), args.hostnames)
+    mock = MockSefaz(args)
+
+    async def run():
+        soap_app = web.Application(client_max_size=64 * 1024 * 1024)
+        soap_app.router.add_post("/{tail:.*}", mock.handle)
+        stats_app = web.Application()
+        stats_app.router.add_get("/stats", mock.handle_stats)
+
+        runners = [web.AppRunner(soap_app, access_log=None), web.AppRunner(stats_app, access_log=None)]
+        for runner in runners:
+            await runner.setup()
+        await web.TCPSite(
+            runners[0], args.host, args.port,
+            ssl_context=server_ssl_context(certs_dir, args.client_auth, args.client_ca),
+        ).start()
+        await web.TCPSite(runners[1], args.host, args.stats_port).start()
+
+        print(f"Mock SEFAZ em https://{args.hostnames[0]}:{args.port} (stats: http://{args.host}:{args.stats_port}/stats)")
+        print(f"  REQUESTS_CA_BUNDLE={certs_dir / 'ca.pem'}")
+        print(f"  SEFAZ_URL_OVERRIDE=https://{args.hostnames[0]}:{args.port}")
+        print(f"  certificado cliente: {certs_dir / 'client.pfx'} (senha {PFX_PASSWORD.decode()})")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+Micro-benchmarks dos caminhos quentes do app.py (offline, dados sintéticos).
+
+Cobre: construção do InMemoryCert, sign_xml (CT-e/MDF-e), validate_cte_xsd,
+build_cte_lote_xml + build_soap_envelope e extract_sefaz_response, com
+documentos de 1, 50 e 500 referências infNFe e PFX gerados na hora. Para cada
+caso mede vazão (ops/s), latência p50/p99 e pico de memória Python
+(tracemalloc — alocações internas do libxml2/OpenSSL não entram).
+
+Os resultados vão para JSON (bench/results/<commit>.json por padrão); com
+--compare, imprime a variação de p50 contra um JSON anterior.
+
+Sem os XSD oficiais em XSD_DIR, a validação usa um schema estrutural inferido
+dos próprios documentos sintéticos (mesmo custo de percorrer/validar a árvore,
+sem as restrições de tipo do schema oficial). O JSON registra qual foi usado.
+
+Executar (a partir de xml-signer/):
+  python bench/run_bench.py
+  python bench/run_bench.py --sizes 1 50 --filter sign_xml
+  python bench/run_bench.py --compare bench/results/abc1234.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+
+from lxml import etree  # noqa: E402
+
+from bench.fixtures import PFX_PASSWORD, cte_xml, make_pfx, mdfe_xml  # noqa: E402
+
+XS = "http://www.w3.org/2001/XMLSchema"
+
+
+# ── Schema inferido ──────────────────────────────────────────────
+
+def infer_xsd(sample_xml: str) -> bytes:
+    """
+    Gera um XSD estrutural a partir de um documento de exemplo: cada elemento
+    vira um complexType com a sequência dos filhos (repetidos = unbounded) e
+    atributos xs:string; folhas viram xs:string.
+    """
+    sample = etree.fromstring(sample_xml.encode("utf-8"))
+    target_ns = etree.QName(sample).namespace
+
+    schema = etree.Element(
+        f"{{{XS}}}schema", nsmap={"xs": XS},
+        targetNamespace=target_ns, elementFormDefault="qualified",
+    )
+
+    def declare(parent: etree._Element, node: etree._Element, repeated: bool):
+        decl = etree.SubElement(parent, f"{{{XS}}}element", name=etree.QName(node).localname)
+        if repeated:
+            decl.set("maxOccurs", "unbounded")
+        children = [c for c in node if isinstance(c.tag, str)]
+        if not children and not node.attrib:
+            decl.set("type", "xs:string")
+            return
+        complex_type = etree.SubElement(decl, f"{{{XS}}}complexType")
+        if children:
+            sequence = etree.SubElement(complex_type, f"{{{XS}}}sequence")
+            i = 0
+            while i < len(children):
+                j = i
+                while j + 1 < len(children) and children[j + 1].tag == children[i].tag:
+                    j += 1
+                declare(sequence, children[i], repeated=j > i)
+                i = j + 1
+        for name in node.attrib:
+            if not name.startswith("{"):
+                etree.SubElement(complex_type, f"{{{XS}}}attribute", name=name, type="xs:string")
+
+    declare(schema, sample, repeated=False)
+    return etree.tostring(schema, xml_declaration=True, encoding="UTF-8")
+
+
+def prepare_xsd_dir() -> str:
+    """Usa XSD_DIR se tiver os schemas oficiais; senão gera os inferidos num diretório temporário."""
+    xsd_dir = Path(os.environ.get("XSD_DIR", "/app/xsd"))
+    if (xsd_dir / "cte_v4.00.xsd").exists():
+        return "oficial"
+    tmp = Path(tempfile.mkdtemp(prefix="bench-xsd-"))
+    (tmp / "cte_v4.00.xsd").write_bytes(infer_xsd(cte_xml(2)))
+    (tmp / "mdfe_v3.00.xsd").write_bytes(infer_xsd(mdfe_xml(2)))
+    os.environ["XSD_DIR"] = str(tmp)
+    return "inferido"
+
+
+XSD_SOURCE = prepare_xsd_dir()
+os.environ.setdefault("JOBS_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="bench-jobs-"), "jobs.sqlite3"))
+
+import logging  # noqa: E402
+
+import app  # noqa: E402
+import signer  # noqa: E402
+from bench.bench_extract import _body, consulta_response, lote_response  # noqa: E402
+
+logging.disable(logging.WARNING)
+
+
+# ── Casos ────────────────────────────────────────────────────────
+
+class Case:
+    def __init__(self, name: str, size: int | None, func: Callable[[], object]):
+        self.name = name
+        self.size = size
+        self.func = func
+
+    @property
+    def label(self) -> str:
+        return self.name if self.size is None else f"{self.name}[{self.size}]"
+
+
+def build_cases(sizes: list[int]) -> list[Case]:
+    pfx = make_pfx()
+    cert = app.InMemoryCert(pfx, PFX_PASSWORD)
+    cte_action = "http://www.portalfiscal.inf.br/cte/wsdl/CTeRecepcaoSinc/cteRecepcaoLote"
+
+    cases = [Case("InMemoryCert", None, lambda: app.InMemoryCert(pfx, PFX_PASSWORD))]
+    for n in sizes:
+        cte, mdfe = cte_xml(n), mdfe_xml(n)
+        signed = app.sign_xml(cte, cert, "cte", "bench")
+        lote_body, consulta_body = _body(lote_response(n)), _body(consulta_response(n))
+
+        cases += [
+            Case("sign_xml.cte", n, lambda x=cte: app.sign_xml(x, cert, "cte", "bench")),
+            Case("sign_xml.mdfe", n, lambda x=mdfe: app.sign_xml(x, cert, "mdfe", "bench")),
+            Case("validate_cte_xsd", n, lambda x=cte: app.validate_cte_xsd(x)),
+            Case("build_soap_envelope.lote_str", n, lambda s=signed: app.build_soap_envelope(
+                app.build_cte_lote_xml(s["signed_xml"], "1"), cte_action,
+            )),
+            Case("build_soap_envelope.lote_bytes", n, lambda s=signed: app.build_soap_envelope(
+                app.build_cte_lote_bytes(s["signed_bytes"], "1"), cte_action,
+            )),
+            Case("extract_sefaz_response.lote", n, lambda b=lote_body: app.extract_sefaz_protocols(b, "cte")),
+            Case("extract_sefaz_response.consulta", n, lambda b=consulta_body: app.extract_sefaz_response(b, "cte")),
+        ]
+    return cases
+
+
+# ── Medição ──────────────────────────────────────────────────────
+
+def _percentile(sorted_values: list[float], pct: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def measure(case: Case, min_iterations: int, min_seconds: float) -> dict:
+    for _ in range(3):
+        case.func()
+
+    samples: list[float] = []
+    started = time.perf_counter()
+    while len(samples) < min_iterations or time.perf_counter() - started < min_seconds:
+        t0 = time.perf_counter_ns()
+        case.func()
+        samples.append((time.perf_counter_ns() - t0) / 1e6)
+
+    tracemalloc.start()
+    case.func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    samples.sort()
+    mean = sum(samples) / len(samples)
+    return {
+        "name": case.name,
+        "size": case.size,
+        "iterations": len(samples),
+        "ops_per_s": round(1000 / mean, 1),
+        "mean_ms": round(mean, 4),
+        "p50_ms": round(_percentile(samples, 50), 4),
+        "p99_ms": round(_percentile(samples, 99), 4),
+        "peak_mem_kib": round(peak / 1024, 1),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconhecido"
+
+
+def compare(results: list[dict], baseline_path: str):
+    baseline = json.loads(Path(baseline_path).read_text())
+    previous = {(r["name"], r["size"]): r for r in baseline["results"]}
+    print(f"\nComparação com {baseline['meta']['commit']} ({baseline_path}):")
+    print(f"{'caso':<40} {'p50 antes':>10} {'p50 agora':>10} {'variação':>9}")
+    for r in results:
+        old = previous.get((r["name"], r["size"]))
+        if old is None:
+            continue
+        delta = (r["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100 if old["p50_ms"] else 0.0
+        label = r["name"] if r["size"] is None else f"{r['name']}[{r['size']}]"
+        print(f"{label:<40} {old['p50_ms']:>10.3f} {r['p50_ms']:>10.3f} {delta:>+8.1f}%")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 50, 500], help="referências infNFe por documento")
+    parser.add_argument("--filter", default="", help="roda só os casos cujo nome contém o texto")
+    parser.add_argument("--min-iterations", type=int, default=30)
+    parser.add_argument("--min-seconds", type=float, default=1.0, help="tempo mínimo de medição por caso")
+    parser.add_argument("--output", help="arquivo JSON de saída (padrão: bench/results/<commit>.json)")
+    parser.add_argument("--compare", help="JSON de uma execução anterior para comparar")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    cases = [c for c in build_cases(args.sizes) if args.filter in c.label]
+
+    print(f"{'caso':<40} {'ops/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'pico KiB':>9}")
+    results = []
+    for case in cases:
+        r = measure(case, args.min_iterations, args.min_seconds)
+        results.append(r)
+        print(f"{case.label:<40} {r['ops_per_s']:>10.1f} {r['p50_ms']:>9.3f} {r['p99_ms']:>9.3f} {r['peak_mem_kib']:>9.1f}")
+
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "lxml": ".".join(map(str, etree.LXML_VERSION)),
+            "libxml2": ".".join(map(str, etree.LIBXML_VERSION)),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "signer_backend": signer.SIGNER_BACKEND,
+            "xsd": XSD_SOURCE,
+            "sizes": args.sizes,
+        },
+        "results": results,
+    }
+    output = Path(args.output) if args.output else BENCH_DIR / "results" / f"{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n")
+    print(f"\nResultados em {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""
+Cache de resultados de consulta (/cte/consult, /mdfe/consult) por (ambiente, chave).
+
+Situações finais (autorizado, cancelado, denegado, encerrado) ficam guardadas
+sem prazo de validade; as demais (217 "não consta", rejeições como a 656 de
+consumo indevido) valem por `transient_ttl` segundos — o bastante para
+absorver consultas repetidas da mesma chave sem martelar a SEFAZ. A memória é
+limitada a `max_entries` (LRU).
+
+"Autorizado" (100/150) ainda pode virar cancelado/encerrado, mas só por
+evento: os eventos enviados por este serviço atualizam o cache (app.py); para
+eventos registrados por fora, o cliente consulta com force_refresh. Como o
+evento passa por um worker só, "autorizado" não fica na memória sem prazo:
+com `db_path` é sempre lido do SQLite (onde o worker do evento já gravou o
+cancelamento ou apagou a entrada); sem `db_path` vale por `transient_ttl` na
+memória de cada worker.
+
+Com `db_path`, as situações finais também vão para um SQLite compartilhado
+pelos workers: sobrevivem a restart e um worker aproveita o que outro já
+consultou ou emitiu.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# cStat de consulta que não mudam mais (ou só mudam por eventos que passam por este serviço)
+TERMINAL_CSTATS = frozenset(("100", "101", "110", "132", "150", "151", "155"))
+# ...dos quais "autorizado", que um evento de outro worker ainda pode mudar
+MUTABLE_CSTATS = frozenset(("100", "150"))
+
+# Campos de extract_sefaz_response guardados (o resto é da operação, não da chave)
+CONSULT_FIELDS = (
+    "success", "cStat", "cStat_lote", "xMotivo", "xMotivo_lote", "chave_acesso", "protocolo",
+    "nRec", "data_autorizacao", "xml_autorizado", "status_detail", "motivo_rejeicao",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS consult_cache (
+    key TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    cached_at REAL NOT NULL
+);
+"""
+
+
+class ConsultCache:
+    def __init__(self, max_entries: int, transient_ttl: float, db_path: str = ""):
+        self.max_entries = max_entries
+        self.transient_ttl = transient_ttl
+        self.db_path = db_path
+        # chave -> (resultado, cached_at, expires_at | None)
+        self._entries: OrderedDict[str, tuple[dict, float, float | None]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def _key(ambiente: str, chave: str) -> str:
+        return f"{ambiente}:{chave}"
+
+    def _conn(self) -> sqlite3.Connection:
+        """Uma conexão por thread (sqlite3 não compartilha conexões entre threads)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    # ── API ──────────────────────────────────────────────────────
+
+    def get(self, ambiente: str, chave: str) -> dict | None:
+        """Resultado guardado (cópia, com cached/cached_at) ou None."""
+        if not self.enabled:
+            return None
+        key = self._key(ambiente, chave)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[2] is None or now < entry[2]):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._response(entry)
+            if entry is not None:
+                del self._entries[key]
+
+        entry = self._load(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            if entry[0].get("cStat") not in MUTABLE_CSTATS:
+                self._remember(key, entry)
+        return self._response(entry)
+
+    def put(self, ambiente: str, chave: str, result: dict):
+        """Guarda o resultado de uma consulta: final sem prazo, demais por transient_ttl."""
+        cstat = result.get("cStat", "")
+        if not self.enabled or not chave or not cstat or result.get("status_detail") == "servico_indisponivel":
+            return
+        if cstat in TERMINAL_CSTATS:
+            self.put_final(ambiente, chave, result)
+            return
+        now = time.time()
+        with self._lock:
+            self._remember(self._key(ambiente, chave), (self._slim(result), now, now + self.transient_ttl))
+
+    def put_final(self, ambiente: str, chave: str, result: dict):
+        """Guarda uma situação final (de consulta, emissão ou evento); outros cStat são ignorados."""
+        if not self.enabled or not chave or result.get("cStat") not in TERMINAL_CSTATS:
+            return
+        key = self._key(ambiente, chave)
+        now = time.time()
+        mutable = result["cStat"] in MUTABLE_CSTATS
+        entry = (self._slim(result), now, now + self.transient_ttl if mutable else None)
+        with self._lock:
+            if mutable and self.db_path:
+                # Lido sempre do SQLite: um cancelamento em outro worker vale já
+                self._entries.pop(key, None)
+            else:
+                self._remember(key, entry)
+        if self.db_path:
+            try:
+                self._conn().execute(
+                    "INSERT OR REPLACE INTO consult_cache (key, result, cached_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(entry[0]), entry[1]),
+                )
+            except sqlite3.Error as e:
+                logger.warning(f"[CONSULT CACHE] Falha ao gravar {key}: {e}")
+
+    def discard(self, ambiente: str, chave: str):
+        """Esquece a chave (memória e disco) — a próxima consulta vai à SEFAZ."""
+        if not self.enabled:
+            return
+        key = self._key(ambiente, chave)
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.db_path:
+            try:
+                self._conn().execute("DELETE FROM consult_cache WHERE key = ?", (key,))
+            except sqlite3.Error as e:
+                logger.warning(f"[CONSULT CACHE] Falha ao remover {key}: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "transient_ttl": self.transient_ttl,
+                "persistent": bool(self.db_path),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+    # ── Interno ──────────────────────────────────────────────────
+
+    @staticmethod
+    def _slim(result: dict) -> dict:
+        return {field: result[field] for field in CONSULT_FIELDS if field in result}
+
+    @staticmethod
+    def _response(entry: tuple[dict, float, float | None]) -> dict:
+        result, cached_at, _ = entry
+        return dict(
+            result, cached=True,
+            cached_at=time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(cached_at)),
+        )
+
+    def _remember(self, key: str, entry: tuple[dict, float, float | None]):
+        """Insere na LRU de memória (chamar com lock)."""
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load(self, key: str) -> tuple[dict, float, None] | None:
+        if not self.db_path:
+            return None
+        try:
+            row = self._conn().execute(
+                "SELECT result, cached_at FROM consult_cache WHERE key = ?", (key,),
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"[CONSULT CACHE] Falha ao ler {key}: {e}")
+            return None
+        return (json.loads(row[0]), row[1], None) if row else None
@@ -0,0 +1,47 @@
+"""
+Configuração do gunicorn.
+
+SERVE_MODE=sync    (padrão) — workers síncronos Flask (app:app), uma requisição por worker
+SERVE_MODE=gthread — workers Flask com GUNICORN_THREADS threads cada: várias
+                     chamadas SEFAZ em andamento por worker, limitadas por
+                     webservice (SEFAZ_ENDPOINT_CONCURRENCY/SEFAZ_ENDPOINT_QUEUE)
+SERVE_MODE=async   — workers aiohttp (async_app:app), chamadas SEFAZ assíncronas
+
+As métricas Prometheus usam o modo multiprocesso do prometheus_client: os
+workers herdam PROMETHEUS_MULTIPROC_DIR do master, que limpa o diretório ao
+subir e descarta os valores "ao vivo" de cada worker que termina.
+"""
+
+import glob
+import os
+
+bind = "0.0.0.0:8080"
+workers = int(os.environ.get("GUNICORN_WORKERS", "2"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+
+serve_mode = os.environ.get("SERVE_MODE", "sync")
+if serve_mode == "async":
+    wsgi_app = "async_app:app"
+    worker_class = "aiohttp.GunicornWebWorker"
+else:
+    wsgi_app = "app:app"
+    if serve_mode == "gthread":
+        worker_class = "gthread"
+        threads = int(os.environ.get("GUNICORN_THREADS", "16"))
+
+# Definido antes do fork: os workers importam o prometheus_client já em modo multiprocesso
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus-metrics")
+
+
+def on_starting(server):
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(metrics_dir, exist_ok=True)
+    # Arquivos de uma execução anterior somariam valores de processos que não existem mais
+    for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+        os.remove(path)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
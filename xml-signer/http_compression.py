@@ -0,0 +1,123 @@
+"""
+Compressão dos corpos HTTP da API do próprio serviço (não da SEFAZ).
+
+Requisições com `Content-Encoding: gzip` ou `zstd` são descompactadas com
+limite de tamanho (proteção contra "zip bombs"); respostas são compactadas
+conforme o `Accept-Encoding` do cliente, em blocos, sem montar o corpo
+compactado inteiro na memória. zstd depende do pacote opcional `zstandard`;
+sem ele, só gzip é anunciado/aceito.
+"""
+
+import io
+import zlib
+from typing import Iterable, Iterator
+
+try:
+    import zstandard
+except ImportError:  # dependência opcional
+    zstandard = None
+
+# Ordem de preferência quando o cliente aceita mais de um
+ENCODINGS = ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UnsupportedEncoding(ValueError):
+    """Content-Encoding da requisição não suportado."""
+
+
+class BodyTooLarge(ValueError):
+    """Corpo descompactado acima do limite."""
+
+
+def decode_body(body: bytes, encoding: str, max_size: int) -> bytes:
+    """Descompacta o corpo da requisição; `encoding` vazio/identity devolve o corpo como está."""
+    encoding = (encoding or "identity").strip().lower()
+    if encoding == "identity":
+        data = body
+    elif encoding in ("gzip", "x-gzip"):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            data = decompressor.decompress(body, max_size + 1)
+        except zlib.error as e:
+            raise ValueError(f"Corpo gzip inválido: {e}")
+        if len(data) <= max_size and not decompressor.eof:
+            raise ValueError("Corpo gzip truncado")
+    elif encoding == "zstd" and zstandard is not None:
+        try:
+            with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body)) as reader:
+                data = reader.read(max_size + 1)
+        except zstandard.ZstdError as e:
+            raise ValueError(f"Corpo zstd inválido: {e}")
+    else:
+        raise UnsupportedEncoding(f"Content-Encoding não suportado: {encoding} (aceitos: {', '.join(ENCODINGS)})")
+    if len(data) > max_size:
+        raise BodyTooLarge(f"Corpo da requisição acima de {max_size} bytes")
+    return data
+
+
+def negotiate(accept_encoding: str) -> str | None:
+    """Melhor codificação de ENCODINGS aceita pelo cliente (q > 0), ou None (sem compressão)."""
+    weights: dict[str, float] = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name] = q
+
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class Compressor:
+    """Compressão incremental: compress() por bloco, flush() entrega o que já entrou, finish() fecha."""
+
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+            self._flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            self._obj = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._flush_mode = zlib.Z_SYNC_FLUSH
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data)
+
+    def flush(self) -> bytes:
+        return self._obj.flush(self._flush_mode)
+
+    def finish(self) -> bytes:
+        return self._obj.flush()
+
+
+def iter_compressed(chunks: Iterable[bytes], compressor: Compressor, flush_each: bool = False) -> Iterator[bytes]:
+    """
+    Compacta `chunks` em blocos de até CHUNK_SIZE. Com `flush_each` (respostas
+    em streaming, ex.: NDJSON), cada bloco recebido sai imediatamente.
+    """
+    for chunk in chunks:
+        view = memoryview(chunk)
+        for start in range(0, len(view), CHUNK_SIZE):
+            out = compressor.compress(view[start:start + CHUNK_SIZE])
+            if out:
+                yield out
+        if flush_each:
+            out = compressor.flush()
+            if out:
+                yield out
+    yield compressor.finish()
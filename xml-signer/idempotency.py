@@ -0,0 +1,255 @@
+"""
+Idempotência e coalescência (single-flight) de emissões e eventos.
+
+Cada requisição idempotente tem uma chave. begin() devolve um Claim:
+  - "replay": a chave terminou há menos de `ttl` segundos — devolve o resultado guardado
+  - "wait":   a chave está em andamento — `future` resolve com o resultado do
+              líder (None se ele falhou: o chamador tenta de novo)
+  - "leader": este chamador executa a operação e depois chama finish()
+
+Sem `db_path`, vale dentro do processo. Com `db_path` (SQLite compartilhado),
+workers e réplicas coalescem entre si: o líder grava uma reserva com lease de
+`lease` segundos e os demais aguardam o resultado — uma única thread consulta
+o banco por todas as chaves reservadas por outro processo. Reserva com lease
+vencido (processo morto) é assumida pelo próximo chamador.
+"""
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    state TEXT NOT NULL,          -- running | done
+    owner TEXT NOT NULL,
+    result TEXT,
+    expires_at REAL NOT NULL      -- running: fim do lease; done: fim do replay
+);
+"""
+
+POLL_INTERVAL = 0.2
+MAX_ENTRIES = 10_000
+
+
+class IdempotencyConflict(Exception):
+    """Mesma chave de idempotência com conteúdo diferente."""
+
+
+class Claim(NamedTuple):
+    role: str  # leader | wait | replay
+    result: dict | None = None
+    future: Future | None = None
+
+
+class IdempotencyStore:
+    def __init__(self, ttl: float, lease: float, db_path: str = ""):
+        self.ttl = ttl
+        self.lease = lease
+        self.db_path = db_path
+        # chave -> (fingerprint, future) das execuções deste processo
+        self._inflight: dict[str, tuple[str, Future]] = {}
+        # chave -> (fingerprint, future) reservadas por outro processo (db_path)
+        self._remote: dict[str, tuple[str, Future]] = {}
+        # chave -> (fingerprint, resultado, expira_em); TTL único = ordem de expiração
+        self._done: OrderedDict[str, tuple[str, dict, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._poller: threading.Thread | None = None
+        self._last_cleanup = 0.0
+        self.replays = 0
+        self.coalesced = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    @property
+    def owner(self) -> str:
+        # Calculado a cada uso: o processo pode ter sido criado por fork depois do import
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def _conn(self) -> sqlite3.Connection:
+        """Uma conexão por thread (sqlite3 não compartilha conexões entre threads)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    # ── API ──────────────────────────────────────────────────────
+
+    def begin(self, key: str, fingerprint: str) -> Claim:
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            done = self._done.get(key)
+            if done is not None:
+                self._check(key, done[0], fingerprint)
+                self.replays += 1
+                return Claim("replay", result=done[1])
+            running = self._inflight.get(key) or self._remote.get(key)
+            if running is not None:
+                self._check(key, running[0], fingerprint)
+                self.coalesced += 1
+                return Claim("wait", future=running[1])
+
+            if self.db_path:
+                claim = self._claim_db(key, fingerprint, now)
+                if claim is not None:
+                    return claim
+
+            future = Future()
+            self._inflight[key] = (fingerprint, future)
+            return Claim("leader", future=future)
+
+    def finish(self, key: str, fingerprint: str, result: dict | None, store: bool = True):
+        """
+        Encerra a execução do líder. `result` vai para quem aguarda; com `store`,
+        também fica para replay por `ttl` segundos. result=None (falhou) libera a chave.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._inflight.pop(key, None)
+            keep = result is not None and store
+            if keep:
+                self._done[key] = (fingerprint, result, now + self.ttl)
+                self._done.move_to_end(key)
+                self._purge(now)
+
+        if self.db_path:
+            try:
+                conn = self._conn()
+                if keep:
+                    conn.execute(
+                        "UPDATE idempotency SET state = 'done', result = ?, expires_at = ? WHERE key = ? AND owner = ?",
+                        (json.dumps(result), now + self.ttl, key, self.owner),
+                    )
+                else:
+                    conn.execute("DELETE FROM idempotency WHERE key = ? AND owner = ?", (key, self.owner))
+                if now - self._last_cleanup > 60:
+                    self._last_cleanup = now
+                    conn.execute("DELETE FROM idempotency WHERE expires_at < ?", (now,))
+            except sqlite3.Error as e:
+                logger.warning(f"[IDEMPOTENCY] Falha ao gravar {key}: {e}")
+
+        if entry is not None:
+            entry[1].set_result(result)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "ttl": self.ttl,
+                "shared": bool(self.db_path),
+                "in_flight": len(self._inflight),
+                "waiting_remote": len(self._remote),
+                "stored": len(self._done),
+                "replays": self.replays,
+                "coalesced": self.coalesced,
+            }
+
+    # ── Interno ──────────────────────────────────────────────────
+
+    @staticmethod
+    def _check(key: str, stored: str, fingerprint: str):
+        if stored != fingerprint:
+            raise IdempotencyConflict(f"Chave de idempotência {key} já usada com outro conteúdo")
+
+    def _purge(self, now: float):
+        """Descarta resultados expirados e o excesso (chamar com lock)."""
+        while self._done:
+            key, (_, _, expires_at) = next(iter(self._done.items()))
+            if expires_at > now and len(self._done) <= MAX_ENTRIES:
+                break
+            del self._done[key]
+
+    def _claim_db(self, key: str, fingerprint: str, now: float) -> Claim | None:
+        """Reserva a chave no banco; devolve replay/wait se outro processo já a tem (chamar com lock)."""
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT fingerprint, state, owner, result, expires_at FROM idempotency WHERE key = ?", (key,),
+                ).fetchone()
+                if row is not None and row[4] > now:
+                    self._check(key, row[0], fingerprint)
+                    if row[1] == "done":
+                        result = json.loads(row[3])
+                        self._done[key] = (fingerprint, result, row[4])
+                        self.replays += 1
+                        return Claim("replay", result=result)
+                    if row[2] != self.owner:
+                        future = Future()
+                        self._remote[key] = (fingerprint, future)
+                        self._ensure_poller()
+                        self.coalesced += 1
+                        return Claim("wait", future=future)
+                conn.execute(
+                    "INSERT OR REPLACE INTO idempotency (key, fingerprint, state, owner, result, expires_at) "
+                    "VALUES (?, ?, 'running', ?, NULL, ?)",
+                    (key, fingerprint, self.owner, now + self.lease),
+                )
+            finally:
+                conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            # Banco indisponível: segue só com a coalescência local
+            logger.warning(f"[IDEMPOTENCY] Falha ao reservar {key}: {e}")
+        return None
+
+    def _ensure_poller(self):
+        if self._poller is None or not self._poller.is_alive():
+            self._poller = threading.Thread(target=self._poll_remote, daemon=True, name="idempotency-poller")
+            self._poller.start()
+
+    def _poll_remote(self):
+        """Resolve as esperas por chaves de outros processos quando o líder termina ou some."""
+        while True:
+            time.sleep(POLL_INTERVAL)
+            with self._lock:
+                keys = list(self._remote)
+            if not keys:
+                continue
+            now = time.time()
+            try:
+                conn = self._conn()
+                rows = {
+                    row[0]: row for row in conn.execute(
+                        f"SELECT key, state, result, expires_at FROM idempotency WHERE key IN ({','.join('?' * len(keys))})",
+                        keys,
+                    )
+                }
+            except sqlite3.Error as e:
+                logger.warning(f"[IDEMPOTENCY] Falha ao consultar reservas: {e}")
+                continue
+
+            resolved = []
+            with self._lock:
+                for key in keys:
+                    row = rows.get(key)
+                    if row is not None and row[1] == "done":
+                        result = json.loads(row[2])
+                        fingerprint = self._remote[key][0]
+                        self._done[key] = (fingerprint, result, row[3])
+                    elif row is None or row[3] <= now:
+                        result = None  # líder falhou ou morreu: quem aguarda tenta de novo
+                    else:
+                        continue
+                    resolved.append((self._remote.pop(key)[1], result))
+            for future, result in resolved:
+                future.set_result(result)
@@ -0,0 +1,360 @@
+"""
+Fila de jobs persistente (SQLite) com pool de workers e faixas de prioridade.
+
+Usada pelas rotas /jobs do app.py: o cliente recebe um job_id na hora e
+consulta o resultado depois (ou recebe um callback). Os jobs ficam num SQLite
+local, então um restart do worker não perde nada. Enquanto o job executa, o
+worker renova o lease a cada terço de `lease_seconds`; um job "running" cujo
+lease expirou (processo morto) volta para a fila só se a operação puder ser
+repetida (consultas);
+emissões e eventos interrompidos podem ter chegado à SEFAZ, então terminam
+como "failed" com status_detail "consultar_chave". Vários processos gunicorn
+podem compartilhar o mesmo arquivo: a reserva de um job é atômica (BEGIN
+IMMEDIATE).
+
+Os payloads levam o PFX e a senha: a fila só aceita jobs com a chave Fernet
+configurada. Callbacks só vão para hosts da allowlist, sem seguir redirects.
+
+Faixas de prioridade: priority 0 (emissões/eventos) sempre sai antes de
+priority 1 (consultas), e `reserved_high` workers só atendem a faixa 0, para
+que uma rajada de consultas nunca ocupe todos os workers.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable
+from urllib.parse import urlsplit
+
+import requests as http_requests
+from cryptography.fernet import Fernet
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0
+PRIORITY_LOW = 1
+
+# Resultado de um job interrompido (lease vencido) que não pode ser repetido
+INTERRUPTED_RESULT = {
+    "success": False,
+    "error": "Job interrompido durante a execução; a SEFAZ pode ter recebido o documento. "
+             "Consulte a chave de acesso antes de reenviar",
+    "status_detail": "consultar_chave",
+}
+
+
+class JobQueueError(Exception):
+    """Job recusado na submissão (fila sem criptografia, callback fora da allowlist)."""
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    operation TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    payload BLOB,
+    callback_url TEXT,
+    result TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (status, priority, created_at);
+"""
+
+
+class JobQueue:
+    """
+    runner(operation, payload) -> (resultado, http_status) executa o job;
+    status 200 vira "done", qualquer outro vira "failed". `resumable` são as
+    operações que podem ser repetidas depois de um lease vencido;
+    `callback_hosts` os hosts aceitos em callback_url ("*.dominio" vale para
+    os subdomínios).
+    """
+
+    def __init__(
+        self, db_path: str, runner: Callable[[str, dict], tuple[dict, int]],
+        workers: int = 4, reserved_high: int = 1, lease_seconds: float = 300,
+        max_attempts: int = 3, retention_seconds: int = 86400, encryption_key: str = "",
+        resumable: frozenset[str] = frozenset(), callback_hosts: frozenset[str] = frozenset(),
+    ):
+        self.db_path = db_path
+        self.runner = runner
+        self.workers = workers
+        self.reserved_high = min(reserved_high, workers)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self._fernet = Fernet(encryption_key) if encryption_key else None
+        self.resumable = resumable
+        self.callback_hosts = callback_hosts
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _conn(self) -> sqlite3.Connection:
+        """Uma conexão por thread (sqlite3 não compartilha conexões entre threads)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @property
+    def enabled(self) -> bool:
+        """Sem a chave Fernet a fila não aceita nem executa jobs: o PFX iria em claro para o SQLite."""
+        return self._fernet is not None
+
+    def _encode(self, payload: dict) -> bytes:
+        return self._fernet.encrypt(json.dumps(payload).encode("utf-8"))
+
+    def _decode(self, blob: bytes) -> dict:
+        return json.loads(self._fernet.decrypt(blob))
+
+    def callback_allowed(self, url: str) -> bool:
+        """callback_url http(s) para um host da allowlist (sem credenciais na URL)."""
+        try:
+            parts = urlsplit(url)
+            host = (parts.hostname or "").lower()
+        except ValueError:
+            return False
+        if parts.scheme not in ("http", "https") or not host or parts.username or parts.password:
+            return False
+        return any(
+            host == allowed or (allowed.startswith("*.") and host.endswith(allowed[1:]))
+            for allowed in self.callback_hosts
+        )
+
+    # ── API ──────────────────────────────────────────────────────
+
+    def submit(self, operation: str, payload: dict, priority: int, callback_url: str = "") -> str:
+        if not self.enabled:
+            raise JobQueueError("Fila de jobs desativada: JOBS_ENCRYPTION_KEY não configurado")
+        if callback_url and not self.callback_allowed(callback_url):
+            raise JobQueueError("callback_url fora da allowlist (JOBS_CALLBACK_HOSTS)")
+        job_id = uuid.uuid4().hex
+        self._conn().execute(
+            "INSERT INTO jobs (id, operation, priority, status, payload, callback_url, created_at) "
+            "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+            (job_id, operation, priority, self._encode(payload), callback_url or None, time.time()),
+        )
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id: str) -> dict | None:
+        row = self._conn().execute(
+            "SELECT id, operation, priority, status, result, attempts, created_at, started_at, finished_at "
+            "FROM jobs WHERE id = ?", (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        job = {
+            "job_id": row["id"],
+            "operation": row["operation"],
+            "priority": row["priority"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+        }
+        if row["result"] is not None:
+            job["result"] = json.loads(row["result"])
+        return job
+
+    def stats(self) -> dict:
+        rows = self._conn().execute(
+            "SELECT status, priority, COUNT(*) AS n FROM jobs GROUP BY status, priority"
+        ).fetchall()
+        counts: dict[str, int] = {}
+        for row in rows:
+            key = f"{row['status']}_p{row['priority']}"
+            counts[key] = counts.get(key, 0) + row["n"]
+        return {"workers": self.workers, "reserved_high": self.reserved_high, "jobs": counts}
+
+    # ── Workers ──────────────────────────────────────────────────
+
+    def start(self):
+        """Inicia os workers (idempotente)."""
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+        if not self.enabled:
+            logger.error("[JOBS] JOBS_ENCRYPTION_KEY não definido — workers de jobs não iniciados")
+            return
+        for i in range(self.workers):
+            max_priority = PRIORITY_HIGH if i < self.reserved_high else PRIORITY_LOW
+            threading.Thread(
+                target=self._worker_loop, args=(max_priority,), name=f"job-worker-{i}", daemon=True,
+            ).start()
+        logger.info(f"[JOBS] {self.workers} workers iniciados ({self.reserved_high} reservados para emissões)")
+
+    def stop(self):
+        self._stop.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def _claim(self, max_priority: int) -> sqlite3.Row | None:
+        """
+        Reserva o próximo job (fila ou lease vencido de operação repetível) de
+        forma atômica entre processos. Os demais jobs com lease vencido
+        terminam como "failed" (INTERRUPTED_RESULT).
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        now = time.time()
+        resumable = sorted(self.resumable)
+        marks = ", ".join("?" * len(resumable))
+        try:
+            interrupted = conn.execute(
+                "SELECT id, operation, callback_url, attempts FROM jobs WHERE status = 'running' AND lease_until < ? "
+                f"AND operation NOT IN ({marks})",
+                (now, *resumable),
+            ).fetchall()
+            for job in interrupted:
+                self._finish(job["id"], job["attempts"], "failed", INTERRUPTED_RESULT)
+            row = conn.execute(
+                "SELECT id, operation, payload, callback_url, attempts FROM jobs "
+                "WHERE (status = 'queued' OR (status = 'running' AND lease_until < ? AND attempts < ? "
+                f"AND operation IN ({marks}))) "
+                "AND priority <= ? ORDER BY priority, created_at LIMIT 1",
+                (now, self.max_attempts, *resumable, max_priority),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ?, lease_until = ?, "
+                    "attempts = attempts + 1 WHERE id = ?",
+                    (now, now + self.lease_seconds, row["id"]),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        for job in interrupted:
+            logger.warning(f"[JOBS] {job['id']} {job['operation']} interrompido (lease vencido) -> failed")
+            if job["callback_url"]:
+                self._send_callback(job["callback_url"], {
+                    "job_id": job["id"], "status": "failed", "result": INTERRUPTED_RESULT,
+                })
+        return row
+
+    def _finish(self, job_id: str, attempts: int, status: str, result: dict) -> bool:
+        """
+        Grava o resultado da execução `attempts`; False se ela já não é a dona
+        do job (lease perdido: outro worker o finalizou ou retomou).
+        """
+        # O payload (com o PFX) é descartado assim que o job termina
+        cursor = self._conn().execute(
+            "UPDATE jobs SET status = ?, result = ?, payload = NULL, finished_at = ?, lease_until = NULL "
+            "WHERE id = ? AND status = 'running' AND attempts = ?",
+            (status, json.dumps(result), time.time(), job_id, attempts),
+        )
+        return cursor.rowcount > 0
+
+    def _renew_lease(self, job_id: str, attempts: int) -> bool:
+        cursor = self._conn().execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running' AND attempts = ?",
+            (time.time() + self.lease_seconds, job_id, attempts),
+        )
+        return cursor.rowcount > 0
+
+    def _keep_lease(self, job_id: str, attempts: int, done: threading.Event):
+        """Renova o lease enquanto o runner executa (lotes grandes passam de lease_seconds)."""
+        while not done.wait(self.lease_seconds / 3):
+            try:
+                if not self._renew_lease(job_id, attempts):
+                    logger.warning(f"[JOBS] {job_id} perdeu o lease durante a execução")
+                    return
+            except sqlite3.Error as e:
+                logger.error(f"[JOBS] Falha ao renovar o lease de {job_id}: {e}")
+
+    def _purge_expired(self):
+        """Falha jobs que esgotaram as tentativas e remove os antigos já finalizados."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', payload = NULL, finished_at = ?, lease_until = NULL, "
+            "result = ? WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+            (now, json.dumps({"error": "Job interrompido após o máximo de tentativas", "success": False}),
+             now, self.max_attempts),
+        )
+        conn.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+            (now - self.retention_seconds,),
+        )
+
+    def _worker_loop(self, max_priority: int):
+        last_purge = 0.0
+        while not self._stop.is_set():
+            try:
+                row = self._claim(max_priority)
+                if time.time() - last_purge > 600:
+                    self._purge_expired()
+                    last_purge = time.time()
+            except sqlite3.Error as e:
+                logger.error(f"[JOBS] Erro no SQLite: {e}")
+                row = None
+
+            if row is None:
+                # Sem trabalho: dorme até um submit local ou o próximo poll
+                # (jobs enviados por outros processos só são vistos no poll)
+                with self._wakeup:
+                    self._wakeup.wait(timeout=1.0)
+                continue
+
+            self._run(row)
+
+    def _run(self, row: sqlite3.Row):
+        job_id, operation = row["id"], row["operation"]
+        # _claim incrementou attempts depois do SELECT
+        attempts = row["attempts"] + 1
+        start = time.time()
+        done = threading.Event()
+        threading.Thread(
+            target=self._keep_lease, args=(job_id, attempts, done), name=f"job-lease-{job_id}", daemon=True,
+        ).start()
+        try:
+            result, status_code = self.runner(operation, self._decode(row["payload"]))
+        except Exception as e:
+            result, status_code = {"error": str(e), "success": False}, 500
+        finally:
+            done.set()
+        status = "done" if status_code == 200 else "failed"
+        result = dict(result, http_status=status_code)
+        if not self._finish(job_id, attempts, status, result):
+            # Outro worker já deu o job como interrompido (e avisou o callback)
+            logger.warning(f"[JOBS] {job_id} {operation} -> {status} descartado: lease perdido")
+            return
+        logger.info(f"[JOBS] {job_id} {operation} -> {status} em {int((time.time() - start) * 1000)}ms")
+
+        if row["callback_url"]:
+            self._send_callback(row["callback_url"], {"job_id": job_id, "status": status, "result": result})
+
+    def _send_callback(self, url: str, body: dict):
+        if not self.callback_allowed(url):
+            # Allowlist mudou depois da submissão
+            logger.warning(f"[JOBS] Callback {url} fora da allowlist, não enviado")
+            return
+        try:
+            response = http_requests.post(url, json=body, timeout=10, allow_redirects=False)
+            if response.status_code >= 400:
+                logger.warning(f"[JOBS] Callback {url} retornou HTTP {response.status_code}")
+        except Exception as e:
+            logger.warning(f"[JOBS] Callback {url} falhou: {e}")
@@ -0,0 +1,362 @@
+"""
+Keystore de certificados A1 no servidor, indexado por CNPJ e fingerprint.
+
+Cada certificado é um arquivo `<fingerprint>.pfx.enc` em `directory`: um
+token Fernet (`key`) com o PFX e a senha. Os arquivos são carregados no
+início e mantidos em memória já decriptados (objeto de `loader`), então as
+requisições referenciam o certificado por `cert_id` (fingerprint SHA-256) ou
+`cnpj` em vez de enviar o PFX.
+
+O diretório é relido a cada `reload_interval` segundos (e na hora, quando um
+cert_id/CNPJ não é encontrado): um certificado registrado por outro worker ou
+réplica, ou copiado por fora, passa a valer sem restart. Na troca de
+certificado (renovação) basta registrar o novo: a busca por CNPJ usa o
+certificado válido que vence por último. Certificados a menos de `warn_days`
+do vencimento geram aviso no log (uma vez por dia) e aparecem em stats().
+
+Cadastro por linha de comando (a chave vem de KEYSTORE_KEY):
+  python keystore.py add /app/data/keystore empresa.pfx --password-env PFX_PASSWORD
+"""
+
+import argparse
+import base64
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.serialization import pkcs12
+from cryptography.x509 import ExtensionNotFound, NameOID, OtherName, SubjectAlternativeName
+from cryptography.x509.oid import ObjectIdentifier
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = ".pfx.enc"
+# otherName do e-CNPJ ICP-Brasil com o CNPJ do titular
+OID_ICP_CNPJ = ObjectIdentifier("2.16.76.1.3.3")
+CERT_ID_RE = re.compile(r"[0-9a-f]{64}")
+# Releitura forçada por busca sem resultado: no máximo uma por intervalo,
+# salvo se o diretório mudou (arquivo criado/removido)
+MISS_RELOAD_INTERVAL = 1.0
+
+
+class KeystoreError(Exception):
+    """Certificado não encontrado, vencido ou inválido."""
+
+
+def certificate_cnpj(certificate) -> str:
+    """CNPJ do titular: otherName ICP-Brasil (2.16.76.1.3.3) ou o sufixo "RAZAO:CNPJ" do CN."""
+    try:
+        san = certificate.extensions.get_extension_for_class(SubjectAlternativeName).value
+        for other in san.get_values_for_type(OtherName):
+            if other.type_id == OID_ICP_CNPJ:
+                digits = re.search(rb"\d{14}", other.value)
+                if digits:
+                    return digits.group().decode()
+    except ExtensionNotFound:
+        pass
+    cn = certificate.subject.get_attributes_for_oid(NameOID.COMMON_NAME)
+    name = str(cn[0].value) if cn else ""
+    digits = name.rpartition(":")[2]
+    return digits if len(digits) == 14 and digits.isdigit() else ""
+
+
+class Keystore:
+    """
+    loader(pfx_bytes, password) -> certificado carregado, com os atributos
+    `certificate` (x509), `fingerprint` (hex) e `not_valid_after` (timestamp).
+    """
+
+    def __init__(
+        self, directory: str, key: str, loader: Callable[[bytes, bytes], Any],
+        reload_interval: float = 30, warn_days: float = 30,
+    ):
+        self.directory = Path(directory) if directory else None
+        self._fernet = Fernet(key) if key else None
+        self.loader = loader
+        self.reload_interval = reload_interval
+        self.warn_days = warn_days
+        # fingerprint -> (certificado, info, mtime do arquivo)
+        self._entries: dict[str, tuple[Any, dict, float]] = {}
+        self._by_cnpj: dict[str, list[str]] = {}
+        self._warned: dict[str, float] = {}
+        # arquivos que não abriram (chave/senha errada): nome -> mtime, para logar uma vez só
+        self._ignored: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._loaded = False
+        self._last_reload = 0.0
+        self._dir_mtime = 0.0
+        self._watcher: threading.Thread | None = None
+        self.reloads = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None and self._fernet is not None
+
+    def start(self):
+        """Carrega o diretório e inicia a releitura periódica (idempotente)."""
+        if not self.enabled:
+            return
+        self._ensure_loaded()
+        with self._lock:
+            if self._watcher is not None and self._watcher.is_alive():
+                return
+            self._watcher = threading.Thread(target=self._watch, daemon=True, name="keystore-reload")
+            self._watcher.start()
+
+    # ── API ──────────────────────────────────────────────────────
+
+    def get(self, cert_id: str = "", cnpj: str = ""):
+        """Certificado por fingerprint ou, sem ele, o válido mais novo do CNPJ (ou da matriz)."""
+        if not self.enabled:
+            raise KeystoreError("Keystore de certificados não configurado (KEYSTORE_DIR/KEYSTORE_KEY)")
+        self._ensure_loaded()
+        found = self._find(cert_id, cnpj)
+        if found is None and (self._dir_changed() or time.time() - self._last_reload > MISS_RELOAD_INTERVAL):
+            self.reload()
+            found = self._find(cert_id, cnpj)
+        if found is None:
+            raise KeystoreError(f"Certificado não encontrado no keystore: {cert_id or cnpj}")
+        cert, info = found
+        if cert.not_valid_after <= time.time():
+            raise KeystoreError(f"Certificado {info['cert_id'][:16]} ({info['cnpj']}) vencido em {info['not_valid_after']}")
+        return cert
+
+    def register(self, pfx_bytes: bytes, password: bytes, label: str = "") -> dict:
+        """Valida o PFX, grava cifrado no diretório e devolve as informações (sem segredos)."""
+        if not self.enabled:
+            raise KeystoreError("Keystore de certificados não configurado (KEYSTORE_DIR/KEYSTORE_KEY)")
+        cert = self.loader(pfx_bytes, password)
+        token = self._fernet.encrypt(json.dumps({
+            "pfx_base64": base64.b64encode(pfx_bytes).decode(),
+            "password": password.decode(),
+            "label": label,
+        }).encode())
+
+        path = self.directory / f"{cert.fingerprint}{SUFFIX}"
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(token)
+        os.chmod(tmp, 0o600)
+        os.replace(tmp, path)
+
+        info = self._info(cert, label)
+        with self._lock:
+            self._add(cert, info, path.stat().st_mtime)
+        logger.info(f"[KEYSTORE] Certificado {info['cert_id'][:16]} registrado para {info['cnpj'] or info['subject']}")
+        self._warn_expiring()
+        return info
+
+    def remove(self, cert_id: str) -> bool:
+        cert_id = cert_id.lower()
+        if not self.enabled or not CERT_ID_RE.fullmatch(cert_id):
+            return False
+        self._ensure_loaded()
+        with self._lock:
+            removed = self._drop(cert_id)
+        path = self.directory / f"{cert_id}{SUFFIX}"
+        if path.exists():
+            path.unlink()
+            removed = True
+        return removed
+
+    def list(self) -> list[dict]:
+        if not self.enabled:
+            return []
+        self._ensure_loaded()
+        now = time.time()
+        with self._lock:
+            entries = [(cert, info) for cert, info, _ in self._entries.values()]
+        return sorted(
+            ({**info, "days_left": int((cert.not_valid_after - now) // 86400)} for cert, info in entries),
+            key=lambda info: (info["cnpj"], info["not_valid_after"]),
+        )
+
+    def reload(self):
+        """Relê o diretório: carrega arquivos novos/alterados e esquece os removidos."""
+        if not self.enabled:
+            return
+        with self._reload_lock:
+            self._last_reload = time.time()
+            self._dir_mtime = self._stat_dir()
+            files = {path.name[:-len(SUFFIX)]: path for path in self.directory.glob(f"*{SUFFIX}")} \
+                if self.directory.is_dir() else {}
+            with self._lock:
+                known = {fp: mtime for fp, (_, _, mtime) in self._entries.items()}
+                for fingerprint in set(known) - set(files):
+                    self._drop(fingerprint)
+
+            for fingerprint, path in files.items():
+                try:
+                    mtime = path.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                if mtime in (known.get(fingerprint), self._ignored.get(fingerprint)):
+                    continue
+                try:
+                    payload = json.loads(self._fernet.decrypt(path.read_bytes()))
+                    cert = self.loader(base64.b64decode(payload["pfx_base64"]), payload["password"].encode())
+                except (InvalidToken, ValueError, KeyError) as e:
+                    logger.error(f"[KEYSTORE] Ignorando {path.name}: {type(e).__name__} {e}")
+                    self._ignored[fingerprint] = mtime
+                    continue
+                self._ignored.pop(fingerprint, None)
+                with self._lock:
+                    self._drop(fingerprint)
+                    self._add(cert, self._info(cert, payload.get("label", "")), mtime)
+            self._loaded = True
+            self.reloads += 1
+        self._warn_expiring()
+
+    def stats(self) -> dict:
+        if not self.enabled:
+            return {"enabled": False}
+        now = time.time()
+        with self._lock:
+            expiring = [
+                {"cert_id": info["cert_id"], "cnpj": info["cnpj"], "days_left": int((cert.not_valid_after - now) // 86400)}
+                for cert, info, _ in self._entries.values()
+                if cert.not_valid_after - now < self.warn_days * 86400
+            ]
+            return {
+                "enabled": True,
+                "directory": str(self.directory),
+                "certificates": len(self._entries),
+                "cnpjs": len(self._by_cnpj),
+                "expiring": expiring,
+                "reloads": self.reloads,
+            }
+
+    # ── Interno ──────────────────────────────────────────────────
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.reload()
+
+    def _stat_dir(self) -> float:
+        try:
+            return self.directory.stat().st_mtime
+        except FileNotFoundError:
+            return 0.0
+
+    def _dir_changed(self) -> bool:
+        """Arquivo criado/removido no diretório desde a última releitura."""
+        return self._stat_dir() != self._dir_mtime
+
+    def _watch(self):
+        while True:
+            time.sleep(self.reload_interval)
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error(f"[KEYSTORE] Falha ao reler {self.directory}: {e}")
+
+    @staticmethod
+    def _info(cert, label: str) -> dict:
+        certificate = cert.certificate
+        cn = certificate.subject.get_attributes_for_oid(NameOID.COMMON_NAME)
+        return {
+            "cert_id": cert.fingerprint,
+            "cnpj": certificate_cnpj(certificate),
+            "subject": str(cn[0].value) if cn else certificate.subject.rfc4514_string(),
+            "label": label,
+            "not_valid_after": certificate.not_valid_after_utc.isoformat(),
+        }
+
+    def _find(self, cert_id: str, cnpj: str):
+        with self._lock:
+            if cert_id:
+                entry = self._entries.get(cert_id.lower())
+                return entry[:2] if entry else None
+            cnpj = re.sub(r"\D", "", cnpj)
+            # e-CNPJ da matriz (ordem 0001) também assina pelas filiais da mesma
+            # raiz de 8 dígitos; o de outra filial nunca substitui o do CNPJ pedido
+            candidates = self._by_cnpj.get(cnpj) or [
+                fp for other, fps in self._by_cnpj.items()
+                if other[:8] == cnpj[:8] and other[8:12] == "0001" for fp in fps
+            ]
+            entries = [self._entries[fp] for fp in candidates]
+        if not entries:
+            return None
+        now = time.time()
+        valid = [e for e in entries if e[0].not_valid_after > now] or entries
+        cert, info, _ = max(valid, key=lambda e: e[0].not_valid_after)
+        return cert, info
+
+    def _add(self, cert, info: dict, mtime: float):
+        """Indexa o certificado (chamar com lock)."""
+        self._entries[cert.fingerprint] = (cert, info, mtime)
+        if info["cnpj"]:
+            fps = self._by_cnpj.setdefault(info["cnpj"], [])
+            if cert.fingerprint not in fps:
+                fps.append(cert.fingerprint)
+
+    def _drop(self, fingerprint: str) -> bool:
+        """Remove do índice (chamar com lock)."""
+        entry = self._entries.pop(fingerprint, None)
+        if entry is None:
+            return False
+        cnpj = entry[1]["cnpj"]
+        fps = self._by_cnpj.get(cnpj, [])
+        if fingerprint in fps:
+            fps.remove(fingerprint)
+        if not fps:
+            self._by_cnpj.pop(cnpj, None)
+        return True
+
+    def _warn_expiring(self):
+        now = time.time()
+        with self._lock:
+            entries = [(cert, info) for cert, info, _ in self._entries.values()]
+        for cert, info in entries:
+            days_left = (cert.not_valid_after - now) / 86400
+            if days_left >= self.warn_days or now - self._warned.get(info["cert_id"], 0) < 86400:
+                continue
+            self._warned[info["cert_id"]] = now
+            if days_left <= 0:
+                logger.warning(f"[KEYSTORE] Certificado {info['cert_id'][:16]} ({info['cnpj']}) VENCIDO em {info['not_valid_after']}")
+            else:
+                logger.warning(
+                    f"[KEYSTORE] Certificado {info['cert_id'][:16]} ({info['cnpj']}) vence em {int(days_left)} dia(s)"
+                )
+
+
+class _PfxInfo:
+    """Loader mínimo da linha de comando (só valida o PFX e lê o certificado)."""
+
+    def __init__(self, pfx_bytes: bytes, password: bytes):
+        private_key, self.certificate, _ = pkcs12.load_key_and_certificates(pfx_bytes, password)
+        if private_key is None or self.certificate is None:
+            raise ValueError("Certificado inválido ou senha incorreta")
+        self.fingerprint = self.certificate.fingerprint(hashes.SHA256()).hex()
+        self.not_valid_after = self.certificate.not_valid_after_utc.timestamp()
+
+
+def _cli():
+    parser = argparse.ArgumentParser(description="Cadastra um PFX no diretório do keystore (chave em KEYSTORE_KEY)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    add = sub.add_parser("add")
+    add.add_argument("directory")
+    add.add_argument("pfx")
+    add.add_argument("--password-env", default="PFX_PASSWORD", help="variável de ambiente com a senha do PFX")
+    add.add_argument("--label", default="")
+    args = parser.parse_args()
+
+    key = os.environ.get("KEYSTORE_KEY", "")
+    if not key:
+        sys.exit("KEYSTORE_KEY não definida")
+    store = Keystore(args.directory, key, _PfxInfo)
+    info = store.register(Path(args.pfx).read_bytes(), os.environ.get(args.password_env, "").encode(), args.label)
+    print(json.dumps(info, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    _cli()
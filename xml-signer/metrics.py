@@ -0,0 +1,111 @@
+"""
+Métricas Prometheus do microserviço fiscal (GET /metrics).
+
+Com PROMETHEUS_MULTIPROC_DIR definido (o gunicorn.conf.py define), cada
+processo — workers gunicorn e processos do SigningPool — grava seus valores
+em arquivos nesse diretório e /metrics soma todos eles, seja qual for o
+worker que atendeu o scrape. Sem a variável (ex.: `python app.py`), vale o
+registro do próprio processo.
+
+Métricas:
+  fiscal_stage_seconds{stage}                       — pfx_load, xsd_validation,
+      signing, envelope_build, response_parse
+  sefaz_request_seconds{uf, ambiente, service}      — round trip mTLS
+  sefaz_responses_total{uf, ambiente, service, cstat} — cStat do retorno
+      (ou http_<status> / erro_conexao)
+  sefaz_queue_seconds{uf, ambiente, service}        — espera por vaga no webservice
+  sefaz_throttled_seconds{uf, ambiente, service}    — espera no limite de consumo (token bucket)
+  sefaz_rejected_total{uf, ambiente, service, reason} — recusas com HTTP 429
+      (reason = concorrencia | consumo)
+  fiscal_operation_results_total{operation, status_detail}
+"""
+
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess,
+)
+
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR", "")
+
+STAGES = ("pfx_load", "xsd_validation", "signing", "envelope_build", "response_parse")
+
+STAGE_SECONDS = Histogram(
+    "fiscal_stage_seconds", "Duração de cada etapa do processamento",
+    ["stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+SEFAZ_SECONDS = Histogram(
+    "sefaz_request_seconds", "Round trip mTLS com a SEFAZ (POST até o corpo da resposta)",
+    ["uf", "ambiente", "service"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 8, 13, 20, 30, 60),
+)
+SEFAZ_RESPONSES = Counter(
+    "sefaz_responses_total", "Respostas da SEFAZ por cStat (http_<status>/erro_conexao em falhas)",
+    ["uf", "ambiente", "service", "cstat"],
+)
+SEFAZ_QUEUE_SECONDS = Histogram(
+    "sefaz_queue_seconds", "Espera por vaga no limite de concorrência do webservice SEFAZ",
+    ["uf", "ambiente", "service"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+SEFAZ_THROTTLED_SECONDS = Histogram(
+    "sefaz_throttled_seconds", "Espera imposta pelo limite de consumo (token bucket por CNPJ/UF/serviço)",
+    ["uf", "ambiente", "service"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+SEFAZ_REJECTED = Counter(
+    "sefaz_rejected_total", "Chamadas recusadas com HTTP 429 (fila do webservice cheia ou limite de consumo)",
+    ["uf", "ambiente", "service", "reason"],
+)
+OPERATION_RESULTS = Counter(
+    "fiscal_operation_results_total", "Resultados por operação e status_detail (por documento nos lotes)",
+    ["operation", "status_detail"],
+)
+
+# Filhos pré-criados: evita a busca de labels a cada observação
+_stage_children = {name: STAGE_SECONDS.labels(name) for name in STAGES}
+
+
+def stage(name: str):
+    """Context manager que mede a etapa `name` (um dos STAGES)."""
+    return _stage_children[name].time()
+
+
+def observe_sefaz(endpoint: tuple[str, str, str], seconds: float, cstat: str):
+    """Registra um round trip; `endpoint` = (UF, ambiente, serviço)."""
+    uf, ambiente, service = endpoint
+    SEFAZ_SECONDS.labels(uf, ambiente, service).observe(seconds)
+    SEFAZ_RESPONSES.labels(uf, ambiente, service, cstat or "sem_cstat").inc()
+
+
+def observe_queue(endpoint: tuple[str, str, str], seconds: float):
+    """Registra a espera por vaga no webservice antes da chamada."""
+    SEFAZ_QUEUE_SECONDS.labels(*endpoint).observe(seconds)
+
+
+def observe_throttled(endpoint: tuple[str, str, str], seconds: float):
+    """Registra a espera imposta pelo limite de consumo antes da chamada."""
+    SEFAZ_THROTTLED_SECONDS.labels(*endpoint).observe(seconds)
+
+
+def observe_rejected(endpoint: tuple[str, str, str], reason: str):
+    SEFAZ_REJECTED.labels(*endpoint, reason).inc()
+
+
+def observe_results(operation: str, result: dict):
+    """Conta o status_detail do resultado (de cada item, em respostas de lote)."""
+    for item in result.get("results") or [result]:
+        detail = item.get("status_detail") or ("erro" if item.get("error") else "ok")
+        OPERATION_RESULTS.labels(operation, detail).inc()
+
+
+def render() -> tuple[bytes, str]:
+    """Corpo e Content-Type da resposta de /metrics."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
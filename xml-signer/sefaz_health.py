@@ -0,0 +1,254 @@
+"""
+Saúde dos webservices SEFAZ, por processo.
+
+CircuitBreaker: circuito por URL de webservice. Falhas seguidas abrem o
+circuito e as chamadas para aquela URL são recusadas de antemão (o app
+responde 503 ou desvia para a SVC) até uma chamada de teste passar.
+
+SefazStatusTable: status de cada UF/ambiente pelo CTeStatusServico, sondado
+em segundo plano e compartilhado entre os workers por um arquivo JSON.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class _Circuit:
+    def __init__(self):
+        self.failures = 0
+        self.opened_at = 0.0  # 0 = fechado
+        self.probing_since = 0.0  # > 0: meio-aberto, uma chamada de teste em andamento
+        self.trips = 0
+
+
+class CircuitBreaker:
+    """
+    Circuito por URL de webservice — uma por (ambiente, região, serviço) em
+    SEFAZ_ENDPOINTS.
+
+    Timeout/erro de conexão, HTTP 5xx, resposta ilegível e cStat 108/109/999
+    contam como falha; `failure_threshold` falhas seguidas abrem o circuito.
+    Aberto, available() e begin() recusam a URL por `open_seconds`; depois deixam
+    passar uma chamada de teste (meio-aberto): sucesso fecha o circuito, falha
+    reabre. A chamada de teste só é marcada em begin(), logo antes do POST;
+    se terminar sem record() (erro local, fila cheia), end() a libera para
+    outra. O estado é por processo.
+    """
+
+    def __init__(self, failure_threshold: int, open_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self._circuits: dict[str, _Circuit] = {}
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _blocked(self, circuit: _Circuit, now: float) -> bool:
+        waiting = now - circuit.opened_at < self.open_seconds
+        # Teste já em andamento (e recente): os demais continuam barrados
+        probing = circuit.probing_since and now - circuit.probing_since < self.open_seconds
+        return bool(waiting or probing)
+
+    def available(self, url: str) -> bool:
+        """Se uma chamada agora passaria (fechado, ou meio-aberto sem teste em andamento); não marca nada."""
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            circuit = self._circuits.get(url)
+            if circuit is None or not circuit.opened_at:
+                return True
+            if self._blocked(circuit, time.monotonic()):
+                self.rejected += 1
+                return False
+            return True
+
+    def begin(self, url: str) -> float | None:
+        """
+        Logo antes do POST: None se o circuito barra a chamada; senão 0.0, ou
+        o instante em que esta passou a ser a chamada de teste do meio-aberto
+        (a devolver a end()).
+        """
+        if self.failure_threshold <= 0:
+            return 0.0
+        with self._lock:
+            circuit = self._circuits.get(url)
+            if circuit is None or not circuit.opened_at:
+                return 0.0
+            now = time.monotonic()
+            if self._blocked(circuit, now):
+                self.rejected += 1
+                return None
+            circuit.probing_since = now
+            return now
+
+    def end(self, url: str, probe: float | None):
+        """Saída da chamada: a de teste que não chegou a record() libera o meio-aberto."""
+        if not probe:
+            return
+        with self._lock:
+            circuit = self._circuits.get(url)
+            if circuit is not None and circuit.probing_since == probe:
+                circuit.probing_since = 0.0
+
+    def record(self, url: str, success: bool):
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            circuit = self._circuits.get(url)
+            if success:
+                if circuit is not None:
+                    if circuit.opened_at:
+                        logger.info(f"[CIRCUIT] Fechado: {url}")
+                    circuit.failures = 0
+                    circuit.opened_at = circuit.probing_since = 0.0
+                return
+            if circuit is None:
+                circuit = self._circuits[url] = _Circuit()
+            circuit.failures += 1
+            if circuit.probing_since or (not circuit.opened_at and circuit.failures >= self.failure_threshold):
+                logger.warning(f"[CIRCUIT] Aberto por {self.open_seconds:g}s após {circuit.failures} falha(s): {url}")
+                circuit.opened_at = time.monotonic()
+                circuit.probing_since = 0.0
+                circuit.trips += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "failure_threshold": self.failure_threshold,
+                "open_seconds": self.open_seconds,
+                "rejected": self.rejected,
+                "circuits": {
+                    url: {
+                        "state": (
+                            "closed" if not c.opened_at
+                            else "half_open" if now - c.opened_at >= self.open_seconds
+                            else "open"
+                        ),
+                        "failures": c.failures,
+                        "trips": c.trips,
+                    }
+                    for url, c in self._circuits.items() if c.failures or c.trips
+                },
+            }
+
+
+class SefazStatusTable:
+    """
+    Status de cada UF/ambiente (cStat do CTeStatusServico e tMed), consultado
+    em segundo plano com o certificado da sonda e compartilhado entre os
+    workers por um arquivo JSON. loader(pfx_bytes, password) carrega o
+    certificado; probe(cert, uf, ambiente) consulta a SEFAZ e devolve a
+    entrada da UF ("status": "ok" | "down" | "desconhecido").
+
+    Todo processo roda a thread, mas só quem consegue o flock do arquivo e o
+    encontra vencido (mais velho que `interval`) consulta a SEFAZ; os demais só
+    releem o arquivo quando ele muda. Entradas com mais de 3 intervalos são
+    ignoradas — se a sonda parar, nada fica bloqueado por status antigo.
+    """
+
+    def __init__(
+        self, path: str, ufs: list[str], ambientes: list[str], interval: float,
+        pfx_path: str, pfx_password: str, loader: Callable[[bytes, bytes], Any],
+        probe: Callable[[Any, str, str], dict],
+    ):
+        self.path = path
+        self.ufs = ufs
+        self.ambientes = ambientes
+        self.interval = interval
+        self.pfx_path = pfx_path
+        self.pfx_password = pfx_password
+        self.loader = loader
+        self.probe = probe
+        self._table: dict = {}
+        self._mtime = 0.0
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.ufs and self.pfx_path)
+
+    def start(self):
+        with self._lock:
+            if not self.enabled or self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="sefaz-status", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self._probe_if_due()
+            except Exception as e:
+                logger.error(f"[STATUS] Erro na sonda: {e}")
+            # Acorda antes do vencimento: assume a sonda se o processo que a fazia morreu
+            time.sleep(max(5.0, self.interval / 4))
+
+    def _probe_if_due(self):
+        with open(self.path + ".lock", "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # outro worker está consultando
+            if time.time() - self.read().get("updated_at", 0) < self.interval:
+                return
+
+            with open(self.pfx_path, "rb") as f:
+                cert = self.loader(f.read(), self.pfx_password.encode())
+            entries = {
+                f"{ambiente}:{uf}": self.probe(cert, uf, ambiente)
+                for ambiente in self.ambientes for uf in self.ufs
+            }
+            table = {"updated_at": time.time(), "interval": self.interval, "entries": entries}
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(table, f)
+            os.replace(tmp_path, self.path)
+            down = [key for key, entry in entries.items() if entry["status"] == "down"]
+            logger.info(f"[STATUS] {len(entries)} UF/ambiente consultados; fora do ar: {', '.join(down) or 'nenhum'}")
+
+    def read(self) -> dict:
+        """Tabela atual (relida do arquivo só quando ele muda)."""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return {}
+        with self._lock:
+            if mtime != self._mtime:
+                try:
+                    with open(self.path) as f:
+                        self._table = json.load(f)
+                    self._mtime = mtime
+                except (OSError, ValueError):
+                    pass  # gravação em andamento ou arquivo inválido: fica com a versão anterior
+            return self._table
+
+    def is_down(self, uf: str, ambiente: str) -> dict | None:
+        """Entrada da UF/ambiente se ela estiver fora do ar segundo uma consulta recente."""
+        if not self.enabled:
+            return None
+        table = self.read()
+        if time.time() - table.get("updated_at", 0) > 3 * self.interval:
+            return None
+        entry = table.get("entries", {}).get(f"{ambiente}:{uf}")
+        return entry if entry and entry["status"] == "down" else None
+
+    def snapshot(self) -> dict:
+        table = self.read()
+        return {
+            "enabled": self.enabled,
+            "interval": self.interval,
+            "updated_at": (
+                datetime.fromtimestamp(table["updated_at"]).isoformat(timespec="seconds")
+                if table.get("updated_at") else None
+            ),
+            "entries": sorted(table.get("entries", {}).values(), key=lambda e: (e["ambiente"], e["uf"])),
+        }
@@ -0,0 +1,391 @@
+"""
+Controle de concorrência e de consumo das chamadas à SEFAZ.
+
+EndpointLimiter — chamadas simultâneas por webservice (URL). Cada
+autorizador tem um limite por processo. Quem chega com o limite ocupado
+entra numa fila de até `max_queue` chamadas e espera no máximo `max_wait`
+segundos; com a fila cheia (ou a espera vencida) a chamada é recusada na
+hora com EndpointBusy, que a API devolve como HTTP 429 + Retry-After — em
+vez de acumular requisições presas até o timeout do worker. A fila é por
+contribuinte (CNPJ) e as vagas são distribuídas em rodízio entre eles: um
+CNPJ com milhares de chamadas na fila não atrasa os demais.
+
+RateLimiter — token bucket por (CNPJ, UF, ambiente, serviço), para ficar
+abaixo dos limites de uso da SEFAZ (cStat 656, consumo indevido). Rajadas
+acima do balde aguardam a reposição; um 656 esvazia o balde e bloqueia a
+chave por `penalty` segundos.
+
+As filas atendem threads (modo sync/gthread) e o event loop (modo async):
+ao liberar uma vaga ela passa direto para o próximo da fila, então ninguém
+"fura" a fila entre a liberação e o despertar de quem espera.
+"""
+
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+# Peso da última duração na média móvel usada para estimar o Retry-After
+EWMA_ALPHA = 0.2
+RETRY_AFTER_MAX = 60
+# Baldes cheios e ociosos são descartados acima deste número de chaves
+MAX_BUCKETS = 10_000
+
+
+class EndpointBusy(Exception):
+    """Webservice no limite de concorrência e fila cheia (ou espera esgotada)."""
+
+    status_detail = "sefaz_sobrecarregada"
+    reason = "concorrencia"
+    message = "Webservice SEFAZ sobrecarregado, tente novamente em {retry_after}s: {key}"
+
+    def __init__(self, key: str, retry_after: int):
+        super().__init__(self.message.format(key=key, retry_after=retry_after))
+        self.key = key
+        self.retry_after = retry_after
+
+
+class RateLimited(EndpointBusy):
+    """Limite de consumo (token bucket) da chave CNPJ/UF/ambiente/serviço além da espera permitida."""
+
+    status_detail = "sefaz_limite_consumo"
+    reason = "consumo"
+    message = "Limite de consumo da SEFAZ atingido para {key}, tente novamente em {retry_after}s"
+
+
+def _retry_after(seconds: float) -> int:
+    return max(1, min(RETRY_AFTER_MAX, math.ceil(seconds)))
+
+
+class _Waiter:
+    __slots__ = ("granted", "_notify")
+
+    def __init__(self, notify):
+        self.granted = False
+        self._notify = notify
+
+    def grant(self):
+        self.granted = True
+        self._notify()
+
+
+class _Slot:
+    __slots__ = ("active", "waiting", "n_waiting", "seconds", "admitted", "queued", "rejected")
+
+    def __init__(self):
+        self.active = 0
+        # contribuinte -> fila dele; a ordem das chaves é a vez no rodízio
+        self.waiting: OrderedDict[str, deque[_Waiter]] = OrderedDict()
+        self.n_waiting = 0
+        self.seconds = 1.0  # média móvel da duração de uma chamada
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+
+
+class EndpointLimiter:
+    """
+    limit <= 0 desativa o controle. `max_queue`/`max_wait` só valem para
+    chamadas com `admission=True` (requisições da API); jobs, consultas de
+    recibo e sondas de status (`admission=False`) aguardam a vez sem limite
+    de fila — já estão fora do caminho do cliente.
+    """
+
+    def __init__(self, limit: int, max_queue: int, max_wait: float):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._slots: dict[str, _Slot] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.limit > 0
+
+    @contextmanager
+    def acquire(self, key: str, admission: bool = True, tenant: str = ""):
+        """Ocupa uma vaga de `key` durante o bloco (bloqueia a thread na fila de `tenant`)."""
+        if not self.enabled:
+            yield 0.0
+            return
+        start = time.monotonic()
+        event = threading.Event()
+        waiter = self._enter(key, event.set, admission, tenant)
+        if waiter is not None and not event.wait(self.max_wait if admission else None):
+            self._give_up(key, waiter, tenant)
+        waited = time.monotonic() - start
+        try:
+            yield waited
+        finally:
+            self._leave(key, time.monotonic() - start - waited)
+
+    @asynccontextmanager
+    async def acquire_async(self, key: str, admission: bool = True, tenant: str = ""):
+        """Versão para o event loop de acquire()."""
+        if not self.enabled:
+            yield 0.0
+            return
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = self._enter(key, notify, admission, tenant)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.max_wait if admission else None)
+            except asyncio.TimeoutError:
+                self._give_up(key, waiter, tenant)
+            except BaseException:
+                # Cancelado na fila: devolve a vaga se ela já tinha chegado
+                with self._lock:
+                    if not waiter.granted:
+                        self._dequeue(self._slots[key], waiter, tenant)
+                        raise
+                self._leave(key, 0.0)
+                raise
+        waited = time.monotonic() - start
+        try:
+            yield waited
+        finally:
+            self._leave(key, time.monotonic() - start - waited)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "max_queue": self.max_queue,
+                "max_wait": self.max_wait,
+                "endpoints": {
+                    key: {
+                        "active": slot.active,
+                        "waiting": slot.n_waiting,
+                        "waiting_tenants": len(slot.waiting),
+                        "admitted": slot.admitted,
+                        "queued": slot.queued,
+                        "rejected": slot.rejected,
+                        "avg_seconds": round(slot.seconds, 3),
+                    }
+                    for key, slot in self._slots.items()
+                },
+            }
+
+    # ── Interno ──────────────────────────────────────────────────
+
+    def _retry_after(self, slot: _Slot) -> int:
+        """Tempo estimado até a fila atual escoar (chamar com lock)."""
+        return _retry_after(slot.seconds * (slot.n_waiting + 1) / self.limit)
+
+    def _enter(self, key: str, notify, admission: bool, tenant: str) -> _Waiter | None:
+        """Ocupa a vaga (None) ou entra na fila (devolve o _Waiter); fila cheia: EndpointBusy."""
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = _Slot()
+            if slot.active < self.limit and not slot.n_waiting:
+                slot.active += 1
+                slot.admitted += 1
+                return None
+            if admission and slot.n_waiting >= self.max_queue:
+                slot.rejected += 1
+                raise EndpointBusy(key, self._retry_after(slot))
+            waiter = _Waiter(notify)
+            slot.waiting.setdefault(tenant, deque()).append(waiter)
+            slot.n_waiting += 1
+            slot.queued += 1
+            return waiter
+
+    @staticmethod
+    def _dequeue(slot: _Slot, waiter: _Waiter, tenant: str):
+        """Tira `waiter` da fila do contribuinte (chamar com lock)."""
+        queue = slot.waiting[tenant]
+        queue.remove(waiter)
+        if not queue:
+            del slot.waiting[tenant]
+        slot.n_waiting -= 1
+
+    def _give_up(self, key: str, waiter: _Waiter, tenant: str):
+        """Espera esgotada: sai da fila, salvo se a vaga chegou nesse meio tempo."""
+        with self._lock:
+            if waiter.granted:
+                return
+            slot = self._slots[key]
+            self._dequeue(slot, waiter, tenant)
+            slot.rejected += 1
+            raise EndpointBusy(key, self._retry_after(slot))
+
+    def _leave(self, key: str, seconds: float):
+        """Libera a vaga, entregando-a ao próximo contribuinte do rodízio."""
+        with self._lock:
+            slot = self._slots[key]
+            if seconds > 0:
+                slot.seconds += EWMA_ALPHA * (seconds - slot.seconds)
+            if slot.n_waiting:
+                tenant, queue = next(iter(slot.waiting.items()))
+                waiter = queue.popleft()
+                if queue:
+                    slot.waiting.move_to_end(tenant)  # o próximo da vez é outro contribuinte
+                else:
+                    del slot.waiting[tenant]
+                slot.n_waiting -= 1
+                slot.admitted += 1
+                waiter.grant()
+            else:
+                slot.active -= 1
+
+
+# ── Limite de consumo (token bucket) ─────────────────────────────
+
+def parse_rate_limits(spec: str) -> dict[str, tuple[float, float]]:
+    """
+    "cteConsulta=2:10,*=5" -> {serviço: (chamadas por segundo, tamanho do balde)}.
+    `*` vale para os serviços não listados; sem o tamanho, o balde comporta 1 s de chamadas.
+    """
+    limits = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        service, _, value = item.partition("=")
+        rate, _, burst = value.partition(":")
+        try:
+            rate = float(rate)
+            burst = float(burst) if burst else max(1.0, rate)
+        except ValueError:
+            raise ValueError(f"Limite de consumo inválido: {item.strip()!r} (esperado serviço=taxa[:balde])")
+        if rate <= 0 or burst < 1:
+            raise ValueError(f"Limite de consumo inválido: {item.strip()!r} (taxa > 0 e balde >= 1)")
+        limits[service.strip()] = (rate, burst)
+    return limits
+
+
+class _Bucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float | None, burst: float, now: float):
+        self.rate = rate  # None: sem limite configurado (só a penalidade do 656)
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now  # no futuro: chave bloqueada (penalidade) até lá
+
+    def refill(self, now: float):
+        if now > self.updated:
+            if self.rate:
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            else:
+                self.tokens = self.burst
+            self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Segundos até haver uma ficha para a próxima chamada."""
+        blocked = max(0.0, self.updated - now)
+        if self.tokens >= 1 or not self.rate:
+            return blocked
+        return blocked + (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Token bucket por chave (CNPJ, UF, ambiente, serviço), com a taxa do
+    serviço em `limits` (ver parse_rate_limits). reserve() retira a ficha na
+    hora e devolve quanto esperar por ela: a ficha pode ficar negativa, então
+    quem chega depois espera mais, na ordem de chegada. Chamada reservada que
+    não chega à SEFAZ (fila do endpoint cheia) devolve a ficha com refund().
+    """
+
+    def __init__(self, limits: dict[str, tuple[float, float]], penalty: float):
+        self.limits = limits
+        self.penalty = penalty
+        self._buckets: dict[tuple, _Bucket] = {}
+        self._lock = threading.Lock()
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+        self.rejected = 0
+        self.refunded = 0
+        self.penalties = 0
+
+    def limit_for(self, service: str) -> tuple[float, float] | None:
+        return self.limits.get(service) or self.limits.get("*")
+
+    def reserve(self, key: tuple, max_wait: float | None = None) -> float:
+        """
+        Reserva uma chamada para `key` e devolve os segundos a aguardar antes
+        dela. Se a espera passar de `max_wait`, nada é reservado: RateLimited.
+        """
+        limit = self.limit_for(key[-1])
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if limit is None:
+                    return 0.0  # serviço sem limite e chave sem penalidade
+                now = time.monotonic()
+                self._purge(now)
+                bucket = self._buckets[key] = _Bucket(*limit, now)
+            else:
+                now = time.monotonic()
+                bucket.refill(now)
+            delay = bucket.delay(now)
+            if max_wait is not None and delay > max_wait:
+                self.rejected += 1
+                raise RateLimited("/".join(key), _retry_after(delay))
+            bucket.tokens -= 1
+            if delay > 0:
+                self.throttled += 1
+                self.throttled_seconds += delay
+            return delay
+
+    def refund(self, key: tuple):
+        """Devolve a ficha reservada por uma chamada que não foi feita."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                return
+            bucket.refill(time.monotonic())
+            bucket.tokens = min(bucket.burst, bucket.tokens + 1)
+            self.refunded += 1
+
+    def penalize(self, key: tuple):
+        """SEFAZ recusou por consumo indevido (656): esvazia o balde e bloqueia a chave por `penalty` s."""
+        if self.penalty <= 0:
+            return
+        limit = self.limit_for(key[-1]) or (None, 1.0)
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = _Bucket(*limit, now)
+            bucket.refill(now)
+            bucket.tokens = min(bucket.tokens, 0.0)
+            bucket.updated = max(bucket.updated, now + self.penalty)
+            self.penalties += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "limits": {service: {"rate": rate, "burst": burst} for service, (rate, burst) in self.limits.items()},
+                "penalty_seconds": self.penalty,
+                "buckets": len(self._buckets),
+                "throttled": self.throttled,
+                "throttled_seconds": round(self.throttled_seconds, 3),
+                "rejected": self.rejected,
+                "refunded": self.refunded,
+                "penalties": self.penalties,
+                "blocked": {
+                    "/".join(key): round(bucket.updated - now, 1)
+                    for key, bucket in self._buckets.items() if bucket.updated > now
+                },
+            }
+
+    def _purge(self, now: float):
+        """Descarta baldes que já estariam cheios (chamar com lock)."""
+        if len(self._buckets) < MAX_BUCKETS:
+            return
+        for key, bucket in list(self._buckets.items()):
+            if bucket.updated <= now and (
+                not bucket.rate or bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.burst
+            ):
+                del self._buckets[key]
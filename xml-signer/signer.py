@@ -0,0 +1,350 @@
+"""
+Assinatura XMLDSig de CT-e/MDF-e e pool de processos de assinatura.
+
+Módulo enxuto de propósito: os processos do SigningPool importam só ele
+(lxml, cryptography, signxml) e metrics.py (prometheus_client, para a etapa
+"signing" medida no próprio processo entrar na soma multiprocesso de
+/metrics), sem o app, o SSLContext de mTLS nem o bundle de CAs. O certificado chega aos processos como SigningKey.export() — chave
+e certificado em DER, sem o PFX nem a senha — e fica num cache local por
+fingerprint, reaproveitado entre blocos e requisições.
+
+SIGNER_BACKEND escolhe o assinador: "native" (EnvelopedSigner, perfil fixo
+da SEFAZ) ou "signxml". Os dois geram a mesma saída byte a byte (conferido
+por tests/test_signer.py, com os casos de bench/crosscheck_signer.py).
+"""
+
+import base64
+import copy
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, NamedTuple
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric.padding import PKCS1v15
+from cryptography.hazmat.primitives.serialization import (
+    Encoding, NoEncryption, PrivateFormat, load_der_private_key,
+)
+from cryptography.x509 import Certificate, load_der_x509_certificate
+from lxml import etree
+from signxml import XMLSigner, methods
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SIGNER_BACKEND = os.environ.get("SIGNER_BACKEND", "native")  # native | signxml
+# Certificados mantidos por processo do pool
+SIGN_POOL_KEY_CACHE = int(os.environ.get("SIGN_POOL_KEY_CACHE", "32"))
+
+NAMESPACES = {
+    "cte": "http://www.portalfiscal.inf.br/cte",
+    "mdfe": "http://www.portalfiscal.inf.br/mdfe",
+    "ds": "http://www.w3.org/2000/09/xmldsig#",
+}
+
+C14N_ALGORITHM = "http://www.w3.org/TR/2001/REC-xml-c14n-20010315"
+
+
+def _ds(tag: str) -> str:
+    return f"{{{NAMESPACES['ds']}}}{tag}"
+
+
+def c14n_subtree(node: etree._Element) -> bytes:
+    """
+    C14N 1.0 inclusiva do nó como documento isolado, como o signxml faz.
+
+    A c14n do libxml2 sobre um nó filho (no lugar ou copiado com deepcopy)
+    pode sair com xmlns="" nos descendentes; só reparsear o nó serializado
+    isola os namespaces de forma confiável.
+    """
+    if node.getparent() is not None:
+        node = etree.fromstring(etree.tostring(node))
+    return etree.tostring(node, method="c14n", with_comments=False)
+
+
+class EnvelopedSigner:
+    """
+    XMLDSig no perfil fixo da SEFAZ: enveloped, RSA-SHA256, C14N 1.0 inclusiva
+    e uma única Reference "#Id".
+
+    Usa só lxml (c14n) e cryptography, com o bloco Signature — incluindo o
+    KeyInfo/X509Certificate do certificado — montado uma vez e copiado a cada
+    assinatura. A saída é byte a byte a mesma do signxml com esse perfil
+    (conferida por bench/crosscheck_signer.py).
+    """
+
+    def __init__(self, private_key, cert_pem: bytes):
+        self.private_key = private_key
+        self._template = self._build_template(cert_pem)
+
+    @staticmethod
+    def _build_template(cert_pem: bytes) -> etree._Element:
+        # Mesma estrutura, ordem de atributos e declarações de namespace do signxml
+        nsmap = {"ds": NAMESPACES["ds"]}
+        signature = etree.Element(_ds("Signature"), nsmap=nsmap)
+        signed_info = etree.SubElement(signature, _ds("SignedInfo"), nsmap=nsmap)
+        etree.SubElement(signed_info, _ds("CanonicalizationMethod"), Algorithm=C14N_ALGORITHM)
+        etree.SubElement(
+            signed_info, _ds("SignatureMethod"), Algorithm="http://www.w3.org/2001/04/xmldsig-more#rsa-sha256",
+        )
+        reference = etree.SubElement(signed_info, _ds("Reference"), URI="")
+        transforms = etree.SubElement(reference, _ds("Transforms"))
+        etree.SubElement(
+            transforms, _ds("Transform"), Algorithm="http://www.w3.org/2000/09/xmldsig#enveloped-signature",
+        )
+        etree.SubElement(transforms, _ds("Transform"), Algorithm=C14N_ALGORITHM)
+        etree.SubElement(reference, _ds("DigestMethod"), Algorithm="http://www.w3.org/2001/04/xmlenc#sha256")
+        etree.SubElement(reference, _ds("DigestValue"))
+        etree.SubElement(signature, _ds("SignatureValue"))
+
+        key_info = etree.SubElement(signature, _ds("KeyInfo"))
+        x509_data = etree.SubElement(key_info, _ds("X509Data"))
+        # Corpo do PEM (com as quebras de linha), como o strip_pem_header do signxml
+        pem = cert_pem.decode("ascii").replace("\r", "")
+        body = pem.split("-----BEGIN CERTIFICATE-----\n", 1)[1].split("-----END CERTIFICATE-----", 1)[0]
+        etree.SubElement(x509_data, _ds("X509Certificate")).text = body
+        return signature
+
+    def sign(self, root: etree._Element, sign_node: etree._Element, node_id: str) -> etree._Element:
+        """Insere a assinatura de `sign_node` no fim de `root` (no lugar) e devolve `root`."""
+        digest = hashlib.sha256(c14n_subtree(sign_node)).digest()
+
+        signature = copy.deepcopy(self._template)
+        signed_info, signature_value = signature[0], signature[1]
+        reference = signed_info[2]
+        reference.set("URI", f"#{node_id}")
+        reference[2].text = base64.b64encode(digest).decode()
+
+        # SignedInfo é canonizado já dentro do documento (namespaces em escopo do root)
+        root.append(signature)
+        value = self.private_key.sign(
+            etree.tostring(signed_info, method="c14n", with_comments=False), PKCS1v15(), hashes.SHA256(),
+        )
+        signature_value.text = base64.b64encode(value).decode()
+        return root
+
+
+class InPlaceXMLSigner(XMLSigner):
+    """
+    XMLSigner que insere a assinatura direto na árvore recebida.
+
+    O signxml serializa e reparseia cada elemento lxml que recebe, para isolar
+    o nó dos namespaces do pai. Para a raiz do documento isso só gera cópias
+    (a árvore é nossa e descartável); o nó referenciado (infCte/infMDFe)
+    continua sendo copiado, pois a c14n dele depende desse isolamento.
+    """
+
+    def get_root(self, data):
+        if isinstance(data, etree._Element) and data.getparent() is None:
+            return data
+        return super().get_root(data)
+
+
+class KeyMaterial(NamedTuple):
+    """Chave privada (PKCS#8) e certificado em DER, para levar a chave a outro processo."""
+    fingerprint: str
+    key_der: bytes
+    cert_der: bytes
+
+
+class SigningKey:
+    """
+    O que a assinatura precisa do certificado A1: chave privada, certificado
+    do titular e o bloco Signature pré-montado. InMemoryCert estende com o
+    SSLContext de mTLS; os processos do pool usam só esta classe.
+    """
+
+    def __init__(self, private_key, certificate: Certificate):
+        self.private_key = private_key
+        self.certificate = certificate
+        self.fingerprint = certificate.fingerprint(hashes.SHA256()).hex()
+        self._cert_pem = certificate.public_bytes(Encoding.PEM)
+        # Bloco Signature/KeyInfo pré-montado para este certificado
+        self.signer = EnvelopedSigner(private_key, self._cert_pem)
+
+    def export(self) -> KeyMaterial:
+        return KeyMaterial(
+            self.fingerprint,
+            self.private_key.private_bytes(Encoding.DER, PrivateFormat.PKCS8, NoEncryption()),
+            self.certificate.public_bytes(Encoding.DER),
+        )
+
+    @classmethod
+    def from_material(cls, material: KeyMaterial) -> "SigningKey":
+        return cls(load_der_private_key(material.key_der, None), load_der_x509_certificate(material.cert_der))
+
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
+
+def parse_xml(xml: str | etree._Element) -> etree._Element:
+    """Converte o XML recebido em árvore lxml (árvores já parseadas passam direto)."""
+    if isinstance(xml, etree._Element):
+        return xml
+    return etree.fromstring(xml.encode("utf-8"))
+
+
+def sign_xml(xml: str | etree._Element, cert: SigningKey, doc_type: str, doc_id: str) -> dict:
+    """
+    Assina XML usando XMLDSig (enveloped signature).
+
+    Aceita o XML como string ou árvore já parseada. O documento assinado é
+    serializado uma única vez: `signed_bytes` (UTF-8, sem declaração) é o que
+    vai no lote/envelope SOAP e `signed_xml` é a mesma serialização decodificada.
+    """
+    root = parse_xml(xml)
+
+    if doc_type == "cte":
+        sign_node = root.find(".//cte:infCte", NAMESPACES)
+    elif doc_type == "mdfe":
+        sign_node = root.find(".//mdfe:infMDFe", NAMESPACES)
+    else:
+        raise ValueError(f"document_type inválido: {doc_type}")
+
+    if sign_node is None:
+        raise ValueError(f"Nó {'infCte' if doc_type == 'cte' else 'infMDFe'} não encontrado no XML")
+
+    node_id = sign_node.attrib.get("Id", "")
+    if not node_id:
+        raise ValueError("Atributo Id não encontrado no nó a ser assinado")
+
+    with metrics.stage("signing"):
+        if SIGNER_BACKEND == "signxml":
+            signer = InPlaceXMLSigner(
+                method=methods.enveloped,
+                signature_algorithm="rsa-sha256",
+                digest_algorithm="sha256",
+                c14n_algorithm=C14N_ALGORITHM,
+            )
+            signed_root = signer.sign(
+                root,
+                key=cert.private_key,
+                cert=[cert.certificate],
+                reference_uri=f"#{node_id}",
+            )
+        else:
+            signed_root = cert.signer.sign(root, sign_node, node_id)
+
+        signed_bytes = etree.tostring(signed_root, encoding="UTF-8", xml_declaration=False)
+    signed_xml = XML_DECLARATION + signed_bytes.decode("utf-8")
+
+    digest_el = signed_root.find(".//ds:DigestValue", NAMESPACES)
+    sig_val_el = signed_root.find(".//ds:SignatureValue", NAMESPACES)
+
+    return {
+        "signed_xml": signed_xml,
+        "signed_bytes": signed_bytes,
+        "signed_root": signed_root,
+        "node_id": node_id,
+        "digest_value": digest_el.text if digest_el is not None else "",
+        "signature_value": sig_val_el.text if sig_val_el is not None else "",
+    }
+
+
+def _sign_job(cert: SigningKey, xml: str | etree._Element, doc_type: str, doc_id: str) -> dict:
+    """Assina um job de lote; devolve só dados serializáveis (sem signed_root/signed_bytes)."""
+    try:
+        result = sign_xml(xml, cert, doc_type, doc_id)
+    except Exception as e:
+        # O erro vai por documento no resultado do lote; o traceback só no log
+        logger.exception(f"[SIGN] Falha ao assinar {doc_id} ({doc_type})")
+        return {"error": f"Erro ao assinar: {str(e)}"}
+    del result["signed_root"], result["signed_bytes"]
+    return result
+
+
+# Chaves já carregadas neste processo do pool, por fingerprint (LRU)
+_pool_keys: OrderedDict[str, SigningKey] = OrderedDict()
+_pool_keys_lock = threading.Lock()
+
+
+def _pool_key(material: KeyMaterial) -> SigningKey:
+    with _pool_keys_lock:
+        key = _pool_keys.get(material.fingerprint)
+        if key is not None:
+            _pool_keys.move_to_end(material.fingerprint)
+            return key
+    key = SigningKey.from_material(material)
+    with _pool_keys_lock:
+        _pool_keys[material.fingerprint] = key
+        while len(_pool_keys) > SIGN_POOL_KEY_CACHE:
+            _pool_keys.popitem(last=False)
+    return key
+
+
+def _sign_chunk(material: KeyMaterial, jobs: list[tuple[str, str, str]]) -> list[dict]:
+    """Executado dentro do processo do pool: a chave é montada uma vez por fingerprint."""
+    cert = _pool_key(material)
+    return [_sign_job(cert, *job) for job in jobs]
+
+
+class SigningPool:
+    """
+    Assinatura XMLDSig em paralelo num pool de processos.
+
+    signxml faz C14N e RSA segurando o GIL, então um processo assina um
+    documento por vez. Lotes grandes são divididos em blocos contíguos e
+    distribuídos entre SIGN_WORKERS processos; cada processo monta a chave
+    uma vez (cache por fingerprint) e a reutiliza entre blocos.
+    Lotes menores que SIGN_POOL_MIN_BATCH são assinados no próprio processo.
+    O mesmo pool verifica assinaturas em lote (verify_many).
+    """
+
+    def __init__(self, workers: int, min_batch: int, start_method: str):
+        self.workers = workers
+        self.min_batch = min_batch
+        self.start_method = start_method
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                )
+            return self._executor
+
+    def in_process(self, count: int) -> bool:
+        """Se `count` itens rodam aqui mesmo (lote pequeno ou pool de um worker)."""
+        return self.workers <= 1 or count < self.min_batch
+
+    def sign_many(self, cert: SigningKey, jobs: list[tuple[str | etree._Element, str, str]]) -> list[dict]:
+        """
+        Assina [(xml, doc_type, doc_id), ...] e devolve os resultados na mesma
+        ordem. Árvores já parseadas só servem quando in_process(len(jobs)); para
+        os processos o XML vai como texto.
+        """
+        if self.in_process(len(jobs)):
+            return [_sign_job(cert, *job) for job in jobs]
+        return self.map_chunks(_sign_chunk, jobs, cert.export())
+
+    def map_chunks(self, func: Callable[..., list], items: list, *args) -> list:
+        """
+        Executa func(*args, bloco) nos processos, com `items` dividido em blocos
+        contíguos, e junta os resultados na ordem. Lotes pequenos rodam aqui mesmo.
+        """
+        if self.in_process(len(items)):
+            return func(*args, items)
+        chunk_size = max(1, -(-len(items) // (self.workers * 2)))
+        executor = self._get_executor()
+        futures = [
+            executor.submit(func, *args, items[i:i + chunk_size])
+            for i in range(0, len(items), chunk_size)
+        ]
+        results = []
+        for future in futures:
+            results.extend(future.result())
+        return results
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
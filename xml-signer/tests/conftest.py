@@ -0,0 +1,130 @@
+"""
+Testes do xml-signer. Rodam offline (certificados gerados por bench/fixtures.py)
+a partir de xml-signer/:
+  python -m pytest -q tests
+"""
+
+import argparse
+import base64
+import os
+import ssl
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+from lxml import etree
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fixtures import PFX_PASSWORD, make_ca, make_pfx, make_server_cert  # noqa: E402
+from bench.mock_sefaz import SOAP_NS, MockSefaz  # noqa: E402
+from cryptography.hazmat.primitives.serialization import Encoding, NoEncryption, PrivateFormat  # noqa: E402
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Responde 200 a todo POST (/slow: após 0,3s); anota se o handshake da conexão foi retomado."""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.reused.append(self.connection.session_reused)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path == "/slow":
+            time.sleep(0.3)
+        body = b"<ok/>"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        if self.path == "/close":
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope="session")
+def cert_fields() -> dict:
+    """pfx_base64/password de um A1 autoassinado, para os bodies de request."""
+    return {"pfx_base64": base64.b64encode(make_pfx()).decode(), "password": PFX_PASSWORD.decode()}
+
+
+@pytest.fixture(scope="session")
+def test_ca():
+    return make_ca("AC TESTE XML-SIGNER")
+
+
+@pytest.fixture
+def mtls_server(test_ca, tmp_path):
+    """
+    Servidor HTTPS local que exige certificado de cliente emitido pela AC de
+    teste. `reused` lista, por conexão aceita, se o handshake foi retomado.
+    """
+    key, cert = make_server_cert(test_ca, ["127.0.0.1", "localhost"])
+    cert_path = tmp_path / "server.pem"
+    cert_path.write_bytes(
+        cert.public_bytes(Encoding.PEM)
+        + key.private_bytes(Encoding.PEM, PrivateFormat.TraditionalOpenSSL, NoEncryption())
+    )
+    ca_pem = test_ca[1].public_bytes(Encoding.PEM).decode()
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(str(cert_path))
+    context.load_verify_locations(cadata=ca_pem)
+    context.verify_mode = ssl.CERT_REQUIRED
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.daemon_threads = True
+    server.reused = []
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield SimpleNamespace(
+            port=server.server_address[1],
+            ca_pem=ca_pem,
+            pfx=make_pfx(ca=test_ca),
+            reused=server.reused,
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def fake_sefaz(monkeypatch) -> MockSefaz:
+    """
+    SEFAZ em processo: o MockSefaz de bench/mock_sefaz.py responde às chamadas
+    de app.send_to_sefaz, sem rede. `emit_mix` (parse_mix) muda os cStat,
+    `calls` lista a operação (fim do SOAPAction) de cada chamada e `fail_calls` os números das chamadas
+    (1, 2, ...) que falham com erro de conexão. Cache de consultas e
+    idempotência começam vazios.
+    """
+    import app
+    from consult_cache import ConsultCache
+    from idempotency import IdempotencyStore
+
+    mock = MockSefaz(argparse.Namespace(
+        latency=[], processing_delay="0", emit_mix="100=100", mdfe_mix="100=100", event_mix="135=100",
+        max_documents=100_000,
+    ))
+    mock.calls = []
+    mock.fail_calls = set()
+
+    def send_to_sefaz(url, soap_xml, cert, soap_action, timeout=None, endpoint=("", "", "")):
+        mock.calls.append(soap_action.rpartition("/")[2])
+        if len(mock.calls) in mock.fail_calls:
+            raise ConnectionError(f"Falha simulada na chamada {len(mock.calls)}")
+        _, result = mock.dispatch(app.build_soap_envelope(soap_xml, soap_action))
+        return etree.fromstring(f'<Body xmlns="{SOAP_NS}">{result}</Body>')
+
+    monkeypatch.setattr(app, "send_to_sefaz", send_to_sefaz)
+    monkeypatch.setattr(app, "consult_cache", ConsultCache(1000, 60))
+    monkeypatch.setattr(app, "idempotency_store", IdempotencyStore(ttl=60, lease=30))
+    return mock
@@ -0,0 +1,126 @@
+"""Modo assíncrono (aiohttp): rotas pelo cliente de teste do aiohttp e ciclo de vida das sessões SEFAZ."""
+
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import app
+import async_app
+from bench.fixtures import PFX_PASSWORD, chave_acesso, cte_xml
+from bench.mock_sefaz import SOAP_NS
+
+
+class StubSefazClient:
+    """No lugar do AsyncSefazClient: entrega o envelope ao MockSefaz, sem rede."""
+
+    def __init__(self, mock):
+        self.mock = mock
+
+    async def post(self, cert, call, data: bytes) -> tuple[int, bytes]:
+        self.mock.calls.append(call.soap_action.rpartition("/")[2])
+        service, result = self.mock.dispatch(data)
+        envelope = (
+            f'<soap:Envelope xmlns:soap="{SOAP_NS}"><soap:Body>'
+            f"<{service}Result>{result}</{service}Result></soap:Body></soap:Envelope>"
+        )
+        return 200, envelope.encode()
+
+    async def close_idle(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"sessions": 0, "limit_per_host": 0}
+
+
+@pytest.fixture
+def client(fake_sefaz, monkeypatch):
+    """Executa `scenario(client)` com a aplicação aiohttp no ar, respondendo pela SEFAZ simulada."""
+    monkeypatch.setattr(async_app, "sefaz_client", StubSefazClient(fake_sefaz))
+    # O cleanup da aplicação encerra o executor: cada teste usa o seu
+    monkeypatch.setattr(async_app, "cpu_executor", ThreadPoolExecutor(max_workers=2))
+
+    def run(scenario):
+        async def main():
+            async with TestClient(TestServer(async_app.create_app())) as test_client:
+                return await scenario(test_client)
+        return asyncio.run(main())
+
+    return run
+
+
+def test_emit(fake_sefaz, client, cert_fields):
+    async def scenario(test_client):
+        response = await test_client.post("/cte/emit", json={
+            "xml": cte_xml(1, 21), "uf": "SP", "ambiente": "homologacao", "skip_xsd_validation": True,
+            **cert_fields,
+        })
+        return response.status, await response.json()
+
+    status, body = client(scenario)
+    assert status == 200
+    assert (body["cStat"], body["status_detail"]) == ("100", "autorizado")
+    assert body["protocolo"] and body["chave_acesso"] == chave_acesso("57", 21)
+    assert fake_sefaz.calls == ["cteRecepcaoLote"]
+
+
+def test_consult_batch_stream(fake_sefaz, client, cert_fields):
+    chaves = [chave_acesso("57", numero) for numero in (31, 32, 33)]
+    for numero, chave in enumerate(chaves):
+        fake_sefaz.remember(chave, "100", f"13526000000000{numero}")
+
+    async def scenario(test_client):
+        response = await test_client.post("/cte/consult-batch", json={
+            "chaves": chaves + ["123"], "ambiente": "homologacao", **cert_fields,
+        })
+        return response.status, response.content_type, await response.text()
+
+    status, content_type, text = client(scenario)
+    assert status == 200 and content_type == "application/x-ndjson"
+    lines = [json.loads(line) for line in text.splitlines()]
+    assert (lines[0]["chave_acesso"], lines[0]["http_status"]) == ("123", 400)
+    assert sorted(line["chave_acesso"] for line in lines[1:-1]) == sorted(chaves)
+    assert {line["status_detail"] for line in lines[1:-1]} == {"autorizado"}
+    assert lines[-1] == {"done": True, "total": 4, "status_detail": {"autorizado": 3, "requisicao_invalida": 1}}
+    assert fake_sefaz.calls == ["cteConsultaCT"] * 3
+
+
+def test_health(client):
+    async def scenario(test_client):
+        response = await test_client.get("/health")
+        return response.status, await response.json()
+
+    status, body = client(scenario)
+    assert status == 200
+    assert body["serve_mode"] == "async" and "async_sessions" in body
+
+
+# ── AsyncSefazClient ─────────────────────────────────────────────
+
+def test_close_idle_keeps_session_in_use(mtls_server):
+    cert = app.InMemoryCert(mtls_server.pfx, PFX_PASSWORD)
+    cert.ssl_context.load_verify_locations(cadata=mtls_server.ca_pem)
+    call = app.SefazCall(f"https://127.0.0.1:{mtls_server.port}/slow", b"<a/>", "teste", 5)
+
+    async def main():
+        sefaz_client = async_app.AsyncSefazClient(limit_per_host=2, idle_timeout=0)
+        try:
+            post = asyncio.create_task(sefaz_client.post(cert, call, b"<a/>"))
+            await asyncio.sleep(0.1)
+            # Ociosa pelo relógio, mas com a chamada em andamento: fica
+            await sefaz_client.close_idle()
+            assert sefaz_client.stats()["sessions"] == 1
+            assert await post == (200, b"<ok/>")
+
+            await asyncio.sleep(0.01)
+            await sefaz_client.close_idle()
+            assert sefaz_client.stats()["sessions"] == 0
+        finally:
+            await sefaz_client.close()
+
+    asyncio.run(main())
@@ -0,0 +1,159 @@
+"""CertCache: LRU/TTL, carga única para threads concorrentes e erros de senha fora do cache."""
+
+import threading
+import time
+
+import pytest
+
+import app
+from bench.fixtures import PFX_PASSWORD, make_pfx
+
+
+@pytest.fixture(scope="module")
+def pfxs() -> list[bytes]:
+    return [make_pfx() for _ in range(3)]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [time.time()]
+    monkeypatch.setattr(app.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def loads(monkeypatch) -> list[bytes]:
+    """Conta as cargas PKCS#12 de fato feitas (as que não vieram do cache)."""
+    calls = []
+    load = app.InMemoryCert
+
+    def counting(pfx_bytes, password):
+        calls.append(pfx_bytes)
+        return load(pfx_bytes, password)
+
+    monkeypatch.setattr(app, "InMemoryCert", counting)
+    return calls
+
+
+def test_hit_returns_the_same_cert(pfxs, loads):
+    cache = app.CertCache(max_size=2, ttl=60)
+    first = cache.get(pfxs[0], PFX_PASSWORD)
+    assert cache.get(pfxs[0], PFX_PASSWORD) is first
+    assert len(loads) == 1
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+
+
+def test_lru_evicts_least_recently_used(pfxs, loads):
+    cache = app.CertCache(max_size=2, ttl=60)
+    cache.get(pfxs[0], PFX_PASSWORD)
+    cache.get(pfxs[1], PFX_PASSWORD)
+    cache.get(pfxs[0], PFX_PASSWORD)  # pfxs[1] passa a ser o menos usado
+    cache.get(pfxs[2], PFX_PASSWORD)
+    assert cache.stats()["size"] == 2 and cache.stats()["evictions"] == 1
+
+    cache.get(pfxs[0], PFX_PASSWORD)
+    assert len(loads) == 3
+    cache.get(pfxs[1], PFX_PASSWORD)
+    assert loads[-1] == pfxs[1] and len(loads) == 4
+
+
+def test_ttl_expires_entry(pfxs, loads, clock):
+    cache = app.CertCache(max_size=2, ttl=60)
+    first = cache.get(pfxs[0], PFX_PASSWORD)
+    clock[0] += 59
+    assert cache.get(pfxs[0], PFX_PASSWORD) is first
+    clock[0] += 2
+    assert cache.get(pfxs[0], PFX_PASSWORD) is not first
+    assert len(loads) == 2 and cache.stats()["evictions"] == 1
+
+
+def test_expiry_capped_by_certificate_validity(loads, clock):
+    pfx = make_pfx(days=1)
+    cache = app.CertCache(max_size=2, ttl=7 * 86400)
+    cache.get(pfx, PFX_PASSWORD)
+    clock[0] += 2 * 86400
+    cache.get(pfx, PFX_PASSWORD)
+    assert len(loads) == 2
+
+
+def test_concurrent_loads_are_coalesced(pfxs, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    calls = []
+    load = app.InMemoryCert
+
+    def slow(pfx_bytes, password):
+        calls.append(pfx_bytes)
+        started.set()
+        release.wait(5)
+        return load(pfx_bytes, password)
+
+    monkeypatch.setattr(app, "InMemoryCert", slow)
+    cache = app.CertCache(max_size=2, ttl=60)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(pfxs[0], PFX_PASSWORD))) for _ in range(4)]
+    threads[0].start()
+    assert started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    while cache.stats()["coalesced"] < 3:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert len(results) == 4 and all(cert is results[0] for cert in results)
+    assert cache.stats()["misses"] == 1
+
+
+def test_wrong_password_is_not_cached(pfxs, loads):
+    cache = app.CertCache(max_size=2, ttl=60)
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            cache.get(pfxs[0], b"senha-errada")
+    assert len(loads) == 2
+    assert cache.stats()["size"] == 0
+    # A senha certa depois do erro carrega normalmente
+    assert cache.get(pfxs[0], PFX_PASSWORD).cnpj
+
+
+def test_wrong_password_propagates_to_waiting_threads(pfxs, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    load = app.InMemoryCert
+
+    def slow(pfx_bytes, password):
+        started.set()
+        release.wait(5)
+        return load(pfx_bytes, password)
+
+    monkeypatch.setattr(app, "InMemoryCert", slow)
+    cache = app.CertCache(max_size=2, ttl=60)
+    errors = []
+
+    def get():
+        try:
+            cache.get(pfxs[0], b"senha-errada")
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=get) for _ in range(2)]
+    threads[0].start()
+    assert started.wait(5)
+    threads[1].start()
+    while cache.stats()["coalesced"] < 1:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(errors) == 2
+    assert cache.stats()["size"] == 0 and not cache._loading
+
+
+def test_clear_resets_counters(pfxs):
+    cache = app.CertCache(max_size=1, ttl=60)
+    cache.get(pfxs[0], PFX_PASSWORD)
+    cache.get(pfxs[0], PFX_PASSWORD)
+    cache.get(pfxs[1], PFX_PASSWORD)
+    cache.clear()
+    stats = cache.stats()
+    assert (stats["size"], stats["hits"], stats["misses"], stats["evictions"], stats["coalesced"]) == (0, 0, 0, 0, 0)
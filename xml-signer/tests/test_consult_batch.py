@@ -0,0 +1,153 @@
+"""Consulta em lote: uma consulta por chave, com o certificado e a idempotência do lote, em stream NDJSON."""
+
+import base64
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from lxml import etree
+
+import app
+from bench.fixtures import PFX_PASSWORD, chave_acesso, make_pfx
+from consult_cache import ConsultCache
+from idempotency import IdempotencyStore
+
+CHAVES = [chave_acesso("57", numero) for numero in (1, 2, 3)]
+
+
+def ret_cons_sit(cstat: str, chave: str) -> etree._Element:
+    return etree.fromstring(
+        '<retConsSitCTe xmlns="http://www.portalfiscal.inf.br/cte" versao="4.00">'
+        f"<cStat>{cstat}</cStat><xMotivo>Autorizado o uso do CT-e</xMotivo>"
+        f"<protCTe><infProt><chCTe>{chave}</chCTe><nProt>135{chave[-12:]}</nProt>"
+        f"<cStat>{cstat}</cStat></infProt></protCTe></retConsSitCTe>"
+    )
+
+
+@pytest.fixture
+def sefaz(monkeypatch) -> SimpleNamespace:
+    """
+    SEFAZ simulada: responde 100 para toda chave consultada. `calls` anota as
+    chaves, `delays` atrasa a resposta de uma chave, `gate` (Semaphore) segura
+    cada chamada até ser liberada e `peak` guarda, por URL, o máximo de
+    chamadas simultâneas.
+    """
+    state = SimpleNamespace(calls=[], delays={}, gate=None, peak={}, in_flight={}, lock=threading.Lock())
+
+    def send_to_sefaz(url, soap_xml, cert, soap_action, timeout=None, endpoint=("", "", "")):
+        chave = etree.fromstring(soap_xml).findtext("{*}chCTe")
+        with state.lock:
+            state.calls.append(chave)
+            state.in_flight[url] = state.in_flight.get(url, 0) + 1
+            state.peak[url] = max(state.peak.get(url, 0), state.in_flight[url])
+        try:
+            if state.gate is not None:
+                state.gate.acquire(timeout=5)
+            time.sleep(state.delays.get(chave, 0.01))
+            return ret_cons_sit("100", chave)
+        finally:
+            with state.lock:
+                state.in_flight[url] -= 1
+
+    monkeypatch.setattr(app, "send_to_sefaz", send_to_sefaz)
+    monkeypatch.setattr(app, "consult_cache", ConsultCache(0, 0))
+    monkeypatch.setattr(app, "idempotency_store", IdempotencyStore(ttl=60, lease=30))
+    return state
+
+
+@pytest.fixture
+def batch_data() -> dict:
+    return {
+        "chaves": CHAVES, "pfx_base64": base64.b64encode(make_pfx()).decode(),
+        "password": PFX_PASSWORD.decode(), "ambiente": "homologacao",
+    }
+
+
+def run_batch(data: dict) -> list[dict]:
+    return list(app.stream_consult_batch(app.prepare_consult_batch("/cte/consult-batch", data)))
+
+
+def wait_batch_threads():
+    deadline = time.monotonic() + 5
+    while any(thread.name == "consult-batch" for thread in threading.enumerate()):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_explicit_idempotency_key_applies_per_chave(sefaz, batch_data):
+    batch_data["idempotency_key"] = "conciliacao-2026-01"
+    lines = run_batch(batch_data)
+    assert sorted(line["chave_acesso"] for line in lines[:-1]) == sorted(CHAVES)
+    assert {line["http_status"] for line in lines[:-1]} == {200}
+    assert {line["status_detail"] for line in lines[:-1]} == {"autorizado"}
+    assert sorted(sefaz.calls) == sorted(CHAVES)
+
+    # O mesmo lote repetido é replay chave a chave, sem ir à SEFAZ
+    replay = run_batch(batch_data)
+    assert all(line["idempotent_replay"] for line in replay[:-1])
+    assert len(sefaz.calls) == len(CHAVES)
+
+
+def test_lines_follow_completion_order(sefaz, batch_data):
+    sefaz.delays = {CHAVES[0]: 0.3, CHAVES[1]: 0.15, CHAVES[2]: 0.0}
+    lines = run_batch(batch_data)
+    assert [line["chave_acesso"] for line in lines[:-1]] == CHAVES[::-1]
+
+
+def test_invalid_keys_first_and_summary_last(sefaz, batch_data):
+    batch_data["chaves"] = ["123", CHAVES[0], "x" * 44, CHAVES[0], CHAVES[1]]
+    lines = run_batch(batch_data)
+    assert [(line["chave_acesso"], line["http_status"]) for line in lines[:2]] == [("123", 400), ("x" * 44, 400)]
+    assert {line["status_detail"] for line in lines[:2]} == {"requisicao_invalida"}
+    # Chave repetida é consultada uma vez
+    assert sorted(line["chave_acesso"] for line in lines[2:-1]) == sorted(CHAVES[:2])
+    assert lines[-1] == {"done": True, "total": 4, "status_detail": {"autorizado": 2, "requisicao_invalida": 2}}
+    assert sorted(sefaz.calls) == sorted(CHAVES[:2])
+
+
+def test_concurrency_capped_per_endpoint(sefaz, batch_data, monkeypatch):
+    monkeypatch.setattr(app, "CONSULT_BATCH_CONCURRENCY", 2)
+    sp = [chave_acesso("57", numero) for numero in range(1, 7)]
+    mg = [chave_acesso("57", numero, uf="31") for numero in range(1, 7)]
+    sefaz.delays = dict.fromkeys(sp + mg, 0.05)
+    batch_data["chaves"] = sp + mg
+    lines = run_batch(batch_data)
+    assert lines[-1]["status_detail"] == {"autorizado": 12}
+    assert len(sefaz.peak) == 2
+    # Os dois endpoints andam em paralelo, cada um com no máximo 2 chamadas
+    assert set(sefaz.peak.values()) == {2}
+
+
+def test_client_disconnect_stops_batch(sefaz, batch_data, monkeypatch):
+    monkeypatch.setattr(app, "CONSULT_BATCH_CONCURRENCY", 1)
+    batch_data["chaves"] = [chave_acesso("57", numero) for numero in range(1, 11)]
+    sefaz.gate = threading.Semaphore(0)
+    stream = app.stream_consult_batch(app.prepare_consult_batch("/cte/consult-batch", batch_data))
+    sefaz.gate.release()
+    assert next(stream)["http_status"] == 200
+    stream.close()  # o WSGI fecha o gerador quando o cliente desconecta
+    sefaz.gate.release(10)
+    wait_batch_threads()
+    # Só a chave que já estava em andamento ao fechar chega à SEFAZ
+    assert len(sefaz.calls) <= 2
+
+
+def test_route_streams_ndjson(sefaz, batch_data):
+    batch_data["chaves"] = CHAVES + ["123"]
+    response = app.app.test_client().post("/cte/consult-batch", json=batch_data)
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[0]["chave_acesso"] == "123"
+    assert lines[-1]["done"] and lines[-1]["total"] == 4
+
+
+def test_route_rejects_bad_certificate_before_streaming(sefaz, batch_data):
+    batch_data["password"] = "senha-errada"
+    response = app.app.test_client().post("/cte/consult-batch", json=batch_data)
+    # Erro comum em JSON (como em /cte/consult), não um stream NDJSON começado
+    assert response.status_code == 500 and response.mimetype == "application/json"
+    assert "password" in response.get_json()["error"]
+    assert sefaz.calls == []
@@ -0,0 +1,144 @@
+"""ConsultCache: situação final sem prazo, transitória por TTL, LRU e SQLite compartilhado."""
+
+import pytest
+
+import consult_cache
+from consult_cache import ConsultCache
+
+CHAVE = "35260112345678000199570010000000011000000011"
+AUTORIZADO = {
+    "success": True, "cStat": "100", "xMotivo": "Autorizado o uso do CT-e",
+    "chave_acesso": CHAVE, "protocolo": "135000000000001", "status_detail": "autorizado",
+}
+CANCELADO = {
+    "success": True, "cStat": "101", "xMotivo": "Cancelamento homologado",
+    "chave_acesso": CHAVE, "protocolo": "135000000000002", "status_detail": "cancelamento_homologado",
+}
+NAO_CONSTA = {"success": False, "cStat": "217", "xMotivo": "Rejeicao: CT-e nao consta na base de dados da SEFAZ"}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(consult_cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_terminal_result_never_expires(clock):
+    cache = ConsultCache(max_entries=10, transient_ttl=30)
+    cache.put("homologacao", CHAVE, CANCELADO)
+    clock[0] += 86400 * 365
+    hit = cache.get("homologacao", CHAVE)
+    assert hit["protocolo"] == "135000000000002" and hit["cached"] is True
+    assert "cached_at" in hit
+
+
+def test_authorized_expires_in_memory_only_cache(clock):
+    # Sem SQLite, um cancelamento feito por outro worker só aparece após transient_ttl
+    cache = ConsultCache(max_entries=10, transient_ttl=30)
+    cache.put("homologacao", CHAVE, AUTORIZADO)
+    assert cache.get("homologacao", CHAVE)["cStat"] == "100"
+    clock[0] += 31
+    assert cache.get("homologacao", CHAVE) is None
+
+
+def test_transient_result_expires(clock):
+    cache = ConsultCache(max_entries=10, transient_ttl=30)
+    cache.put("homologacao", CHAVE, NAO_CONSTA)
+    clock[0] += 29
+    assert cache.get("homologacao", CHAVE)["cStat"] == "217"
+    clock[0] += 2
+    assert cache.get("homologacao", CHAVE) is None
+    assert cache.stats()["size"] == 0
+
+
+def test_ambiente_is_part_of_key():
+    cache = ConsultCache(max_entries=10, transient_ttl=30)
+    cache.put("homologacao", CHAVE, AUTORIZADO)
+    assert cache.get("producao", CHAVE) is None
+
+
+def test_only_consult_fields_are_stored():
+    cache = ConsultCache(max_entries=10, transient_ttl=30)
+    cache.put("homologacao", CHAVE, dict(AUTORIZADO, signed_xml="<CTe/>", elapsed_ms=12))
+    hit = cache.get("homologacao", CHAVE)
+    assert set(hit) - {"cached", "cached_at"} <= set(consult_cache.CONSULT_FIELDS)
+    assert "signed_xml" not in hit
+
+
+def test_unavailable_and_empty_are_not_stored():
+    cache = ConsultCache(max_entries=10, transient_ttl=30)
+    cache.put("homologacao", CHAVE, {"cStat": "", "status_detail": "erro"})
+    cache.put("homologacao", CHAVE, {"cStat": "108", "status_detail": "servico_indisponivel"})
+    cache.put("homologacao", "", AUTORIZADO)
+    assert cache.stats()["size"] == 0
+
+
+def test_put_final_ignores_non_terminal():
+    cache = ConsultCache(max_entries=10, transient_ttl=30)
+    cache.put_final("homologacao", CHAVE, NAO_CONSTA)
+    assert cache.get("homologacao", CHAVE) is None
+
+
+def test_lru_eviction():
+    cache = ConsultCache(max_entries=2, transient_ttl=30)
+    cache.put("homologacao", "a", AUTORIZADO)
+    cache.put("homologacao", "b", AUTORIZADO)
+    assert cache.get("homologacao", "a") is not None
+    cache.put("homologacao", "c", AUTORIZADO)
+    assert cache.get("homologacao", "b") is None
+    assert cache.get("homologacao", "a") is not None
+    assert cache.get("homologacao", "c") is not None
+
+
+def test_disabled_when_max_entries_zero():
+    cache = ConsultCache(max_entries=0, transient_ttl=30)
+    assert not cache.enabled
+    cache.put("homologacao", CHAVE, AUTORIZADO)
+    assert cache.get("homologacao", CHAVE) is None
+    assert cache.stats()["misses"] == 0
+
+
+def test_terminal_shared_through_sqlite(tmp_path):
+    db = str(tmp_path / "cache" / "consult.db")
+    ConsultCache(max_entries=10, transient_ttl=30, db_path=db).put("homologacao", CHAVE, AUTORIZADO)
+    ConsultCache(max_entries=10, transient_ttl=30, db_path=db).put("homologacao", "outra", NAO_CONSTA)
+    other = ConsultCache(max_entries=10, transient_ttl=30, db_path=db)
+    assert other.get("homologacao", CHAVE)["protocolo"] == "135000000000001"
+    assert other.get("homologacao", "outra") is None
+    assert other.get("homologacao", CHAVE) is not None
+    stats = other.stats()
+    # "autorizado" não vai para a memória: as duas leituras são do SQLite
+    assert (stats["disk_hits"], stats["hits"], stats["misses"], stats["size"]) == (2, 0, 1, 0)
+
+
+def test_cancel_by_one_worker_seen_by_other(tmp_path):
+    db = str(tmp_path / "consult.db")
+    worker_a = ConsultCache(max_entries=10, transient_ttl=30, db_path=db)
+    worker_b = ConsultCache(max_entries=10, transient_ttl=30, db_path=db)
+    worker_a.put("homologacao", CHAVE, AUTORIZADO)
+    assert worker_b.get("homologacao", CHAVE)["cStat"] == "100"
+    worker_a.put_final("homologacao", CHAVE, CANCELADO)
+    assert worker_b.get("homologacao", CHAVE)["cStat"] == "101"
+    # Situação que não muda mais fica na memória do worker que leu
+    assert worker_b.get("homologacao", CHAVE)["cStat"] == "101"
+    assert worker_b.stats()["hits"] == 1
+
+
+def test_close_by_one_worker_seen_by_other(tmp_path):
+    db = str(tmp_path / "consult.db")
+    worker_a = ConsultCache(max_entries=10, transient_ttl=30, db_path=db)
+    worker_b = ConsultCache(max_entries=10, transient_ttl=30, db_path=db)
+    worker_b.put("homologacao", CHAVE, AUTORIZADO)
+    assert worker_b.get("homologacao", CHAVE) is not None
+    worker_a.discard("homologacao", CHAVE)
+    assert worker_b.get("homologacao", CHAVE) is None
+
+
+def test_discard_removes_from_disk(tmp_path):
+    db = str(tmp_path / "consult.db")
+    cache = ConsultCache(max_entries=10, transient_ttl=30, db_path=db)
+    cache.put("homologacao", CHAVE, AUTORIZADO)
+    cache.discard("homologacao", CHAVE)
+    assert cache.get("homologacao", CHAVE) is None
+    assert ConsultCache(max_entries=10, transient_ttl=30, db_path=db).get("homologacao", CHAVE) is None
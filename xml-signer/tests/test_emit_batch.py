@@ -0,0 +1,128 @@
+"""/cte/emit-batch: empacotamento em lotes, protocolo por chave, falha parcial e recibos."""
+
+import pytest
+from lxml import etree
+
+import app
+from bench.fixtures import chave_acesso, cte_xml
+from bench.mock_sefaz import CTE_NS, parse_mix
+
+
+@pytest.fixture
+def batch(cert_fields):
+    def make(*numeros: int, **extra) -> dict:
+        return {
+            "xmls": [{"xml": cte_xml(1, n), "document_id": f"doc{n}"} for n in numeros],
+            "uf": "SP", "ambiente": "homologacao", "skip_xsd_validation": True, **cert_fields, **extra,
+        }
+    return make
+
+
+def emit(data: dict) -> dict:
+    return app.run_plan(app.prepare_cte_emit_batch(data))
+
+
+# ── pack_cte_lotes ───────────────────────────────────────────────
+
+def test_pack_by_document_count():
+    lotes = app.pack_cte_lotes(["<CTe/>"] * 120)
+    assert [len(lote) for lote in lotes] == [50, 50, 20]
+    assert [i for lote in lotes for i in lote] == list(range(120))
+
+
+def test_pack_by_size_boundary():
+    overhead = len(app.build_cte_lote_xml([], "0" * 15).encode("utf-8"))
+    room = app.CTE_LOTE_MAX_BYTES - overhead
+    # Cada documento ocupa len + 3 no lote; os dois primeiros fecham exatamente o limite
+    first = "a" * (room // 2 - 3)
+    second = "b" * (room - len(first) - 6)
+    assert app.pack_cte_lotes([first, second, "c"]) == [[0, 1], [2]]
+    assert app.pack_cte_lotes([first, second + "b", "c"]) == [[0], [1, 2]]
+
+
+def test_oversized_document_goes_alone():
+    big = "x" * (app.CTE_LOTE_MAX_BYTES + 1)
+    assert app.pack_cte_lotes(["<a/>", big, "<b/>"]) == [[0], [1], [2]]
+
+
+# ── Emissão em lote ──────────────────────────────────────────────
+
+def reverse_protocols(mock):
+    """A SEFAZ não garante a ordem dos protCTe: devolve-os invertidos."""
+    envi_cte = mock.envi_cte
+
+    def reversed_envi_cte(request):
+        ret = etree.fromstring(envi_cte(request))
+        prots = ret.findall(f"{{{CTE_NS}}}protCTe")
+        for prot in prots:
+            ret.remove(prot)
+        ret.extend(reversed(prots))
+        return etree.tostring(ret, encoding="unicode")
+
+    mock.envi_cte = reversed_envi_cte
+
+
+def test_protocols_mapped_by_chave(fake_sefaz, batch, monkeypatch):
+    monkeypatch.setattr(app, "CTE_LOTE_MAX_DOCS", 2)
+    reverse_protocols(fake_sefaz)
+    # Já autorizada na SEFAZ: o segundo documento volta com 204
+    fake_sefaz.remember(chave_acesso("57", 2), "100", "135000000000002")
+    result = emit(batch(1, 2, 3))
+
+    assert [lote["quantidade"] for lote in result["lotes"]] == [2, 1]
+    assert [r["document_id"] for r in result["results"]] == ["doc1", "doc2", "doc3"]
+    assert [r["chave_acesso"] for r in result["results"]] == [chave_acesso("57", n) for n in (1, 2, 3)]
+    assert [r["cStat"] for r in result["results"]] == ["100", "204", "100"]
+    assert result["results"][0]["protocolo"] != result["results"][2]["protocolo"]
+    assert result["results"][0]["id_lote"] == result["results"][1]["id_lote"] != result["results"][2]["id_lote"]
+
+
+def test_one_failed_lote_does_not_fail_the_others(fake_sefaz, batch, monkeypatch):
+    monkeypatch.setattr(app, "CTE_LOTE_MAX_DOCS", 2)
+    fake_sefaz.fail_calls = {2}
+    result = emit(batch(1, 2, 3))
+
+    assert [r["status_detail"] for r in result["results"]] == ["autorizado", "autorizado", "erro_envio"]
+    assert "Falha simulada" in result["lotes"][1]["error"]
+    assert "error" not in result["lotes"][0]
+    assert not result["success"]
+
+
+def test_duplicate_chave_rejected_before_sending(fake_sefaz, batch):
+    with pytest.raises(app.RequestError) as error:
+        emit(batch(1, 2, 1))
+    assert error.value.status == 400
+    assert error.value.payload["status_detail"] == "chave_duplicada"
+    assert error.value.payload["chaves_duplicadas"] == [chave_acesso("57", 1)]
+    assert fake_sefaz.calls == []
+
+
+def test_pending_lote_followed_until_protocol(fake_sefaz, batch, monkeypatch):
+    monkeypatch.setattr(app, "receipt_poller", app.ReceiptPoller(initial_delay=0.01, max_delay=0.05))
+    fake_sefaz.emit_mix = parse_mix("103=100")
+    result = emit(batch(1, 2))
+
+    assert fake_sefaz.calls == ["cteRecepcaoLote", "cteRetRecepcao"]
+    assert [r["status_detail"] for r in result["results"]] == ["autorizado", "autorizado"]
+    assert all(r["protocolo"] for r in result["results"])
+    assert result["lotes"][0]["cStat"] == "104"
+
+
+def test_xsd_validated_tree_is_the_one_signed(fake_sefaz, batch, monkeypatch):
+    validated = []
+    monkeypatch.setattr(app, "validate_cte_xsd", lambda root: validated.append(root) or [])
+    result = emit(batch(1, 2, skip_xsd_validation=False))
+
+    assert all(isinstance(root, etree._Element) for root in validated)
+    # A assinatura entrou na árvore validada: não houve segundo parse
+    assert all(root.find(".//{http://www.w3.org/2000/09/xmldsig#}Signature") is not None for root in validated)
+    assert result["success"]
+
+
+def test_malformed_document_reported_per_item(fake_sefaz, batch):
+    data = batch(1, skip_xsd_validation=False)
+    data["xmls"].append({"xml": "<CTe><infCte>", "document_id": "quebrado"})
+    result = emit(data)
+    assert result["results"][1]["status_detail"] == "xsd_invalido"
+    assert result["results"][1]["xsd_errors"][0].startswith("XML malformado")
+    assert result["results"][0]["status_detail"] == "autorizado"
@@ -0,0 +1,79 @@
+"""Compressão dos corpos da API: descompactação com limite, negociação e compressão em blocos."""
+
+import gzip
+import zlib
+
+import pytest
+
+import http_compression
+from http_compression import BodyTooLarge, Compressor, UnsupportedEncoding, decode_body, iter_compressed, negotiate
+
+BODY = b'{"chaves": [' + b",".join(b'"35%042d"' % i for i in range(2000)) + b"]}"
+
+needs_zstd = pytest.mark.skipif(http_compression.zstandard is None, reason="zstandard não instalado")
+
+
+@pytest.mark.parametrize("encoding", ["", "identity", "gzip", "x-gzip", pytest.param("zstd", marks=needs_zstd)])
+def test_decode_body_roundtrip(encoding):
+    if encoding in ("gzip", "x-gzip"):
+        body = gzip.compress(BODY)
+    elif encoding == "zstd":
+        body = http_compression.zstandard.ZstdCompressor().compress(BODY)
+    else:
+        body = BODY
+    assert decode_body(body, encoding, len(BODY)) == BODY
+
+
+@pytest.mark.parametrize("encoding", ["gzip", pytest.param("zstd", marks=needs_zstd)])
+def test_decompression_bomb_is_capped(encoding):
+    bomb = b"\0" * (10 * 1024 * 1024)
+    body = gzip.compress(bomb) if encoding == "gzip" else http_compression.zstandard.ZstdCompressor().compress(bomb)
+    with pytest.raises(BodyTooLarge):
+        decode_body(body, encoding, 1024)
+
+
+def test_truncated_and_invalid_gzip():
+    with pytest.raises(ValueError, match="truncado"):
+        decode_body(gzip.compress(BODY)[:-20], "gzip", len(BODY))
+    with pytest.raises(ValueError, match="inválido"):
+        decode_body(b"nao e gzip", "gzip", len(BODY))
+
+
+def test_unsupported_encoding():
+    with pytest.raises(UnsupportedEncoding):
+        decode_body(BODY, "br", len(BODY))
+
+
+@pytest.mark.parametrize("header,expected", [
+    ("", None),
+    ("gzip", "gzip"),
+    ("gzip;q=0.5, zstd", "zstd"),
+    ("zstd;q=0, gzip;q=0.1", "gzip"),
+    ("*", "zstd"),
+    ("br, deflate", None),
+    ("gzip;q=abc", None),
+])
+def test_negotiate(header, expected):
+    if http_compression.zstandard is None and expected == "zstd":
+        expected = "gzip"
+    assert negotiate(header) == expected
+
+
+@pytest.mark.parametrize("encoding", ["gzip", pytest.param("zstd", marks=needs_zstd)])
+def test_iter_compressed_roundtrip(encoding):
+    chunks = [BODY[i:i + 70_000] for i in range(0, len(BODY), 70_000)]
+    compressed = b"".join(iter_compressed(chunks, Compressor(encoding, 3)))
+    assert decode_body(compressed, encoding, len(BODY)) == BODY
+
+
+def test_flush_each_emits_every_line():
+    compressor = Compressor("gzip", 3)
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    lines = [b'{"chave_acesso":"1"}\n', b'{"chave_acesso":"2"}\n']
+    stream = iter_compressed(iter(lines), compressor, flush_each=True)
+    received = b""
+    for line in lines:
+        # Cada linha já sai descompactável, sem esperar o fim do stream
+        while not received.endswith(line):
+            received += decompressor.decompress(next(stream))
+    assert received == b"".join(lines)
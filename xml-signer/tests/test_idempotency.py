@@ -0,0 +1,93 @@
+"""IdempotencyStore: líder/espera/replay no processo e entre processos (SQLite compartilhado)."""
+
+import sqlite3
+
+import pytest
+
+import idempotency
+from idempotency import IdempotencyConflict, IdempotencyStore
+
+RESULT = {"success": True, "status_detail": "autorizado", "protocolo": "135000000000001"}
+
+
+class OtherProcess(IdempotencyStore):
+    """Mesmo banco, outro dono: simula um segundo worker/réplica."""
+
+    owner = "outra-replica:1"
+
+
+def test_leader_wait_replay():
+    store = IdempotencyStore(ttl=60, lease=30)
+    leader = store.begin("k", "fp")
+    assert leader.role == "leader"
+    waiter = store.begin("k", "fp")
+    assert waiter.role == "wait"
+    store.finish("k", "fp", RESULT)
+    assert waiter.future.result(timeout=1) == RESULT
+    replay = store.begin("k", "fp")
+    assert (replay.role, replay.result) == ("replay", RESULT)
+    assert store.stats()["replays"] == 1 and store.stats()["coalesced"] == 1
+
+
+def test_conflicting_content():
+    store = IdempotencyStore(ttl=60, lease=30)
+    store.begin("k", "fp")
+    with pytest.raises(IdempotencyConflict):
+        store.begin("k", "outro")
+
+
+def test_failure_releases_key():
+    store = IdempotencyStore(ttl=60, lease=30)
+    store.begin("k", "fp")
+    waiter = store.begin("k", "fp")
+    store.finish("k", "fp", None)
+    assert waiter.future.result(timeout=1) is None
+    assert store.begin("k", "fp").role == "leader"
+
+
+def test_unstored_result_goes_to_waiters_only():
+    store = IdempotencyStore(ttl=60, lease=30)
+    store.begin("k", "fp")
+    waiter = store.begin("k", "fp")
+    unavailable = {"success": False, "status_detail": "servico_indisponivel"}
+    store.finish("k", "fp", unavailable, store=False)
+    assert waiter.future.result(timeout=1) == unavailable
+    assert store.begin("k", "fp").role == "leader"
+
+
+def test_replay_expires(monkeypatch):
+    store = IdempotencyStore(ttl=60, lease=30)
+    now = [1000.0]
+    monkeypatch.setattr(idempotency.time, "time", lambda: now[0])
+    store.begin("k", "fp")
+    store.finish("k", "fp", RESULT)
+    now[0] += 61
+    assert store.begin("k", "fp").role == "leader"
+
+
+def test_shared_db_waits_for_other_process(tmp_path, monkeypatch):
+    monkeypatch.setattr(idempotency, "POLL_INTERVAL", 0.01)
+    db = str(tmp_path / "idem.sqlite3")
+    first, second = IdempotencyStore(60, 30, db), OtherProcess(60, 30, db)
+    assert first.begin("k", "fp").role == "leader"
+    waiter = second.begin("k", "fp")
+    assert waiter.role == "wait"
+    first.finish("k", "fp", RESULT)
+    assert waiter.future.result(timeout=5) == RESULT
+    assert second.begin("k", "fp").role == "replay"
+
+
+def test_shared_db_replays_across_processes(tmp_path):
+    db = str(tmp_path / "idem.sqlite3")
+    first = IdempotencyStore(60, 30, db)
+    first.begin("k", "fp")
+    first.finish("k", "fp", RESULT)
+    claim = OtherProcess(60, 30, db).begin("k", "fp")
+    assert (claim.role, claim.result) == ("replay", RESULT)
+
+
+def test_shared_db_takes_over_expired_lease(tmp_path):
+    db = str(tmp_path / "idem.sqlite3")
+    IdempotencyStore(60, 30, db).begin("k", "fp")  # líder morre sem finish
+    sqlite3.connect(db, isolation_level=None).execute("UPDATE idempotency SET expires_at = 0")
+    assert OtherProcess(60, 30, db).begin("k", "fp").role == "leader"
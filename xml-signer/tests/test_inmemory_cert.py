@@ -0,0 +1,70 @@
+"""InMemoryCert: cadeia carregada via memfd ou, sem memfd, por arquivo temporário — ambos fazem mTLS."""
+
+import os
+import tempfile
+
+import pytest
+import requests
+
+import app
+from bench.fixtures import PFX_PASSWORD
+
+
+def mtls_post(cert: app.InMemoryCert, mtls_server):
+    """POST pelo SSLContext do certificado; o servidor recusa o handshake sem certificado de cliente."""
+    cert.ssl_context.load_verify_locations(cadata=mtls_server.ca_pem)
+    with requests.Session() as session:
+        session.mount("https://", app.SSLContextAdapter(cert.ssl_context))
+        response = session.post(f"https://127.0.0.1:{mtls_server.port}/ws", data=b"<a/>", timeout=5)
+    assert response.status_code == 200 and response.content == b"<ok/>"
+
+
+def temp_dir(monkeypatch, tmp_path):
+    """Diretório temporário isolado, para conferir que nada sobra em disco."""
+    path = tmp_path / "tmp"
+    path.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(path))
+    return path
+
+
+@pytest.mark.skipif(not hasattr(os, "memfd_create"), reason="memfd_create só existe no Linux")
+def test_memfd_chain_authenticates(mtls_server, monkeypatch, tmp_path):
+    created = []
+    memfd_create = os.memfd_create
+
+    def spy(name, flags=0):
+        created.append(name)
+        return memfd_create(name, flags)
+
+    monkeypatch.setattr(os, "memfd_create", spy)
+    tmp_dir = temp_dir(monkeypatch, tmp_path)
+    mtls_post(app.InMemoryCert(mtls_server.pfx, PFX_PASSWORD), mtls_server)
+    assert created == ["client-cert"]
+    assert list(tmp_dir.iterdir()) == []
+
+
+def test_tempfile_fallback_authenticates_and_removes_file(mtls_server, monkeypatch, tmp_path):
+    monkeypatch.delattr(os, "memfd_create", raising=False)
+    tmp_dir = temp_dir(monkeypatch, tmp_path)
+    created = []
+    named_temporary_file = tempfile.NamedTemporaryFile
+
+    def spy(*args, **kwargs):
+        tmp = named_temporary_file(*args, **kwargs)
+        created.append(tmp.name)
+        return tmp
+
+    monkeypatch.setattr(tempfile, "NamedTemporaryFile", spy)
+    mtls_post(app.InMemoryCert(mtls_server.pfx, PFX_PASSWORD), mtls_server)
+    assert len(created) == 1 and created[0].startswith(str(tmp_dir))
+    # A chave privada não fica em disco após a carga
+    assert list(tmp_dir.iterdir()) == []
+
+
+def test_without_client_cert_handshake_fails(mtls_server):
+    """Controle: o servidor de teste de fato exige o certificado de cliente."""
+    context = app.ssl.create_default_context(cadata=mtls_server.ca_pem)
+    with requests.Session() as session:
+        session.mount("https://", app.SSLContextAdapter(context))
+        with pytest.raises(requests.exceptions.RequestException):
+            session.post(f"https://127.0.0.1:{mtls_server.port}/ws", data=b"<a/>", timeout=5)
@@ -0,0 +1,170 @@
+"""JobQueue: payload cifrado, faixas de prioridade, lease vencido e allowlist de callbacks."""
+
+import sqlite3
+import time
+
+import pytest
+from cryptography.fernet import Fernet
+
+import job_queue
+from job_queue import INTERRUPTED_RESULT, PRIORITY_HIGH, PRIORITY_LOW, JobQueue, JobQueueError
+
+PAYLOAD = {"pfx_base64": "MIIK-segredo", "password": "1234", "chave_acesso": "35" + "0" * 42}
+
+
+@pytest.fixture
+def runs():
+    return []
+
+
+@pytest.fixture
+def queue(tmp_path, runs) -> JobQueue:
+    def runner(operation, payload):
+        runs.append((operation, payload))
+        return {"success": True, "status_detail": "autorizado"}, 200
+
+    return JobQueue(
+        str(tmp_path / "jobs.sqlite3"), runner, workers=2, reserved_high=1, lease_seconds=60,
+        encryption_key=Fernet.generate_key().decode(), resumable=frozenset({"/cte/consult"}),
+        callback_hosts=frozenset({"erp.exemplo.com.br", "*.cliente.com.br"}),
+    )
+
+
+def run_next(queue: JobQueue, max_priority: int = PRIORITY_LOW) -> str | None:
+    row = queue._claim(max_priority)
+    if row is None:
+        return None
+    queue._run(row)
+    return row["id"]
+
+
+def expire_leases(queue: JobQueue):
+    queue._conn().execute("UPDATE jobs SET lease_until = 0 WHERE status = 'running'")
+
+
+def test_payload_is_encrypted_and_dropped_when_done(queue, runs):
+    job_id = queue.submit("/cte/emit", PAYLOAD, PRIORITY_HIGH)
+    raw = sqlite3.connect(queue.db_path).execute("SELECT payload FROM jobs").fetchone()[0]
+    assert b"segredo" not in raw
+    assert run_next(queue) == job_id
+    assert runs == [("/cte/emit", PAYLOAD)]
+    job = queue.get(job_id)
+    assert job["status"] == "done"
+    assert job["result"]["http_status"] == 200
+    assert sqlite3.connect(queue.db_path).execute("SELECT payload FROM jobs").fetchone()[0] is None
+
+
+def test_high_priority_first_and_reserved_workers(queue):
+    low = queue.submit("/cte/consult", PAYLOAD, PRIORITY_LOW)
+    high = queue.submit("/cte/emit", PAYLOAD, PRIORITY_HIGH)
+    # Worker reservado só atende a faixa 0
+    assert run_next(queue, PRIORITY_HIGH) == high
+    assert run_next(queue, PRIORITY_HIGH) is None
+    assert run_next(queue, PRIORITY_LOW) == low
+
+
+def test_failed_status_from_runner(tmp_path):
+    queue = JobQueue(
+        str(tmp_path / "jobs.sqlite3"), lambda operation, payload: ({"error": "x"}, 400),
+        encryption_key=Fernet.generate_key().decode(),
+    )
+    job_id = queue.submit("/cte/emit", PAYLOAD, PRIORITY_HIGH)
+    run_next(queue)
+    assert queue.get(job_id)["status"] == "failed"
+
+
+def test_interrupted_emit_fails_instead_of_rerunning(queue, runs):
+    job_id = queue.submit("/cte/emit", PAYLOAD, PRIORITY_HIGH)
+    assert queue._claim(PRIORITY_LOW)["id"] == job_id  # worker morre sem terminar
+    expire_leases(queue)
+    assert queue._claim(PRIORITY_LOW) is None
+    job = queue.get(job_id)
+    assert (job["status"], job["result"]) == ("failed", INTERRUPTED_RESULT)
+    assert runs == []
+
+
+def test_interrupted_consult_is_resumed(queue, runs):
+    job_id = queue.submit("/cte/consult", PAYLOAD, PRIORITY_LOW)
+    queue._claim(PRIORITY_LOW)
+    expire_leases(queue)
+    assert run_next(queue) == job_id
+    job = queue.get(job_id)
+    assert (job["status"], job["attempts"]) == ("done", 2)
+
+
+def test_interrupted_job_callback(queue, monkeypatch):
+    sent = []
+    monkeypatch.setattr(job_queue.http_requests, "post", lambda url, **kwargs: sent.append((url, kwargs)))
+    job_id = queue.submit("/cte/emit", PAYLOAD, PRIORITY_HIGH, "https://erp.exemplo.com.br/cb")
+    queue._claim(PRIORITY_LOW)
+    expire_leases(queue)
+    queue._claim(PRIORITY_LOW)
+    url, kwargs = sent[0]
+    assert url == "https://erp.exemplo.com.br/cb"
+    assert kwargs["json"] == {"job_id": job_id, "status": "failed", "result": INTERRUPTED_RESULT}
+    assert kwargs["allow_redirects"] is False
+
+
+def test_lease_renewed_while_running(tmp_path):
+    db_path = str(tmp_path / "jobs.sqlite3")
+    key = Fernet.generate_key().decode()
+    sibling = JobQueue(db_path, lambda operation, payload: ({}, 200), encryption_key=key)
+    claimed_by_sibling = []
+
+    def slow_runner(operation, payload):
+        # Lote longo: passa de vários leases; o irmão não pode dá-lo como interrompido
+        time.sleep(0.6)
+        claimed_by_sibling.append(sibling._claim(PRIORITY_LOW))
+        return {"success": True}, 200
+
+    queue = JobQueue(db_path, slow_runner, lease_seconds=0.2, encryption_key=key)
+    job_id = queue.submit("/cte/emit-batch", PAYLOAD, PRIORITY_HIGH)
+    run_next(queue)
+    assert claimed_by_sibling == [None]
+    assert queue.get(job_id)["status"] == "done"
+
+
+def test_late_finish_does_not_overwrite_interrupted(tmp_path, monkeypatch):
+    sent = []
+    monkeypatch.setattr(job_queue.http_requests, "post", lambda url, **kwargs: sent.append(kwargs["json"]))
+    db_path = str(tmp_path / "jobs.sqlite3")
+    key = Fernet.generate_key().decode()
+    hosts = frozenset({"erp.exemplo.com.br"})
+    sibling = JobQueue(db_path, lambda operation, payload: ({}, 200), encryption_key=key, callback_hosts=hosts)
+
+    def runner(operation, payload):
+        # Processo "travado": o lease vence e outro worker finaliza o job
+        expire_leases(sibling)
+        sibling._claim(PRIORITY_LOW)
+        return {"success": True}, 200
+
+    queue = JobQueue(db_path, runner, encryption_key=key, callback_hosts=hosts)
+    job_id = queue.submit("/cte/emit", PAYLOAD, PRIORITY_HIGH, "https://erp.exemplo.com.br/cb")
+    run_next(queue)
+    job = queue.get(job_id)
+    assert (job["status"], job["result"]) == ("failed", INTERRUPTED_RESULT)
+    assert [body["status"] for body in sent] == ["failed"]
+
+
+@pytest.mark.parametrize("url,allowed", [
+    ("https://erp.exemplo.com.br/cb", True),
+    ("http://api.cliente.com.br/cb", True),
+    ("https://cliente.com.br.evil.io/cb", False),
+    ("https://user:pw@erp.exemplo.com.br/cb", False),
+    ("ftp://erp.exemplo.com.br/cb", False),
+    ("https://169.254.169.254/latest/meta-data", False),
+])
+def test_callback_allowlist(queue, url, allowed):
+    assert queue.callback_allowed(url) is allowed
+
+
+def test_submit_rejects_callback_outside_allowlist(queue):
+    with pytest.raises(JobQueueError, match="allowlist"):
+        queue.submit("/cte/emit", PAYLOAD, PRIORITY_HIGH, "https://outro.com/cb")
+
+
+def test_queue_without_key_refuses_jobs(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), lambda operation, payload: ({}, 200))
+    assert not queue.enabled
+    with pytest.raises(JobQueueError, match="JOBS_ENCRYPTION_KEY"):
+        queue.submit("/cte/emit", PAYLOAD, PRIORITY_HIGH)
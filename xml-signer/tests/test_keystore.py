@@ -0,0 +1,78 @@
+"""Keystore: cadastro cifrado, busca por cert_id/CNPJ e fallback para a matriz."""
+
+from types import SimpleNamespace
+
+import pytest
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.serialization import pkcs12
+
+from bench.fixtures import PFX_PASSWORD, make_pfx
+from keystore import Keystore, KeystoreError, certificate_cnpj
+
+
+def load(pfx_bytes: bytes, password: bytes):
+    _, certificate, _ = pkcs12.load_key_and_certificates(pfx_bytes, password)
+    return SimpleNamespace(
+        certificate=certificate,
+        fingerprint=certificate.fingerprint(hashes.SHA256()).hex(),
+        not_valid_after=certificate.not_valid_after_utc.timestamp(),
+    )
+
+
+@pytest.fixture
+def keystore(tmp_path) -> Keystore:
+    return Keystore(str(tmp_path), Fernet.generate_key().decode(), load, reload_interval=3600)
+
+
+def register(keystore: Keystore, cnpj: str, days: int = 365) -> str:
+    return keystore.register(make_pfx(cn=f"EMPRESA:{cnpj}", days=days), PFX_PASSWORD)["cert_id"]
+
+
+def test_certificate_cnpj_from_common_name():
+    assert certificate_cnpj(load(make_pfx(cn="EMPRESA TESTE:12345678000199"), PFX_PASSWORD).certificate) == "12345678000199"
+
+
+def test_get_by_cert_id_and_cnpj(keystore):
+    cert_id = register(keystore, "12345678000199")
+    assert keystore.get(cert_id=cert_id).fingerprint == cert_id
+    assert keystore.get(cnpj="12.345.678/0001-99").fingerprint == cert_id
+
+
+def test_newest_valid_certificate_wins(keystore):
+    register(keystore, "12345678000199", days=30)
+    renewed = register(keystore, "12345678000199", days=800)
+    assert keystore.get(cnpj="12345678000199").fingerprint == renewed
+
+
+def test_branch_falls_back_to_matriz_only(keystore):
+    matriz = register(keystore, "12345678000199")
+    assert keystore.get(cnpj="12345678000270").fingerprint == matriz
+
+
+def test_branch_never_uses_another_branch(keystore):
+    register(keystore, "12345678000350")
+    with pytest.raises(KeystoreError, match="não encontrado"):
+        keystore.get(cnpj="12345678000270")
+
+
+def test_reload_reads_other_process_registration(tmp_path):
+    key = Fernet.generate_key().decode()
+    first = Keystore(str(tmp_path), key, load, reload_interval=3600)
+    second = Keystore(str(tmp_path), key, load, reload_interval=3600)
+    second.reload()
+    cert_id = register(first, "11222333000181")
+    assert second.get(cert_id=cert_id).fingerprint == cert_id
+
+
+def test_remove(keystore):
+    cert_id = register(keystore, "12345678000199")
+    assert keystore.remove(cert_id)
+    assert not keystore.remove(cert_id)
+    with pytest.raises(KeystoreError):
+        keystore.get(cnpj="12345678000199")
+
+
+def test_disabled_keystore_refuses(tmp_path):
+    with pytest.raises(KeystoreError, match="não configurado"):
+        Keystore("", "", load).get(cnpj="12345678000199")
@@ -0,0 +1,114 @@
+"""Métricas: etapas, cStat e resultados registrados por uma requisição; coletor multiprocesso."""
+
+import contextlib
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import pytest
+from prometheus_client import REGISTRY
+
+import app
+import metrics
+from bench.fixtures import chave_acesso, cte_xml
+from bench.mock_sefaz import SOAP_NS
+
+# O verdadeiro: o fixture fake_sefaz o substitui, aqui a chamada passa por ele até o POST
+SEND_TO_SEFAZ = app.send_to_sefaz
+SEFAZ_LABELS = {"uf": "SP", "ambiente": "homologacao", "service": "cteAutorizacao"}
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+class StubSessions:
+    """No lugar do SefazSessionPool: o POST vai ao MockSefaz, sem rede."""
+
+    def __init__(self, mock):
+        self.mock = mock
+
+    @contextlib.contextmanager
+    def lease(self, cert, url):
+        def post(url, data, headers, timeout):
+            service, result = self.mock.dispatch(data)
+            envelope = (
+                f'<soap:Envelope xmlns:soap="{SOAP_NS}"><soap:Body>'
+                f"<{service}Result>{result}</{service}Result></soap:Body></soap:Envelope>"
+            )
+            return SimpleNamespace(status_code=200, content=envelope.encode())
+
+        yield SimpleNamespace(post=post)
+
+
+@pytest.fixture
+def client(fake_sefaz, monkeypatch):
+    monkeypatch.setattr(app, "send_to_sefaz", SEND_TO_SEFAZ)
+    monkeypatch.setattr(app, "sefaz_sessions", StubSessions(fake_sefaz))
+    # Cache vazio: a requisição passa pela carga do PFX
+    monkeypatch.setattr(app, "cert_cache", app.CertCache(10, 60))
+    return app.app.test_client()
+
+
+def test_request_records_stages_cstat_and_result(fake_sefaz, client, cert_fields):
+    stages = ("pfx_load", "signing", "envelope_build", "response_parse")
+    before = {name: sample("fiscal_stage_seconds_count", stage=name) for name in stages}
+    # cStat do retorno do lote (104); o protCTe traz o 100 do documento
+    responses = sample("sefaz_responses_total", **SEFAZ_LABELS, cstat="104")
+    round_trips = sample("sefaz_request_seconds_count", **SEFAZ_LABELS)
+    results = sample("fiscal_operation_results_total", operation="CTE EMIT", status_detail="autorizado")
+
+    response = client.post("/cte/emit", json={
+        "xml": cte_xml(1, 41), "uf": "SP", "ambiente": "homologacao", "skip_xsd_validation": True,
+        **cert_fields,
+    })
+    assert response.status_code == 200 and response.get_json()["chave_acesso"] == chave_acesso("57", 41)
+
+    for name in stages:
+        assert sample("fiscal_stage_seconds_count", stage=name) > before[name], name
+    assert sample("sefaz_responses_total", **SEFAZ_LABELS, cstat="104") == responses + 1
+    assert sample("sefaz_request_seconds_count", **SEFAZ_LABELS) == round_trips + 1
+    assert sample("fiscal_operation_results_total", operation="CTE EMIT", status_detail="autorizado") == results + 1
+
+
+def test_rejected_request_counts_status_detail(client):
+    before = sample("fiscal_operation_results_total", operation="CTE EMIT", status_detail="requisicao_invalida")
+    response = client.post("/cte/emit", json={"xml": "<CTe/>"})
+    assert response.status_code == 400
+    assert sample("fiscal_operation_results_total", operation="CTE EMIT", status_detail="requisicao_invalida") == before + 1
+
+
+def test_metrics_route_renders_registry(client):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert b"fiscal_stage_seconds_bucket" in response.data
+
+
+RECORD = """
+import metrics
+metrics.observe_results("CTE", {"status_detail": "autorizado"})
+metrics.observe_sefaz(("SP", "homologacao", "cteConsulta"), 0.2, "100")
+with metrics.stage("signing"):
+    pass
+"""
+
+
+def run_python(code: str, metrics_dir) -> str:
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(metrics_dir)}
+    return subprocess.run(
+        [sys.executable, "-c", code], env=env, cwd=os.path.dirname(metrics.__file__),
+        check=True, capture_output=True, text=True,
+    ).stdout
+
+
+def test_multiprocess_collector_sums_processes(tmp_path):
+    """Com PROMETHEUS_MULTIPROC_DIR, /metrics soma o que cada processo gravou no diretório."""
+    for _ in range(2):
+        run_python(RECORD, tmp_path)
+    assert len(list(tmp_path.glob("*.db"))) >= 2
+
+    body = run_python("import metrics; print(metrics.render()[0].decode())", tmp_path)
+    assert 'fiscal_operation_results_total{operation="CTE",status_detail="autorizado"} 2.0' in body
+    assert 'sefaz_responses_total{ambiente="homologacao",cstat="100",service="cteConsulta",uf="SP"} 2.0' in body
+    assert 'fiscal_stage_seconds_count{stage="signing"} 2.0' in body
@@ -0,0 +1,138 @@
+"""ReceiptPoller: coalescência por nRec, backoff, estimativa EWMA, prazo e o fluxo 103/105 → protocolo."""
+
+import time
+
+import pytest
+
+import app
+from bench.fixtures import PFX_PASSWORD, chave_acesso, cte_xml, make_pfx
+from bench.mock_sefaz import parse_mix
+
+URL = "https://homologacao.nfe.fazenda.sp.gov.br/cteWEB/services/CTeRetRecepcao.asmx"
+N_REC = "351000000000001"
+
+
+@pytest.fixture(scope="module")
+def cert() -> app.InMemoryCert:
+    return app.InMemoryCert(make_pfx(), PFX_PASSWORD)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app.time, "monotonic", lambda: now[0])
+    return now
+
+
+def pending_receipt(fake_sefaz, chave: str, ready_in: float = 0.0):
+    """Lote 103 na SEFAZ simulada: 105 até `ready_in` segundos, depois 104 + protCTe 100."""
+    fake_sefaz.receipts[N_REC] = (time.monotonic() + ready_in, [(chave, "100")])
+
+
+def register(poller: app.ReceiptPoller, cert, delay: float, max_wait: float):
+    """Recibo pendente montado à mão, para chamar _poll sem a thread do endpoint."""
+    endpoint = poller._endpoints.setdefault(URL, app._EndpointReceipts(poller.initial_delay))
+    pending = endpoint.pending[N_REC] = app._PendingReceipt(cert, "2", delay, max_wait, ("SP", "homologacao", ""))
+    return endpoint, pending
+
+
+def test_same_nrec_is_coalesced(fake_sefaz, cert):
+    pending_receipt(fake_sefaz, chave_acesso("57", 1))
+    poller = app.ReceiptPoller(initial_delay=0.05, max_delay=0.1)
+    first = poller.submit(cert, URL, N_REC, "2", max_wait=5)
+    second = poller.submit(cert, URL, N_REC, "2", max_wait=5)
+    assert first is second
+    result = first.result(timeout=5)
+    assert result["status_detail"] == "autorizado" and result["nRec"] == N_REC
+    assert poller.stats()["coalesced"] == 1
+    assert fake_sefaz.calls == ["cteRetRecepcao"]
+
+
+def test_backoff_grows_until_max_delay(fake_sefaz, cert, clock):
+    fake_sefaz.receipts[N_REC] = (float("inf"), [])  # sempre 105
+    poller = app.ReceiptPoller(initial_delay=1.0, max_delay=3.0)
+    endpoint, pending = register(poller, cert, delay=1.0, max_wait=100)
+    delays = []
+    for _ in range(4):
+        clock[0] = pending.next_poll
+        poller._poll(URL, endpoint, N_REC, pending)
+        delays.append(pending.delay)
+        assert pending.next_poll == clock[0] + pending.delay
+    assert delays == [1.5, 2.25, 3.0, 3.0]
+    assert not pending.future.done()
+
+
+def test_first_poll_waits_the_ewma_estimate(fake_sefaz, cert, clock):
+    pending_receipt(fake_sefaz, chave_acesso("57", 1))
+    poller = app.ReceiptPoller(initial_delay=1.0, max_delay=10.0)
+    endpoint, pending = register(poller, cert, delay=1.0, max_wait=100)
+    clock[0] += 2.0  # lote processado 2s depois do envio
+    poller._poll(URL, endpoint, N_REC, pending)
+    assert pending.future.result()["status_detail"] == "autorizado"
+    assert endpoint.estimate == pytest.approx(0.7 * 1.0 + 0.3 * 2.0)
+
+    # O próximo recibo do endpoint começa pela estimativa, não pelo initial_delay
+    future = poller.submit(cert, URL, "351000000000002", "2", max_wait=100)
+    with poller._cond:
+        assert endpoint.pending["351000000000002"].delay == pytest.approx(1.3)
+        endpoint.pending.clear()
+        poller._cond.notify_all()
+    assert not future.done()
+
+
+def test_max_wait_returns_last_pending_result(fake_sefaz, cert, clock):
+    fake_sefaz.receipts[N_REC] = (float("inf"), [])
+    poller = app.ReceiptPoller(initial_delay=1.0, max_delay=10.0)
+    endpoint, pending = register(poller, cert, delay=1.0, max_wait=3.0)
+    clock[0] += 1.0
+    poller._poll(URL, endpoint, N_REC, pending)  # 105, próxima em 1.5s: ainda no prazo
+    assert not pending.future.done()
+    clock[0] += 1.5
+    poller._poll(URL, endpoint, N_REC, pending)  # 105 e a próxima passaria do prazo
+    result = pending.future.result()
+    assert (result["cStat"], result["status_detail"]) == ("105", "em_processamento")
+    assert N_REC not in endpoint.pending
+
+
+def test_max_wait_with_errors_raises(fake_sefaz, cert, clock):
+    fake_sefaz.fail_calls = {1}
+    poller = app.ReceiptPoller(initial_delay=1.0, max_delay=10.0)
+    endpoint, pending = register(poller, cert, delay=1.0, max_wait=1.0)
+    clock[0] += 1.0
+    poller._poll(URL, endpoint, N_REC, pending)
+    with pytest.raises(ConnectionError):
+        pending.future.result()
+
+
+# ── Pela API ─────────────────────────────────────────────────────
+
+@pytest.fixture
+def client(fake_sefaz, monkeypatch):
+    monkeypatch.setattr(app, "receipt_poller", app.ReceiptPoller(initial_delay=0.02, max_delay=0.05))
+    return app.app.test_client()
+
+
+def test_receipt_route_follows_105_until_protocol(fake_sefaz, client, cert_fields):
+    chave = chave_acesso("57", 7)
+    pending_receipt(fake_sefaz, chave, ready_in=0.3)
+    response = client.post("/cte/receipt", json={
+        "nRec": N_REC, "uf": "SP", "ambiente": "homologacao", "max_wait": 5, **cert_fields,
+    })
+    body = response.get_json()
+    assert response.status_code == 200
+    assert (body["cStat"], body["status_detail"], body["chave_acesso"]) == ("100", "autorizado", chave)
+    assert body["protocolo"]
+    # Ao menos uma resposta 105 antes do 104
+    assert len(fake_sefaz.calls) >= 2
+
+
+def test_emit_103_followed_until_protocol(fake_sefaz, client, cert_fields):
+    fake_sefaz.emit_mix = parse_mix("103=100")
+    response = client.post("/cte/emit", json={
+        "xml": cte_xml(1, 8), "uf": "SP", "ambiente": "homologacao", "skip_xsd_validation": True,
+        "aguardar_recibo": True, **cert_fields,
+    })
+    body = response.get_json()
+    assert response.status_code == 200
+    assert body["status_detail"] == "autorizado" and body["nRec"]
+    assert fake_sefaz.calls == ["cteRecepcaoLote", "cteRetRecepcao"]
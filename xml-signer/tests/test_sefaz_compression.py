@@ -0,0 +1,89 @@
+"""Envio compactado para a SEFAZ (cteDadosMsg em gzip + base64) e leitura de retCTe/docZip compactados."""
+
+import base64
+import gzip
+
+import pytest
+from lxml import etree
+
+import app
+from bench.fixtures import PFX_PASSWORD, cte_xml, make_pfx
+
+SINC_ACTION = "http://www.portalfiscal.inf.br/cte/wsdl/CTeRecepcaoSinc/cteRecepcao"
+RET_CTE = (
+    '<retCTe xmlns="http://www.portalfiscal.inf.br/cte" versao="4.00"><cStat>100</cStat>'
+    "<xMotivo>Autorizado o uso do CT-e</xMotivo></retCTe>"
+)
+
+
+def gzip_b64(xml: str) -> str:
+    return base64.b64encode(gzip.compress(xml.encode("utf-8"))).decode()
+
+
+def dados_msg(envelope: bytes) -> etree._Element:
+    body = etree.fromstring(envelope).find("{http://www.w3.org/2003/05/soap-envelope}Body")
+    return body[0]
+
+
+def test_compressed_envelope_carries_the_document():
+    xml = cte_xml(3).split("\n", 1)[1]
+    envelope = app.build_soap_envelope(xml, SINC_ACTION, compress=True)
+    msg = dados_msg(envelope)
+    assert msg.tag == "{http://www.portalfiscal.inf.br/cte/wsdl/CTeRecepcaoSinc}cteDadosMsg"
+    assert gzip.decompress(base64.b64decode(msg.text)).decode("utf-8") == xml
+    # mtime fixo: mesmo documento, mesmo envelope
+    assert app.build_soap_envelope(xml, SINC_ACTION, compress=True) == envelope
+
+
+def test_plain_envelope_by_default():
+    xml = cte_xml(1).split("\n", 1)[1]
+    msg = dados_msg(app.build_soap_envelope(xml, app.CTE_RECEPCAO_ACTION))
+    assert etree.QName(msg).localname == "CTe"
+    assert not app.sends_compressed(("SP", "homologacao", "cteRecepcaoSinc"))
+
+
+def test_inflate_only_compressed_carriers():
+    response = etree.fromstring(
+        '<cteRecepcaoResult xmlns="http://www.portalfiscal.inf.br/cte/wsdl/CTeRecepcaoSinc">'
+        f'<retCTe xmlns="http://www.portalfiscal.inf.br/cte">{gzip_b64(RET_CTE)}</retCTe>'
+        f'<xObs>{gzip_b64("<a/>")}</xObs>'
+        "</cteRecepcaoResult>"
+    )
+    app.inflate_compressed_nodes(response)
+    carrier = response[0]
+    assert carrier.text is None
+    assert carrier[0].findtext("{*}cStat") == "100"
+    # Outros nós com texto em base64 não são tocados
+    assert len(response[1]) == 0 and response[1].text
+
+
+def test_inflate_leaves_invalid_content():
+    response = etree.fromstring('<retCTe xmlns="http://www.portalfiscal.inf.br/cte">não é gzip</retCTe>')
+    app.inflate_compressed_nodes(response)
+    assert response.text == "não é gzip"
+
+
+@pytest.fixture
+def emit_data():
+    return {
+        "xml": cte_xml(1), "pfx_base64": base64.b64encode(make_pfx()).decode(),
+        "password": PFX_PASSWORD.decode(), "uf": "SP", "ambiente": "homologacao", "skip_xsd_validation": True,
+    }
+
+
+def test_emit_uses_sync_reception_when_enabled(monkeypatch, emit_data):
+    monkeypatch.setattr(app, "SEFAZ_GZIP_SERVICES", {"cteRecepcaoSinc"})
+    call = app.prepare_cte_emit(emit_data).calls[0]
+    assert call.endpoint[2] == "cteRecepcaoSinc"
+    assert call.url.endswith("/CTeRecepcaoSinc.asmx")
+    assert call.soap_action == SINC_ACTION
+    # CT-e assinado sozinho, sem o lote enviCTe
+    assert etree.QName(etree.fromstring(call.soap_xml)).localname == "CTe"
+    assert app.sends_compressed(call.endpoint)
+
+
+def test_emit_uses_lote_by_default(emit_data):
+    call = app.prepare_cte_emit(emit_data).calls[0]
+    assert call.endpoint[2] == "cteAutorizacao"
+    assert call.soap_action == app.CTE_RECEPCAO_ACTION
+    assert etree.QName(etree.fromstring(call.soap_xml)).localname == "enviCTe"
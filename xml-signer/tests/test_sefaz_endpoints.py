@@ -0,0 +1,46 @@
+"""get_sefaz_url: autorizador da UF e desvio para a SVC com o circuito aberto."""
+
+import pytest
+
+import app
+from sefaz_health import CircuitBreaker
+
+
+@pytest.fixture
+def circuits(monkeypatch) -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=1, open_seconds=60)
+    monkeypatch.setattr(app, "sefaz_circuits", breaker)
+    monkeypatch.setattr(app, "SEFAZ_SVC_SERVICES", {"cteConsulta"})
+    return breaker
+
+
+def open_circuit(breaker: CircuitBreaker, url: str):
+    breaker.record(url, success=False)
+    assert not breaker.available(url)
+
+
+@pytest.mark.parametrize("uf", ["AP", "PE", "RR", "BA"])
+def test_svrs_served_uf_diverts_to_svc_sp(circuits, uf):
+    svrs = app._endpoint_url("homologacao", "SVRS", "cteConsulta")
+    assert app.get_sefaz_url(uf, "homologacao", "cteConsulta") == svrs
+    open_circuit(circuits, svrs)
+    assert app.get_sefaz_url(uf, "homologacao", "cteConsulta") == app._endpoint_url(
+        "homologacao", "SVC-SP", "cteConsulta",
+    )
+
+
+@pytest.mark.parametrize("uf", ["SP", "MT", "MS"])
+def test_own_authorizer_diverts_to_svc_rs(circuits, uf):
+    open_circuit(circuits, app._endpoint_url("producao", uf, "cteConsulta"))
+    assert app.get_sefaz_url(uf, "producao", "cteConsulta") == app._endpoint_url(
+        "producao", "SVC-RS", "cteConsulta",
+    )
+
+
+def test_open_circuit_without_svc_fails_fast(circuits):
+    svrs = app._endpoint_url("homologacao", "SVRS", "cteEvento")
+    open_circuit(circuits, svrs)
+    with pytest.raises(app.RequestError) as error:
+        app.get_sefaz_url("PE", "homologacao", "cteEvento")
+    assert error.value.status == 503
+    assert error.value.payload["status_detail"] == "servico_indisponivel"
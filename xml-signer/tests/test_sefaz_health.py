@@ -0,0 +1,155 @@
+"""
+CircuitBreaker (abertura, chamada de teste do meio-aberto, liberação em end())
+e SefazStatusTable (sonda compartilhada por arquivo, entradas vencidas).
+"""
+
+import json
+
+import pytest
+
+import sefaz_health
+from sefaz_health import CircuitBreaker, SefazStatusTable
+
+URL = "https://cte.fazenda.sp.gov.br/CTeWS/WS/CTeRecepcaoSincV4.asmx"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sefaz_health.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def breaker(clock) -> CircuitBreaker:
+    return CircuitBreaker(failure_threshold=3, open_seconds=30)
+
+
+def trip(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record(URL, success=False)
+
+
+def test_opens_after_threshold(breaker):
+    breaker.record(URL, success=False)
+    breaker.record(URL, success=False)
+    assert breaker.available(URL)
+    breaker.record(URL, success=False)
+    assert not breaker.available(URL)
+    assert breaker.begin(URL) is None
+    assert breaker.stats()["circuits"][URL]["state"] == "open"
+
+
+def test_success_resets_failures(breaker):
+    breaker.record(URL, success=False)
+    breaker.record(URL, success=False)
+    breaker.record(URL, success=True)
+    breaker.record(URL, success=False)
+    assert breaker.available(URL)
+
+
+def test_half_open_allows_a_single_probe(breaker, clock):
+    trip(breaker)
+    clock[0] += 30
+    assert breaker.available(URL)
+    probe = breaker.begin(URL)
+    assert probe
+    # Os demais continuam barrados enquanto o teste está em andamento
+    assert breaker.begin(URL) is None
+    breaker.record(URL, success=True)
+    breaker.end(URL, probe)
+    assert breaker.begin(URL) == 0.0
+    assert breaker.stats()["circuits"][URL]["state"] == "closed"
+
+
+def test_failed_probe_reopens(breaker, clock):
+    trip(breaker)
+    clock[0] += 30
+    probe = breaker.begin(URL)
+    breaker.record(URL, success=False)
+    breaker.end(URL, probe)
+    assert breaker.begin(URL) is None
+    assert breaker.stats()["circuits"][URL]["trips"] == 2
+    clock[0] += 29
+    assert not breaker.available(URL)
+
+
+def test_probe_without_record_is_released(breaker, clock):
+    trip(breaker)
+    clock[0] += 30
+    probe = breaker.begin(URL)
+    # Chamada de teste que não chegou à SEFAZ (fila cheia, erro local)
+    breaker.end(URL, probe)
+    assert breaker.begin(URL)
+
+
+def test_stale_end_does_not_release_newer_probe(breaker, clock):
+    trip(breaker)
+    clock[0] += 30
+    old = breaker.begin(URL)
+    clock[0] += 30  # teste antigo esquecido: outro assume
+    new = breaker.begin(URL)
+    assert new and new != old
+    breaker.end(URL, old)
+    assert breaker.begin(URL) is None
+
+
+def test_disabled_breaker_never_blocks(clock):
+    breaker = CircuitBreaker(failure_threshold=0, open_seconds=30)
+    for _ in range(10):
+        breaker.record(URL, success=False)
+    assert breaker.available(URL)
+    assert breaker.begin(URL) == 0.0
+
+
+# ── SefazStatusTable ─────────────────────────────────────────────
+
+def status_table(tmp_path, probe, interval: float = 60) -> SefazStatusTable:
+    pfx = tmp_path / "sonda.pfx"
+    pfx.write_bytes(b"pfx")
+    return SefazStatusTable(
+        str(tmp_path / "status.json"), ["SP", "RS"], ["homologacao"], interval,
+        str(pfx), "1234", lambda pfx_bytes, password: "cert", probe,
+    )
+
+
+def fake_probe(down: set[str], calls: list):
+    def probe(cert, uf, ambiente):
+        calls.append((cert, uf, ambiente))
+        return {"uf": uf, "ambiente": ambiente, "status": "down" if uf in down else "ok", "cStat": ""}
+    return probe
+
+
+def test_status_probe_marks_down_ufs(tmp_path):
+    calls = []
+    table = status_table(tmp_path, fake_probe({"RS"}, calls))
+    table._probe_if_due()
+    assert calls == [("cert", "SP", "homologacao"), ("cert", "RS", "homologacao")]
+    assert table.is_down("RS", "homologacao")["status"] == "down"
+    assert table.is_down("SP", "homologacao") is None
+    assert [e["uf"] for e in table.snapshot()["entries"]] == ["RS", "SP"]
+
+
+def test_status_probe_skipped_while_fresh(tmp_path):
+    calls = []
+    table = status_table(tmp_path, fake_probe(set(), calls))
+    table._probe_if_due()
+    # Outro worker com o mesmo arquivo: tabela recente, não consulta de novo
+    status_table(tmp_path, fake_probe(set(), calls))._probe_if_due()
+    assert len(calls) == 2
+
+
+def test_stale_status_is_ignored(tmp_path):
+    table = status_table(tmp_path, fake_probe({"SP"}, []), interval=60)
+    table._probe_if_due()
+    path = tmp_path / "status.json"
+    data = json.loads(path.read_text())
+    data["updated_at"] -= 3 * 60 + 1
+    path.write_text(json.dumps(data))
+    assert table.is_down("SP", "homologacao") is None
+
+
+def test_status_disabled_without_probe_certificate(tmp_path):
+    table = SefazStatusTable(str(tmp_path / "s.json"), ["SP"], ["homologacao"], 60, "", "", None, None)
+    assert not table.enabled
+    assert table.is_down("SP", "homologacao") is None
@@ -0,0 +1,177 @@
+"""EndpointLimiter (vagas por webservice, fila por contribuinte em rodízio) e RateLimiter."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+import sefaz_limits
+from sefaz_limits import EndpointBusy, EndpointLimiter, RateLimited, RateLimiter, parse_rate_limits
+
+URL = "https://cte.fazenda.sp.gov.br/CTeWS/WS/CTeRecepcaoSincV4.asmx"
+
+
+def wait_until(condition, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condição não atingida"
+        time.sleep(0.005)
+
+
+def waiting(limiter: EndpointLimiter) -> int:
+    return limiter.stats()["endpoints"][URL]["waiting"]
+
+
+def test_full_queue_is_rejected():
+    limiter = EndpointLimiter(limit=1, max_queue=0, max_wait=1)
+    with limiter.acquire(URL):
+        with pytest.raises(EndpointBusy) as exc:
+            with limiter.acquire(URL):
+                pass
+    assert exc.value.retry_after >= 1
+    assert limiter.stats()["endpoints"][URL]["rejected"] == 1
+
+
+def test_wait_times_out():
+    limiter = EndpointLimiter(limit=1, max_queue=5, max_wait=0.05)
+    with limiter.acquire(URL):
+        with pytest.raises(EndpointBusy):
+            with limiter.acquire(URL):
+                pass
+    assert waiting(limiter) == 0
+
+
+def test_background_calls_skip_admission():
+    limiter = EndpointLimiter(limit=1, max_queue=0, max_wait=0.01)
+    entered = threading.Event()
+
+    def background():
+        with limiter.acquire(URL, admission=False):
+            entered.set()
+
+    thread = threading.Thread(target=background)
+    with limiter.acquire(URL):
+        thread.start()
+        wait_until(lambda: waiting(limiter) == 1)
+        time.sleep(0.05)  # além de max_wait: continua na fila
+        assert not entered.is_set()
+    thread.join(2)
+    assert entered.is_set()
+
+
+def test_slots_round_robin_between_tenants():
+    limiter = EndpointLimiter(limit=1, max_queue=10, max_wait=5)
+    order = []
+
+    def call(tenant: str, n: int):
+        with limiter.acquire(URL, tenant=tenant):
+            order.append(f"{tenant}{n}")
+
+    threads = []
+    with limiter.acquire(URL, tenant="A"):
+        for tenant, n in (("A", 1), ("A", 2), ("A", 3), ("B", 1)):
+            thread = threading.Thread(target=call, args=(tenant, n))
+            thread.start()
+            threads.append(thread)
+            wait_until(lambda: waiting(limiter) == len(threads))
+    for thread in threads:
+        thread.join(2)
+    # B não espera as três chamadas de A que chegaram antes
+    assert order == ["A1", "B1", "A2", "A3"]
+
+
+def test_async_acquire_and_cancel():
+    limiter = EndpointLimiter(limit=1, max_queue=10, max_wait=5)
+
+    async def scenario():
+        async with limiter.acquire_async(URL):
+            queued = asyncio.ensure_future(limiter.acquire_async(URL).__aenter__())
+            await asyncio.sleep(0.01)
+            assert waiting(limiter) == 1
+            queued.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await queued
+            assert waiting(limiter) == 0
+        async with limiter.acquire_async(URL) as waited:
+            return waited
+
+    assert asyncio.run(scenario()) < 0.5
+    assert limiter.stats()["endpoints"][URL]["active"] == 0
+
+
+def test_disabled_limiter():
+    limiter = EndpointLimiter(limit=0, max_queue=0, max_wait=0)
+    with limiter.acquire(URL) as waited, limiter.acquire(URL):
+        assert waited == 0.0
+
+
+# ── RateLimiter ──────────────────────────────────────────────────
+
+KEY = ("12345678000199", "SP", "producao", "cteConsulta")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sefaz_limits.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_parse_rate_limits():
+    assert parse_rate_limits("cteConsulta=2:10, *=5") == {"cteConsulta": (2.0, 10.0), "*": (5.0, 5.0)}
+    assert parse_rate_limits("") == {}
+    with pytest.raises(ValueError):
+        parse_rate_limits("cteConsulta=0")
+    with pytest.raises(ValueError):
+        parse_rate_limits("cteConsulta=x")
+
+
+def test_burst_then_queue_in_arrival_order(clock):
+    limiter = RateLimiter({"cteConsulta": (2.0, 2.0)}, penalty=60)
+    assert [limiter.reserve(KEY) for _ in range(4)] == [0.0, 0.0, 0.5, 1.0]
+    clock[0] += 1.0
+    assert limiter.reserve(KEY) == 0.5
+
+
+def test_max_wait_rejects_without_reserving(clock):
+    limiter = RateLimiter({"*": (1.0, 1.0)}, penalty=60)
+    limiter.reserve(KEY)
+    with pytest.raises(RateLimited) as exc:
+        limiter.reserve(KEY, max_wait=0.5)
+    assert exc.value.retry_after == 1
+    assert limiter.reserve(KEY, max_wait=1.0) == 1.0
+
+
+def test_refund_returns_the_token(clock):
+    limiter = RateLimiter({"cteConsulta": (1.0, 1.0)}, penalty=60)
+    limiter.reserve(KEY)
+    limiter.refund(KEY)
+    assert limiter.reserve(KEY) == 0.0
+    assert limiter.stats()["refunded"] == 1
+
+
+def test_refund_never_overfills(clock):
+    limiter = RateLimiter({"cteConsulta": (1.0, 2.0)}, penalty=60)
+    limiter.reserve(KEY)
+    limiter.refund(KEY)
+    limiter.refund(KEY)
+    assert [limiter.reserve(KEY) for _ in range(3)] == [0.0, 0.0, 1.0]
+
+
+def test_penalty_blocks_key(clock):
+    limiter = RateLimiter({}, penalty=60)
+    assert limiter.reserve(KEY) == 0.0  # sem limite configurado
+    limiter.penalize(KEY)
+    assert limiter.reserve(KEY) == 60.0
+    with pytest.raises(RateLimited):
+        limiter.reserve(KEY, max_wait=10)
+    assert limiter.stats()["blocked"] == {"/".join(KEY): 60.0}
+    clock[0] += 61
+    assert limiter.reserve(KEY) == 0.0
+
+
+def test_keys_are_independent(clock):
+    limiter = RateLimiter({"*": (1.0, 1.0)}, penalty=60)
+    limiter.reserve(KEY)
+    assert limiter.reserve(("11222333000181", *KEY[1:])) == 0.0
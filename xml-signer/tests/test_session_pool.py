@@ -0,0 +1,72 @@
+"""SefazSessionPool: keep-alive por (certificado, host), retomada de sessão TLS, ociosidade e limite."""
+
+import time
+
+import pytest
+
+import app
+from bench.fixtures import PFX_PASSWORD
+
+
+@pytest.fixture
+def cert(mtls_server) -> app.InMemoryCert:
+    cert = app.InMemoryCert(mtls_server.pfx, PFX_PASSWORD)
+    cert.ssl_context.load_verify_locations(cadata=mtls_server.ca_pem)
+    return cert
+
+
+def post(pool: app.SefazSessionPool, cert: app.InMemoryCert, url: str):
+    with pool.lease(cert, url) as session:
+        response = session.post(url, data=b"<a/>", timeout=5)
+    assert response.status_code == 200
+
+
+def test_back_to_back_calls_share_one_connection(mtls_server, cert):
+    pool = app.SefazSessionPool(max_sessions=4, pool_maxsize=2, idle_timeout=60)
+    url = f"https://127.0.0.1:{mtls_server.port}/ws"
+    post(pool, cert, url)
+    post(pool, cert, url)
+    stats = pool.stats()
+    assert (stats["created"], stats["reused"], stats["tls_handshakes"]) == (1, 1, 1)
+    assert mtls_server.reused == [False]
+
+
+def test_new_connection_resumes_tls_session(mtls_server, cert):
+    pool = app.SefazSessionPool(max_sessions=4, pool_maxsize=2, idle_timeout=60)
+    # A SEFAZ encerra a conexão: a próxima chamada abre outra, com handshake abreviado
+    post(pool, cert, f"https://127.0.0.1:{mtls_server.port}/close")
+    post(pool, cert, f"https://127.0.0.1:{mtls_server.port}/ws")
+    assert mtls_server.reused == [False, True]
+    stats = pool.stats()
+    assert (stats["created"], stats["tls_handshakes"], stats["tls_resumed"]) == (1, 2, 1)
+
+
+def test_idle_session_closed_and_tls_resumed(mtls_server, cert):
+    pool = app.SefazSessionPool(max_sessions=4, pool_maxsize=2, idle_timeout=0)
+    url = f"https://127.0.0.1:{mtls_server.port}/ws"
+    post(pool, cert, url)
+    time.sleep(0.01)
+    post(pool, cert, url)
+    stats = pool.stats()
+    assert (stats["created"], stats["reused"]) == (2, 0)
+    # Sessão HTTP nova, mas a sessão TLS do (certificado, host) continua valendo
+    assert mtls_server.reused == [False, True]
+    assert stats["tls_resumed"] == 1
+
+
+def test_max_sessions_evicts_least_recently_used(mtls_server, cert):
+    pool = app.SefazSessionPool(max_sessions=1, pool_maxsize=2, idle_timeout=60)
+    post(pool, cert, f"https://127.0.0.1:{mtls_server.port}/ws")
+    post(pool, cert, f"https://localhost:{mtls_server.port}/ws")
+    stats = pool.stats()
+    assert (stats["sessions"], stats["created"]) == (1, 2)
+    # Host diferente: outra sessão TLS, sem retomada
+    assert mtls_server.reused == [False, False]
+
+
+def test_sessions_in_use_are_not_evicted(mtls_server, cert):
+    pool = app.SefazSessionPool(max_sessions=1, pool_maxsize=2, idle_timeout=0)
+    with pool.lease(cert, f"https://127.0.0.1:{mtls_server.port}/ws"):
+        post(pool, cert, f"https://localhost:{mtls_server.port}/ws")
+        assert pool.stats()["in_use"] == 1
+        assert pool.stats()["sessions"] == 2
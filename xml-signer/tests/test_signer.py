@@ -0,0 +1,61 @@
+"""Assinador nativo (signer.EnvelopedSigner) contra o XMLSigner do signxml, byte a byte."""
+
+import pytest
+
+import signer
+from bench.crosscheck_signer import cases, signing_key, signxml_reference
+from bench.fixtures import cte_xml, make_ca, make_pfx
+
+CASES = cases()
+
+
+@pytest.fixture(scope="module", params=["RSA 2048", "RSA 4096", "emitido por AC"])
+def cert(request) -> signer.SigningKey:
+    if request.param == "RSA 4096":
+        return signing_key(make_pfx(key_size=4096))
+    if request.param == "emitido por AC":
+        return signing_key(make_pfx(ca=make_ca()))
+    return signing_key(make_pfx())
+
+
+@pytest.fixture
+def backend(monkeypatch, request):
+    monkeypatch.setattr(signer, "SIGNER_BACKEND", request.param)
+    return request.param
+
+
+@pytest.mark.parametrize("backend", ["native", "signxml"], indirect=True)
+@pytest.mark.parametrize("name,doc_type,xml", CASES, ids=[case[0] for case in CASES])
+def test_signature_matches_signxml(cert, backend, name, doc_type, xml):
+    result = signer.sign_xml(xml, cert, doc_type, name)
+    assert result["signed_xml"] == signxml_reference(xml, cert, doc_type)
+    assert result["signed_bytes"].decode("utf-8") == result["signed_xml"][len(signer.XML_DECLARATION):]
+
+
+def test_sign_xml_rejects_missing_id():
+    cert = signing_key(make_pfx())
+    xml = cte_xml(1).replace('Id="CTe', 'Ref="CTe', 1)
+    with pytest.raises(ValueError, match="Id"):
+        signer.sign_xml(xml, cert, "cte", "sem-id")
+
+
+def test_signing_key_export_roundtrip():
+    cert = signing_key(make_pfx())
+    restored = signer.SigningKey.from_material(cert.export())
+    assert restored.fingerprint == cert.fingerprint
+    xml = cte_xml(2)
+    assert signer.sign_xml(xml, restored, "cte", "1")["signed_xml"] == signer.sign_xml(xml, cert, "cte", "1")["signed_xml"]
+
+
+def test_signing_pool_matches_single_document():
+    cert = signing_key(make_pfx())
+    jobs = [(cte_xml(1, n), "cte", str(n)) for n in range(1, 6)]
+    jobs.append(("<CTe/>", "cte", "invalido"))
+    pool = signer.SigningPool(2, 2, "fork")
+    try:
+        results = pool.sign_many(cert, jobs)
+    finally:
+        pool.shutdown()
+    for (xml, doc_type, doc_id), result in zip(jobs[:-1], results):
+        assert result["signed_xml"] == signer.sign_xml(xml, cert, doc_type, doc_id)["signed_xml"]
+    assert "error" in results[-1]
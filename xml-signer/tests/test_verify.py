@@ -0,0 +1,91 @@
+"""verify_document: digest, SignatureValue e cadeia até o TrustStore, com a validade em dhEmi."""
+
+from datetime import datetime
+
+import pytest
+from cryptography.hazmat.primitives.serialization import Encoding
+
+import signer
+import verify
+from bench.crosscheck_signer import signing_key
+from bench.fixtures import cte_xml, make_ca, make_pfx, mdfe_xml
+
+NOW = datetime.now().astimezone().replace(microsecond=0).isoformat()
+
+
+def issued_now(xml: str) -> str:
+    return xml.replace("2026-01-01T10:00:00-03:00", NOW)
+
+
+@pytest.fixture(scope="module")
+def ca():
+    return make_ca("AC RAIZ TESTE")
+
+
+@pytest.fixture(autouse=True)
+def trust_store(tmp_path, monkeypatch, ca):
+    (tmp_path / "raiz.crt").write_bytes(ca[1].public_bytes(Encoding.PEM))
+    store = verify.TrustStore(str(tmp_path))
+    monkeypatch.setattr(verify, "trust_store", store)
+    return store
+
+
+@pytest.fixture(scope="module")
+def cert(ca) -> signer.SigningKey:
+    return signing_key(make_pfx(ca=ca))
+
+
+def signed(cert, xml: str, doc_type: str = "cte") -> str:
+    return signer.sign_xml(issued_now(xml), cert, doc_type, "teste")["signed_xml"]
+
+
+@pytest.mark.parametrize("doc_type,xml", [("cte", cte_xml(3)), ("mdfe", mdfe_xml(3))])
+def test_valid_document(cert, doc_type, xml):
+    result = verify.verify_document(signed(cert, xml, doc_type))
+    assert result["status_detail"] == "assinatura_valida"
+    assert result["valid"] and result["chain_valid"]
+    assert result["document_type"] == doc_type
+    assert result["chain"] == ["EMPRESA TESTE LTDA:12345678000199", "AC RAIZ TESTE"]
+    assert result["signer"]["cnpj"] == "12345678000199"
+
+
+def test_tampered_document(cert):
+    xml = signed(cert, cte_xml(1)).replace("<vTPrest>1500.00</vTPrest>", "<vTPrest>1.00</vTPrest>")
+    assert verify.verify_document(xml)["status_detail"] == "digest_invalido"
+
+
+def test_untrusted_root():
+    result = verify.verify_document(signed(signing_key(make_pfx()), cte_xml(1)))
+    assert result["status_detail"] == "cadeia_nao_confiavel"
+    assert result["signature_valid"] and not result["valid"]
+
+
+def test_certificate_outside_validity_at_dh_emi(cert):
+    # dhEmi de 2026-01-01, antes da emissão do certificado de teste
+    result = verify.verify_document(signer.sign_xml(cte_xml(1), cert, "cte", "1")["signed_xml"])
+    assert result["status_detail"] == "certificado_expirado"
+
+
+def test_cte_proc_reports_protocol(cert):
+    document = signed(cert, cte_xml(1)).split("\n", 1)[1]
+    proc = (
+        '<cteProc xmlns="http://www.portalfiscal.inf.br/cte" versao="4.00">' + document
+        + "<protCTe><infProt><cStat>100</cStat><nProt>135000000000001</nProt></infProt></protCTe></cteProc>"
+    )
+    result = verify.verify_document(proc)
+    assert result["status_detail"] == "assinatura_valida"
+    assert (result["protocolo"], result["cStat_protocolo"]) == ("135000000000001", "100")
+
+
+@pytest.mark.parametrize("xml,status_detail", [
+    ("<a", "xml_invalido"),
+    (cte_xml(1), "sem_assinatura"),
+    ("<NFe/>", "xml_invalido"),
+])
+def test_invalid_input(xml, status_detail):
+    assert verify.verify_document(xml)["status_detail"] == status_detail
+
+
+def test_verify_chunk_isolates_errors(cert):
+    results = verify.verify_chunk([signed(cert, cte_xml(1)), "<a"])
+    assert [r["status_detail"] for r in results] == ["assinatura_valida", "xml_invalido"]
@@ -0,0 +1,317 @@
+"""
+Verificação de assinatura XMLDSig de CT-e, CT-e OS e MDF-e (ou cteProc/mdfeProc).
+
+Confere o DigestValue do nó referenciado, a SignatureValue do SignedInfo com o
+certificado do KeyInfo e a cadeia desse certificado até uma raiz do TrustStore
+ICP-Brasil, com a validade na data de emissão. Como signer.py, é enxuto de
+propósito: /verify-batch roda verify_chunk nos processos do SigningPool, que
+importam só este módulo e o signer (cada processo carrega o trust store uma vez).
+"""
+
+import base64
+import copy
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric.padding import PKCS1v15
+from cryptography.x509 import (
+    AuthorityKeyIdentifier, Certificate, ExtensionNotFound, NameOID, SubjectKeyIdentifier,
+    load_der_x509_certificate, load_pem_x509_certificate,
+)
+from lxml import etree
+
+from signer import C14N_ALGORITHM, NAMESPACES, parse_xml
+
+logger = logging.getLogger(__name__)
+
+# Cadeia ICP-Brasil instalada pelo Dockerfile (certs/ + pacote do ITI)
+ICP_TRUST_DIR = os.environ.get("ICP_TRUST_DIR", "/usr/local/share/ca-certificates/icp-brasil")
+
+DIGEST_ALGORITHMS = {
+    "http://www.w3.org/2000/09/xmldsig#sha1": hashes.SHA1,
+    "http://www.w3.org/2001/04/xmlenc#sha256": hashes.SHA256,
+}
+SIGNATURE_ALGORITHMS = {
+    "http://www.w3.org/2000/09/xmldsig#rsa-sha1": hashes.SHA1,
+    "http://www.w3.org/2001/04/xmldsig-more#rsa-sha256": hashes.SHA256,
+}
+C14N_EXCLUSIVE_ALGORITHM = "http://www.w3.org/2001/10/xml-exc-c14n#"
+C14N_ALGORITHMS = {
+    C14N_ALGORITHM: (False, False),
+    C14N_ALGORITHM + "#WithComments": (False, True),
+    C14N_EXCLUSIVE_ALGORITHM: (True, False),
+    C14N_EXCLUSIVE_ALGORITHM + "WithComments": (True, True),
+}
+# Elemento assinado -> tipo; *Proc envolve o documento junto com o protocolo
+SIGNED_DOCUMENTS = {"CTe": "cte", "CTeOS": "cte", "MDFe": "mdfe"}
+MAX_CHAIN_DEPTH = 8
+
+
+class TrustStore:
+    """
+    Certificados de AC confiáveis (ICP-Brasil), lidos uma vez por processo.
+
+    Indexados pelo SKI e pelo subject, para achar o emissor de um certificado
+    sem percorrer a lista. As cadeias já montadas ficam em cache pelo
+    fingerprint do certificado final: no lote, o mesmo emitente assina
+    milhares de documentos.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self._by_ski: dict[bytes, list[Certificate]] = {}
+        self._by_subject: dict[bytes, list[Certificate]] = {}
+        self._anchors: set[bytes] = set()
+        self._chains: OrderedDict[bytes, list[Certificate] | str] = OrderedDict()
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            files = [p for p in self.directory.glob("*") if p.suffix.lower() in (".crt", ".pem", ".cer")] \
+                if self.directory.is_dir() else []
+            for path in files:
+                data = path.read_bytes()
+                try:
+                    cert = (
+                        load_pem_x509_certificate(data) if b"-----BEGIN CERTIFICATE-----" in data
+                        else load_der_x509_certificate(data)
+                    )
+                except ValueError:
+                    logger.warning(f"[TRUST] Ignorando certificado ilegível: {path.name}")
+                    continue
+                self._add(cert)
+            logger.info(f"[TRUST] {len(self._anchors)} certificados de AC carregados de {self.directory}")
+            self._loaded = True
+
+    def _add(self, cert: Certificate):
+        fingerprint = cert.fingerprint(hashes.SHA256())
+        if fingerprint in self._anchors:
+            return
+        self._anchors.add(fingerprint)
+        self._by_subject.setdefault(cert.subject.public_bytes(), []).append(cert)
+        ski = _subject_key_id(cert)
+        if ski:
+            self._by_ski.setdefault(ski, []).append(cert)
+
+    def _issuer_candidates(self, cert: Certificate, extra: list[Certificate]) -> list[Certificate]:
+        aki = _authority_key_id(cert)
+        candidates = list(self._by_ski.get(aki, ())) if aki else []
+        candidates += [c for c in self._by_subject.get(cert.issuer.public_bytes(), ()) if c not in candidates]
+        return candidates + [c for c in extra if c.subject == cert.issuer]
+
+    def chain(self, leaf: Certificate, extra: list[Certificate]) -> list[Certificate] | str:
+        """Cadeia leaf → raiz confiável, ou a mensagem de erro se não houver."""
+        self._load()
+        # Intermediárias do KeyInfo entram na chave: sem elas a cadeia pode não fechar
+        key = b"".join(c.fingerprint(hashes.SHA256()) for c in [leaf, *extra])
+        with self._lock:
+            cached = self._chains.get(key)
+        if cached is not None:
+            return cached
+
+        result = self._build_chain(leaf, extra)
+        with self._lock:
+            self._chains[key] = result
+            while len(self._chains) > 1024:
+                self._chains.popitem(last=False)
+        return result
+
+    def _build_chain(self, leaf: Certificate, extra: list[Certificate]) -> list[Certificate] | str:
+        chain = [leaf]
+        current = leaf
+        for _ in range(MAX_CHAIN_DEPTH):
+            if current.issuer == current.subject:
+                if current.fingerprint(hashes.SHA256()) in self._anchors:
+                    return chain
+                return f"Raiz não confiável: {_common_name(current)}"
+            issuer = None
+            for candidate in self._issuer_candidates(current, extra):
+                try:
+                    current.verify_directly_issued_by(candidate)
+                except (ValueError, TypeError, InvalidSignature):
+                    continue
+                issuer = candidate
+                break
+            if issuer is None:
+                return f"Emissor não encontrado na cadeia ICP-Brasil: {current.issuer.rfc4514_string()}"
+            chain.append(issuer)
+            current = issuer
+        return "Cadeia de certificação longa demais"
+
+    def stats(self) -> dict:
+        return {"directory": str(self.directory), "loaded": self._loaded, "certificates": len(self._anchors)}
+
+
+trust_store = TrustStore(ICP_TRUST_DIR)
+
+
+def _subject_key_id(cert: Certificate) -> bytes:
+    try:
+        return cert.extensions.get_extension_for_class(SubjectKeyIdentifier).value.digest
+    except ExtensionNotFound:
+        return b""
+
+
+def _authority_key_id(cert: Certificate) -> bytes:
+    try:
+        return cert.extensions.get_extension_for_class(AuthorityKeyIdentifier).value.key_identifier or b""
+    except ExtensionNotFound:
+        return b""
+
+
+def _common_name(cert: Certificate) -> str:
+    names = cert.subject.get_attributes_for_oid(NameOID.COMMON_NAME)
+    return names[0].value if names else cert.subject.rfc4514_string()
+
+
+def _c14n(node: etree._Element, algorithm: str, isolate: bool = False) -> bytes:
+    """C14N pelo algoritmo declarado; `isolate` canoniza o nó como documento próprio (ver c14n_subtree)."""
+    exclusive, with_comments = C14N_ALGORITHMS[algorithm]
+    if isolate and node.getparent() is not None:
+        node = etree.fromstring(etree.tostring(node))
+    return etree.tostring(node, method="c14n", exclusive=exclusive, with_comments=with_comments)
+
+
+def _signing_time(document: etree._Element) -> datetime:
+    """dhEmi do documento (validade do certificado é conferida nessa data); sem ele, agora."""
+    dh_emi = document.findtext(".//{*}ide/{*}dhEmi")
+    try:
+        return datetime.fromisoformat(dh_emi).astimezone(timezone.utc) if dh_emi else datetime.now(timezone.utc)
+    except ValueError:
+        return datetime.now(timezone.utc)
+
+
+def verify_document(xml: str) -> dict:
+    """
+    Verifica a assinatura XMLDSig de um CTe/CTeOS/MDFe (ou cteProc/mdfeProc).
+
+    Confere o DigestValue do nó referenciado, a SignatureValue do SignedInfo
+    com o certificado do KeyInfo e a cadeia desse certificado até uma raiz do
+    trust store ICP-Brasil, com a validade na data de emissão (dhEmi).
+    """
+    result = {"valid": False, "digest_valid": False, "signature_valid": False, "chain_valid": False}
+    try:
+        root = parse_xml(xml)
+    except etree.XMLSyntaxError as e:
+        return {**result, "status_detail": "xml_invalido", "error": f"XML malformado: {str(e)}"}
+
+    local = etree.QName(root).localname
+    if local in SIGNED_DOCUMENTS:
+        document = root
+    else:
+        document = next((child for child in root if etree.QName(child).localname in SIGNED_DOCUMENTS), None)
+        if document is None:
+            return {**result, "status_detail": "xml_invalido", "error": f"Documento não suportado: {local}"}
+        prot_cstat = root.findtext("{*}*/{*}infProt/{*}cStat")
+        if prot_cstat:
+            result["protocolo"] = root.findtext("{*}*/{*}infProt/{*}nProt") or ""
+            result["cStat_protocolo"] = prot_cstat
+    result["document_type"] = SIGNED_DOCUMENTS[etree.QName(document).localname]
+
+    # O documento é verificado isolado, como foi assinado (sem os namespaces do *Proc)
+    parent = document.getparent()
+    if parent is not None:
+        own = [prefix for prefix, uri in document.nsmap.items() if prefix and parent.nsmap.get(prefix) != uri]
+        document = etree.fromstring(etree.tostring(document))
+        etree.cleanup_namespaces(document, keep_ns_prefixes=own)
+
+    signature = document.find("ds:Signature", NAMESPACES)
+    if signature is None:
+        return {**result, "status_detail": "sem_assinatura", "error": "Assinatura não encontrada"}
+
+    try:
+        signed_info = signature.find("ds:SignedInfo", NAMESPACES)
+        reference = signed_info.find("ds:Reference", NAMESPACES)
+        node_id = (reference.get("URI") or "").lstrip("#")
+        targets = document.xpath("//*[@Id=$id]", id=node_id) if node_id else [document]
+        if len(targets) != 1:
+            raise ValueError(f"Reference URI #{node_id} não encontrada")
+        target = targets[0]
+        result["chave_acesso"] = node_id[3:] if node_id.startswith("CTe") else node_id[4:]
+
+        # 1. Digest do nó referenciado (enveloped: sem a própria Signature)
+        transforms = [t.get("Algorithm") for t in reference.iterfind("ds:Transforms/ds:Transform", NAMESPACES)]
+        c14n_method = next((t for t in transforms if t in C14N_ALGORITHMS), C14N_ALGORITHM)
+        if signature in target.iter():
+            target = copy.deepcopy(target)
+            target.remove(target.find("ds:Signature", NAMESPACES))
+        digest_method = DIGEST_ALGORITHMS[reference.find("ds:DigestMethod", NAMESPACES).get("Algorithm")]
+        digest = hashes.Hash(digest_method())
+        digest.update(_c14n(target, c14n_method, isolate=True))
+        result["digest_valid"] = digest.finalize() == base64.b64decode(
+            reference.findtext("ds:DigestValue", namespaces=NAMESPACES) or "",
+        )
+
+        # 2. SignatureValue do SignedInfo com o certificado do KeyInfo
+        certs = [
+            load_der_x509_certificate(base64.b64decode(el.text or ""))
+            for el in signature.iterfind(".//ds:X509Certificate", NAMESPACES)
+        ]
+        signature_method = SIGNATURE_ALGORITHMS[signed_info.find("ds:SignatureMethod", NAMESPACES).get("Algorithm")]
+        canonical_info = _c14n(signed_info, signed_info.find("ds:CanonicalizationMethod", NAMESPACES).get("Algorithm"))
+        signature_value = base64.b64decode(signature.findtext("ds:SignatureValue", namespaces=NAMESPACES) or "")
+        signer = None
+        for cert in certs:
+            try:
+                cert.public_key().verify(signature_value, canonical_info, PKCS1v15(), signature_method())
+            except (InvalidSignature, TypeError, ValueError):
+                continue
+            signer = cert
+            break
+        result["signature_valid"] = signer is not None
+    except (AttributeError, KeyError, ValueError) as e:
+        # Estrutura de assinatura incompleta ou algoritmo fora do padrão SEFAZ
+        return {**result, "status_detail": "assinatura_invalida", "error": f"Assinatura ilegível: {str(e)}"}
+
+    if not result["digest_valid"]:
+        return {**result, "status_detail": "digest_invalido", "error": "DigestValue não confere: documento alterado"}
+    if signer is None:
+        return {**result, "status_detail": "assinatura_invalida", "error": "SignatureValue não confere"}
+
+    cn = _common_name(signer)
+    result["signer"] = {
+        "subject": cn,
+        "cnpj": cn.rpartition(":")[2] if ":" in cn else "",
+        "issuer": signer.issuer.rfc4514_string(),
+        "serial": format(signer.serial_number, "x"),
+        "not_valid_before": signer.not_valid_before_utc.isoformat(),
+        "not_valid_after": signer.not_valid_after_utc.isoformat(),
+    }
+
+    # 3. Cadeia até uma raiz ICP-Brasil, válida na data de emissão
+    chain = trust_store.chain(signer, [c for c in certs if c is not signer])
+    if isinstance(chain, str):
+        return {**result, "status_detail": "cadeia_nao_confiavel", "error": chain}
+    result["chain"] = [_common_name(c) for c in chain]
+    signed_at = _signing_time(document)
+    expired = next((c for c in chain if not c.not_valid_before_utc <= signed_at <= c.not_valid_after_utc), None)
+    if expired is not None:
+        return {
+            **result, "status_detail": "certificado_expirado",
+            "error": f"Certificado {_common_name(expired)} fora da validade em {signed_at.isoformat()}",
+        }
+
+    result["chain_valid"] = True
+    result["valid"] = True
+    result["status_detail"] = "assinatura_valida"
+    return result
+
+
+def verify_chunk(xmls: list[str]) -> list[dict]:
+    """Executado dentro do processo do pool (trust store carregado uma vez por processo)."""
+    results = []
+    for xml in xmls:
+        try:
+            results.append(verify_document(xml))
+        except Exception as e:
+            results.append({"valid": False, "status_detail": "erro", "error": str(e)})
+    return results